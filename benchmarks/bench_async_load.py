@@ -0,0 +1,150 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput of a route that waits on the provider from a worker thread (as every
+route used to) against one that awaits it on the event loop, at rising numbers
+of concurrent requests. AWS Bedrock is replaced by a local server that takes
+`PROVIDER_LATENCY` to answer, like a model generating a short completion.
+
+Sync routes can only have as many requests waiting on the provider as there
+are worker threads (40 by default), async routes are limited by the connection
+pool (`PROVIDER_MAX_CONNECTIONS`) instead.
+
+    poetry run python -m benchmarks.bench_async_load
+"""
+
+import asyncio
+import statistics
+import time
+from functools import partial
+from unittest.mock import patch
+
+import httpx
+from aiohttp import web
+from anyio import from_thread
+from fastapi import FastAPI
+
+from benchmarks.common import print_table
+from llm_gateway.providers.awsbedrock import ANTHROPIC_CLAUDE_V2, AWSBedrockWrapper
+from llm_gateway.providers.awsbedrock import settings as awsbedrock_settings
+
+PROVIDER_LATENCY = 0.1
+CONCURRENCY = [10, 50, 200, 500]
+REQUESTS_PER_CLIENT = 4
+
+
+async def fake_invoke(request: web.Request) -> web.Response:
+    await request.read()
+    await asyncio.sleep(PROVIDER_LATENCY)
+    return web.json_response({"completion": "ok"})
+
+
+def make_app(wrapper: AWSBedrockWrapper) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/sync")
+    def sync_route() -> dict:
+        # holds the worker thread until AWS Bedrock answers, like a sync client
+        resp, _ = from_thread.run(
+            partial(
+                wrapper.asend_awsbedrock_request,
+                "Text",
+                model=ANTHROPIC_CLAUDE_V2,
+                max_tokens=10,
+                prompt="Hello",
+            )
+        )
+        return resp
+
+    @app.post("/async")
+    async def async_route() -> dict:
+        resp, _ = await wrapper.asend_awsbedrock_request(
+            "Text", model=ANTHROPIC_CLAUDE_V2, max_tokens=10, prompt="Hello"
+        )
+        return resp
+
+    return app
+
+
+async def load(client: httpx.AsyncClient, path: str, concurrency: int) -> tuple:
+    latencies = []
+
+    async def run_client() -> None:
+        for _ in range(REQUESTS_PER_CLIENT):
+            start = time.perf_counter()
+            response = await client.post(path)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, latencies
+
+
+async def main() -> None:
+    server = web.Application()
+    server.router.add_post("/model/{model_id}/invoke", fake_invoke)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    with patch.multiple(
+        awsbedrock_settings,
+        AWS_REGION="us-east-1",
+        AWS_PUBLIC_ACCESS_KEY="key",
+        AWS_PRIVATE_ACCESS_KEY="secret",
+        AWS_BEDROCK_ENDPOINT_URL=f"http://127.0.0.1:{port}",
+    ):
+        wrapper = AWSBedrockWrapper()
+
+    rows = []
+    transport = httpx.ASGITransport(app=make_app(wrapper))
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://gateway", timeout=None
+    ) as client:
+        # warm up connections to the provider
+        await load(client, "/sync", 10)
+        await load(client, "/async", 10)
+        for concurrency in CONCURRENCY:
+            for path in ("/sync", "/async"):
+                throughput, latencies = await load(client, path, concurrency)
+                rows.append(
+                    (
+                        path.strip("/"),
+                        concurrency,
+                        f"{throughput:.0f} req/s",
+                        f"{statistics.median(latencies) * 1e3:.0f} ms",
+                        f"{latencies[int(len(latencies) * 0.99)] * 1e3:.0f} ms",
+                    )
+                )
+
+    wrapper.close()
+    await wrapper.aclose()
+    await runner.cleanup()
+    print_table(
+        ["route", "concurrency", "throughput", "median latency", "p99 latency"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
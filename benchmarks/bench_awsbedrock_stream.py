@@ -0,0 +1,170 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time to first token of a Bedrock text response, from `/awsbedrock/text`, which
+waits for the whole response, and from `/awsbedrock/text/stream`. Bedrock is
+replaced by a local server that generates `TOKENS` tokens, `TOKEN_INTERVAL`
+apart, and streams them as an event stream when asked to.
+
+    poetry run python -m benchmarks.bench_awsbedrock_stream
+"""
+
+import asyncio
+import base64
+import json
+import struct
+import time
+from binascii import crc32
+from statistics import median
+from unittest.mock import patch
+
+from aiohttp import web
+
+from benchmarks.common import print_table
+from llm_gateway.app import app
+from llm_gateway.dependencies import aclose_provider_clients
+from llm_gateway.providers import awsbedrock
+
+TOKENS = 50
+TOKEN_INTERVAL = 0.02
+RUNS = 5
+
+
+def event_message(chunk: dict) -> bytes:
+    """
+    Encode a chunk as a message of an `application/vnd.amazon.eventstream` body
+    """
+    headers = b"".join(
+        struct.pack("B", len(name)) + name + struct.pack("!BH", 7, len(value)) + value
+        for name, value in ((b":message-type", b"event"), (b":event-type", b"chunk"))
+    )
+    payload = json.dumps(
+        {"bytes": base64.b64encode(json.dumps(chunk).encode()).decode()}
+    ).encode()
+    prelude = struct.pack("!II", 16 + len(headers) + len(payload), len(headers))
+    message = prelude + struct.pack("!I", crc32(prelude)) + headers + payload
+    return message + struct.pack("!I", crc32(message))
+
+
+async def invoke(request: web.Request) -> web.Response:
+    await request.read()
+    await asyncio.sleep(TOKENS * TOKEN_INTERVAL)
+    completion = "".join(f" t{i}" for i in range(TOKENS))
+    return web.json_response({"completion": completion, "stop_reason": "max_tokens"})
+
+
+async def invoke_stream(request: web.Request) -> web.StreamResponse:
+    await request.read()
+    response = web.StreamResponse(
+        headers={"Content-Type": "application/vnd.amazon.eventstream"}
+    )
+    await response.prepare(request)
+    for i in range(TOKENS):
+        await asyncio.sleep(TOKEN_INTERVAL)
+        await response.write(event_message({"completion": f" t{i}"}))
+    await response.write(event_message({"completion": "", "stop_reason": "max_tokens"}))
+    return response
+
+
+async def call(path: str) -> tuple:
+    """
+    Call a route and return the seconds to its first and last body message
+    """
+    body = {
+        "model": awsbedrock.ANTHROPIC_CLAUDE_V2_1,
+        "prompt": "hi",
+        "max_tokens": TOKENS,
+        "temperature": 0,
+    }
+    requested = False
+    done = asyncio.Event()
+    first = last = None
+
+    async def receive() -> dict:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": json.dumps(body).encode()}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal first, last
+        if message["type"] == "http.response.body":
+            if message.get("body") and first is None:
+                first = time.perf_counter()
+            if not message.get("more_body"):
+                last = time.perf_counter()
+                done.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("gateway", 80),
+    }
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return first - start, last - start
+
+
+async def main() -> None:
+    server = web.Application()
+    server.router.add_post("/model/{model_id}/invoke", invoke)
+    server.router.add_post(
+        "/model/{model_id}/invoke-with-response-stream", invoke_stream
+    )
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    rows = []
+    with patch.multiple(
+        awsbedrock.settings,
+        AWS_REGION="us-east-1",
+        AWS_PUBLIC_ACCESS_KEY="AKIDEXAMPLE",
+        AWS_PRIVATE_ACCESS_KEY="secret",
+        AWS_BEDROCK_ENDPOINT_URL=url,
+    ), patch("llm_gateway.providers.awsbedrock.write_record_to_db"):
+        for path in ("/api/awsbedrock/text", "/api/awsbedrock/text/stream"):
+            timings = [await call(path) for _ in range(RUNS)]
+            rows.append(
+                (
+                    path,
+                    f"{median(first for first, _ in timings) * 1e3:.0f} ms",
+                    f"{median(last for _, last in timings) * 1e3:.0f} ms",
+                )
+            )
+        await aclose_provider_clients()
+
+    await runner.cleanup()
+    print_table(["route", "time to first token", "time to last token"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
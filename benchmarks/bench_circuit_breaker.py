@@ -0,0 +1,103 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+How long requests to a model that is down take, with and without its circuit
+breaker. A fake provider takes `PROVIDER_LATENCY` seconds to fail every call with
+a 503, and `REQUESTS` requests arrive `REQUEST_INTERVAL` apart. Every request is
+retried by `max_retries` as the providers' calls are.
+
+    poetry run python -m benchmarks.bench_circuit_breaker
+"""
+
+import asyncio
+import time
+from statistics import mean
+from unittest.mock import patch
+
+from openai.error import APIError
+
+from benchmarks.common import print_table
+from llm_gateway.circuit_breaker import circuit_breaker, reset_circuit_breakers
+from llm_gateway.constants import get_settings
+from llm_gateway.exceptions import OPENAI_EXCEPTIONS, is_retryable_openai_error
+from llm_gateway.utils import max_retries
+
+PROVIDER_LATENCY = 0.2
+REQUESTS = 50
+REQUEST_INTERVAL = 0.02
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def complete(self, model: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(PROVIDER_LATENCY)
+        raise APIError("Service unavailable", http_status=503)
+
+
+async def run(breaker: bool) -> tuple:
+    provider = FakeProvider()
+    call = provider.complete
+    if breaker:
+        call = circuit_breaker(
+            "openai", exceptions=OPENAI_EXCEPTIONS, is_failure=is_retryable_openai_error
+        )(call)
+    call = max_retries(
+        3,
+        exceptions=OPENAI_EXCEPTIONS,
+        provider="openai",
+        is_retryable=is_retryable_openai_error,
+    )(call)
+
+    async def request() -> float:
+        start = time.perf_counter()
+        try:
+            await call(model="gpt-4")
+        except Exception:
+            pass
+        return time.perf_counter() - start
+
+    tasks = []
+    for _ in range(REQUESTS):
+        tasks.append(asyncio.create_task(request()))
+        await asyncio.sleep(REQUEST_INTERVAL)
+    latencies = sorted(await asyncio.gather(*tasks))
+    return (
+        provider.calls,
+        f"{mean(latencies) * 1e3:.0f} ms",
+        f"{latencies[len(latencies) // 2] * 1e3:.0f} ms",
+    )
+
+
+async def main() -> None:
+    rows = []
+    with patch.multiple(get_settings(), RETRY_BACKOFF_BASE=0.05), patch(
+        "llm_gateway.utils.logger"
+    ):
+        for breaker in (False, True):
+            reset_circuit_breakers()
+            rows.append(("on" if breaker else "off", *await run(breaker)))
+    print_table(
+        ["circuit breaker", "provider calls", "mean latency", "median latency"], rows
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Show that scanning text for denylisted terms takes about as long for 100,000
+terms as for 100, and with thousands of them in the text as with a few, compared
+to a plain alternation of the terms.
+
+    poetry run python -m benchmarks.bench_denylist
+"""
+
+import random
+import re
+import string
+import time
+from typing import List
+
+from benchmarks.common import format_size, make_text, print_table, time_call
+from llm_gateway.denylist import Denylist
+
+TERM_COUNTS = (100, 1_000, 10_000, 100_000)
+TEXT_SIZE = 1 << 20
+# a plain alternation gets too slow to bother timing past this many terms
+MAX_ALTERNATION_TERMS = 1_000
+# how many distinct terms are planted in the text
+PLANTED_COUNTS = (50, 5_000)
+
+
+def make_terms(count: int) -> List[str]:
+    rng = random.Random(count)
+    terms = set()
+    while len(terms) < count:
+        kind = rng.random()
+        if kind < 0.4:
+            # client names
+            words = rng.randint(1, 3)
+            term = " ".join(
+                "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+                for _ in range(words)
+            ).title()
+        elif kind < 0.7:
+            # internal account identifiers
+            term = "ACCT-" + "".join(rng.choices(string.digits, k=8))
+        else:
+            # project codenames
+            term = "Project " + "".join(rng.choices(string.ascii_uppercase, k=6))
+        terms.add(term)
+    return sorted(terms)
+
+
+def main() -> None:
+    text = make_text(TEXT_SIZE)
+    rows = []
+    for count in TERM_COUNTS:
+        terms = make_terms(count)
+        start = time.perf_counter()
+        denylist = Denylist(terms)
+        build = time.perf_counter() - start
+
+        scans = []
+        for planted_count in PLANTED_COUNTS:
+            # plant some of the terms in the text so there is something to find
+            planted = " ".join(terms[:: max(1, count // planted_count)])
+            sample = f"{planted} {text}"
+            scan = time_call(lambda: list(denylist.find(sample)), repeat=3)
+            scans.append(f"{scan * 1e3:.1f} ms")
+
+        alternation = "-"
+        if count <= MAX_ALTERNATION_TERMS:
+            regex = re.compile(
+                r"(?<!\w)(?:" + "|".join(map(re.escape, terms)) + r")(?!\w)",
+                re.IGNORECASE,
+            )
+            seconds = time_call(lambda: regex.findall(sample), repeat=3)
+            alternation = f"{seconds * 1e3:.1f} ms"
+
+        rows.append(
+            (
+                f"{count:,}",
+                format_size(len(text)),
+                f"{build * 1e3:.0f} ms",
+                *scans,
+                alternation,
+            )
+        )
+    print_table(
+        [
+            "terms",
+            "text",
+            "build",
+            *(f"scan, {n:,} present" for n in PLANTED_COUNTS),
+            "plain alternation",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Micro-batching of embedding requests. `REQUESTS` single-text requests are sent,
+`CONCURRENCY` at a time, to a fake provider that takes `ROUND_TRIP` seconds plus
+`PER_TEXT` seconds a text, and serves `PROVIDER_CONCURRENCY` calls at once (like a
+rate limit). Compares upstream calls, latency and throughput with and without
+batching.
+
+    poetry run python -m benchmarks.bench_embedding_batching
+"""
+
+import asyncio
+import time
+
+from benchmarks.common import print_table
+from llm_gateway.batching import EmbeddingBatcher
+from llm_gateway.hedging import LatencyWindow
+
+ROUND_TRIP = 0.05
+PER_TEXT = 0.0002
+PROVIDER_CONCURRENCY = 8
+REQUESTS = 2000
+CONCURRENCY = 200
+MAX_DELAY = 0.005
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.semaphore = asyncio.Semaphore(PROVIDER_CONCURRENCY)
+
+    async def embed(self, model: str, texts: list) -> list:
+        async with self.semaphore:
+            self.calls += 1
+            await asyncio.sleep(ROUND_TRIP + PER_TEXT * len(texts))
+            return [[0.0]] * len(texts)
+
+
+def split(response: list, texts: list) -> list:
+    parts = []
+    start = 0
+    for request_texts in texts:
+        end = start + len(request_texts)
+        parts.append(response[start:end])
+        start = end
+    return parts
+
+
+async def run(batch: bool) -> tuple:
+    provider = FakeProvider()
+    batcher = EmbeddingBatcher(
+        "text-embedding-ada-002",
+        provider.embed,
+        split,
+        max_batch_size=2048,
+        max_delay=MAX_DELAY,
+    )
+    latencies = LatencyWindow(REQUESTS)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def request(number: int) -> None:
+        texts = [f"text {number}"]
+        async with semaphore:
+            start = time.perf_counter()
+            if batch:
+                await batcher.submit(texts)
+            else:
+                await provider.embed("text-embedding-ada-002", texts)
+            latencies.record(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request(number) for number in range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    return (
+        provider.calls,
+        *(f"{latencies.percentile(percent) * 1e3:.0f} ms" for percent in (50, 99)),
+        f"{REQUESTS / elapsed:.0f}/s",
+    )
+
+
+async def main() -> None:
+    rows = [(name, *await run(batch)) for name, batch in (("off", False), ("on", True))]
+    print_table(["batching", "upstream calls", "p50", "p99", "throughput"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
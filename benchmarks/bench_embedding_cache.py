@@ -0,0 +1,108 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Embedding cache during re-indexing. `DOCUMENTS` documents of `CHUNKS` texts are
+embedded, then re-indexed after `CHANGED_SHARE` of the texts changed. The fake
+provider takes `ROUND_TRIP` seconds a call and returns `DIMENSIONS` floats a text.
+Compares upstream texts and time of the re-index with no cache, the in-memory tier,
+and a restarted worker that only has the SQLite tier.
+
+    poetry run python -m benchmarks.bench_embedding_cache
+"""
+
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.common import make_text, print_table
+from llm_gateway.embedding_cache import EmbeddingCache, aembed_cached
+
+DOCUMENTS = 200
+CHUNKS = 16
+CHANGED_SHARE = 0.1
+DIMENSIONS = 1536
+ROUND_TRIP = 0.02
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.texts = 0
+
+    async def embed(self, texts: list) -> tuple:
+        self.calls += 1
+        self.texts += len(texts)
+        await asyncio.sleep(ROUND_TRIP)
+        return None, [[0.1] * DIMENSIONS for _ in texts]
+
+
+def make_documents(changed_share: float) -> list:
+    rng = random.Random(0)
+    return [
+        [
+            make_text(200 + document * CHUNKS + chunk)
+            + (f" v{rng.random()}" if rng.random() < changed_share else "")
+            for chunk in range(CHUNKS)
+        ]
+        for document in range(DOCUMENTS)
+    ]
+
+
+async def reindex(cache, documents: list) -> tuple:
+    provider = FakeProvider()
+    start = time.perf_counter()
+    for texts in documents:
+        if cache is None:
+            await provider.embed(texts)
+        else:
+            await aembed_cached(cache, "openai", "model", texts, provider.embed)
+    return provider.calls, provider.texts, time.perf_counter() - start
+
+
+async def main() -> None:
+    first, second = make_documents(0), make_documents(CHANGED_SHARE)
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "embeddings.sqlite3"
+        for name, make_cache, restart in (
+            ("none", lambda: None, False),
+            ("memory", lambda: EmbeddingCache(512 * 1024 * 1024), False),
+            ("sqlite, restarted", lambda: EmbeddingCache(1, path=path), True),
+        ):
+            cache = make_cache()
+            await reindex(cache, first)
+            if restart:
+                cache.close()
+                cache = make_cache()
+            calls, texts, elapsed = await reindex(cache, second)
+            rows.append(
+                (
+                    name,
+                    f"{calls}/{DOCUMENTS}",
+                    f"{texts}/{DOCUMENTS * CHUNKS}",
+                    f"{elapsed * 1e3:.0f} ms",
+                )
+            )
+    print_table(["cache", "upstream calls", "texts sent", "re-index time"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
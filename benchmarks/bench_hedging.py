@@ -0,0 +1,85 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Tail latency of hedged requests. A fake provider answers in `FAST` seconds,
+except for `SLOW_SHARE` of calls that take `SLOW` seconds. `REQUESTS` requests
+are sent, `CONCURRENCY` at a time, with and without hedging.
+
+    poetry run python -m benchmarks.bench_hedging
+"""
+
+import asyncio
+import random
+import time
+
+from benchmarks.common import print_table
+from llm_gateway.hedging import LatencyWindow, hedged, reset_latency_windows
+from llm_gateway.metrics import metrics
+
+FAST = 0.02
+SLOW = 0.3
+SLOW_SHARE = 0.03
+REQUESTS = 2000
+CONCURRENCY = 20
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def embed(self) -> str:
+        self.calls += 1
+        await asyncio.sleep(SLOW if random.random() < SLOW_SHARE else FAST)
+        return "embedding"
+
+
+async def run(hedge: bool) -> tuple:
+    random.seed(0)
+    reset_latency_windows()
+    metrics.reset()
+    provider = FakeProvider()
+    latencies = LatencyWindow(REQUESTS)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def request() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            if hedge:
+                await hedged(provider.embed, "openai", "text-embedding-ada-002")
+            else:
+                await provider.embed()
+            latencies.record(time.perf_counter() - start)
+
+    await asyncio.gather(*(request() for _ in range(REQUESTS)))
+    hedges = metrics.get_counter(
+        "hedging.hedged", provider="openai", model="text-embedding-ada-002"
+    )
+    return (
+        *(f"{latencies.percentile(percent) * 1e3:.0f} ms" for percent in (50, 95, 99)),
+        f"{hedges / REQUESTS:.1%}",
+        f"{provider.calls / REQUESTS - 1:+.1%}",
+    )
+
+
+async def main() -> None:
+    rows = [(name, *await run(hedge)) for name, hedge in (("off", False), ("on", True))]
+    print_table(["hedging", "p50", "p95", "p99", "hedge rate", "extra calls"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time scrubbing of inputs crafted to make the PII patterns backtrack, and fail if
+any of them takes longer than the limit.
+
+    poetry run python -m benchmarks.bench_pii_adversarial
+"""
+
+import random
+import sys
+from typing import Dict
+
+from benchmarks.common import format_size, print_table, time_call
+from llm_gateway.pii_scrubber import ALL_SCRUBBERS, scrub_all
+
+SIZE = 100 << 10
+TIME_LIMIT = 1.0  # seconds
+
+
+def adversarial_texts(size: int) -> Dict[str, str]:
+    texts = {
+        "letters then '@'": "a" * size + "@",
+        "dotted words then '@'": "ab." * (size // 3) + "@",
+        "quoted then '@'": '"' + "a" * size + '"@',
+        "phone numbers then '@'": "1234567890a" * (size // 11) + "@",
+        "long domain": "a@" + "a-" * (size // 2),
+        "'@' signs": "a@" * (size // 2),
+        "digits": "1" * size,
+        "digits and separators": "1 -." * (size // 4),
+        "digits and letters": "1a" * (size // 2),
+        "dots without '@'": "." * size,
+    }
+    # runs of a few characters the patterns care about, in random order
+    rng = random.Random(size)
+    for i in range(10):
+        runs = [
+            char * rng.choice((1, 2, 17, 65, 200))
+            for char in rng.sample('a1@.- "_A\t+(),', 4)
+        ]
+        texts[f"random #{i}"] = "".join(rng.choice(runs) for _ in range(size))[:size]
+    return texts
+
+
+def scrub_sequentially(text: str) -> str:
+    for scrubber in ALL_SCRUBBERS:
+        text = scrubber(text)
+    return text
+
+
+def main() -> int:
+    rows = []
+    slowest = 0.0
+    for label, text in adversarial_texts(SIZE).items():
+        single_pass = time_call(lambda: scrub_all(text), repeat=3)
+        sequential = time_call(lambda: scrub_sequentially(text), repeat=3)
+        slowest = max(slowest, single_pass, sequential)
+        rows.append(
+            (
+                label,
+                format_size(len(text)),
+                f"{single_pass * 1e3:.1f} ms",
+                f"{sequential * 1e3:.1f} ms",
+            )
+        )
+    print_table(["input", "size", "scrub_all", "each scrubber"], rows)
+
+    if slowest > TIME_LIMIT:
+        print(f"FAIL: slowest input took {slowest:.2f}s, limit is {TIME_LIMIT:.2f}s")
+        return 1
+    print(f"OK: slowest input took {slowest * 1e3:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare `scrub_all`, which finds the spans of every pattern without rewriting
+the text in between, against running each scrubber in turn, which is how
+`scrub_all` used to work and gives the same output.
+
+    poetry run python -m benchmarks.bench_pii_scrubber
+"""
+
+from itertools import product
+
+from benchmarks.common import format_size, make_text, print_table, time_call
+from llm_gateway.pii_scrubber import ALL_SCRUBBERS, scrub_all
+
+SIZES = (1 << 10, 32 << 10, 1 << 20)
+
+
+def scrub_sequentially(text: str) -> str:
+    for scrubber in ALL_SCRUBBERS:
+        text = scrubber(text)
+    return text
+
+
+# (label, pii_rate, number_rate), plain prose is what the pre-filter short-circuits
+PROFILES = (("mixed", 0.01, 0.02), ("prose", 0, 0))
+
+
+def main() -> None:
+    rows = []
+    for (label, pii_rate, number_rate), size in product(PROFILES, SIZES):
+        text = make_text(size, pii_rate=pii_rate, number_rate=number_rate)
+        number = max(1, (256 << 10) // size)
+        sequential = time_call(lambda: scrub_sequentially(text), number=number)
+        scrub_all_time = time_call(lambda: scrub_all(text), number=number)
+        rows.append(
+            (
+                label,
+                format_size(size),
+                f"{sequential * 1e3:.3f} ms",
+                f"{scrub_all_time * 1e3:.3f} ms",
+                f"{sequential / scrub_all_time:.1f}x",
+            )
+        )
+    print_table(["text", "input", "sequential", "scrub_all", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare scrubbing a whole prompt on every request against rendering a prompt
+template, whose static text was scrubbed once when it was registered.
+
+    poetry run python -m benchmarks.bench_prompt_templates
+"""
+
+import datetime
+
+from benchmarks.common import format_size, make_text, print_table, time_call
+from llm_gateway.pii_scrubber import scrub_all, scrub_many
+from llm_gateway.templates import PromptTemplate, parse_prompt_template
+
+INSTRUCTION_SIZES = (2 << 10, 16 << 10, 128 << 10)
+VARIABLES = {
+    "client": "Jane Doe (jane.doe@example.com)",
+    "account": "4520 1234 5678 9010",
+    "question": make_text(512),
+}
+
+
+def make_template(instructions: str) -> PromptTemplate:
+    segments, variables = parse_prompt_template(
+        instructions + "\n\nClient: {client}\nAccount: {account}\n\n{question}"
+    )
+    return PromptTemplate(
+        id=1,
+        name="benchmark",
+        segments=scrub_many(segments),
+        variables=variables,
+        redaction_counts={},
+        created_at=datetime.datetime.now(),
+    )
+
+
+def main() -> None:
+    rows = []
+    for size in INSTRUCTION_SIZES:
+        instructions = make_text(size)
+        template = make_template(instructions)
+        prompt = instructions + (
+            f"\n\nClient: {VARIABLES['client']}\nAccount: {VARIABLES['account']}"
+            f"\n\n{VARIABLES['question']}"
+        )
+        assert template.render(VARIABLES) == scrub_all(prompt)
+
+        whole = time_call(lambda: scrub_all(prompt), number=20)
+        rendered = time_call(lambda: template.render(VARIABLES), number=20)
+        rows.append(
+            (
+                format_size(size),
+                f"{whole * 1e3:.2f} ms",
+                f"{rendered * 1e3:.2f} ms",
+                f"{whole / rendered:.1f}x",
+            )
+        )
+    print_table(["instructions", "scrub_all", "render template", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
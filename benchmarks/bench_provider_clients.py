@@ -0,0 +1,142 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-request latency of the provider wrappers when each request builds its own
+(as every route used to) against one wrapper shared by every request, as
+injected by `llm_gateway.dependencies`. Providers are replaced by a local HTTP
+server that answers instantly, so the difference is all client overhead:
+creating the boto3 client, Cohere's API key check, and new connections.
+
+    poetry run python -m benchmarks.bench_provider_clients
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from benchmarks.common import print_table
+from llm_gateway.providers.awsbedrock import ANTHROPIC_CLAUDE_V2, AWSBedrockWrapper
+from llm_gateway.providers.cohere import CohereWrapper
+from llm_gateway.providers.cohere import settings as cohere_settings
+
+REQUESTS = 200
+RESPONSE = json.dumps(
+    {
+        "valid": True,
+        "id": "1",
+        "prompt": "",
+        "generations": [{"id": "1", "text": "ok"}],
+        "completion": "ok",
+    }
+).encode()
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    # keep connections open, like the real providers
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, don't wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+async def send_awsbedrock(wrapper: AWSBedrockWrapper) -> None:
+    await wrapper.asend_awsbedrock_request(
+        "Text", model=ANTHROPIC_CLAUDE_V2, max_tokens=10, prompt="Hello"
+    )
+
+
+async def send_cohere(wrapper: CohereWrapper) -> None:
+    await wrapper.asend_cohere_request(
+        "generate", model="command-light", max_tokens=10, prompt="Hello"
+    )
+
+
+async def close(wrapper) -> None:
+    wrapper.close()
+    await wrapper.aclose()
+
+
+async def latencies(wrapper_class: type, send, shared: bool) -> list:
+    wrapper = wrapper_class() if shared else None
+    runs = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        if shared:
+            await send(wrapper)
+            runs.append(time.perf_counter() - start)
+        else:
+            request_wrapper = wrapper_class()
+            await send(request_wrapper)
+            runs.append(time.perf_counter() - start)
+            await close(request_wrapper)
+    if shared:
+        await close(wrapper)
+    return sorted(runs)
+
+
+async def main() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeProviderHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    rows = []
+    with patch.multiple(
+        cohere_settings,
+        COHERE_API_KEY="key",
+        AWS_REGION="us-east-1",
+        AWS_PUBLIC_ACCESS_KEY="key",
+        AWS_PRIVATE_ACCESS_KEY="secret",
+        AWS_BEDROCK_ENDPOINT_URL=url,
+    ), patch.dict(os.environ, {"CO_API_URL": url}):
+        for name, wrapper_class, send in (
+            ("awsbedrock text", AWSBedrockWrapper, send_awsbedrock),
+            ("cohere generate", CohereWrapper, send_cohere),
+        ):
+            # warm up imports and botocore's service model loading
+            await latencies(wrapper_class, send, shared=False)
+            for shared in (False, True):
+                runs = await latencies(wrapper_class, send, shared)
+                rows.append(
+                    (
+                        name,
+                        "shared" if shared else "per request",
+                        f"{statistics.median(runs) * 1e3:.2f} ms",
+                        f"{runs[int(len(runs) * 0.99)] * 1e3:.2f} ms",
+                    )
+                )
+    server.shutdown()
+    print_table(["route", "wrapper", "median latency", "p99 latency"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Rate limiter against a provider's requests per second limit. `REQUESTS` requests
+arrive at `ARRIVAL_RATE` a second at a fake provider that allows `PROVIDER_RATE` a
+second (refilled continuously, in bursts of up to a second's worth) and answers in
+`LATENCY` seconds, or with a 429 and Retry-After: 1 over its limit. Without the
+limiter, 429s are retried with backoff like `llm_gateway.utils.max_retries`. With
+it, calls wait for their turn in the gateway. Compares 429s, failed requests and
+latency.
+
+    poetry run python -m benchmarks.bench_rate_limiter
+"""
+
+import asyncio
+import time
+from unittest.mock import patch
+
+from benchmarks.common import print_table
+from llm_gateway.constants import get_settings
+from llm_gateway.hedging import LatencyWindow
+from llm_gateway.rate_limiter import areserve
+from llm_gateway.retries import backoff_delay
+
+REQUESTS = 300
+ARRIVAL_RATE = 100
+PROVIDER_RATE = 50
+LATENCY = 0.1
+RETRIES = 3
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.rate_limited = 0
+        self._allowed = PROVIDER_RATE
+        self._updated = time.monotonic()
+
+    async def complete(self) -> dict:
+        self.calls += 1
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._allowed = min(PROVIDER_RATE, self._allowed + elapsed * PROVIDER_RATE)
+        self._updated = now
+        if self._allowed < 1:
+            self.rate_limited += 1
+            raise RateLimitError()
+        self._allowed -= 1
+        await asyncio.sleep(LATENCY)
+        return {"choices": [{"text": "ok"}]}
+
+
+async def run(limited: bool) -> tuple:
+    provider = FakeProvider()
+    latencies = LatencyWindow(REQUESTS)
+    failed = 0
+
+    async def request() -> None:
+        nonlocal failed
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            if limited:
+                await areserve("openai", "gpt-4", 100)
+            try:
+                await provider.complete()
+                break
+            except RateLimitError:
+                attempt += 1
+                if attempt > RETRIES:
+                    failed += 1
+                    return
+                # at least as long as the Retry-After hint
+                await asyncio.sleep(max(backoff_delay(attempt, 0.5, 20), 1))
+        latencies.record(time.perf_counter() - start)
+
+    tasks = []
+    for _ in range(REQUESTS):
+        tasks.append(asyncio.ensure_future(request()))
+        await asyncio.sleep(1 / ARRIVAL_RATE)
+    await asyncio.gather(*tasks)
+    return (
+        provider.calls,
+        provider.rate_limited,
+        failed,
+        *(f"{latencies.percentile(percent) * 1e3:.0f} ms" for percent in (50, 95)),
+    )
+
+
+async def main() -> None:
+    rows = []
+    for name, limited in (("off", False), ("on", True)):
+        with patch.multiple(
+            get_settings(),
+            RATE_LIMIT_RPM={"openai/gpt-4": PROVIDER_RATE * 60},
+            RATE_LIMIT_MAX_WAIT=30,
+            RATE_LIMIT_MAX_QUEUE=REQUESTS,
+        ):
+            rows.append((name, *await run(limited)))
+    print_table(
+        ["limiter", "upstream calls", "429s", "failed", "p50", "p95"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Response cache on templated temperature 0 traffic. `REQUESTS` classification
+requests are sent, `CONCURRENCY` at a time, drawn from `DISTINCT_PROMPTS` prompts
+with a Zipf-like skew, to a fake provider that takes `LATENCY` seconds. Compares
+upstream calls and latency with the cache off and on.
+
+    poetry run python -m benchmarks.bench_response_cache
+"""
+
+import asyncio
+import random
+import time
+from unittest.mock import patch
+
+from benchmarks.common import make_text, print_table
+from llm_gateway.constants import get_settings
+from llm_gateway.hedging import LatencyWindow
+from llm_gateway.response_cache import CachedResponse, get_response_cache
+
+REQUESTS = 5000
+CONCURRENCY = 50
+DISTINCT_PROMPTS = 500
+LATENCY = 0.2
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def complete(self, prompt: str) -> dict:
+        self.calls += 1
+        await asyncio.sleep(LATENCY)
+        return {"choices": [{"text": "positive", "finish_reason": "stop"}]}
+
+
+async def run(prompts: list) -> tuple:
+    get_response_cache.cache_clear()
+    provider = FakeProvider()
+    latencies = LatencyWindow(REQUESTS)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def request(prompt: str) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            cached = CachedResponse(
+                "openai",
+                "openai/completion",
+                0,
+                model="text-davinci-003",
+                prompt=prompt,
+                max_tokens=5,
+                stream=False,
+                kwargs={},
+            )
+            if cached.get() is None:
+                cached.set(await provider.complete(prompt))
+            latencies.record(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request(prompt) for prompt in prompts))
+    elapsed = time.perf_counter() - start
+    return (
+        provider.calls,
+        *(f"{latencies.percentile(percent) * 1e3:.1f} ms" for percent in (50, 95)),
+        f"{REQUESTS / elapsed:.0f}/s",
+    )
+
+
+async def main() -> None:
+    rng = random.Random(0)
+    templates = [
+        f"Classify the sentiment of this review: {make_text(300 + i)}"
+        for i in range(DISTINCT_PROMPTS)
+    ]
+    weights = [1 / (rank + 1) for rank in range(DISTINCT_PROMPTS)]
+    prompts = rng.choices(templates, weights=weights, k=REQUESTS)
+
+    rows = []
+    for name, enabled in (("off", False), ("on", True)):
+        with patch.object(get_settings(), "RESPONSE_CACHE", enabled):
+            rows.append((name, *await run(prompts)))
+    get_response_cache.cache_clear()
+    print_table(["cache", "upstream calls", "p50", "p95", "throughput"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
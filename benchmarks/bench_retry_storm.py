@@ -0,0 +1,123 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+What retries do to a provider that is rate limiting. `CLIENTS` requests arrive
+at once at a fake provider that answers every call with a 429 for `OUTAGE`
+seconds, then recovers. Compares retrying straight away (the old `max_retries`)
+with backing off with jitter under the retry budget.
+
+    poetry run python -m benchmarks.bench_retry_storm
+"""
+
+import asyncio
+import time
+from unittest.mock import patch
+
+from openai.error import RateLimitError
+
+from benchmarks.common import print_table
+from llm_gateway.exceptions import is_retryable_openai_error
+from llm_gateway.retries import RetryBudget
+from llm_gateway.utils import max_retries
+
+CLIENTS = 200
+OUTAGE = 0.5
+RETRIES = 3
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.calls = 0
+        self.calls_during_outage = 0
+
+    async def complete(self) -> str:
+        self.calls += 1
+        await asyncio.sleep(0.001)
+        if time.perf_counter() - self.started < OUTAGE:
+            self.calls_during_outage += 1
+            raise RateLimitError("Rate limit reached", http_status=429)
+        return "ok"
+
+
+def immediate_retries(times: int, exceptions: tuple):
+    """
+    The old `max_retries`: retry in a tight loop, then once more uncaught
+    """
+
+    def decorator(func):
+        async def newfn(*args, **kwargs):
+            attempt = 0
+            while attempt < times:
+                try:
+                    return await func(*args, **kwargs)
+                except exceptions:
+                    attempt += 1
+            return await func(*args, **kwargs)
+
+        return newfn
+
+    return decorator
+
+
+async def run(decorator) -> tuple:
+    provider = FakeProvider()
+    call = decorator(provider.complete)
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(call() for _ in range(CLIENTS)), return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+    succeeded = sum(result == "ok" for result in results)
+    return (
+        provider.calls,
+        provider.calls_during_outage,
+        f"{succeeded}/{CLIENTS}",
+        f"{elapsed:.2f} s",
+    )
+
+
+async def main() -> None:
+    rows = [
+        (
+            "retry straight away",
+            *await run(immediate_retries(RETRIES, exceptions=(RateLimitError,))),
+        )
+    ]
+    backoff = max_retries(
+        RETRIES,
+        exceptions=(RateLimitError,),
+        provider="openai",
+        is_retryable=is_retryable_openai_error,
+    )
+    budgets = (
+        ("jittered backoff, no budget", RetryBudget(ratio=1, min_per_second=1e6)),
+        ("jittered backoff, retry budget", RetryBudget(ratio=0.1, min_per_second=10)),
+    )
+    with patch("llm_gateway.utils.logger"):
+        for name, budget in budgets:
+            with patch("llm_gateway.utils.get_retry_budget", return_value=budget):
+                rows.append((name, *await run(backoff)))
+    print_table(
+        ["retries", "provider calls", "calls during outage", "succeeded", "took"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Routing between two backends of the same model while one of them degrades. Cohere
+answers in 50 ms and Bedrock in 80 ms, until Cohere slows to 400 ms and fails
+`DEGRADED_ERROR_SHARE` of calls for the middle third of the run. `REQUESTS`
+requests are sent `CONCURRENCY` at a time, always to Cohere or routed by
+`ModelRouter`.
+
+    poetry run python -m benchmarks.bench_routing
+"""
+
+import asyncio
+import random
+import time
+
+from benchmarks.common import print_table
+from llm_gateway.hedging import LatencyWindow
+from llm_gateway.routing import TEXT_EQUIVALENCE_CLASSES, ModelRouter
+
+REQUESTS = 600
+CONCURRENCY = 10
+DEGRADED_ERROR_SHARE = 0.3
+# shorter than ROUTING_STATS_DECAY, for the run to see Cohere recover
+STATS_DECAY = 1
+
+COHERE, BEDROCK = TEXT_EQUIVALENCE_CLASSES["cohere-command"]
+
+
+class FakeBackends:
+    def __init__(self) -> None:
+        self.sent = 0
+        self.calls = {COHERE: 0, BEDROCK: 0}
+
+    def degraded(self) -> bool:
+        return REQUESTS / 3 <= self.sent < REQUESTS * 2 / 3
+
+    async def send(self, backend) -> str:
+        self.calls[backend] += 1
+        if backend == COHERE and self.degraded():
+            await asyncio.sleep(0.4)
+            if random.random() < DEGRADED_ERROR_SHARE:
+                raise ConnectionError("Cohere is down")
+        else:
+            await asyncio.sleep(0.05 if backend == COHERE else 0.08)
+        return "generation"
+
+
+async def run(routed: bool) -> tuple:
+    random.seed(0)
+    backends = FakeBackends()
+    router = ModelRouter(
+        TEXT_EQUIVALENCE_CLASSES, alpha=0.3, decay=STATS_DECAY, max_error_rate=0.5
+    )
+    latencies = LatencyWindow(REQUESTS)
+    errors = 0
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def request() -> None:
+        nonlocal errors
+        async with semaphore:
+            backends.sent += 1
+            start = time.perf_counter()
+            try:
+                if routed:
+                    await router.asend(
+                        "cohere-command", backends.send, lambda backend, e: True
+                    )
+                else:
+                    await backends.send(COHERE)
+            except ConnectionError:
+                errors += 1
+            latencies.record(time.perf_counter() - start)
+
+    await asyncio.gather(*(request() for _ in range(REQUESTS)))
+    return (
+        *(f"{latencies.percentile(percent) * 1e3:.0f} ms" for percent in (50, 95, 99)),
+        errors,
+        f"{backends.calls[COHERE]} / {backends.calls[BEDROCK]}",
+    )
+
+
+async def main() -> None:
+    rows = [
+        (name, *await run(routed))
+        for name, routed in (("always Cohere", False), ("routed", True))
+    ]
+    print_table(
+        ["backend", "p50", "p95", "p99", "errors", "Cohere / Bedrock calls"], rows
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare scrubbing a large embedding batch serially against the process pool
+used by `scrub_many`.
+
+    poetry run python -m benchmarks.bench_scrub_many
+"""
+
+from unittest.mock import Mock, patch
+
+from benchmarks.common import format_size, make_text, print_table, time_call
+from llm_gateway.pii_scrubber import scrub_many, shutdown_scrub_pool
+
+BATCHES = ((2_000, 512), (2_000, 2 << 10), (500, 32 << 10))
+
+
+def scrub_with_threshold(texts, threshold: int):
+    settings = Mock(
+        PII_SCRUB_POOL_THRESHOLD=threshold,
+        PII_SCRUB_POOL_WORKERS=None,
+        PII_SCRUB_OFFLOAD_THRESHOLD=10**12,
+    )
+    with patch("llm_gateway.pii_scrubber.get_settings", return_value=settings):
+        return scrub_many(texts)
+
+
+def main() -> None:
+    rows = []
+    try:
+        for num_docs, doc_size in BATCHES:
+            texts = [make_text(doc_size + i) for i in range(num_docs)]
+            total = sum(len(text) for text in texts)
+            # warm up the pool so worker start-up isn't counted
+            scrub_with_threshold(texts[:2], threshold=0)
+
+            serial = time_call(lambda: scrub_with_threshold(texts, threshold=10**12))
+            pooled = time_call(lambda: scrub_with_threshold(texts, threshold=0))
+            rows.append(
+                (
+                    f"{num_docs} x {format_size(doc_size)}",
+                    f"{total / serial / (1 << 20):.1f} MB/s",
+                    f"{total / pooled / (1 << 20):.1f} MB/s",
+                    f"{serial / pooled:.1f}x",
+                )
+            )
+    finally:
+        shutdown_scrub_pool()
+    print_table(["batch", "serial", "process pool", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
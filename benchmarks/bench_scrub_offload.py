@@ -0,0 +1,92 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency of small scrubs on request threads while another thread scrubs a large
+document, with the large document scrubbed inline and offloaded to the process
+pool (`PII_SCRUB_OFFLOAD_THRESHOLD`).
+
+    poetry run python -m benchmarks.bench_scrub_offload
+"""
+
+import statistics
+import threading
+import time
+from unittest.mock import Mock, patch
+
+from benchmarks.common import make_text, print_table
+from llm_gateway.pii_scrubber import scrub_many, shutdown_scrub_pool
+
+LARGE_SIZE = 8 << 20
+SMALL_SIZE = 1 << 10
+SMALL_THREADS = 4
+
+
+def run(large: str, small: str, offload_threshold: int) -> list:
+    settings = Mock(
+        PII_SCRUB_POOL_THRESHOLD=10**12,
+        PII_SCRUB_POOL_WORKERS=None,
+        PII_SCRUB_OFFLOAD_THRESHOLD=offload_threshold,
+    )
+    latencies = []
+    done = threading.Event()
+
+    def scrub_small() -> None:
+        while not done.is_set():
+            start = time.perf_counter()
+            scrub_many([small])
+            latencies.append(time.perf_counter() - start)
+
+    with patch("llm_gateway.pii_scrubber.get_settings", return_value=settings):
+        threads = [threading.Thread(target=scrub_small) for _ in range(SMALL_THREADS)]
+        for thread in threads:
+            thread.start()
+        scrub_many([large])
+        done.set()
+        for thread in threads:
+            thread.join()
+    return latencies
+
+
+def main() -> None:
+    # sparse PII means long regex scans between matches, which hold the GIL
+    large = make_text(LARGE_SIZE, pii_rate=0.0001)
+    small = make_text(SMALL_SIZE)
+    rows = []
+    try:
+        # warm up the pool so worker start-up isn't counted
+        run(small, small, offload_threshold=0)
+        for name, threshold in (("inline", 10**12), ("offloaded", SMALL_SIZE + 1)):
+            latencies = sorted(run(large, small, threshold))
+            p99 = latencies[int(len(latencies) * 0.99)]
+            rows.append(
+                (
+                    name,
+                    len(latencies),
+                    f"{statistics.median(latencies) * 1e3:.2f} ms",
+                    f"{p99 * 1e3:.2f} ms",
+                )
+            )
+    finally:
+        shutdown_scrub_pool()
+    print_table(
+        ["large document", "small scrubs", "median latency", "p99 latency"], rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Singleflight on bursts of duplicate temperature 0 requests, i.e. a batch job
+fanning out the same prompts. `REQUESTS` requests, drawn from `DISTINCT_PROMPTS`
+prompts, are sent at once to a fake provider that takes `LATENCY` seconds, or
+streams `STREAM_CHUNKS` chunks over that time. Compares upstream calls and latency
+with singleflight off and on.
+
+    poetry run python -m benchmarks.bench_singleflight
+"""
+
+import asyncio
+import random
+import time
+from unittest.mock import patch
+
+from benchmarks.common import make_text, print_table
+from llm_gateway.constants import get_settings
+from llm_gateway.hedging import LatencyWindow
+from llm_gateway.singleflight import Flight
+
+REQUESTS = 2000
+DISTINCT_PROMPTS = 100
+LATENCY = 0.5
+STREAM_CHUNKS = 20
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def complete(self, prompt: str) -> dict:
+        self.calls += 1
+        await asyncio.sleep(LATENCY)
+        return {"choices": [{"text": "positive", "finish_reason": "stop"}]}
+
+    async def open_stream(self, prompt: str) -> tuple:
+        self.calls += 1
+        await asyncio.sleep(LATENCY / STREAM_CHUNKS)
+
+        async def chunks():
+            for _ in range(STREAM_CHUNKS - 1):
+                await asyncio.sleep(LATENCY / STREAM_CHUNKS)
+                yield "token "
+
+        return chunks(), None
+
+
+async def run(prompts: list, stream: bool) -> tuple:
+    provider = FakeProvider()
+    latencies = LatencyWindow(REQUESTS)
+
+    async def request(prompt: str) -> None:
+        start = time.perf_counter()
+        flight = Flight(
+            "openai",
+            "openai/completion",
+            0,
+            model="text-davinci-003",
+            prompt=prompt,
+            max_tokens=20,
+            stream=stream,
+            kwargs={},
+        )
+        if stream:
+            chunks, _ = await flight.stream(lambda: provider.open_stream(prompt))
+            async for _ in chunks:
+                pass
+        else:
+            await flight.call(lambda: provider.complete(prompt))
+        latencies.record(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request(prompt) for prompt in prompts))
+    elapsed = time.perf_counter() - start
+    return (
+        provider.calls,
+        *(f"{latencies.percentile(percent) * 1e3:.1f} ms" for percent in (50, 95)),
+        f"{REQUESTS / elapsed:.0f}/s",
+    )
+
+
+async def main() -> None:
+    rng = random.Random(0)
+    templates = [
+        f"Classify the sentiment of this review: {make_text(300 + i)}"
+        for i in range(DISTINCT_PROMPTS)
+    ]
+    prompts = rng.choices(templates, k=REQUESTS)
+
+    rows = []
+    for stream in (False, True):
+        for name, enabled in (("off", False), ("on", True)):
+            with patch.object(get_settings(), "SINGLEFLIGHT", enabled):
+                row = await run(prompts, stream)
+            rows.append(("stream" if stream else "call", name, *row))
+    print_table(
+        ["request", "singleflight", "upstream calls", "p50", "p95", "throughput"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
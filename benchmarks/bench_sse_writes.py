@@ -0,0 +1,156 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Writes and bytes sent per generated token by `/cohere/generate/stream`, as plain
+text (one write per token) and as server-sent events with different coalescing
+windows. Cohere is replaced by a local server that streams `TOKENS` tokens,
+`TOKEN_INTERVAL` apart.
+
+Writes are counted as the response body messages the app sends, each of which
+is one `send` syscall by the server unless the socket is backed up. Bytes
+include the framing of HTTP/1.1 chunked encoding.
+
+    poetry run python -m benchmarks.bench_sse_writes
+"""
+
+import asyncio
+import json
+import os
+import time
+from unittest.mock import patch
+
+from aiohttp import web
+
+from benchmarks.common import print_table
+from llm_gateway.app import app
+from llm_gateway.constants import get_settings
+from llm_gateway.dependencies import aclose_provider_clients
+from llm_gateway.providers.cohere import settings as cohere_settings
+
+TOKENS = 200
+TOKEN_INTERVAL = 0.005
+
+
+async def fake_generate(request: web.Request) -> web.StreamResponse:
+    await request.read()
+    response = web.StreamResponse(headers={"Content-Type": "application/stream+json"})
+    await response.prepare(request)
+    for i in range(TOKENS):
+        await asyncio.sleep(TOKEN_INTERVAL)
+        line = {"text": f" token{i}", "is_finished": False}
+        await response.write(json.dumps(line).encode() + b"\n")
+    await response.write(json.dumps({"is_finished": True}).encode() + b"\n")
+    await response.write_eof()
+    return response
+
+
+async def stream_once(sse: bool) -> tuple:
+    """
+    Call the stream route through ASGI, returning the number of body writes, the
+    bytes they took on the wire, and the time to the first body write
+    """
+    body = json.dumps({"temperature": 0, "prompt": "Hello"}).encode()
+    headers = [(b"content-type", b"application/json")]
+    if sse:
+        headers.append((b"accept", b"text/event-stream"))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/cohere/generate/stream",
+        "raw_path": b"/api/cohere/generate/stream",
+        "query_string": b"",
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 1234),
+        "server": ("gateway", 80),
+    }
+    requested = False
+    writes = 0
+    wire_bytes = 0
+    first_write = None
+    start = time.perf_counter()
+
+    async def receive() -> dict:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # the client never goes away
+        await asyncio.Future()
+
+    async def send(message: dict) -> None:
+        nonlocal writes, wire_bytes, first_write
+        if message["type"] != "http.response.body" or not message.get("body"):
+            return
+        writes += 1
+        size = len(message["body"])
+        # chunk size in hex, CRLF, data, CRLF
+        wire_bytes += len(f"{size:x}") + 2 + size + 2
+        if first_write is None:
+            first_write = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    return writes, wire_bytes, first_write
+
+
+async def main() -> None:
+    server = web.Application()
+    server.router.add_post("/v1/generate", fake_generate)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    rows = []
+    with patch.multiple(cohere_settings, COHERE_API_KEY="key"), patch.dict(
+        os.environ, {"CO_API_URL": url}
+    ), patch("cohere.Client.check_api_key"), patch(
+        "llm_gateway.providers.cohere.write_record_to_db"
+    ):
+        for name, sse, interval in (
+            ("text/plain", False, None),
+            ("sse, no coalescing", True, 0),
+            ("sse, 20 ms window", True, 0.02),
+            ("sse, 50 ms window (default)", True, 0.05),
+            ("sse, 200 ms window", True, 0.2),
+        ):
+            with patch.multiple(get_settings(), STREAM_SSE_COALESCE_INTERVAL=interval):
+                writes, wire_bytes, first_write = await stream_once(sse)
+            rows.append(
+                (
+                    name,
+                    writes,
+                    f"{writes / TOKENS:.2f}",
+                    f"{wire_bytes / TOKENS:.1f}",
+                    f"{first_write * 1e3:.1f} ms",
+                )
+            )
+        await aclose_provider_clients()
+
+    await runner.cleanup()
+    print_table(
+        ["format", "writes", "writes/token", "bytes/token", "first write"], rows
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
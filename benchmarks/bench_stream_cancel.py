@@ -0,0 +1,204 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+How long the providers keep generating after a client walks away mid-stream,
+with the upstream response closed on disconnect or left to be cleaned up.
+OpenAI and Cohere are replaced by a local server that streams up to
+`MAX_TOKENS` tokens, `TOKEN_INTERVAL` apart, and counts how many it wrote before
+the gateway closed the connection. The client disconnects after
+`CLIENT_CHUNKS` chunks.
+
+    poetry run python -m benchmarks.bench_stream_cancel
+"""
+
+import asyncio
+import json
+import os
+import time
+from unittest.mock import patch
+
+import openai
+from aiohttp import web
+
+from benchmarks.common import print_table
+from llm_gateway.app import app
+from llm_gateway.dependencies import aclose_provider_clients
+from llm_gateway.providers.cohere import settings as cohere_settings
+from llm_gateway.utils import StreamProcessor
+
+MAX_TOKENS = 300
+TOKEN_INTERVAL = 0.01
+CLIENT_CHUNKS = 5
+
+
+class FakeProvider:
+    def __init__(self) -> None:
+        self.tokens_written = 0
+        self.stopped_at = 0.0
+
+    async def stream(self, request: web.Request, line) -> web.StreamResponse:
+        await request.read()
+        response = web.StreamResponse()
+        response.content_type = (
+            "text/event-stream"
+            if request.path.endswith("completions")
+            else "application/stream+json"
+        )
+        await response.prepare(request)
+        try:
+            for i in range(MAX_TOKENS):
+                await asyncio.sleep(TOKEN_INTERVAL)
+                await response.write(line(i))
+                self.tokens_written += 1
+        except ConnectionError:
+            pass
+        finally:
+            self.stopped_at = time.perf_counter()
+        return response
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        def line(i: int) -> bytes:
+            chunk = {"choices": [{"index": 0, "delta": {"content": f" t{i}"}}]}
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        return await self.stream(request, line)
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        def line(i: int) -> bytes:
+            return json.dumps({"text": f" t{i}", "is_finished": False}).encode() + b"\n"
+
+        return await self.stream(request, line)
+
+
+async def stream_and_leave(path: str, body: dict) -> float:
+    """
+    Call a stream route, disconnecting after `CLIENT_CHUNKS` chunks, and return
+    when the client disconnected
+    """
+    enough_chunks = asyncio.Event()
+    requested = False
+    chunks = 0
+    disconnected_at = 0.0
+
+    async def receive() -> dict:
+        nonlocal requested, disconnected_at
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": json.dumps(body).encode()}
+        await enough_chunks.wait()
+        disconnected_at = time.perf_counter()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal chunks
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks += 1
+            if chunks >= CLIENT_CHUNKS:
+                enough_chunks.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("gateway", 80),
+    }
+    await app(scope, receive, send)
+    return disconnected_at
+
+
+async def main() -> None:
+    provider = FakeProvider()
+    server = web.Application()
+    server.router.add_post("/v1/chat/completions", provider.chat_completions)
+    server.router.add_post("/v1/generate", provider.generate)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    routes = (
+        (
+            "openai chat_completion",
+            "/api/openai/chat_completion/stream",
+            {
+                "messages": [{"role": "user", "content": "hi"}],
+                "model": "gpt-3.5-turbo",
+                "temperature": 0,
+                "max_tokens": MAX_TOKENS,
+            },
+        ),
+        (
+            "cohere generate",
+            "/api/cohere/generate/stream",
+            {"temperature": 0, "prompt": "hi", "max_tokens": MAX_TOKENS},
+        ),
+    )
+    rows = []
+    with patch.multiple(cohere_settings, COHERE_API_KEY="key"), patch.dict(
+        os.environ, {"CO_API_URL": url}
+    ), patch("cohere.Client.check_api_key"), patch.multiple(
+        openai, api_key="key", api_base=f"{url}/v1"
+    ), patch(
+        "llm_gateway.providers.cohere.write_record_to_db"
+    ), patch(
+        "llm_gateway.providers.openai.write_record_to_db"
+    ):
+        for name, path, body in routes:
+            for cancel in (False, True):
+                provider.tokens_written = 0
+                with patch.object(
+                    StreamProcessor,
+                    "cancel",
+                    StreamProcessor.cancel if cancel else lambda self: None,
+                ):
+                    disconnected_at = await stream_and_leave(path, body)
+                    # let the provider notice, or finish
+                    await asyncio.sleep(MAX_TOKENS * TOKEN_INTERVAL + 0.5)
+                rows.append(
+                    (
+                        name,
+                        "closed on disconnect" if cancel else "left to clean up",
+                        provider.tokens_written,
+                        f"{(provider.stopped_at - disconnected_at) * 1e3:.0f} ms",
+                    )
+                )
+        await aclose_provider_clients()
+
+    await runner.cleanup()
+    print_table(
+        [
+            "route",
+            "upstream response",
+            "tokens generated",
+            "generating after disconnect",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
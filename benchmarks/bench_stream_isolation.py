@@ -0,0 +1,170 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency of a regular (thread pool) route while many streams are open, with the
+streams iterated in the thread pool (as the stream routes used to) or on the
+event loop. Cohere is replaced by a local server that streams
+`CHUNKS_PER_STREAM` chunks, `CHUNK_INTERVAL` apart.
+
+    poetry run python -m benchmarks.bench_stream_isolation
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import time
+from functools import partial
+from typing import AsyncIterator, Iterator
+from unittest.mock import patch
+
+import httpx
+from aiohttp import web
+from anyio import from_thread
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from benchmarks.common import print_table
+from llm_gateway.providers.cohere import CohereWrapper
+from llm_gateway.providers.cohere import settings as cohere_settings
+from llm_gateway.streaming import StreamLimiter, StreamSlot
+
+CHUNKS_PER_STREAM = 20
+CHUNK_INTERVAL = 0.05
+OPEN_STREAMS = [0, 20, 100, 200]
+PROBES = 20
+
+
+async def fake_generate(request: web.Request) -> web.StreamResponse:
+    await request.read()
+    response = web.StreamResponse(headers={"Content-Type": "application/stream+json"})
+    await response.prepare(request)
+    for _ in range(CHUNKS_PER_STREAM):
+        await asyncio.sleep(CHUNK_INTERVAL)
+        line = {"text": "token ", "is_finished": False}
+        await response.write(json.dumps(line).encode() + b"\n")
+    await response.write(json.dumps({"is_finished": True}).encode() + b"\n")
+    await response.write_eof()
+    return response
+
+
+def blocking_iter(stream: AsyncIterator) -> Iterator:
+    """
+    Iterate an async stream from a worker thread, which is held until each chunk
+    arrives, like the stream of a sync client
+    """
+    while True:
+        try:
+            yield from_thread.run(stream.__anext__)
+        except StopAsyncIteration:
+            return
+
+
+def make_app(wrapper: CohereWrapper) -> FastAPI:
+    app = FastAPI()
+    limiter = StreamLimiter(max_streams=max(OPEN_STREAMS))
+
+    @app.post("/sync_stream")
+    def sync_stream() -> StreamingResponse:
+        response, _ = from_thread.run(
+            partial(
+                wrapper.asend_cohere_request,
+                "generate",
+                model="command",
+                max_tokens=10,
+                prompt="Hello",
+                stream=True,
+            )
+        )
+        return StreamingResponse(blocking_iter(response), media_type="text/plain")
+
+    @app.post("/async_stream")
+    async def async_stream() -> StreamingResponse:
+        with StreamSlot(limiter) as slot:
+            response, _ = await wrapper.asend_cohere_request(
+                "generate", model="command", max_tokens=10, prompt="Hello", stream=True
+            )
+            return slot.streaming_response(response)
+
+    @app.get("/probe")
+    def probe() -> dict:
+        return {}
+
+    return app
+
+
+async def probe_latencies(client: httpx.AsyncClient, path: str, streams: int):
+    async def open_stream() -> None:
+        response = await client.post(path)
+        response.raise_for_status()
+
+    stream_tasks = [asyncio.create_task(open_stream()) for _ in range(streams)]
+    # let the streams start
+    await asyncio.sleep(CHUNK_INTERVAL * 2)
+    latencies = []
+    for _ in range(PROBES):
+        start = time.perf_counter()
+        (await client.get("/probe")).raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+    await asyncio.gather(*stream_tasks)
+    return sorted(latencies)
+
+
+async def main() -> None:
+    server = web.Application()
+    server.router.add_post("/v1/generate", fake_generate)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    with patch.multiple(cohere_settings, COHERE_API_KEY="key"), patch.dict(
+        os.environ, {"CO_API_URL": url}
+    ), patch("cohere.Client.check_api_key"):
+        wrapper = CohereWrapper()
+
+    rows = []
+    transport = httpx.ASGITransport(app=make_app(wrapper))
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://gateway", timeout=None
+    ) as client:
+        for streams in OPEN_STREAMS:
+            for path in ("/sync_stream", "/async_stream"):
+                latencies = await probe_latencies(client, path, streams)
+                rows.append(
+                    (
+                        path.strip("/"),
+                        streams,
+                        f"{statistics.median(latencies) * 1e3:.1f} ms",
+                        f"{latencies[-1] * 1e3:.1f} ms",
+                    )
+                )
+
+    wrapper.close()
+    await wrapper.aclose()
+    await runner.cleanup()
+    print_table(
+        ["streams", "open streams", "probe median latency", "probe max latency"],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
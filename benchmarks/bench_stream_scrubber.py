@@ -0,0 +1,90 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure what scrubbing streamed output adds: latency per chunk, and how much
+text is held back while it could still be PII.
+
+    poetry run python -m benchmarks.bench_stream_scrubber
+"""
+
+import statistics
+import time
+from typing import Iterator, List
+
+from benchmarks.common import make_text, print_table
+from llm_gateway.utils import StreamScrubber
+
+SIZE = 256 << 10
+# model output streams in small chunks, roughly a token each
+CHUNK_SIZE = 4
+
+
+def chunks(text: str) -> Iterator[str]:
+    for start in range(0, len(text), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        yield text[start:end]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    return sorted(values)[int(fraction * (len(values) - 1))]
+
+
+PROFILES = (
+    ("prose", make_text(SIZE, pii_rate=0, number_rate=0)),
+    ("mixed", make_text(SIZE, pii_rate=0.01, number_rate=0.02)),
+    ("pii heavy", make_text(SIZE, pii_rate=0.2, number_rate=0.2)),
+    ("digits and spaces", "1234 " * (SIZE // 5)),
+)
+
+
+def main() -> None:
+    rows = []
+    for label, text in PROFILES:
+        scrubber = StreamScrubber()
+        latencies = []
+        held_back = []
+        for chunk in chunks(text):
+            start = time.perf_counter()
+            scrubber.feed(chunk)
+            latencies.append(time.perf_counter() - start)
+            held_back.append(scrubber.held_back)
+        scrubber.flush()
+
+        rows.append(
+            (
+                label,
+                f"{statistics.mean(latencies) * 1e6:.1f} us",
+                f"{percentile(latencies, 0.99) * 1e6:.1f} us",
+                f"{statistics.mean(held_back):.1f}",
+                f"{max(held_back)}",
+            )
+        )
+    print_table(
+        [
+            "text",
+            "mean per chunk",
+            "p99 per chunk",
+            "mean held back (chars)",
+            "max held back (chars)",
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
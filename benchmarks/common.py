@@ -0,0 +1,113 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Shared helpers for the scripts in this directory. Benchmarks are plain scripts,
+run them from the repo root, e.g. `poetry run python -m benchmarks.bench_pii_scrubber`
+"""
+
+import random
+import statistics
+import time
+from typing import Callable, Iterable, List
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog please summarize this document "
+    "for our client and reply with a short list of action items in plain english"
+).split()
+
+PII_SAMPLES = (
+    "jane.doe@example.com",
+    "416-555-0199",
+    "(647) 555 0123",
+    "4520 1234 5678 9010",
+    "046 454 286",
+    "M5V 3L9",
+)
+
+NON_PII_NUMBERS = ("2023", "$1,200.50", "v2", "Q3", "#42", "10:30")
+
+
+def make_text(size: int, pii_rate: float = 0.01, number_rate: float = 0.02) -> str:
+    """
+    Build roughly `size` characters of prose, sprinkled with PII and harmless numbers
+
+    :param size: Length of the generated text
+    :type size: int
+    :param pii_rate: Fraction of words replaced by a PII sample
+    :type pii_rate: float
+    :param number_rate: Fraction of words replaced by a non-PII number
+    :type number_rate: float
+    :return: Generated text
+    :rtype: str
+    """
+    rng = random.Random(size)
+    words = []
+    length = 0
+    while length < size:
+        roll = rng.random()
+        if roll < pii_rate:
+            word = rng.choice(PII_SAMPLES)
+        elif roll < pii_rate + number_rate:
+            word = rng.choice(NON_PII_NUMBERS)
+        else:
+            word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def time_call(func: Callable, repeat: int = 5, number: int = 1) -> float:
+    """
+    Median wall time of `number` calls to func, over `repeat` runs, in seconds per call
+
+    :param func: Zero-argument callable to time
+    :type func: Callable
+    :param repeat: Number of timing runs
+    :type repeat: int
+    :param number: Number of calls per timing run
+    :type number: int
+    :return: Median seconds per call
+    :rtype: float
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        runs.append((time.perf_counter() - start) / number)
+    return statistics.median(runs)
+
+
+def format_size(size: int) -> str:
+    if size >= 1 << 20:
+        return f"{size >> 20} MB"
+    if size >= 1 << 10:
+        return f"{size >> 10} KB"
+    return f"{size} B"
+
+
+def print_table(headers: List[str], rows: Iterable[Iterable]) -> None:
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [
+        max(len(header), *(len(row[i]) for row in rows))
+        for i, header in enumerate(headers)
+    ]
+    for line in [headers, *rows]:
+        print(
+            "  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+        )
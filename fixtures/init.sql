@@ -8,7 +8,8 @@ CREATE TABLE openai_requests(
     openai_model VARCHAR,
     temperature FLOAT,
     created_at TIMESTAMP WITHOUT TIME ZONE,
-    openai_endpoint VARCHAR
+    openai_endpoint VARCHAR,
+    gateway_metadata JSON
 );
 
 CREATE TABLE cohere_requests(
@@ -19,7 +20,8 @@ CREATE TABLE cohere_requests(
     cohere_model VARCHAR,
     temperature FLOAT,
     created_at TIMESTAMP WITHOUT TIME ZONE,
-    cohere_endpoint VARCHAR
+    cohere_endpoint VARCHAR,
+    gateway_metadata JSON
 );
 
 CREATE TABLE awsbedrock_requests(
@@ -30,6 +32,16 @@ CREATE TABLE awsbedrock_requests(
     awsbedrock_model VARCHAR,
     temperature FLOAT,
     created_at TIMESTAMP WITHOUT TIME ZONE,
-    awsbedrock_endpoint VARCHAR
-    extras JSON
+    awsbedrock_endpoint VARCHAR,
+    extras JSON,
+    gateway_metadata JSON
+);
+
+CREATE TABLE prompt_templates(
+    id serial primary key,
+    name VARCHAR NOT NULL,
+    segments JSON NOT NULL,
+    variables JSON NOT NULL,
+    redaction_counts JSON NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
 );
@@ -19,7 +19,19 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from llm_gateway.constants import get_settings
-from llm_gateway.routers import awsbedrock_api, cohere_api, openai_api
+from llm_gateway.denylist import get_denylist
+from llm_gateway.dependencies import aclose_provider_clients, start_provider_clients
+from llm_gateway.pii_scrubber import shutdown_scrub_pool
+from llm_gateway.rate_limiter import CallerMiddleware
+from llm_gateway.response_cache import CacheControlMiddleware
+from llm_gateway.retries import RequestDeadlineMiddleware
+from llm_gateway.routers import (
+    admin_api,
+    awsbedrock_api,
+    cohere_api,
+    openai_api,
+    templates_api,
+)
 
 settings = get_settings()
 
@@ -34,6 +46,8 @@ api.description = settings.APP_DESCRIPTION
 api.include_router(openai_api.router, prefix="/openai")
 api.include_router(cohere_api.router, prefix="/cohere")
 api.include_router(awsbedrock_api.router, prefix="/awsbedrock")
+api.include_router(templates_api.router, prefix="/templates")
+api.include_router(admin_api.router, prefix="/admin")
 
 app.mount(settings.API_PREFIX, api, name="api")
 
@@ -47,6 +61,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestDeadlineMiddleware)
+app.add_middleware(CacheControlMiddleware)
+app.add_middleware(CallerMiddleware)
 
 
 @api.get("/healthcheck")
@@ -55,3 +72,16 @@ async def healthcheck():
     Endpoint to verify that the service is up and running
     """
     return {"message": "llm-gateway is healthy"}
+
+
+@app.on_event("startup")
+def startup() -> None:
+    # compile the denylist now rather than on the first request
+    get_denylist()
+    start_provider_clients()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await aclose_provider_clients()
+    shutdown_scrub_pool()
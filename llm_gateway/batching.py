@@ -0,0 +1,211 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-batching of embedding requests. Requests for the same model that arrive
+within a few milliseconds of each other are merged into one provider call, and
+the embeddings are split back out to each request. This saves a round trip per
+request and counts once against the provider's requests-per-minute limit.
+"""
+
+import asyncio
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+
+
+class EmbeddingBatcher:
+    """
+    Collects the texts of concurrent requests for one model, and embeds them
+    together once `max_delay` seconds have passed since the first one arrived, or
+    once there are `max_batch_size` of them
+
+    :param embed: Embeds a list of texts with the model in one provider call
+    :type embed: Callable[[str, List[str]], Awaitable[Any]]
+    :param split: Splits the response of `embed` into one response per request,
+        given each request's texts
+    :type split: Callable[[Any, List[List[str]]], List[Any]]
+    """
+
+    def __init__(
+        self,
+        model: str,
+        embed: Callable[[str, List[str]], Awaitable[Any]],
+        split: Callable[[Any, List[List[str]]], List[Any]],
+        max_batch_size: int,
+        max_delay: float,
+        **labels,
+    ) -> None:
+        self.model = model
+        self.embed = embed
+        self.split = split
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.labels = labels
+        # texts, future and time queued of each waiting request
+        self._pending: List[Tuple[List[str], asyncio.Future, float]] = []
+        self._pending_texts = 0
+        self._timer = None
+
+    async def submit(self, texts: List[str]) -> Tuple[Any, dict]:
+        """
+        Embed a request's texts in the next batch
+
+        :param texts: Texts of the request
+        :type texts: List[str]
+        :return: The request's share of the batch's response, and the size of the
+            batch and how long the request waited for it, for the DB log
+        :rtype: Tuple[Any, dict]
+        """
+        loop = asyncio.get_running_loop()
+        if self._pending_texts + len(texts) > self.max_batch_size:
+            # doesn't fit in the waiting batch
+            self._flush()
+        future = loop.create_future()
+        self._pending.append((texts, future, time.monotonic()))
+        self._pending_texts += len(texts)
+        if self._pending_texts >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch = self._pending
+        self._pending = []
+        self._pending_texts = 0
+        asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[List[str], asyncio.Future, float]]):
+        # requests cancelled while waiting don't need embedding
+        batch = [request for request in batch if not request[1].done()]
+        if not batch:
+            return
+        texts = [text for request_texts, _, _ in batch for text in request_texts]
+        sent_at = time.monotonic()
+        labels = {"model": self.model, **self.labels}
+        metrics.observe("embedding_batch.texts", len(texts), **labels)
+        metrics.observe("embedding_batch.requests", len(batch), **labels)
+        for _, _, queued_at in batch:
+            metrics.observe(
+                "embedding_batch.queue_delay_ms",
+                (sent_at - queued_at) * 1e3,
+                **labels,
+            )
+
+        try:
+            response = await self.embed(self.model, texts)
+            parts = self.split(response, [request[0] for request in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, queued_at), part in zip(batch, parts):
+            if not future.done():
+                future.set_result(
+                    (
+                        part,
+                        {
+                            "requests": len(batch),
+                            "texts": len(texts),
+                            "queue_delay_ms": round((sent_at - queued_at) * 1e3, 3),
+                        },
+                    )
+                )
+
+
+# batchers belong to the event loop that waits on them
+_batchers: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_embedding_batcher(
+    provider: str,
+    model: str,
+    embed: Callable[[str, List[str]], Awaitable[Any]],
+    split: Callable[[Any, List[List[str]]], List[Any]],
+    max_batch_size: int,
+) -> EmbeddingBatcher:
+    """
+    The batcher of a provider model's embedding requests on the running event loop,
+    created on first use
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param model: Name of the model
+    :type model: str
+    :param embed: Embeds a list of texts with the model in one provider call
+    :type embed: Callable[[str, List[str]], Awaitable[Any]]
+    :param split: Splits the response of `embed` into one response per request
+    :type split: Callable[[Any, List[List[str]]], List[Any]]
+    :param max_batch_size: Most texts the provider embeds in one call
+    :type max_batch_size: int
+    :return: The model's batcher
+    :rtype: EmbeddingBatcher
+    """
+    batchers: Dict[tuple, EmbeddingBatcher] = _batchers.setdefault(
+        asyncio.get_running_loop(), {}
+    )
+    # a wrapper that replaced another one gets its own batchers
+    key = (provider, model, embed)
+    batcher = batchers.get(key)
+    if batcher is None:
+        batcher = batchers[key] = EmbeddingBatcher(
+            model,
+            embed,
+            split,
+            max_batch_size=max_batch_size,
+            max_delay=get_settings().EMBEDDING_BATCH_MAX_DELAY,
+            provider=provider,
+        )
+    return batcher
+
+
+def split_usage(total: int, sizes: List[int]) -> List[int]:
+    """
+    Share a batch's token count between its requests, in proportion to their size,
+    as whole numbers that add up to the total
+
+    :param total: Tokens used by the batch
+    :type total: int
+    :param sizes: Size of each request (i.e. characters of text)
+    :type sizes: List[int]
+    :return: Tokens of each request
+    :rtype: List[int]
+    """
+    size = sum(sizes)
+    if not size:
+        shares = [total / len(sizes)] * len(sizes)
+    else:
+        shares = [total * request_size / size for request_size in sizes]
+    counts = [int(share) for share in shares]
+    # the rest goes to the requests that were rounded down the most
+    by_remainder = sorted(
+        range(len(sizes)), key=lambda i: shares[i] - counts[i], reverse=True
+    )
+    for i in by_remainder[: total - sum(counts)]:
+        counts[i] += 1
+    return counts
@@ -0,0 +1,99 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from llm_gateway.metrics import metrics
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache, bounded by the total size of its entries
+    in bytes rather than by the number of entries.
+
+    Hits, misses and evictions are counted in `metrics` under `cache.*`, labelled
+    with the cache name.
+    """
+
+    def __init__(self, name: str, max_bytes: int) -> None:
+        self.name = name
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Look up key, marking it as most recently used
+
+        :param key: Cache key
+        :type key: Hashable
+        :return: Cached value, or None on a miss
+        :rtype: Optional[Any]
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            metrics.increment("cache.misses", cache=self.name)
+            return None
+        metrics.increment("cache.hits", cache=self.name)
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, size: Optional[int] = None) -> None:
+        """
+        Store value under key, evicting least recently used entries to make room
+
+        :param key: Cache key
+        :type key: Hashable
+        :param value: Value to cache
+        :type value: Any
+        :param size: Size of the entry in bytes, defaults to `sys.getsizeof(value)`
+        :type size: Optional[int]
+        """
+        if size is None:
+            size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+
+        evicted = 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                evicted += 1
+
+        if evicted:
+            metrics.increment("cache.evictions", evicted, cache=self.name)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
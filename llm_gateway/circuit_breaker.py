@@ -0,0 +1,338 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Circuit breakers for provider models. When a model keeps failing, its breaker
+opens and requests to it fail straight away with a 503, instead of each waiting
+out the provider's timeout and retries. After a while a few probe requests are
+let through, and the breaker closes again once they succeed.
+"""
+
+import inspect
+import math
+import threading
+import time
+from collections import OrderedDict
+from enum import StrEnum
+from functools import wraps
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+
+
+class CircuitState(StrEnum):
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+
+# value of the `circuit_breaker.state` gauge
+_STATE_GAUGE = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
+
+
+class CircuitOpenError(HTTPException):
+    """
+    Raised instead of calling a model whose circuit breaker is open
+    """
+
+    def __init__(self, provider: str, model: str, retry_after: float) -> None:
+        retry_after = max(math.ceil(retry_after), 1)
+        super().__init__(
+            status_code=503,
+            detail=f"`{model}` from {provider} is failing, try again in "
+            f"{retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one provider model
+
+    Closed, it lets every call through and opens after `failure_threshold` calls
+    in a row fail. Open, it rejects every call for `reset_timeout` seconds, then
+    goes half open. Half open, it lets up to `half_open_probes` calls through at a
+    time, closing once that many have succeeded and opening again if one fails.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_probes: int,
+    ) -> None:
+        self.provider = provider
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._set_state(CircuitState.CLOSED)
+
+    def _set_state(self, state: CircuitState) -> None:
+        self.state = state
+        metrics.set_gauge(
+            "circuit_breaker.state",
+            _STATE_GAUGE[state],
+            provider=self.provider,
+            model=self.model,
+        )
+
+    def _open(self) -> None:
+        self._set_state(CircuitState.OPEN)
+        self.opened_at = time.monotonic()
+        metrics.increment(
+            "circuit_breaker.opened", provider=self.provider, model=self.model
+        )
+
+    def _reject(self, retry_after: float) -> CircuitOpenError:
+        metrics.increment(
+            "circuit_breaker.rejected", provider=self.provider, model=self.model
+        )
+        return CircuitOpenError(self.provider, self.model, retry_after)
+
+    def acquire(self) -> bool:
+        """
+        Let a call through, or reject it if the breaker is open
+
+        :raises CircuitOpenError: The breaker is open, or half open with as many
+            probes as it allows already in flight
+        :return: Whether the call is a probe of a half open breaker, to pass to
+            `release`
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise self._reject(remaining)
+                self._set_state(CircuitState.HALF_OPEN)
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+
+            if self.state == CircuitState.HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    # the probes will be done soon
+                    raise self._reject(1)
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def release(self, probe: bool, failed: Optional[bool]) -> None:
+        """
+        Record how a call that was let through went
+
+        :param probe: What `acquire` returned for the call
+        :type probe: bool
+        :param failed: Whether the provider failed, None if the call didn't get
+            far enough to tell (i.e. it was cancelled)
+        :type failed: Optional[bool]
+        """
+        with self._lock:
+            if probe:
+                self._probes_in_flight -= 1
+                if self.state != CircuitState.HALF_OPEN or failed is None:
+                    return
+                if failed:
+                    self._open()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self.consecutive_failures = 0
+                    self._set_state(CircuitState.CLOSED)
+                return
+
+            # calls let through before the breaker opened don't change it
+            if self.state != CircuitState.CLOSED or failed is None:
+                return
+            if not failed:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_after = None
+            if self.state == CircuitState.OPEN:
+                retry_after = max(
+                    self.opened_at + self.reset_timeout - time.monotonic(), 0
+                )
+            return {
+                "provider": self.provider,
+                "model": self.model,
+                "state": str(self.state),
+                "consecutive_failures": self.consecutive_failures,
+                "retry_after": retry_after,
+            }
+
+
+# breakers in the order they were made, only of models that failed since a closed
+# breaker without failures lets calls through like no breaker at all
+_breakers: OrderedDict[Tuple[str, str], CircuitBreaker] = OrderedDict()
+_breakers_lock = threading.Lock()
+
+
+def _find_circuit_breaker(
+    provider: str, model: Optional[str]
+) -> Optional[CircuitBreaker]:
+    return _breakers.get((provider, model or "default"))
+
+
+def get_circuit_breaker(provider: str, model: Optional[str]) -> CircuitBreaker:
+    """
+    Circuit breaker of a provider model, created on first use
+
+    Past `CIRCUIT_BREAKER_MAX_MODELS` breakers, the oldest closed one (or the
+    oldest one, if they're all open) is forgotten to make room, so made up model
+    names can't grow the registry without bound.
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param model: Name of the model, None for the provider's default model
+    :type model: Optional[str]
+    :return: The model's circuit breaker
+    :rtype: CircuitBreaker
+    """
+    key = (provider, model or "default")
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                settings = get_settings()
+                while _breakers and len(_breakers) >= max(
+                    settings.CIRCUIT_BREAKER_MAX_MODELS, 1
+                ):
+                    evicted = next(
+                        (
+                            k
+                            for k, b in _breakers.items()
+                            if b.state == CircuitState.CLOSED
+                        ),
+                        next(iter(_breakers)),
+                    )
+                    del _breakers[evicted]
+                breaker = _breakers[key] = CircuitBreaker(
+                    *key,
+                    failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                    reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+                    half_open_probes=settings.CIRCUIT_BREAKER_HALF_OPEN_PROBES,
+                )
+    return breaker
+
+
+def get_circuit_breakers() -> List[CircuitBreaker]:
+    with _breakers_lock:
+        return list(_breakers.values())
+
+
+def reset_circuit_breakers() -> None:
+    """
+    Forget every circuit breaker, closing them all
+    """
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def circuit_breaker(
+    provider: str,
+    exceptions: tuple,
+    is_failure: Optional[Callable[[Exception], bool]] = None,
+):
+    """
+    Circuit Breaker Decorator
+    Calls the wrapped function/method through the circuit breaker of the model in
+    its `model` argument, awaiting it if it is a coroutine function. Put it under
+    `max_retries`, so every attempt is counted and an open breaker stops retries.
+    :param provider: Provider of the models
+    :type provider: str
+    :param exceptions: Exceptions that count as the provider failing
+    :type exceptions: tuple
+    :param is_failure: Whether one of `exceptions` is the provider failing rather
+        than the request (i.e. an invalid prompt), defaults to None (all of them are)
+    :type is_failure: Optional[Callable[[Exception], bool]]
+    """
+
+    def failed(e: BaseException) -> Optional[bool]:
+        if isinstance(e, exceptions):
+            return is_failure is None or is_failure(e)
+        # the provider answered, or the call was cancelled before it could
+        return False if isinstance(e, Exception) else None
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def get_model(args, kwargs) -> Optional[str]:
+            return signature.bind_partial(*args, **kwargs).arguments.get("model")
+
+        def release(
+            model: Optional[str],
+            breaker: Optional[CircuitBreaker],
+            probe: bool,
+            failed: Optional[bool],
+        ) -> None:
+            # a model gets a breaker once it fails
+            if breaker is None and failed:
+                breaker = get_circuit_breaker(provider, model)
+            if breaker is not None:
+                breaker.release(probe, failed)
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def anewfn(*args, **kwargs):
+                model = get_model(args, kwargs)
+                breaker = _find_circuit_breaker(provider, model)
+                probe = breaker is not None and breaker.acquire()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException as e:
+                    release(model, breaker, probe, failed(e))
+                    raise
+                release(model, breaker, probe, False)
+                return result
+
+            return anewfn
+
+        @wraps(func)
+        def newfn(*args, **kwargs):
+            model = get_model(args, kwargs)
+            breaker = _find_circuit_breaker(provider, model)
+            probe = breaker is not None and breaker.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                release(model, breaker, probe, failed(e))
+                raise
+            release(model, breaker, probe, False)
+            return result
+
+        return newfn
+
+    return decorator
@@ -18,7 +18,7 @@
 from enum import StrEnum
 from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
 import pkg_resources
 from pydantic import BaseSettings, Field
@@ -51,10 +51,149 @@ class Settings(BaseSettings):
     AWS_REGION: Optional[str]
     AWS_PUBLIC_ACCESS_KEY: Optional[str]
     AWS_PRIVATE_ACCESS_KEY: Optional[str]
+    # Bedrock runtime client, shared by every request (see llm_gateway.dependencies)
+    AWS_BEDROCK_ENDPOINT_URL: Optional[str]
+    AWS_BEDROCK_MAX_POOL_CONNECTIONS: int = Field(default=64)
+    AWS_BEDROCK_CONNECT_TIMEOUT: float = Field(default=5)
+    AWS_BEDROCK_READ_TIMEOUT: float = Field(default=120)
+
+    # Provider Clients
+    # Most connections each provider's async HTTP client keeps open at once
+    PROVIDER_MAX_CONNECTIONS: int = Field(default=1000)
+
+    # Retries of failed provider requests
+    # Backoff before retry n is random, up to BASE * 2 ** (n - 1) seconds, at most MAX
+    RETRY_BACKOFF_BASE: float = Field(default=0.5)
+    RETRY_BACKOFF_MAX: float = Field(default=20)
+    # Seconds a request has to be answered in, when it doesn't send an
+    # X-Request-Timeout header. No retry is started that would wait past it.
+    RETRY_DEADLINE: float = Field(default=120)
+    # Retries in the last RETRY_BUDGET_WINDOW seconds are capped at this share of
+    # requests, plus RETRY_BUDGET_MIN_PER_SECOND a second
+    RETRY_BUDGET_RATIO: float = Field(default=0.1)
+    RETRY_BUDGET_MIN_PER_SECOND: float = Field(default=10)
+    RETRY_BUDGET_WINDOW: float = Field(default=10)
+
+    # Circuit breakers of provider models
+    # Failed calls in a row that open a model's breaker...
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = Field(default=5)
+    # ...which fails requests to it for this many seconds...
+    CIRCUIT_BREAKER_RESET_TIMEOUT: float = Field(default=30)
+    # ...then lets this many probe requests through, and closes if they succeed
+    CIRCUIT_BREAKER_HALF_OPEN_PROBES: int = Field(default=3)
+    # Breakers are only made for models that failed, and at most this many are kept
+    CIRCUIT_BREAKER_MAX_MODELS: int = Field(default=1000)
+
+    # Hedging of requests that are safe to repeat (embeddings and temperature 0
+    # completions), see llm_gateway.hedging
+    HEDGE_REQUESTS: bool = Field(default=False)
+    # A second call is sent when the first takes longer than this percentile of
+    # the model's last HEDGE_LATENCY_WINDOW calls...
+    HEDGE_PERCENTILE: float = Field(default=95)
+    HEDGE_LATENCY_WINDOW: int = Field(default=200)
+    # ...once there are this many
+    HEDGE_MIN_SAMPLES: int = Field(default=20)
+    # Most hedges, as a share of hedgeable requests
+    HEDGE_MAX_RATE: float = Field(default=0.05)
+
+    # Routing of Cohere generate requests between backends that serve the same
+    # model (Cohere and AWS Bedrock), see llm_gateway.routing
+    ROUTE_EQUIVALENT_MODELS: bool = Field(default=False)
+    # Weight of the latest request in each backend's EWMA latency and error rate
+    ROUTING_EWMA_ALPHA: float = Field(default=0.3)
+    # Backends failing more than this share of requests are only used as fallbacks
+    ROUTING_MAX_ERROR_RATE: float = Field(default=0.5)
+    # Seconds for the latency and error rate of an unused backend to decay by a
+    # factor of e, so it is tried again
+    ROUTING_STATS_DECAY: float = Field(default=30)
+
+    # Micro-batching of concurrent embedding requests to the same model into one
+    # provider call, see llm_gateway.batching
+    EMBEDDING_BATCHING: bool = Field(default=False)
+    # Seconds a request waits for others to join its batch
+    EMBEDDING_BATCH_MAX_DELAY: float = Field(default=0.005)
+
+    # Cache of embeddings, see llm_gateway.embedding_cache
+    # Size of the in-memory tier, 0 turns the cache off
+    EMBEDDING_CACHE_MAX_BYTES: int = Field(default=256 * 1024 * 1024)
+    # SQLite file of the on-disk tier, shared by the workers on a host
+    EMBEDDING_CACHE_PATH: Optional[Path]
+
+    # Cache of the responses to temperature 0 completions, see
+    # llm_gateway.response_cache
+    RESPONSE_CACHE: bool = Field(default=False)
+    RESPONSE_CACHE_MAX_BYTES: int = Field(default=64 * 1024 * 1024)
+    # Seconds responses are cached for...
+    RESPONSE_CACHE_TTL: float = Field(default=3600)
+    # ...unless their route (i.e. "openai/chat_completion") has its own TTL here, 0
+    # to not cache the route
+    RESPONSE_CACHE_ROUTE_TTLS: Dict[str, float] = Field(default={})
+
+    # Coalescing of identical temperature 0 completion requests in flight at the
+    # same time into one provider call (or stream), see llm_gateway.singleflight
+    SINGLEFLIGHT: bool = Field(default=False)
+
+    # Rate limits kept to inside the gateway, see llm_gateway.rate_limiter
+    # Requests and tokens a minute allowed to a model, by "provider/model" (i.e.
+    # "openai/gpt-4"), or to every model of a provider together, by "provider"
+    RATE_LIMIT_RPM: Dict[str, float] = Field(default={})
+    RATE_LIMIT_TPM: Dict[str, float] = Field(default={})
+    # Most calls at once, by the same keys
+    RATE_LIMIT_MAX_CONCURRENT: Dict[str, int] = Field(default={})
+    # Quotas of callers, by their X-User-Email header (which a trusted proxy has to
+    # set), or "*" for one quota shared by every caller without their own
+    CALLER_RATE_LIMIT_RPM: Dict[str, float] = Field(default={})
+    CALLER_RATE_LIMIT_TPM: Dict[str, float] = Field(default={})
+    CALLER_RATE_LIMIT_MAX_CONCURRENT: Dict[str, int] = Field(default={})
+    # Share of each limit kept spare, as tokens are estimated before each call
+    RATE_LIMIT_HEADROOM: float = Field(default=0.05)
+    # Seconds' worth of each limit that can be used at once, as providers also
+    # enforce their limits over periods shorter than a minute
+    RATE_LIMIT_BURST: float = Field(default=1)
+    # Calls wait at most this many seconds for their turn, with at most this many
+    # waiting on a limit, the others get a 429
+    RATE_LIMIT_MAX_WAIT: float = Field(default=10)
+    RATE_LIMIT_MAX_QUEUE: int = Field(default=100)
+
+    # Streaming
+    # Most streamed responses open at once, further streams get a 503
+    MAX_CONCURRENT_STREAMS: int = Field(default=200)
+    # Server-sent event streams batch text like Nagle's algorithm: text that comes
+    # within this many seconds of the last batch waits for the next one...
+    STREAM_SSE_COALESCE_INTERVAL: float = Field(default=0.05)
+    # ...unless this many characters are already waiting
+    STREAM_SSE_COALESCE_MAX_CHARS: int = Field(default=1024)
 
     # Postgres Database
     DATABASE_URL: str
 
+    # PII Scrubbing
+    # Batches whose total size (in characters) reaches this threshold are
+    # scrubbed in a process pool instead of on the request thread
+    PII_SCRUB_POOL_THRESHOLD: int = Field(default=1_000_000)
+    # Defaults to the number of CPUs
+    PII_SCRUB_POOL_WORKERS: Optional[int]
+    # Single inputs of at least this many characters are also scrubbed in the
+    # process pool, so they don't hold up the request threads
+    PII_SCRUB_OFFLOAD_THRESHOLD: int = Field(default=100_000)
+    # Size of the cache of already scrubbed chat messages, 0 turns it off
+    PII_SCRUB_CACHE_MAX_BYTES: int = Field(default=64 * 1024 * 1024)
+    # Scrub the output of streaming routes as it is streamed
+    PII_SCRUB_STREAMED_OUTPUT: bool = Field(default=False)
+    # Most characters of streamed output held back while they could still be PII
+    PII_SCRUB_STREAM_MAX_HOLDBACK: int = Field(default=256)
+    # File of organisation-specific terms to redact, one per line
+    PII_DENYLIST_PATH: Optional[Path]
+    PII_DENYLIST_CASE_SENSITIVE: bool = Field(default=False)
+    # Only match terms that aren't part of a longer word
+    PII_DENYLIST_WHOLE_WORDS: bool = Field(default=True)
+    # Seconds between checks of the denylist file for changes to reload
+    PII_DENYLIST_RELOAD_INTERVAL: float = Field(default=30)
+
+    # Prompt Templates
+    # Size of the cache of registered prompt templates
+    PROMPT_TEMPLATE_CACHE_MAX_BYTES: int = Field(default=16 * 1024 * 1024)
+
     MODULE_PATH = Path(
         pkg_resources.resource_filename(llm_gateway.__name__, "")
     ).absolute()
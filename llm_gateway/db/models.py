@@ -37,6 +37,7 @@ class CommonRequest(Base):
     temperature = Column(Float, nullable=True)
     created_at = Column(DateTime, index=True, nullable=False)
     extras = Column(JSON, nullable=True)
+    gateway_metadata = Column(JSON, nullable=True)
 
 
 class OpenAIRequests(CommonRequest):
@@ -58,3 +59,14 @@ class AWSBedrockRequests(CommonRequest):
     awsbedrock_response = Column(JSON, nullable=True)
     awsbedrock_model = Column(String, nullable=True)
     awsbedrock_endpoint = Column(String, nullable=False)
+
+
+class PromptTemplates(Base):
+    __tablename__ = "prompt_templates"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    # static text between the variables, already scrubbed of PII
+    segments = Column(JSON, nullable=False)
+    variables = Column(JSON, nullable=False)
+    redaction_counts = Column(JSON, nullable=False)
+    created_at = Column(DateTime, index=True, nullable=False)
@@ -0,0 +1,318 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from llm_gateway.constants import get_settings
+from llm_gateway.logger import get_logger
+from llm_gateway.metrics import metrics
+
+logger = get_logger(__name__)
+
+_WORD_REGEX = re.compile(r"\w+")
+_WHITESPACE_REGEX = re.compile(r"(\s+)")
+# Trie key standing in for a run of whitespace, which matches any whitespace
+_WHITESPACE = r"\s+"
+
+
+def _trie_keys(term: str) -> Iterator[str]:
+    for piece in _WHITESPACE_REGEX.split(term):
+        if piece.isspace():
+            yield _WHITESPACE
+        else:
+            yield from piece
+
+
+def _build_trie_pattern(terms: Iterable[str]) -> str:
+    """
+    Fold terms into a single regex shaped like a trie of their characters
+
+    Terms sharing a prefix share its branch, so matching at a position walks down
+    one path of the trie instead of trying every term in turn.
+
+    :param terms: Terms to match
+    :type terms: Iterable[str]
+    :return: Regex pattern matching any of the terms, preferring the longest
+    :rtype: str
+    """
+    trie: dict = {}
+    for term in terms:
+        node = trie
+        for key in _trie_keys(term):
+            node = node.setdefault(key, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [
+            (key if key == _WHITESPACE else re.escape(key)) + build(child)
+            for key, child in sorted(node.items())
+            if key
+        ]
+        if not branches:
+            return ""
+        if "" in node:
+            # greedy, so the longer terms are tried before this one ends
+            return f"(?:{'|'.join(branches)})?"
+        if len(branches) == 1:
+            return branches[0]
+        return f"(?:{'|'.join(branches)})"
+
+    return build(trie)
+
+
+class Denylist:
+    """
+    Organisation-specific terms to redact, i.e. client names and project codenames
+
+    With whole word matching (the default) terms are indexed by their first word,
+    each leading to a trie of the characters that follow it. Finding terms in a
+    text walks its words once, and only follows a trie from the words that start
+    a term, so it takes about as long for 100 terms as for 100,000, however many
+    of them occur. Substring matching, and terms that don't start with a word
+    character, use one trie-shaped regex of the terms instead, which is also a
+    single pass but slows down somewhat as the trie gets wider.
+    """
+
+    def __init__(
+        self,
+        terms: Iterable[str],
+        case_sensitive: bool = False,
+        whole_words: bool = True,
+        version: int = 0,
+    ) -> None:
+        self.case_sensitive = case_sensitive
+        self.whole_words = whole_words
+        self.version = version
+
+        terms = {" ".join(term.split()) for term in terms}
+        terms.discard("")
+        if not case_sensitive:
+            terms = {term.lower() for term in terms}
+        self.size = len(terms)
+        # how many words at the end of a stream could still be the start of a term
+        self.max_words = max((len(term.split()) for term in terms), default=0)
+
+        # terms starting with a word, by that word, in a trie of what follows it
+        self._tries: Dict[str, dict] = {}
+        # the other terms, or every term when matching substrings
+        self._regex_terms: Set[str] = set()
+        for term in terms:
+            word = _WORD_REGEX.match(term) if whole_words else None
+            if word is None:
+                self._regex_terms.add(term)
+                continue
+            node = self._tries.setdefault(word.group(), {})
+            for key in _trie_keys(term.removeprefix(word.group())):
+                node = node.setdefault(key, {})
+            node[""] = {}
+        self._get_regex = lru_cache(maxsize=None)(self._compile_regex)
+        # compile the regex up front rather than on the first request
+        if self._regex_terms:
+            self._get_regex(0)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def from_file(cls, path: Path, **kwargs) -> "Denylist":
+        """
+        Load a denylist file, one term per line. Blank lines and lines starting
+        with '#' are skipped.
+
+        :param path: Path to the denylist file
+        :type path: Path
+        :param kwargs: Options passed on to `Denylist`
+        :return: Compiled denylist
+        :rtype: Denylist
+        """
+        with open(path, encoding="utf-8") as file:
+            terms = [
+                line.strip()
+                for line in file
+                if line.strip() and not line.lstrip().startswith("#")
+            ]
+        return cls(terms, **kwargs)
+
+    def _compile_regex(self, flags: int) -> re.Pattern:
+        pattern = _build_trie_pattern(self._regex_terms)
+        if self.whole_words:
+            pattern = rf"(?<!\w)(?:{pattern})(?!\w)"
+        return re.compile(pattern, flags)
+
+    def find(self, text: str, pos: int = 0) -> Iterator[Tuple[int, int]]:
+        """
+        Find every denylisted term in text
+
+        :param text: Input text to search
+        :type text: str
+        :param pos: Index to start searching at, defaults to 0
+        :type pos: int
+        :return: Non-overlapping (start, end) offsets of the terms, in order
+        :rtype: Iterator[Tuple[int, int]]
+        """
+        if not self.size:
+            return
+
+        flags = 0
+        if not self.case_sensitive:
+            lowered = text.lower()
+            if len(lowered) == len(text):
+                text = lowered
+            else:
+                # a few characters change length when lowercased, which would
+                # shift the offsets, so match the original text ignoring case
+                flags = re.IGNORECASE
+
+        spans = []
+        if self._regex_terms:
+            spans = [
+                match.span() for match in self._get_regex(flags).finditer(text, pos)
+            ]
+        if not self.whole_words:
+            yield from spans
+            return
+
+        spans.extend(self._find_words(text, pos, flags == re.IGNORECASE))
+        spans.sort(key=lambda span: (span[0], -span[1]))
+        # terms starting with different words can overlap, keep the leftmost longest
+        last_end = 0
+        for start, end in spans:
+            if start >= last_end:
+                yield start, end
+                last_end = end
+
+    def _find_words(
+        self, text: str, pos: int, lowercase: bool
+    ) -> Iterator[Tuple[int, int]]:
+        """
+        Find the longest term starting at each word of text that starts one
+
+        :param text: Input text to search
+        :type text: str
+        :param pos: Index to start searching at
+        :type pos: int
+        :param lowercase: Whether to lowercase text as it is matched
+        :type lowercase: bool
+        :return: (start, end) offsets of the terms, in order of their start
+        :rtype: Iterator[Tuple[int, int]]
+        """
+        tries = self._tries
+        length = len(text)
+        for word in _WORD_REGEX.finditer(text, pos):
+            node = tries.get(word.group().lower() if lowercase else word.group())
+            if node is None:
+                continue
+            start = word.start()
+            if start == pos and _follows_word_char(text, start):
+                continue
+
+            i = end = word.end()
+            found = "" in node
+            while i < length:
+                char = text[i]
+                if char.isspace():
+                    node = node.get(_WHITESPACE)
+                    i += 1
+                    while i < length and text[i].isspace():
+                        i += 1
+                else:
+                    for key in char.lower() if lowercase else char:
+                        node = node.get(key)
+                        if node is None:
+                            break
+                    i += 1
+                if node is None:
+                    break
+                if "" in node and not (i < length and _WORD_REGEX.match(text, i)):
+                    found, end = True, i
+            if found:
+                yield start, end
+
+
+def _follows_word_char(text: str, index: int) -> bool:
+    return index > 0 and _WORD_REGEX.match(text, index - 1) is not None
+
+
+_denylist: Optional[Denylist] = None
+_denylist_path: Optional[Path] = None
+_denylist_mtime: Optional[int] = None
+_denylist_checked_at = 0.0
+_denylist_lock = threading.Lock()
+
+
+def _denylist_is_fresh(path: Path, now: float, interval: float) -> bool:
+    return (
+        _denylist is not None
+        and _denylist_path == path
+        and now - _denylist_checked_at < interval
+    )
+
+
+def get_denylist() -> Optional[Denylist]:
+    """
+    Get the denylist configured by `PII_DENYLIST_PATH`, if any
+
+    The file is checked for changes at most every `PII_DENYLIST_RELOAD_INTERVAL`
+    seconds and reloaded when it was modified, so terms can be added without a
+    restart. If a reload fails the previous denylist is kept.
+
+    :raises OSError: The denylist file could not be read the first time
+    :return: Compiled denylist, or None when none is configured
+    :rtype: Optional[Denylist]
+    """
+    global _denylist, _denylist_path, _denylist_mtime, _denylist_checked_at
+
+    settings = get_settings()
+    path = settings.PII_DENYLIST_PATH
+    if path is None:
+        return None
+
+    interval = settings.PII_DENYLIST_RELOAD_INTERVAL
+    if _denylist_is_fresh(path, time.monotonic(), interval):
+        return _denylist
+
+    with _denylist_lock:
+        # another thread may have checked while we waited for the lock
+        now = time.monotonic()
+        if _denylist_is_fresh(path, now, interval):
+            return _denylist
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if _denylist is None or _denylist_path != path or mtime != _denylist_mtime:
+                denylist = Denylist.from_file(
+                    path,
+                    case_sensitive=settings.PII_DENYLIST_CASE_SENSITIVE,
+                    whole_words=settings.PII_DENYLIST_WHOLE_WORDS,
+                    version=_denylist.version + 1 if _denylist is not None else 0,
+                )
+                _denylist, _denylist_path, _denylist_mtime = denylist, path, mtime
+                metrics.increment("pii_scrubber.denylist.loads")
+                metrics.set_gauge("pii_scrubber.denylist.terms", len(denylist))
+                logger.info(f"Loaded {len(denylist)} denylisted terms from {path}")
+        except OSError:
+            if _denylist is None or _denylist_path != path:
+                raise
+            logger.exception(f"Failed to reload denylist from {path}")
+        _denylist_checked_at = now
+
+    return _denylist
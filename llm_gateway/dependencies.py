@@ -0,0 +1,105 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provider wrappers shared by every request in the process, injected into routes
+as FastAPI dependencies. They are created at startup (or by the first request
+that needs one) and closed at shutdown.
+"""
+
+import threading
+from typing import Callable, Dict, List
+
+from llm_gateway.constants import get_settings
+from llm_gateway.logger import get_logger
+from llm_gateway.providers.awsbedrock import AWSBedrockWrapper
+from llm_gateway.providers.cohere import CohereWrapper
+from llm_gateway.providers.openai import OpenAIWrapper
+
+logger = get_logger(__name__)
+
+_wrappers: Dict[type, object] = {}
+_wrappers_lock = threading.Lock()
+
+
+def _get_wrapper(wrapper_class: type) -> object:
+    wrapper = _wrappers.get(wrapper_class)
+    if wrapper is None:
+        with _wrappers_lock:
+            wrapper = _wrappers.get(wrapper_class)
+            if wrapper is None:
+                wrapper = _wrappers[wrapper_class] = wrapper_class()
+    return wrapper
+
+
+def get_openai_wrapper() -> OpenAIWrapper:
+    return _get_wrapper(OpenAIWrapper)
+
+
+def get_cohere_wrapper() -> CohereWrapper:
+    return _get_wrapper(CohereWrapper)
+
+
+def get_awsbedrock_wrapper() -> AWSBedrockWrapper:
+    return _get_wrapper(AWSBedrockWrapper)
+
+
+def start_provider_clients() -> None:
+    """
+    Create the wrappers of every provider that has credentials configured
+
+    A provider that fails to start is logged rather than stopping the app, the
+    first request to it tries again (and fails with the provider's error).
+    """
+    settings = get_settings()
+    getters: List[Callable] = [get_openai_wrapper]
+    if settings.COHERE_API_KEY:
+        getters.append(get_cohere_wrapper)
+    if settings.AWS_REGION:
+        getters.append(get_awsbedrock_wrapper)
+
+    for getter in getters:
+        try:
+            getter()
+        except Exception:
+            logger.exception(f"Failed to start provider client in {getter.__name__}")
+
+
+def close_provider_clients() -> None:
+    """
+    Close every wrapper that was created, the next request creates them again
+    """
+    with _wrappers_lock:
+        wrappers = list(_wrappers.values())
+        _wrappers.clear()
+
+    for wrapper in wrappers:
+        wrapper.close()
+
+
+async def aclose_provider_clients() -> None:
+    """
+    Like `close_provider_clients`, but also closes the connection pools of the
+    wrappers' async clients, which can only be closed from the event loop
+    """
+    with _wrappers_lock:
+        wrappers = list(_wrappers.values())
+        _wrappers.clear()
+
+    for wrapper in wrappers:
+        wrapper.close()
+        await wrapper.aclose()
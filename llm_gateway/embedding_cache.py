@@ -0,0 +1,242 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Cache of embeddings, keyed by the model and a hash of the (scrubbed) text. Recent
+embeddings are kept in memory, and optionally in a SQLite file that survives
+restarts and is shared by the workers on a host. Vectors are stored as float32.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from llm_gateway.cache import LRUCache
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+
+# Most keys looked up in one SQLite query, below its limit on parameters
+_SQLITE_MAX_KEYS = 500
+
+
+def embedding_key(provider: str, model: str, text: str) -> bytes:
+    """
+    Key of a text's embedding by a model
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param model: Name of the model
+    :type model: str
+    :param text: Text after being scrubbed of PII
+    :type text: str
+    :return: Hash of the model and text
+    :rtype: bytes
+    """
+    return hashlib.blake2b(
+        f"{provider}\0{model}\0{text}".encode("utf-8", "surrogatepass"),
+        digest_size=16,
+    ).digest()
+
+
+class EmbeddingCache:
+    """
+    Two tier cache of embeddings: a LRU cache in memory, in front of an optional
+    SQLite file
+
+    :param max_bytes: Size of the in-memory tier
+    :type max_bytes: int
+    :param path: SQLite file of the on-disk tier, defaults to None (no disk tier)
+    :type path: Optional[Path]
+    """
+
+    def __init__(self, max_bytes: int, path: Optional[Path] = None) -> None:
+        self.memory = LRUCache("embeddings", max_bytes=max_bytes)
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        if path is not None:
+            # autocommit, so readers in other workers aren't blocked by a transaction
+            self._db = sqlite3.connect(
+                path, check_same_thread=False, isolation_level=None, timeout=5
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # losing the last writes on power loss is fine for a cache
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key BLOB PRIMARY KEY, embedding BLOB NOT NULL) WITHOUT ROWID"
+            )
+
+    def get_many(
+        self, provider: str, model: str, texts: List[str]
+    ) -> List[Optional[List[float]]]:
+        """
+        Look up the embeddings of texts
+
+        :param provider: Provider of the model (i.e. "openai")
+        :type provider: str
+        :param model: Name of the model
+        :type model: str
+        :param texts: Texts after being scrubbed of PII
+        :type texts: List[str]
+        :return: Embedding of each text, or None if it isn't cached
+        :rtype: List[Optional[List[float]]]
+        """
+        keys = [embedding_key(provider, model, text) for text in texts]
+        vectors: List[Optional[array]] = [self.memory.get(key) for key in keys]
+        missing = {key for key, vector in zip(keys, vectors) if vector is None}
+        if missing and self._db is not None:
+            found = self._read(list(missing))
+            metrics.increment(
+                "embedding_cache.disk_hits", len(found), provider=provider, model=model
+            )
+            for i, key in enumerate(keys):
+                if vectors[i] is None and key in found:
+                    vectors[i] = found[key]
+            for key, vector in found.items():
+                self.memory.set(key, vector, size=_size(vector))
+        return [vector.tolist() if vector is not None else None for vector in vectors]
+
+    def set_many(
+        self,
+        provider: str,
+        model: str,
+        texts: List[str],
+        embeddings: List[List[float]],
+    ) -> None:
+        """
+        Store the embeddings of texts
+
+        :param provider: Provider of the model (i.e. "openai")
+        :type provider: str
+        :param model: Name of the model
+        :type model: str
+        :param texts: Texts after being scrubbed of PII
+        :type texts: List[str]
+        :param embeddings: Embedding of each text
+        :type embeddings: List[List[float]]
+        """
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            key = embedding_key(provider, model, text)
+            vector = array("f", embedding)
+            self.memory.set(key, vector, size=_size(vector))
+            rows.append((key, vector.tobytes()))
+        if self._db is not None and rows:
+            with self._lock:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)",
+                    rows,
+                )
+                self._db.execute("COMMIT")
+
+    def _read(self, keys: List[bytes]) -> Dict[bytes, array]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQLITE_MAX_KEYS):
+                end = start + _SQLITE_MAX_KEYS
+                chunk = keys[start:end]
+                rows = self._db.execute(
+                    "SELECT key, embedding FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, embedding in rows:
+                    vector = array("f")
+                    vector.frombytes(embedding)
+                    found[key] = vector
+        return found
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _size(vector: array) -> int:
+    return vector.itemsize * len(vector) + 64
+
+
+@lru_cache(maxsize=None)
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    The process's embedding cache, or None if `EMBEDDING_CACHE_MAX_BYTES` turns it
+    off
+    """
+    settings = get_settings()
+    if settings.EMBEDDING_CACHE_MAX_BYTES <= 0:
+        return None
+    return EmbeddingCache(
+        settings.EMBEDDING_CACHE_MAX_BYTES, path=settings.EMBEDDING_CACHE_PATH
+    )
+
+
+async def aembed_cached(
+    cache: EmbeddingCache,
+    provider: str,
+    model: str,
+    texts: List[str],
+    embed: Callable[[List[str]], Awaitable[Tuple[Any, List[List[float]]]]],
+) -> Tuple[List[List[float]], Optional[Any], dict]:
+    """
+    Embed texts, only sending the ones that aren't cached to the provider
+
+    :param cache: Embedding cache
+    :type cache: EmbeddingCache
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param model: Name of the model
+    :type model: str
+    :param texts: Texts after being scrubbed of PII
+    :type texts: List[str]
+    :param embed: Embeds texts with the provider, returning its response and the
+        embedding of each text
+    :type embed: Callable[[List[str]], Awaitable[Tuple[Any, List[List[float]]]]]
+    :return: Embedding of each text in order, the provider's response (None if every
+        text was cached), and the number of hits and misses for the DB log
+    :rtype: Tuple[List[List[float]], Optional[Any], dict]
+    """
+    if cache.path is not None:
+        embeddings = await run_in_threadpool(cache.get_many, provider, model, texts)
+    else:
+        embeddings = cache.get_many(provider, model, texts)
+    # texts repeated within the request are only sent once
+    hits = sum(embedding is not None for embedding in embeddings)
+    misses = list(dict.fromkeys(t for t, e in zip(texts, embeddings) if e is None))
+    response = None
+    if misses:
+        response, miss_embeddings = await embed(misses)
+        if cache.path is not None:
+            await run_in_threadpool(
+                cache.set_many, provider, model, misses, miss_embeddings
+            )
+        else:
+            cache.set_many(provider, model, misses, miss_embeddings)
+        by_text = dict(zip(misses, miss_embeddings))
+        embeddings = [
+            embedding if embedding is not None else by_text[text]
+            for text, embedding in zip(texts, embeddings)
+        ]
+    return embeddings, response, {"hits": hits, "misses": len(texts) - hits}
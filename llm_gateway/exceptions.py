@@ -19,6 +19,7 @@ from botocore.exceptions import (
     BotoCoreError,
     ClientError,
     ConnectionError,
+    HTTPClientError,
     InvalidRegionError,
     NoCredentialsError,
     NoRegionError,
@@ -31,7 +32,10 @@ from openai.error import (
     APIConnectionError,
     APIError,
     AuthenticationError,
+    InvalidRequestError,
+    PermissionError,
     RateLimitError,
+    ServiceUnavailableError,
     Timeout,
     TryAgain,
 )
@@ -56,9 +60,101 @@ AWSBEDROCK_EXCEPTIONS = (
     InvalidRegionError,
 )
 
+# Errors worth retrying: the same request can succeed once the provider recovers
+RETRYABLE_HTTP_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+OPENAI_RETRYABLE_EXCEPTIONS = (
+    Timeout,
+    APIConnectionError,
+    TryAgain,
+    RateLimitError,
+    ServiceUnavailableError,
+)
+OPENAI_NON_RETRYABLE_EXCEPTIONS = (
+    AuthenticationError,
+    InvalidRequestError,
+    PermissionError,
+)
+AWSBEDROCK_RETRYABLE_EXCEPTIONS = (ConnectionError, HTTPClientError)
+AWSBEDROCK_NON_RETRYABLE_EXCEPTIONS = (
+    NoCredentialsError,
+    NoRegionError,
+    InvalidRegionError,
+)
+AWSBEDROCK_RETRYABLE_ERROR_CODES = frozenset(
+    {
+        "throttlingexception",
+        "servicequotaexceededexception",
+        "serviceunavailableexception",
+        "internalserverexception",
+        "modeltimeoutexception",
+        "modelnotreadyexception",
+    }
+)
+
 logger = get_logger(__name__)
 
 
+def is_retryable_openai_error(e: Exception) -> bool:
+    """
+    Whether an error from OpenAI is worth retrying
+
+    :param e: Error raised by the OpenAI client
+    :type e: Exception
+    :return: False for errors that retrying won't fix, i.e. a bad API key
+    :rtype: bool
+    """
+    if isinstance(e, OPENAI_NON_RETRYABLE_EXCEPTIONS):
+        return False
+    if isinstance(e, RateLimitError):
+        # also sent when the account is out of credit, which won't come back
+        return e.code != "insufficient_quota"
+    if isinstance(e, OPENAI_RETRYABLE_EXCEPTIONS):
+        return True
+    if isinstance(e, APIError):
+        return e.http_status is None or e.http_status in RETRYABLE_HTTP_STATUSES
+    return False
+
+
+def is_retryable_cohere_error(e: Exception) -> bool:
+    """
+    Whether an error from Cohere is worth retrying
+
+    :param e: Error raised by the Cohere client
+    :type e: Exception
+    :return: False for errors that retrying won't fix, i.e. an invalid request
+    :rtype: bool
+    """
+    if isinstance(e, CohereConnectionError):
+        return True
+    if isinstance(e, CohereAPIError):
+        return e.http_status is None or e.http_status in RETRYABLE_HTTP_STATUSES
+    return False
+
+
+def is_retryable_awsbedrock_error(e: Exception) -> bool:
+    """
+    Whether an error from AWS Bedrock is worth retrying
+
+    :param e: Error raised by the AWS Bedrock client
+    :type e: Exception
+    :return: False for errors that retrying won't fix, i.e. missing credentials
+    :rtype: bool
+    """
+    if isinstance(e, AWSBEDROCK_NON_RETRYABLE_EXCEPTIONS):
+        return False
+    if isinstance(e, AWSBEDROCK_RETRYABLE_EXCEPTIONS):
+        return True
+    if isinstance(e, ClientError):
+        # codes of errors in event streams start with a lower case letter
+        code = e.response.get("Error", {}).get("Code") or ""
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return (
+            code.lower() in AWSBEDROCK_RETRYABLE_ERROR_CODES
+            or status in RETRYABLE_HTTP_STATUSES
+        )
+    return False
+
+
 class OpenAIRouteExceptionHandler(APIRoute):
     """
     This is a route class override for the OpenAI router. It is used to
@@ -0,0 +1,201 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Hedged provider calls, for requests that are safe to send twice (embeddings and
+temperature 0 completions). When a call takes longer than most calls to the same
+model, an identical one is sent, and whichever answers first is used. The other
+is cancelled.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+from llm_gateway.retries import RetryBudget
+
+
+class LatencyWindow:
+    """
+    The last `size` latencies of calls to a model, to compute percentiles from
+    """
+
+    def __init__(self, size: int) -> None:
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Latency that `percent`% of the recorded calls took at most
+
+        :param percent: Percentile, from 0 to 100
+        :type percent: float
+        :return: The latency, None if nothing was recorded yet
+        :rtype: Optional[float]
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        index = math.ceil(percent / 100 * len(latencies)) - 1
+        return latencies[min(max(index, 0), len(latencies) - 1)]
+
+
+_windows: Dict[Tuple[str, str], Tuple[LatencyWindow, LatencyWindow]] = {}
+_windows_lock = threading.Lock()
+
+
+def get_latency_windows(
+    provider: str, model: Optional[str]
+) -> Tuple[LatencyWindow, LatencyWindow]:
+    """
+    Latencies of a provider model's calls, and of the (maybe hedged) requests they
+    were made for
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param model: Name of the model, None for the provider's default model
+    :type model: Optional[str]
+    :return: Call latencies and request latencies
+    :rtype: Tuple[LatencyWindow, LatencyWindow]
+    """
+    key = (provider, model or "default")
+    windows = _windows.get(key)
+    if windows is None:
+        with _windows_lock:
+            windows = _windows.get(key)
+            if windows is None:
+                size = get_settings().HEDGE_LATENCY_WINDOW
+                windows = _windows[key] = (LatencyWindow(size), LatencyWindow(size))
+    return windows
+
+
+def reset_latency_windows() -> None:
+    """
+    Forget the latencies of every model
+    """
+    with _windows_lock:
+        _windows.clear()
+
+
+@lru_cache()
+def get_hedge_budget() -> RetryBudget:
+    """
+    Cap on hedges, as a share of hedgeable requests
+    """
+    settings = get_settings()
+    return RetryBudget(
+        ratio=settings.HEDGE_MAX_RATE,
+        min_per_second=0,
+        window=settings.RETRY_BUDGET_WINDOW,
+    )
+
+
+async def _timed(call: Callable[[], Awaitable]) -> Tuple[Any, float]:
+    start = time.monotonic()
+    result = await call()
+    return result, time.monotonic() - start
+
+
+async def hedged(
+    call: Callable[[], Awaitable], provider: str, model: Optional[str]
+) -> Tuple[Any, dict]:
+    """
+    Await `call()`, and call it again if the first call takes longer than
+    `HEDGE_PERCENTILE`% of recent calls to the model, returning the first answer
+
+    Nothing is hedged until `HEDGE_MIN_SAMPLES` calls to the model have been timed,
+    or when hedges would go over `HEDGE_MAX_RATE` of requests. A call that fails
+    doesn't win, the other one is awaited instead. The original call is the one
+    timed, whichever call wins, so slow calls aren't left out of the percentile.
+
+    :param call: Makes the provider call, only for requests that are safe to repeat
+    :type call: Callable[[], Awaitable]
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param model: Name of the model
+    :type model: Optional[str]
+    :return: Result of the first call to answer, and whether the request was
+        hedged and which call won, for the DB log
+    :rtype: Tuple[Any, dict]
+    """
+    settings = get_settings()
+    labels = {"provider": provider, "model": model or "default"}
+    call_latencies, request_latencies = get_latency_windows(provider, model)
+    budget = get_hedge_budget()
+    budget.record_request()
+    metrics.increment("hedging.requests", **labels)
+
+    delay = None
+    if len(call_latencies) >= settings.HEDGE_MIN_SAMPLES:
+        delay = call_latencies.percentile(settings.HEDGE_PERCENTILE)
+        metrics.set_gauge("hedging.delay_ms", delay * 1e3, **labels)
+
+    start = time.monotonic()
+    original = asyncio.ensure_future(_timed(call))
+    calls = {original: "original"}
+    try:
+        done, _ = await asyncio.wait([original], timeout=delay)
+        if not done and budget.try_retry():
+            metrics.increment("hedging.hedged", **labels)
+            calls[asyncio.ensure_future(_timed(call))] = "hedge"
+
+        pending = set(calls)
+        while True:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            # prefer an answer to an error
+            winner = next((task for task in done if task.exception() is None), None)
+            if winner is not None or not pending:
+                break
+        if winner is None:
+            winner = done.pop()
+        result, _ = winner.result()
+        request_latency = time.monotonic() - start
+        if not original.done():
+            # the hedge won, the original would have taken longer still
+            call_latencies.record(request_latency)
+        elif original.exception() is None:
+            call_latencies.record(original.result()[1])
+    finally:
+        for task in calls:
+            task.cancel()
+
+    request_latencies.record(request_latency)
+    for percent in (50, 95, 99):
+        metrics.set_gauge(
+            f"hedging.request_p{percent}_ms",
+            request_latencies.percentile(percent) * 1e3,
+            **labels,
+        )
+    if len(calls) > 1:
+        metrics.increment("hedging.wins", winner=calls[winner], **labels)
+    return result, {"hedged": len(calls) > 1, "winner": calls[winner]}
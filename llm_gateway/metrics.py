@@ -0,0 +1,141 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _metric_key(name: str, labels: dict) -> MetricKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_metric_key(key: MetricKey) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{label}={value}" for label, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Minimal thread-safe, in-process store for counters, gauges and summaries.
+
+    Metrics are per worker process. They are exposed as JSON by the admin router
+    so they can be scraped or inspected without an extra dependency.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[MetricKey, float] = defaultdict(float)
+        self._gauges: Dict[MetricKey, float] = {}
+        self._summaries: Dict[MetricKey, Dict[str, float]] = {}
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Add value to a counter
+
+        :param name: Name of the counter
+        :type name: str
+        :param value: Amount to add, defaults to 1
+        :type value: float
+        :param labels: Labels to split the counter by (i.e. provider="openai")
+        :type labels: dict
+        """
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """
+        Set a gauge to its current value
+
+        :param name: Name of the gauge
+        :type name: str
+        :param value: Current value
+        :type value: float
+        :param labels: Labels to split the gauge by
+        :type labels: dict
+        """
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Record one observation (i.e. a duration) in a count/sum/min/max summary
+
+        :param name: Name of the summary
+        :type name: str
+        :param value: Observed value
+        :type value: float
+        :param labels: Labels to split the summary by
+        :type labels: dict
+        """
+        key = _metric_key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                self._summaries[key] = {
+                    "count": 1,
+                    "sum": value,
+                    "min": value,
+                    "max": value,
+                }
+            else:
+                summary["count"] += 1
+                summary["sum"] += value
+                summary["min"] = min(summary["min"], value)
+                summary["max"] = max(summary["max"], value)
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_metric_key(name, labels), 0)
+
+    def snapshot(self) -> dict:
+        """
+        Copy of every metric, keyed by `name{label=value,...}`
+
+        :return: Counters, gauges and summaries
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "counters": {
+                    _format_metric_key(key): value
+                    for key, value in self._counters.items()
+                },
+                "gauges": {
+                    _format_metric_key(key): value
+                    for key, value in self._gauges.items()
+                },
+                "summaries": {
+                    _format_metric_key(key): dict(summary)
+                    for key, summary in self._summaries.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._summaries.clear()
+
+
+metrics = MetricsRegistry()
@@ -15,30 +15,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List
+from typing import Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, root_validator
 
 
-class GenerateInput(BaseModel):
+class TemplatedPromptInput(BaseModel):
+    """
+    Input whose prompt can be rendered from a registered prompt template instead,
+    see `llm_gateway.templates`
+    """
+
+    template_id: Optional[int] = None
+    template_variables: Dict[str, str] = {}
+
+    @root_validator(skip_on_failure=True)
+    def check_prompt_or_template(cls, values: dict) -> dict:
+        if values["template_id"] is None:
+            if values.get("prompt") is None:
+                raise ValueError("Either `prompt` or `template_id` is required")
+        elif values.get("prompt"):
+            raise ValueError("Send either `prompt` or `template_id`, not both")
+        return values
+
+
+class GenerateInput(TemplatedPromptInput):
     temperature: float
-    prompt: str
+    prompt: Optional[str] = None
     max_tokens: int = 50
     model: str = "command-light"
     model_kwargs: dict = {}
 
 
-class SummarizeInput(BaseModel):
+class SummarizeInput(TemplatedPromptInput):
     temperature: float
-    prompt: str
+    prompt: Optional[str] = None
     additional_command: str = ""
     model: str = "command-light"
     model_kwargs: dict = {}
 
 
-class CompletionInput(BaseModel):
+class CompletionInput(TemplatedPromptInput):
     model: str = "text-davinci-003"
-    prompt: str
+    prompt: Optional[str] = None
     max_tokens: int = 50
     temperature: float = 0
     model_kwargs: dict = {}
@@ -65,7 +84,7 @@ class EmbeddingInput(BaseModel):
     model: str = "text-embedding-ada-002"
 
 
-class AWSBedrockTextInput(BaseModel):
+class AWSBedrockTextInput(TemplatedPromptInput):
     model: str
     max_tokens: int
     prompt: str = ""
@@ -77,3 +96,8 @@ class AWSBedrockEmbedInput(BaseModel):
     model: str
     max_tokens: int
     embedding_texts: List[str] = []
+
+
+class PromptTemplateInput(BaseModel):
+    name: str
+    template: str
@@ -16,30 +16,746 @@
 # limitations under the License.
 
 # flake8: noqa
+import hashlib
+import multiprocessing
+import os
 import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from llm_gateway.cache import LRUCache
+from llm_gateway.constants import get_settings
+from llm_gateway.denylist import get_denylist
+from llm_gateway.metrics import metrics
+
+PHONE_NUMBER_PATTERN = r"(\+?\d{1,2}\s?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}"
+CREDIT_CARD_NUMBER_PATTERN = r"\b(?:\d[ -\.]*?){13,16}\b"
+SIN_NUMBER_PATTERN = r"\b(?:\d[ -\.]*?){9}\b"
+# The lookahead caps the local part at 64 characters (RFC 5321), so that trying
+# to match at every position of a long run of letters is linear rather than
+# quadratic. Longer local parts are widened back to their start, see `find_pii_spans`.
+EMAIL_ADDRESS_PATTERN = "(?:(?=[a-z0-9!#$%&'*+/=?^_`{|}~.-]{1,64}@)[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*|\"(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])*\")@(?:(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?|\[(?:(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9]))\.){3}(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9])|[a-z0-9-]*[a-z0-9]:(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21-\x5a\x53-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])+)\])"
+POSTAL_CODE_PATTERN = r"\b[A-Za-z][0-9][A-Za-z] ?[0-9][A-Za-z][0-9]\b"
+
+# Terms from the denylist file, matched with lower priority than every pattern
+DENYLIST_KIND = "denylisted_term"
+DENYLIST_REPLACEMENT = "[REDACTED TERM]"
+
+# (kind, pattern, replacement) in priority order. Each pattern only matches the
+# text the ones before it left, which is why the over-eager SIN pattern is kept
+# at the end.
+PII_PATTERNS = (
+    ("phone_number", PHONE_NUMBER_PATTERN, "[REDACTED PHONE NUMBER]"),
+    ("credit_card_number", CREDIT_CARD_NUMBER_PATTERN, "[REDACTED CREDIT CARD NUMBER]"),
+    ("email_address", EMAIL_ADDRESS_PATTERN, "[REDACTED EMAIL ADDRESS]"),
+    ("postal_code", POSTAL_CODE_PATTERN, "[REDACTED POSTAL CODE]"),
+    ("sin_number", SIN_NUMBER_PATTERN, "[REDACTED SIN NUMBER]"),
+)
+
+_PII_REPLACEMENTS = {kind: replacement for kind, _, replacement in PII_PATTERNS}
+_PII_REPLACEMENTS[DENYLIST_KIND] = DENYLIST_REPLACEMENT
+_PII_REGEXES = {kind: re.compile(pattern) for kind, pattern, _ in PII_PATTERNS}
+
+_EMAIL_LOCAL_PART_MAX_LENGTH = 64
+# Characters of an unquoted local part, including its dots
+_EMAIL_LOCAL_PART_CHARS = frozenset(
+    "abcdefghijklmnopqrstuvwxyz0123456789!#$%&'*+/=?^_`{|}~.-"
+)
+
+# Fewest digits a match of each kind can contain. Email addresses need an '@' instead.
+_PII_MIN_DIGITS = {
+    "phone_number": 10,
+    "credit_card_number": 13,
+    "postal_code": 3,
+    "sin_number": 9,
+}
+_ASCII_DIGITS = "0123456789"
+# Besides digits and whitespace, the characters that can continue a phone, card or
+# SIN number: the [ -.] separators (space through '.') and phone number punctuation
+_NUMBER_SEPARATORS = frozenset(" !\"#$%&'()*+,-.")
+# Any prefix of a postal code, including a whole one
+_POSTAL_CODE_PREFIX_REGEX = re.compile(
+    r"[A-Za-z](?:[0-9](?:[A-Za-z](?: ?(?:[0-9](?:[A-Za-z][0-9]?)?)?)?)?)?"
+)
+_DIGIT_REGEX = re.compile(r"\d")
+
+# (trigger, lookback) of each pattern: every match contains its trigger starting
+# at most `lookback` characters after the start of the match, or for email
+# addresses, in the same word, as they can't contain a space, tab or newline before
+# their '@'. That lets us jump between triggers and only try to match just before them.
+_PII_TRIGGERS = {
+    # from the area code on, which comes after at most "+12 ("
+    "phone_number": (r"\d\d\d\)?[\s.-]?\d\d\d[\s.-]?\d\d\d\d", 5),
+    "credit_card_number": (r"\d(?:[ -\.]*?\d){12}", 0),
+    "email_address": ("@", None),
+    "postal_code": (r"[0-9][A-Za-z] ?[0-9]", 1),
+    "sin_number": (r"\d(?:[ -\.]*?\d){8}", 0),
+}
+_MATCH_BOUNDARY_CHARS = frozenset(" \t\n\r")
+
+
+class _PIIMatcher(NamedTuple):
+    regex: re.Pattern
+    trigger_regex: re.Pattern
+    # how far before a trigger a match can start, None means the start of the word
+    max_lookback: Optional[int]
+
+
+@lru_cache(maxsize=None)
+def _get_pii_matcher(kind: str) -> _PIIMatcher:
+    """
+    Compile a matcher for one of `PII_PATTERNS`
+
+    :param kind: Kind of PII to match, as named in `PII_PATTERNS`
+    :type kind: str
+    :return: Compiled matcher
+    :rtype: _PIIMatcher
+    """
+    trigger, max_lookback = _PII_TRIGGERS[kind]
+    return _PIIMatcher(_PII_REGEXES[kind], re.compile(trigger), max_lookback)
+
+
+def _count_digits(text: str) -> int:
+    if text.isascii():
+        return sum(map(text.count, _ASCII_DIGITS))
+    return len(_DIGIT_REGEX.findall(text))
+
+
+def _candidate_pii_kinds(text: str) -> Tuple[str, ...]:
+    """
+    Cheaply rule out the kinds of PII that cannot occur in text
+
+    Text with fewer digits than a pattern needs, or without an '@' for email
+    addresses, is never handed to those patterns.
+
+    :param text: Input text to classify
+    :type text: str
+    :return: Kinds of PII that could match, in priority order
+    :rtype: Tuple[str, ...]
+    """
+    digits = _count_digits(text)
+    has_at_sign = "@" in text
+
+    return tuple(
+        kind
+        for kind, _, _ in PII_PATTERNS
+        if (has_at_sign if kind == "email_address" else digits >= _PII_MIN_DIGITS[kind])
+    )
+
+
+def _iter_pii_matches(
+    text: str, matcher: _PIIMatcher, pos: int = 0, endpos: Optional[int] = None
+) -> Iterator[re.Match]:
+    """
+    Find every match of a pattern in text, skipping ahead between trigger characters
+
+    Produces the same matches as `matcher.regex.finditer(text, pos, endpos)`, but
+    the pattern is only attempted at positions that can start a match.
+
+    :param text: Input text to search
+    :type text: str
+    :param matcher: Compiled matcher for the kind of PII to find
+    :type matcher: _PIIMatcher
+    :param pos: Index to start searching at, defaults to 0
+    :type pos: int
+    :param endpos: Index to stop searching at, as if text ended there, defaults to
+        None (the end of text)
+    :type endpos: Optional[int]
+    :return: Non-overlapping matches, in order
+    :rtype: Iterator[re.Match]
+    """
+    if endpos is None:
+        endpos = len(text)
+    search_trigger = matcher.trigger_regex.search
+    match_pii = matcher.regex.match
+    max_lookback = matcher.max_lookback
+
+    while trigger := search_trigger(text, pos, endpos):
+        trigger_pos = trigger.start()
+        if max_lookback is not None:
+            window_start = max(pos, trigger_pos - max_lookback)
+        else:
+            # walk back to the start of the word containing the trigger
+            window_start = trigger_pos
+            while (
+                window_start > pos
+                and text[window_start - 1] not in _MATCH_BOUNDARY_CHARS
+            ):
+                window_start -= 1
+
+        for start in range(window_start, trigger_pos + 1):
+            if match := match_pii(text, start, endpos):
+                yield match
+                pos = match.end()
+                break
+        else:
+            pos = trigger_pos + 1
+
+
+class PIISpan(NamedTuple):
+    start: int
+    end: int
+    kind: str
+
+
+# Per-kind redaction counts, i.e. {"phone_number": 2}
+RedactionCounts = Dict[str, int]
+
+_PII_PRIORITY = {kind: priority for priority, (kind, _, _) in enumerate(PII_PATTERNS)}
+
+
+class ScrubbedStr(str):
+    """
+    Text that has already been scrubbed of PII, i.e. a rendered prompt template
+
+    `scrub_all` and `scrub_many` return it as-is, and count the redactions that
+    were made when it was scrubbed.
+    """
+
+    def __new__(
+        cls, text: str, redaction_counts: Optional[RedactionCounts] = None
+    ) -> "ScrubbedStr":
+        scrubbed = super().__new__(cls, text)
+        scrubbed.redaction_counts = redaction_counts or {}
+        return scrubbed
+
+
+def find_pii_spans(
+    text: str, kinds: Optional[Tuple[str, ...]] = None, pos: int = 0
+) -> List[PIISpan]:
+    """
+    Find where PII occurs in text, without rewriting it between patterns
+
+    The spans are those `ALL_SCRUBBERS` would redact one after another: each
+    pattern, in `PII_PATTERNS` priority order, only matches between the spans of
+    the ones before it.
+
+    Matching is linear in the length of text. An email address whose local part
+    is longer than `EMAIL_ADDRESS_PATTERN` allows is only matched on its last 64
+    characters, so its span is widened to cover the rest of the local part.
+    Terms from the denylist (see `llm_gateway.denylist`) are found as
+    `DENYLIST_KIND` spans, merged with the pattern matches.
+
+    :param text: Input text to search
+    :type text: str
+    :param kinds: Kinds of PII to find, as named in `PII_PATTERNS` or
+        `DENYLIST_KIND`, defaults to all
+    :type kinds: Optional[Tuple[str, ...]]
+    :param pos: Index to start searching at, like `re.Pattern.search` the text
+        before it is still seen by word boundaries, defaults to 0
+    :type pos: int
+    :return: Non-overlapping (start, end, kind) spans, in order
+    :rtype: List[PIISpan]
+    """
+    spans = _find_pattern_spans(text, kinds, pos)
+
+    denylist = get_denylist()
+    if denylist is not None and (kinds is None or DENYLIST_KIND in kinds):
+        denylist_spans = [
+            PIISpan(start, end, DENYLIST_KIND)
+            for start, end in denylist.find(text, pos)
+        ]
+        if denylist_spans:
+            spans = merge_pii_spans(spans + denylist_spans)
+    return spans
+
+
+def _find_pattern_spans(
+    text: str, kinds: Optional[Tuple[str, ...]] = None, pos: int = 0
+) -> List[PIISpan]:
+    candidates = _candidate_pii_kinds(text)
+    if kinds is not None:
+        candidates = tuple(kind for kind in candidates if kind in kinds)
+    if not candidates:
+        metrics.increment("pii_scrubber.prefilter", path="no_candidates")
+        return []
+
+    if len(candidates) == len(PII_PATTERNS):
+        metrics.increment("pii_scrubber.prefilter", path="all_patterns")
+    else:
+        metrics.increment("pii_scrubber.prefilter", path="some_patterns")
+
+    # Each kind is found in turn, in priority order, in the gaps left between the
+    # spans of the kinds before it, which is what scrubbing them one after another
+    # with `re.sub` does since no pattern can match across a redaction
+    spans: List[PIISpan] = []
+    for kind in candidates:
+        found = []
+        gap_start = pos
+        for span_start, span_end, _ in spans:
+            if gap_start < span_start:
+                found += _find_kind_spans(
+                    text, kind, gap_start, span_start, gap_start > pos
+                )
+            gap_start = span_end
+        if gap_start < len(text):
+            found += _find_kind_spans(text, kind, gap_start, len(text), gap_start > pos)
+        if found:
+            spans = sorted(spans + found)
+    return spans
+
+
+def _find_kind_spans(
+    text: str, kind: str, start: int, end: int, after_span: bool
+) -> List[PIISpan]:
+    """
+    Find the spans of one kind of PII in a gap between spans of other kinds
+
+    :param text: Input text to search
+    :type text: str
+    :param kind: Kind of PII to find, as named in `PII_PATTERNS`
+    :type kind: str
+    :param start: Index of the start of the gap
+    :type start: int
+    :param end: Index of the end of the gap, seen as the end of text
+    :type end: int
+    :param after_span: Whether the gap follows a span, whose redaction would be a
+        word boundary for the start of the gap whatever character it replaces
+    :type after_span: bool
+    :return: Non-overlapping spans, in order
+    :rtype: List[PIISpan]
+    """
+    matcher = _get_pii_matcher(kind)
+    if after_span and _is_word_char(text[start - 1]):
+        offset = start
+        matches = _iter_pii_matches(text[start:end], matcher)
+    else:
+        offset = 0
+        matches = _iter_pii_matches(text, matcher, start, end)
+
+    spans = []
+    last_end = start
+    for match in matches:
+        match_start, match_end = match.start() + offset, match.end() + offset
+        if (
+            kind == "email_address"
+            and text.find("@", match_start, match_end) - match_start
+            == _EMAIL_LOCAL_PART_MAX_LENGTH
+        ):
+            while (
+                match_start > last_end
+                and text[match_start - 1] in _EMAIL_LOCAL_PART_CHARS
+            ):
+                match_start -= 1
+        spans.append(PIISpan(match_start, match_end, kind))
+        last_end = match_end
+    return spans
+
+
+def find_pii_tail(text: str, start: int = 0) -> int:
+    """
+    Find where the PII that could still be completed by more text begins
+
+    Used when text arrives in chunks: everything before the returned index can be
+    scrubbed and released, but the rest could be the start of a match (i.e. the
+    first digits of a phone number, or an email address missing its domain) or a
+    match that would grow with the next chunk, so it must be held back.
+
+    :param text: Text received so far
+    :type text: str
+    :param start: Earliest index to look back to, bounding the work done
+    :type start: int
+    :return: Index of the start of the tail to hold back, `len(text)` if none
+    :rtype: int
+    """
+    end = len(text)
+    tail = end
+
+    # phone, card and SIN numbers: a trailing run of digits and separators, from
+    # the first character that can start a number
+    i = end
+    while i > start and (
+        text[i - 1].isdecimal()
+        or text[i - 1].isspace()
+        or text[i - 1] in _NUMBER_SEPARATORS
+    ):
+        i -= 1
+    for j in range(i, end):
+        if text[j].isdecimal() or text[j] in "+(":
+            tail = j
+            break
+
+    # email addresses: a trailing run of local part, '@' and domain characters
+    i = end
+    while i > start and (text[i - 1] in _EMAIL_LOCAL_PART_CHARS or text[i - 1] == "@"):
+        i -= 1
+    tail = min(tail, i)
+
+    # postal codes: the start of one, or a whole one that the next character
+    # could still turn into a longer word
+    for j in range(max(start, end - 7), tail):
+        if (j == 0 or not _is_word_char(text[j - 1])) and (
+            _POSTAL_CODE_PREFIX_REGEX.fullmatch(text, j)
+        ):
+            tail = j
+            break
+
+    # denylisted terms: the last few words, as many as the longest term has
+    denylist = get_denylist()
+    if denylist is not None and len(denylist):
+        i = end
+        for word in range(denylist.max_words):
+            if word:
+                while i > start and text[i - 1].isspace():
+                    i -= 1
+            while i > start and not text[i - 1].isspace():
+                i -= 1
+        tail = min(tail, i)
+
+    return max(tail, start)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def merge_pii_spans(spans: Iterable[PIISpan]) -> List[PIISpan]:
+    """
+    Merge overlapping spans, i.e. from different detectors, into one redaction each
+
+    Spans are ordered by start, then by `PII_PATTERNS` priority. A span that
+    overlaps the one before it is folded into it, and the merged span keeps the
+    kind of whichever came first in that order.
+
+    :param spans: Spans in any order
+    :type spans: Iterable[PIISpan]
+    :return: Non-overlapping spans, in order
+    :rtype: List[PIISpan]
+    """
+    merged = []
+    for span in sorted(
+        spans,
+        key=lambda span: (span.start, _PII_PRIORITY.get(span.kind, len(_PII_PRIORITY))),
+    ):
+        if merged and span.start < merged[-1].end:
+            if span.end > merged[-1].end:
+                merged[-1] = merged[-1]._replace(end=span.end)
+        else:
+            merged.append(span)
+    return merged
+
+
+def redact_pii_spans(text: str, spans: List[PIISpan]) -> str:
+    """
+    Replace each span in text with the redaction for its kind, joining the output once
+
+    :param text: Input text
+    :type text: str
+    :param spans: Non-overlapping spans, in order
+    :type spans: List[PIISpan]
+    :return: Redacted text, or text itself if there were no spans
+    :rtype: str
+    """
+    if not spans:
+        return text
+
+    parts = []
+    last_end = 0
+    for start, end, kind in spans:
+        parts.append(text[last_end:start])
+        parts.append(_PII_REPLACEMENTS[kind])
+        last_end = end
+    parts.append(text[last_end:])
+    return "".join(parts)
+
+
+def count_pii_spans(spans: List[PIISpan]) -> RedactionCounts:
+    """
+    Count spans per kind of PII, i.e. for recording alongside a request
+
+    :param spans: Spans found in a text
+    :type spans: List[PIISpan]
+    :return: Number of spans of each kind
+    :rtype: RedactionCounts
+    """
+    return dict(Counter(span.kind for span in spans))
+
+
+def _scrub_text(text: str) -> Tuple[str, RedactionCounts]:
+    spans = find_pii_spans(text)
+    return redact_pii_spans(text, spans), count_pii_spans(spans)
+
+
+@lru_cache(maxsize=None)
+def _get_scrubbed_message_cache() -> Optional[LRUCache]:
+    max_bytes = get_settings().PII_SCRUB_CACHE_MAX_BYTES
+    if max_bytes <= 0:
+        return None
+    return LRUCache("scrubbed_messages", max_bytes=max_bytes)
+
+
+def _scrub_message_content(content: str) -> Tuple[str, RedactionCounts]:
+    """
+    Scrub the content of a chat message, reusing the result for repeated content
+
+    Chat requests re-send the whole conversation every turn, so the system prompt
+    and earlier turns are looked up by a hash of their content, and the version of
+    the denylist, instead of being scrubbed again.
+
+    :param content: Content of a chat message
+    :type content: str
+    :return: Content after being scrubbed of PII, and what was redacted
+    :rtype: Tuple[str, RedactionCounts]
+    """
+    cache = _get_scrubbed_message_cache()
+    if cache is None or not isinstance(content, str):
+        return _scrub_item(content)
+
+    digest = hashlib.blake2b(
+        content.encode("utf-8", "surrogatepass"), digest_size=16
+    ).digest()
+    # results from before the denylist was reloaded are never looked up again
+    denylist = get_denylist()
+    key = (denylist.version if denylist is not None else None, digest)
+    result = cache.get(key)
+    if result is None:
+        result = _scrub_item(content)
+        cache.set(key, result, size=len(digest) + sys.getsizeof(result[0]))
+    return result
+
+
+def _scrub_item(item: str | dict) -> Tuple[str | dict, RedactionCounts]:
+    if isinstance(item, ScrubbedStr):
+        return item, item.redaction_counts
+    elif isinstance(item, dict):
+        # scrub content val in dict
+        content, counts = _scrub_message_content(item["content"])
+        return item | {"content": content}, counts
+    elif not isinstance(item, str):
+        raise TypeError(f"Expected str/dict, got {type(item)=}")
+
+    return _scrub_text(item)
 
 
 def scrub_all(text: str | dict) -> str | dict:
     """
     Scrub all PII in text
 
+    All patterns are matched in `PII_PATTERNS` priority order without rewriting
+    the text in between, and the scrubbed output is built once. The content of chat messages (dicts)
+    is memoized, see `_scrub_message_content`.
+
     :param text: Input to be scrubbed of PII
     :type text: str | dict
     :raises TypeError: Invalid input type entered
     :return: Input text after being scrubbed of PII
     :rtype: str | dict
     """
+    return _scrub_item(text)[0]
 
-    if isinstance(text, dict):
-        # scrub content val in dict
-        return text | {"content": scrub_all(text["content"])}
-    elif not isinstance(text, str):
-        raise TypeError(f"Expected str/dict, got {type(text)=}")
 
-    for scrubber in ALL_SCRUBBERS:
-        text = scrubber(text)
+def _scrubbed_size(item: str | dict) -> int:
+    if isinstance(item, ScrubbedStr):
+        # never worth sending to the process pool
+        return 0
+    return len(item["content"] if isinstance(item, dict) else item)
+
+
+def _scrub_batch(
+    items: List[str | dict],
+) -> List[Tuple[str | dict, RedactionCounts]]:
+    # runs in the scrubbing process pool, so it must stay a module-level function
+    return [_scrub_item(item) for item in items]
+
+
+_scrub_pool: Optional[ProcessPoolExecutor] = None
+_scrub_pool_workers = 0
+_scrub_pool_lock = threading.Lock()
+# batches submitted to the pool that haven't finished yet, across all requests
+_scrub_pool_queue_depth = 0
+
+
+def _get_scrub_pool() -> ProcessPoolExecutor:
+    """
+    Lazily start the process pool used to scrub large batches
+
+    Workers are spawned rather than forked, since the gateway process is
+    multi-threaded by the time the first large batch arrives.
+
+    :return: Shared scrubbing process pool
+    :rtype: ProcessPoolExecutor
+    """
+    global _scrub_pool, _scrub_pool_workers
+    with _scrub_pool_lock:
+        if _scrub_pool is None:
+            _scrub_pool_workers = (
+                get_settings().PII_SCRUB_POOL_WORKERS or os.cpu_count()
+            )
+            _scrub_pool = ProcessPoolExecutor(
+                max_workers=_scrub_pool_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _scrub_pool
+
+
+def shutdown_scrub_pool() -> None:
+    """
+    Stop the scrubbing process pool, if it was started
+    """
+    global _scrub_pool
+    with _scrub_pool_lock:
+        if _scrub_pool is not None:
+            _scrub_pool.shutdown(wait=True, cancel_futures=True)
+            _scrub_pool = None
+
 
-    return text
+def _scrub_pool_task_done(future: Future) -> None:
+    global _scrub_pool_queue_depth
+    with _scrub_pool_lock:
+        _scrub_pool_queue_depth -= 1
+        metrics.set_gauge("pii_scrubber.pool.queue_depth", _scrub_pool_queue_depth)
+
+
+def _submit_scrub_batch(
+    pool: ProcessPoolExecutor, items: List[str | dict]
+) -> "Future[List[Tuple[str | dict, RedactionCounts]]]":
+    """
+    Scrub items in the process pool, keeping track of the pool's queue depth
+
+    :param pool: Scrubbing process pool
+    :type pool: ProcessPoolExecutor
+    :param items: Inputs to be scrubbed of PII
+    :type items: List[str | dict]
+    :return: Future of the output of `_scrub_batch`
+    :rtype: Future[List[Tuple[str | dict, RedactionCounts]]]
+    """
+    global _scrub_pool_queue_depth
+    with _scrub_pool_lock:
+        _scrub_pool_queue_depth += 1
+        metrics.set_gauge("pii_scrubber.pool.queue_depth", _scrub_pool_queue_depth)
+    future = pool.submit(_scrub_batch, items)
+    future.add_done_callback(_scrub_pool_task_done)
+    return future
+
+
+def _split_batch(
+    items: List[str | dict], sizes: List[int], num_chunks: int
+) -> List[List[str | dict]]:
+    """
+    Split items into at most num_chunks contiguous chunks of similar total size
+
+    :param items: Items to split, order is preserved
+    :type items: List[str | dict]
+    :param sizes: Size of each item
+    :type sizes: List[int]
+    :param num_chunks: Maximum number of chunks
+    :type num_chunks: int
+    :return: Contiguous chunks of items
+    :rtype: List[List[str | dict]]
+    """
+    target = sum(sizes) / num_chunks
+    chunks = [[]]
+    chunk_size = 0
+    for item, size in zip(items, sizes):
+        if chunk_size >= target and len(chunks) < num_chunks:
+            chunks.append([])
+            chunk_size = 0
+        chunks[-1].append(item)
+        chunk_size += size
+    return chunks
+
+
+def _scrub_path(sizes: List[int]) -> str:
+    """
+    Where `scrub_many` scrubs a batch: "inline", "offload" (only the large items go
+    to the process pool) or "pool" (the whole batch, in chunks)
+    """
+    settings = get_settings()
+    if len(sizes) >= 2 and sum(sizes) >= settings.PII_SCRUB_POOL_THRESHOLD:
+        return "pool"
+    if max(sizes, default=0) >= settings.PII_SCRUB_OFFLOAD_THRESHOLD:
+        return "offload"
+    return "inline"
+
+
+def scrub_many(
+    items: List[str | dict], redaction_counts: Optional[Counter] = None
+) -> List[str | dict]:
+    """
+    Scrub all PII in a batch of texts or chat messages
+
+    Small batches are scrubbed inline. Once the total size of the batch reaches
+    `PII_SCRUB_POOL_THRESHOLD` characters it is split into chunks and scrubbed
+    in parallel in a process pool. Below that, single items of at least
+    `PII_SCRUB_OFFLOAD_THRESHOLD` characters are still scrubbed in the pool, so a
+    huge prompt doesn't hold the GIL (and a request thread) for the whole scrub,
+    while the rest of the batch is scrubbed inline. Either way the output keeps
+    the input order.
+
+    :param items: Inputs to be scrubbed of PII, as accepted by `scrub_all`
+    :type items: List[str | dict]
+    :param redaction_counts: If given, updated with how many of each kind of PII
+        were redacted across the batch
+    :type redaction_counts: Optional[Counter]
+    :raises TypeError: Invalid input type entered
+    :return: Inputs after being scrubbed of PII, in input order
+    :rtype: List[str | dict]
+    """
+    settings = get_settings()
+    started = time.perf_counter()
+    sizes = [_scrubbed_size(item) for item in items]
+    path = _scrub_path(sizes)
+    if path == "pool":
+        pool = _get_scrub_pool()
+        # a few chunks per worker evens out chunks that happen to be slow to scrub
+        chunks = _split_batch(items, sizes, num_chunks=_scrub_pool_workers * 4)
+        futures = [_submit_scrub_batch(pool, chunk) for chunk in chunks]
+        results = list(chain.from_iterable(future.result() for future in futures))
+    elif path == "offload":
+        pool = _get_scrub_pool()
+        futures = {
+            i: _submit_scrub_batch(pool, [item])
+            for i, (item, size) in enumerate(zip(items, sizes))
+            if size >= settings.PII_SCRUB_OFFLOAD_THRESHOLD
+        }
+        # small items are scrubbed while the large ones are in the pool
+        results = [
+            None if i in futures else _scrub_item(item) for i, item in enumerate(items)
+        ]
+        for i, future in futures.items():
+            [results[i]] = future.result()
+    else:
+        results = _scrub_batch(items)
+    metrics.observe(
+        "pii_scrubber.scrub_seconds", time.perf_counter() - started, path=path
+    )
+
+    if redaction_counts is not None:
+        for _, counts in results:
+            redaction_counts.update(counts)
+    return [scrubbed for scrubbed, _ in results]
+
+
+async def ascrub_many(
+    items: List[str | dict], redaction_counts: Optional[Counter] = None
+) -> List[str | dict]:
+    """
+    Version of `scrub_many` for async routes
+
+    Batches small enough to scrub inline are scrubbed on the event loop, like any
+    other short piece of CPU work. Batches that go to the process pool are waited
+    on from a worker thread, so the event loop isn't blocked in the meantime.
+
+    :param items: Inputs to be scrubbed of PII, as accepted by `scrub_all`
+    :type items: List[str | dict]
+    :param redaction_counts: If given, updated with how many of each kind of PII
+        were redacted across the batch
+    :type redaction_counts: Optional[Counter]
+    :raises TypeError: Invalid input type entered
+    :return: Inputs after being scrubbed of PII, in input order
+    :rtype: List[str | dict]
+    """
+    if _scrub_path([_scrubbed_size(item) for item in items]) == "inline":
+        return scrub_many(items, redaction_counts)
+    return await run_in_threadpool(scrub_many, items, redaction_counts)
 
 
 def scrub_phone_numbers(text: str) -> str:
@@ -52,11 +768,7 @@ def scrub_phone_numbers(text: str) -> str:
     :rtype: str
     """
 
-    return re.sub(
-        r"(\+?\d{1,2}\s?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}",
-        "[REDACTED PHONE NUMBER]",
-        text,
-    )
+    return _PII_REGEXES["phone_number"].sub("[REDACTED PHONE NUMBER]", text)
 
 
 def scrub_credit_card_numbers(text: str) -> str:
@@ -69,11 +781,7 @@ def scrub_credit_card_numbers(text: str) -> str:
     :rtype: str
     """
 
-    return re.sub(
-        r"\b(?:\d[ -\.]*?){13,16}\b",
-        "[REDACTED CREDIT CARD NUMBER]",
-        text,
-    )
+    return _PII_REGEXES["credit_card_number"].sub("[REDACTED CREDIT CARD NUMBER]", text)
 
 
 def scrub_sin_numbers(text: str) -> str:
@@ -86,11 +794,7 @@ def scrub_sin_numbers(text: str) -> str:
     :rtype: str
     """
 
-    return re.sub(
-        r"\b(?:\d[ -\.]*?){9}\b",
-        "[REDACTED SIN NUMBER]",
-        text,
-    )
+    return _PII_REGEXES["sin_number"].sub("[REDACTED SIN NUMBER]", text)
 
 
 def scrub_email_addresses(text: str) -> str:
@@ -103,11 +807,7 @@ def scrub_email_addresses(text: str) -> str:
     :rtype: str
     """
 
-    return re.sub(
-        "(?:[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*|\"(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])*\")@(?:(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?|\[(?:(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9]))\.){3}(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9])|[a-z0-9-]*[a-z0-9]:(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21-\x5a\x53-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])+)\])",
-        "[REDACTED EMAIL ADDRESS]",
-        text,
-    )
+    return redact_pii_spans(text, find_pii_spans(text, kinds=("email_address",)))
 
 
 def scrub_postal_codes(text: str) -> str:
@@ -120,11 +820,20 @@ def scrub_postal_codes(text: str) -> str:
     :rtype: str
     """
 
-    return re.sub(
-        r"\b[A-Za-z][0-9][A-Za-z] ?[0-9][A-Za-z][0-9]\b",
-        "[REDACTED POSTAL CODE]",
-        text,
-    )
+    return _PII_REGEXES["postal_code"].sub("[REDACTED POSTAL CODE]", text)
+
+
+def scrub_denylisted_terms(text: str) -> str:
+    """
+    Scrub terms from the denylist file configured by `PII_DENYLIST_PATH`
+
+    :param text: Input text to scrub
+    :type text: str
+    :return: Input text with any denylisted terms scrubbed
+    :rtype: str
+    """
+
+    return redact_pii_spans(text, find_pii_spans(text, kinds=(DENYLIST_KIND,)))
 
 
 ALL_SCRUBBERS = [
@@ -134,4 +843,5 @@ ALL_SCRUBBERS = [
     scrub_postal_codes,
     # move sin scrubber to the end since it's over-eager
     scrub_sin_numbers,
+    scrub_denylisted_terms,
 ]
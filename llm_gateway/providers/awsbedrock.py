@@ -15,19 +15,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import base64
 import datetime
 import json
-from typing import Iterator, Optional, Tuple, Union
+from collections import Counter
+from functools import partial
+from typing import AsyncIterator, List, Optional, Tuple, Union
+from urllib.parse import quote
 
+import aiohttp
 import boto3
-from fastapi.responses import JSONResponse
+import yarl
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.eventstream import EventStreamBuffer
+from botocore.exceptions import (
+    ClientError,
+    EndpointConnectionError,
+    EventStreamError,
+    NoCredentialsError,
+    ReadTimeoutError,
+)
 
+from llm_gateway.batching import get_embedding_batcher
+from llm_gateway.circuit_breaker import circuit_breaker
 from llm_gateway.constants import get_settings
 from llm_gateway.db.models import AWSBedrockRequests
 from llm_gateway.db.utils import write_record_to_db
-from llm_gateway.exceptions import AWSBEDROCK_EXCEPTIONS
-from llm_gateway.pii_scrubber import scrub_all
-from llm_gateway.utils import max_retries
+from llm_gateway.embedding_cache import aembed_cached, get_embedding_cache
+from llm_gateway.exceptions import AWSBEDROCK_EXCEPTIONS, is_retryable_awsbedrock_error
+from llm_gateway.hedging import hedged
+from llm_gateway.pii_scrubber import ascrub_many
+from llm_gateway.rate_limiter import (
+    estimate_tokens,
+    get_caller,
+    rate_limited,
+    usage_tokens,
+)
+from llm_gateway.response_cache import CachedResponse, areplay_stream
+from llm_gateway.singleflight import Flight
+from llm_gateway.templates import logged_user_input
+from llm_gateway.utils import StreamEnd, StreamProcessor, astream_items, max_retries
 
 settings = get_settings()
 
@@ -73,6 +103,50 @@ SUPPORTED_AWSBEDROCK_ENDPOINTS = {
 }
 
 
+# Bedrock can't stream these, their whole response is streamed as a single chunk
+UNSTREAMABLE_AWSBEDROCK_MODELS = (AI21_J2_MID_V1, AI21_J2_ULTRA_V1)
+
+# Most texts Cohere embed models take in one request. Titan takes a single text, so
+# its requests aren't batched.
+COHERE_EMBED_MAX_BATCH_SIZE = 96
+
+
+# keys of the most tokens to generate, in the bodies of each model family
+_MAX_TOKENS_KEYS = ("maxTokens", "max_tokens_to_sample", "max_tokens", "max_gen_len")
+
+
+def _estimated_tokens(arguments: dict) -> int:
+    """
+    Tokens an AWS Bedrock call is expected to use, given its arguments (see
+    `llm_gateway.rate_limiter.rate_limited`)
+    """
+    body = arguments["body"]
+    max_tokens = next(
+        (body[key] for key in _MAX_TOKENS_KEYS if body.get(key) is not None),
+        body.get("textGenerationConfig", {}).get("maxTokenCount"),
+    )
+    texts = [body.get("prompt"), body.get("inputText"), *(body.get("texts") or [])]
+    return estimate_tokens(texts, max_tokens)
+
+
+def _tokens_used(result) -> Optional[int]:
+    """
+    Tokens an AWS Bedrock call used, given its response
+    """
+    # Bedrock says in headers, only some models also say in the body
+    if not isinstance(result, dict):
+        return None
+    if "generation_token_count" in result:
+        # Llama 2
+        return usage_tokens(
+            {
+                "input_tokens": result.get("prompt_token_count"),
+                "output_tokens": result["generation_token_count"],
+            }
+        )
+    return None
+
+
 class AWSBedrockWrapper:
     """
     This is a simple wrapper around the AWS Bedrock API client, which adds
@@ -81,12 +155,46 @@ class AWSBedrockWrapper:
     """
 
     def __init__(self) -> None:
-        self._bedrock_runtime = boto3.client(
+        # boto3 clients are thread-safe but creating them isn't, and they are slow
+        # to create, so there is one wrapper per process (see llm_gateway.dependencies)
+        # with its own session
+        session = boto3.session.Session(
             aws_access_key_id=settings.AWS_PUBLIC_ACCESS_KEY,
             aws_secret_access_key=settings.AWS_PRIVATE_ACCESS_KEY,
             region_name=settings.AWS_REGION,
+        )
+        self._bedrock_runtime = session.client(
             service_name="bedrock-runtime",
+            endpoint_url=settings.AWS_BEDROCK_ENDPOINT_URL,
+            config=Config(
+                # enough for every thread serving requests to have a connection
+                max_pool_connections=settings.AWS_BEDROCK_MAX_POOL_CONNECTIONS,
+                connect_timeout=settings.AWS_BEDROCK_CONNECT_TIMEOUT,
+                read_timeout=settings.AWS_BEDROCK_READ_TIMEOUT,
+                tcp_keepalive=True,
+                # retried by max_retries instead, which knows the request's
+                # deadline and the retry budget
+                retries={"total_max_attempts": 1},
+            ),
         )
+        # boto3 has no async API, so the async path signs requests with the same
+        # credentials and sends them with aiohttp
+        self._credentials = session.get_credentials()
+        self._aiohttp_session: Optional[aiohttp.ClientSession] = None
+
+    def close(self) -> None:
+        """
+        Close the connections of the Bedrock runtime client
+        """
+        self._bedrock_runtime.close()
+
+    async def aclose(self) -> None:
+        """
+        Close the connection pool of the async path
+        """
+        if self._aiohttp_session is not None:
+            await self._aiohttp_session.close()
+            self._aiohttp_session = None
 
     def _validate_awsbedrock_endpoint(self, endpoint: str, model: str) -> None:
         """
@@ -108,6 +216,17 @@ class AWSBedrockWrapper:
                 f"`model` must be one of `{SUPPORTED_AWSBEDROCK_ENDPOINTS[endpoint]} for endpoint `{endpoint}`"  # noqa
             )
 
+    def _validate_awsbedrock_stream(self, endpoint: str) -> None:
+        """
+        Check that the endpoint can be streamed, else raise an error
+
+        :param endpoint: The name of an AWS Bedrock endpoint (i.e. "Text")
+        :type endpoint: str
+        :raises NotImplementedError: Raised if the endpoint can't be streamed
+        """
+        if endpoint != "Text":
+            raise NotImplementedError("Only the `Text` endpoint can be streamed")
+
     def _structure_model_body(
         self,
         model: str,
@@ -215,33 +334,281 @@ class AWSBedrockWrapper:
             f"{model}` is not supported by the AWS Bedrock API. Please choose one of `{SUPPORTED_AWSBEDROCK_ENDPOINTS}"  # noqa
         )
 
-    @max_retries(3, exceptions=AWSBEDROCK_EXCEPTIONS)
-    def _invoke_awsbedrock_model(
-        self,
-        model: str,
-        body: dict,
-    ) -> JSONResponse:
+    def _get_aiohttp_session(self) -> aiohttp.ClientSession:
+        if self._aiohttp_session is None or self._aiohttp_session.closed:
+            self._aiohttp_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=settings.PROVIDER_MAX_CONNECTIONS,
+                    keepalive_timeout=60,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=settings.AWS_BEDROCK_CONNECT_TIMEOUT,
+                    sock_read=settings.AWS_BEDROCK_READ_TIMEOUT,
+                ),
+            )
+        return self._aiohttp_session
+
+    async def _arequest_model(
+        self, model: str, body: dict, action: str, headers: dict
+    ) -> aiohttp.ClientResponse:
         """
-        Call the invoke model enpoint from the AWS Bedrock client and return response
+        Sign a request to one of the model's actions like boto3 would and send it
+        with aiohttp
+
+        :param model: The name of an AWS Bedrock model (i.e. "anthropic.claude-v2:1")
+        :type model: str
+        :param body: Body of the model-specific request to the AWS Bedrock API
+        :type body: dict
+        :param action: "invoke" or "invoke-with-response-stream"
+        :type action: str
+        :param headers: Headers of the request, besides the signature
+        :type headers: dict
+        :raises ClientError: Bedrock returned an error
+        :return: Response, once its headers have arrived
+        :rtype: aiohttp.ClientResponse
+        """
+        if self._credentials is None:
+            raise NoCredentialsError()
+        meta = self._bedrock_runtime.meta
+        url = f"{meta.endpoint_url}/model/{quote(model, safe='')}/{action}"
+        request = AWSRequest(
+            method="POST", url=url, data=json.dumps(body), headers=headers
+        )
+        SigV4Auth(
+            self._credentials.get_frozen_credentials(),
+            meta.service_model.signing_name,
+            meta.region_name,
+        ).add_auth(request)
+
+        try:
+            response = await self._get_aiohttp_session().post(
+                # already quoted, and signed as such
+                yarl.URL(url, encoded=True),
+                data=request.body,
+                headers=dict(request.headers),
+            )
+            if response.status < 300:
+                return response
+            async with response:
+                payload = await response.read()
+        except asyncio.TimeoutError as e:
+            raise ReadTimeoutError(endpoint_url=url, error=e)
+        except aiohttp.ClientError as e:
+            raise EndpointConnectionError(endpoint_url=url, error=e)
+
+        try:
+            message = json.loads(payload).get("message", "")
+        except ValueError:
+            message = payload.decode(errors="replace")
+        error_type = response.headers.get("x-amzn-ErrorType", "")
+        raise ClientError(
+            {
+                "Error": {
+                    "Code": error_type.split(":")[0] or str(response.status),
+                    "Message": message,
+                },
+                "ResponseMetadata": {
+                    "HTTPStatusCode": response.status,
+                    # lower cased, like botocore's
+                    "HTTPHeaders": {
+                        name.lower(): value for name, value in response.headers.items()
+                    },
+                },
+            },
+            "InvokeModel",
+        )
+
+    @max_retries(
+        3,
+        exceptions=AWSBEDROCK_EXCEPTIONS,
+        provider="awsbedrock",
+        is_retryable=is_retryable_awsbedrock_error,
+    )
+    @rate_limited("awsbedrock", _estimated_tokens, _tokens_used)
+    @circuit_breaker(
+        "awsbedrock",
+        exceptions=AWSBEDROCK_EXCEPTIONS,
+        is_failure=is_retryable_awsbedrock_error,
+    )
+    async def _ainvoke_awsbedrock_model(self, model: str, body: dict) -> dict:
+        """
+        Call the invoke model endpoint of the AWS Bedrock API and return response
 
         :param model: The name of an AWS Bedrock model (i.e. "anthropic.claude-v2:1")
         :type model: str
         :param body: Body of the model-specific request to the AWS Bedrock API
         :type body: dict
         :return: Response from the AWS Bedrock API
-        :rtype: JSONResponse
+        :rtype: dict
         """
+        response = await self._arequest_model(
+            model,
+            body,
+            "invoke",
+            headers={"Content-Type": "application/json", "Accept": "*/*"},
+        )
+        async with response:
+            try:
+                payload = await response.read()
+            except asyncio.TimeoutError as e:
+                raise ReadTimeoutError(endpoint_url=str(response.url), error=e)
+            except aiohttp.ClientError as e:
+                raise EndpointConnectionError(endpoint_url=str(response.url), error=e)
+        return json.loads(payload)
+
+    @max_retries(
+        3,
+        exceptions=AWSBEDROCK_EXCEPTIONS,
+        provider="awsbedrock",
+        is_retryable=is_retryable_awsbedrock_error,
+    )
+    @rate_limited("awsbedrock", _estimated_tokens, _tokens_used)
+    @circuit_breaker(
+        "awsbedrock",
+        exceptions=AWSBEDROCK_EXCEPTIONS,
+        is_failure=is_retryable_awsbedrock_error,
+    )
+    async def _ainvoke_awsbedrock_model_stream(
+        self, model: str, body: dict
+    ) -> aiohttp.ClientResponse:
+        """
+        Call the invoke model with response stream endpoint of the AWS Bedrock API,
+        and return the response to read the stream from with
+        `aiter_event_stream_chunks`
 
-        res = self._bedrock_runtime.invoke_model(
-            modelId=model,
-            contentType="application/json",
-            accept="*/*",
-            body=json.dumps(body),
+        :param model: The name of an AWS Bedrock model (i.e. "anthropic.claude-v2:1")
+        :type model: str
+        :param body: Body of the model-specific request to the AWS Bedrock API
+        :type body: dict
+        :return: Response with an event stream body
+        :rtype: aiohttp.ClientResponse
+        """
+        return await self._arequest_model(
+            model,
+            body,
+            "invoke-with-response-stream",
+            headers={
+                "Content-Type": "application/json",
+                "Accept": "application/vnd.amazon.eventstream",
+                "X-Amzn-Bedrock-Accept": "*/*",
+            },
+        )
+
+    async def _aembed_batch(self, model: str, texts: List[str]) -> dict:
+        """
+        Embed a batch of requests' texts with a Cohere embed model (see
+        `llm_gateway.batching`), hedging the call if `HEDGE_REQUESTS` is set
+
+        :param model: The name of an AWS Bedrock model (i.e. "cohere.embed-english-v3")
+        :type model: str
+        :param texts: Texts of every request in the batch
+        :type texts: List[str]
+        :return: Response from the AWS Bedrock API
+        :rtype: dict
+        """
+        body, _ = self._structure_model_body(
+            model=model, max_tokens=None, embedding_texts=texts
         )
+        call = partial(self._ainvoke_awsbedrock_model, model, body)
+        if settings.HEDGE_REQUESTS:
+            response, _ = await hedged(call, "awsbedrock", model)
+            return response
+        return await call()
 
-        return json.loads(res.get("body").read())
+    async def _aembed(
+        self, model: str, texts: List[str], hedge: bool, gateway_metadata: dict
+    ) -> dict:
+        """
+        Embed texts with a Cohere embed model, in a batch with concurrent requests if
+        `EMBEDDING_BATCHING` is set
 
-    def send_awsbedrock_request(
+        :param model: The name of an AWS Bedrock model (i.e. "cohere.embed-english-v3")
+        :type model: str
+        :param texts: Texts to embed
+        :type texts: List[str]
+        :param hedge: Hedge the call, if it isn't batched
+        :type hedge: bool
+        :param gateway_metadata: Metadata of the request for the DB log
+        :type gateway_metadata: dict
+        :return: Response from the AWS Bedrock API
+        :rtype: dict
+        """
+        if settings.EMBEDDING_BATCHING:
+            # the batch is hedged as a whole, see `_aembed_batch`
+            batcher = get_embedding_batcher(
+                "awsbedrock",
+                model,
+                self._aembed_batch,
+                split_cohere_embeddings,
+                COHERE_EMBED_MAX_BATCH_SIZE,
+            )
+            response, gateway_metadata["batch"] = await batcher.submit(texts)
+            return response
+        body, _ = self._structure_model_body(
+            model=model, max_tokens=None, embedding_texts=texts
+        )
+        call = partial(self._ainvoke_awsbedrock_model, model, body)
+        if hedge:
+            response, gateway_metadata["hedge"] = await hedged(
+                call, "awsbedrock", model
+            )
+            return response
+        return await call()
+
+    async def _aembed_cached(
+        self, model: str, texts: List[str], hedge: bool, gateway_metadata: dict
+    ) -> dict:
+        """
+        Embed texts with a Cohere embed model, only sending the ones missing from
+        the embedding cache to AWS Bedrock (see `_aembed`)
+
+        :return: Response from the AWS Bedrock API, or one like it
+        :rtype: dict
+        """
+        cache = get_embedding_cache()
+        if cache is None:
+            return await self._aembed(model, texts, hedge, gateway_metadata)
+
+        async def embed(misses: List[str]):
+            response = await self._aembed(model, misses, hedge, gateway_metadata)
+            return response, response["embeddings"]
+
+        embeddings, response, cache_stats = await aembed_cached(
+            cache, "awsbedrock", model, texts, embed
+        )
+        gateway_metadata["embedding_cache"] = cache_stats
+        if not cache_stats["hits"] and len(response["embeddings"]) == len(texts):
+            # nothing to merge
+            return response
+        return {
+            **(response or {"response_type": "embeddings_floats"}),
+            "embeddings": embeddings,
+            "texts": texts,
+        }
+
+    async def _aopen_stream(self, model: str, body: dict):
+        """
+        Start a streamed invocation (see `llm_gateway.singleflight.Flight.stream`),
+        models that can't stream send their whole response as one chunk
+
+        :param model: Model to invoke
+        :type model: str
+        :param body: Body of the model-specific request to the AWS Bedrock API
+        :type body: dict
+        :return: The stream of text, and a function to close it early
+        :rtype: Tuple[AsyncIterator, Optional[Callable[[], None]]]
+        """
+        if model in UNSTREAMABLE_AWSBEDROCK_MODELS:
+            response = await self._ainvoke_awsbedrock_model(model, body)
+            return astream_generator_awsbedrock(_aiter([response]), model), None
+        response = await self._ainvoke_awsbedrock_model_stream(
+            model, _streaming_body(model, body)
+        )
+        chunks = aiter_event_stream_chunks(response)
+        # closing the HTTP response closes its connection too
+        return astream_generator_awsbedrock(chunks, model), response.close
+
+    async def asend_awsbedrock_request(
         self,
         awsbedrock_module: str,
         model: str,
@@ -250,10 +617,14 @@ class AWSBedrockWrapper:
         temperature: Optional[float] = 0,
         instruction: Optional[str] = None,
         embedding_texts: Optional[str] = None,
+        stream: bool = False,
+        sse: bool = False,
+        hedge: Optional[bool] = None,
         **kwargs,
-    ) -> Tuple[Union[dict, Iterator[str]], dict]:
+    ) -> Tuple[Union[dict, AsyncIterator[str]], dict]:
         """
-        Send a request to the AWS Bedrock API and return response and logs for db write
+        Send a request to the AWS Bedrock API and return response and logs for db
+        write, without holding a thread while waiting on AWS Bedrock
 
         :param awsbedrock_module: Valid AWS Bedrock module to hit (i.e. "Text")
         :type awsbedrock_module: str
@@ -269,20 +640,35 @@ class AWSBedrockWrapper:
         :type instruction: Optional[str]
         :param embedding_texts: List of prompts, if calling embedding, defaults to None
         :type embedding_texts: Optional[list]
+        :param stream: Stream the text generated by a "Text" model as an async
+            iterator, defaults to False
+        :type stream: bool
+        :param sse: Stream server-sent events (see `StreamProcessor.aprocess_stream_sse`)
+            instead of plain text, defaults to False
+        :type sse: bool
+        :param hedge: Hedge the request (see `llm_gateway.hedging.hedged`) if it is
+            safe to repeat, an embedding or a temperature 0 completion, defaults to
+            None (`HEDGE_REQUESTS`). Batched embeddings are hedged per batch, with
+            `HEDGE_REQUESTS`.
+        :type hedge: Optional[bool]
         :param kwargs: other model-specific parameters to pass to AWS Bedrock.
             (ie- topP, stop_sequences, seed, etc.)
         :type kwargs: Optional[dict]
-        :return: Flattened response from AWS Bedrock API and logs for db write
-        :rtype: _type_
+        :return: Flattened (or streamed) response from AWS Bedrock API and logs for db
+            write
+        :rtype: Tuple[Union[dict, AsyncIterator[str]], dict]
         """
         self._validate_awsbedrock_endpoint(endpoint=awsbedrock_module, model=model)
+        if stream:
+            self._validate_awsbedrock_stream(awsbedrock_module)
 
+        pii_redactions = Counter()
         if prompt:
-            prompt = scrub_all(prompt)
+            [prompt] = await ascrub_many([prompt], pii_redactions)
         if embedding_texts:
-            embedding_texts = [scrub_all(text) for text in embedding_texts]
+            embedding_texts = await ascrub_many(embedding_texts, pii_redactions)
         if instruction:
-            instruction = scrub_all(instruction)
+            [instruction] = await ascrub_many([instruction], pii_redactions)
 
         body, user_input = self._structure_model_body(
             model=model,
@@ -294,22 +680,246 @@ class AWSBedrockWrapper:
             **kwargs,
         )
 
-        awsbedrock_response = self._invoke_awsbedrock_model(model, body)
+        gateway_metadata = {"pii_redactions": dict(pii_redactions)}
+        route = "awsbedrock/text" if awsbedrock_module == "Text" else None
+        request = dict(model=model, body=body, stream=stream)
+        response_cache = CachedResponse("awsbedrock", route, temperature, **request)
+        flight = Flight("awsbedrock", route, temperature, **request)
+        cached = response_cache.get()
+        if response_cache.status is not None:
+            gateway_metadata["cache"] = response_cache.status
+        if hedge is None:
+            hedge = settings.HEDGE_REQUESTS
+        if cached is not None and not stream:
+            awsbedrock_response = cached
+            cached_response = awsbedrock_response
+        elif (
+            model in (COHERE_EMBED_ENGLISH_V3, COHERE_EMBED_MULTILINGUAL_V3)
+            and embedding_texts
+        ):
+            awsbedrock_response = await self._aembed_cached(
+                model, embedding_texts, hedge, gateway_metadata
+            )
+            cached_response = awsbedrock_response
+        elif not stream:
+            call = partial(self._ainvoke_awsbedrock_model, model, body)
+            if hedge and (awsbedrock_module == "Embed" or temperature == 0):
+                awsbedrock_response, gateway_metadata["hedge"] = await flight.call(
+                    partial(hedged, call, "awsbedrock", model)
+                )
+            else:
+                awsbedrock_response = await flight.call(call)
+            cached_response = awsbedrock_response
+            response_cache.set(awsbedrock_response)
+        else:
+            if cached is not None:
+                chunks, close_upstream = cached, None
+            else:
+                chunks, close_upstream = await flight.stream(
+                    partial(self._aopen_stream, model, body)
+                )
+            stream_processor = StreamProcessor(
+                stream_processor=(
+                    areplay_stream if cached is not None else astream_items
+                ),
+                scrub_output=settings.PII_SCRUB_STREAMED_OUTPUT,
+                provider="awsbedrock",
+                max_tokens=max_tokens,
+                close_upstream=close_upstream,
+                on_complete=None if cached is not None else response_cache.set_stream,
+            )
+            if sse:
+                awsbedrock_response = stream_processor.aprocess_stream_sse(chunks)
+            else:
+                awsbedrock_response = stream_processor.aprocess_stream(chunks)
+            awsbedrock_response = stream_processor.cancellable(awsbedrock_response)
+            # all filled in as the stream is returned
+            cached_response = stream_processor.get_cached_streamed_response()
+            gateway_metadata["stream"] = stream_processor.metadata
+            if stream_processor.scrubber is not None:
+                gateway_metadata["output_pii_redactions"] = (
+                    stream_processor.scrubber.redaction_counts
+                )
+
+        if flight.role == "follower":
+            gateway_metadata["singleflight"] = flight.role
+        db_record = self._make_db_record(
+            awsbedrock_module,
+            logged_user_input(prompt, user_input),
+            cached_response,
+            model,
+            temperature,
+            gateway_metadata,
+            kwargs,
+        )
+        return awsbedrock_response, db_record
 
-        db_record = {
+    def _make_db_record(
+        self,
+        awsbedrock_module: str,
+        user_input: Optional[str],
+        awsbedrock_response: Union[dict, List[str]],
+        model: str,
+        temperature: Optional[float],
+        gateway_metadata: dict,
+        kwargs: dict,
+    ) -> dict:
+        return {
             "user_input": user_input,
-            "user_email": None,
+            "user_email": get_caller(),
             "awsbedrock_response": awsbedrock_response,
             "awsbedrock_model": model,
             "temperature": temperature,
             "extras": json.dumps(kwargs),
             "awsbedrock_endpoint": awsbedrock_module,
             "created_at": datetime.datetime.now(),
+            "gateway_metadata": gateway_metadata,
         }
 
-        return awsbedrock_response, db_record
-
     def write_logs_to_db(self, db_logs: dict):
         if isinstance(db_logs["awsbedrock_response"], list):
             db_logs["awsbedrock_response"] = "".join(db_logs["awsbedrock_response"])
         write_record_to_db(AWSBedrockRequests(**db_logs))
+
+
+def split_cohere_embeddings(response: dict, texts: List[List[str]]) -> List[dict]:
+    """
+    Split the response of a Cohere embed model to a batch of requests into a
+    response per request, as if each had been sent on its own
+
+    :param response: Response from the AWS Bedrock API to the batch
+    :type response: dict
+    :param texts: Texts of each request in the batch
+    :type texts: List[List[str]]
+    :return: Response to each request
+    :rtype: List[dict]
+    """
+    parts = []
+    start = 0
+    for request_texts in texts:
+        end = start + len(request_texts)
+        parts.append(
+            {
+                **response,
+                "embeddings": response["embeddings"][start:end],
+                "texts": response["texts"][start:end],
+            }
+        )
+        start = end
+    return parts
+
+
+def _streaming_body(model: str, body: dict) -> dict:
+    """
+    Body of a model-specific request to stream the response
+    """
+    if model in (COHERE_COMMAND_TEXT_V14, COHERE_COMMAND_LIGHT_TEXT_V14):
+        # the only family that has to ask
+        return {**body, "stream": True}
+    return body
+
+
+def decode_awsbedrock_chunk(model: str, chunk: dict) -> Tuple[str, Optional[str]]:
+    """
+    Get the text out of a chunk streamed by a model
+
+    :param model: The name of an AWS Bedrock model (i.e. "anthropic.claude-v2:1")
+    :type model: str
+    :param chunk: Chunk of the model's response
+    :type chunk: dict
+    :return: Text of the chunk and, if the model stopped, why
+    :rtype: Tuple[str, Optional[str]]
+    """
+    if model in (AI21_J2_MID_V1, AI21_J2_ULTRA_V1):
+        # the whole response
+        completion = chunk["completions"][0]
+        return (
+            completion["data"]["text"],
+            completion.get("finishReason", {}).get("reason"),
+        )
+    if model in (AMAZON_TITAN_TEXT_LITE_V1, AMAZON_TITAN_TEXT_EXPRESS_V1):
+        return chunk.get("outputText") or "", chunk.get("completionReason")
+    if model in (
+        ANTHROPIC_CLAUDE_V1,
+        ANTHROPIC_CLAUDE_V2,
+        ANTHROPIC_CLAUDE_V2_1,
+        ANTHROPIC_CLAUDE_INSTANT_V1,
+    ):
+        return chunk.get("completion") or "", chunk.get("stop_reason")
+    if model in (COHERE_COMMAND_TEXT_V14, COHERE_COMMAND_LIGHT_TEXT_V14):
+        return chunk.get("text") or "", chunk.get("finish_reason")
+    if model in (META_LLAMA2_13B_CHAT_V1, META_LLAMA2_70B_CHAT_V1):
+        return chunk.get("generation") or "", chunk.get("stop_reason")
+
+    raise NotImplementedError(f"`{model}` can't be streamed")
+
+
+def _invocation_usage(chunk: dict) -> Optional[dict]:
+    """
+    Tokens used by the whole stream, which Bedrock adds to the last chunk
+    """
+    invocation_metrics = chunk.get("amazon-bedrock-invocationMetrics")
+    if invocation_metrics is None:
+        return None
+    return {
+        "input_tokens": invocation_metrics.get("inputTokenCount"),
+        "output_tokens": invocation_metrics.get("outputTokenCount"),
+    }
+
+
+async def astream_generator_awsbedrock(
+    generator: AsyncIterator[dict], model: str
+) -> AsyncIterator[Union[str, StreamEnd]]:
+    finish_reason = usage = None
+    async for chunk in generator:
+        text, chunk_finish_reason = decode_awsbedrock_chunk(model, chunk)
+        finish_reason = chunk_finish_reason or finish_reason
+        usage = _invocation_usage(chunk) or usage
+        yield text
+    yield StreamEnd(finish_reason=finish_reason, usage=usage)
+
+
+async def aiter_event_stream_chunks(
+    response: aiohttp.ClientResponse,
+) -> AsyncIterator[dict]:
+    """
+    Decode the model's chunks out of the event stream of an InvokeModelWithResponseStream
+    response, as boto3 does
+
+    :param response: Response from `invoke-with-response-stream`
+    :type response: aiohttp.ClientResponse
+    :raises EventStreamError: Bedrock sent an error in the stream
+    :return: Chunks of the model's response
+    :rtype: AsyncIterator[dict]
+    """
+    buffer = EventStreamBuffer()
+    async with response:
+        async for data in response.content.iter_any():
+            buffer.add_data(data)
+            for message in buffer:
+                headers = message.headers
+                if headers.get(":message-type") == "event":
+                    if headers.get(":event-type") == "chunk":
+                        chunk = json.loads(message.payload)
+                        yield json.loads(base64.b64decode(chunk["bytes"]))
+                    continue
+
+                try:
+                    error_message = json.loads(message.payload).get("message", "")
+                except ValueError:
+                    error_message = headers.get(":error-message", "")
+                raise EventStreamError(
+                    {
+                        "Error": {
+                            "Code": headers.get(":exception-type")
+                            or headers.get(":error-code"),
+                            "Message": error_message,
+                        }
+                    },
+                    "InvokeModelWithResponseStream",
+                )
+
+
+async def _aiter(items: list) -> AsyncIterator:
+    for item in items:
+        yield item
@@ -17,22 +17,55 @@
 
 import datetime
 import json
-from typing import Iterator, Optional
+from collections import Counter
+from functools import partial
+from typing import AsyncIterator, List, Optional, Union
 
 import cohere
-from cohere.responses.generation import StreamingText
+from cohere.responses.generation import StreamingGenerations, StreamingText
 
+from llm_gateway.circuit_breaker import circuit_breaker
 from llm_gateway.constants import get_settings
 from llm_gateway.db.models import CohereRequests
 from llm_gateway.db.utils import write_record_to_db
-from llm_gateway.pii_scrubber import scrub_all
-from llm_gateway.utils import StreamProcessor
+from llm_gateway.exceptions import COHERE_EXCEPTIONS, is_retryable_cohere_error
+from llm_gateway.pii_scrubber import ascrub_many
+from llm_gateway.rate_limiter import (
+    estimate_tokens,
+    get_caller,
+    rate_limited,
+    usage_tokens,
+)
+from llm_gateway.response_cache import CachedResponse, areplay_stream
+from llm_gateway.singleflight import Flight
+from llm_gateway.templates import logged_user_input
+from llm_gateway.utils import StreamEnd, StreamProcessor, astream_items
 
 settings = get_settings()
 
 SUPPORTED_COHERE_ENDPOINTS = ["generate", "summarize"]
 
 
+def _estimated_tokens(arguments: dict) -> int:
+    """
+    Tokens a Cohere call is expected to use, given its arguments (see
+    `llm_gateway.rate_limiter.rate_limited`)
+    """
+    texts = [arguments.get(name) for name in ("prompt", "text", "additional_command")]
+    return estimate_tokens(texts, arguments.get("max_tokens"))
+
+
+def _tokens_used(result) -> Optional[int]:
+    """
+    Tokens a Cohere call used, given its response
+    """
+    # streams only say once they end
+    meta = getattr(result, "meta", None)
+    if not isinstance(meta, dict):
+        return None
+    return usage_tokens(meta.get("billed_units"))
+
+
 class CohereWrapper:
     """
     This is a simple wrapper around the Cohere API client, which adds
@@ -42,6 +75,26 @@ class CohereWrapper:
 
     def __init__(self) -> None:
         self.cohere_client = cohere.Client(settings.COHERE_API_KEY)
+        # the sync client has already checked the key. num_workers caps how many
+        # requests the async client has in flight at once.
+        self.cohere_async_client = cohere.AsyncClient(
+            settings.COHERE_API_KEY,
+            num_workers=settings.PROVIDER_MAX_CONNECTIONS,
+            check_api_key=False,
+        )
+
+    def close(self) -> None:
+        """
+        Stop the threads the Cohere client uses for batched requests
+        """
+        # the client has no public way to do this
+        self.cohere_client._executor.shutdown(wait=False)
+
+    async def aclose(self) -> None:
+        """
+        Close the connection pool of the async client
+        """
+        await self.cohere_async_client.close()
 
     def _validate_cohere_endpoint(self, endpoint: str) -> None:
         """
@@ -56,7 +109,11 @@ class CohereWrapper:
                 f"Cohere endpoint must be one of `{SUPPORTED_COHERE_ENDPOINTS}`"
             )
 
-    def _call_summarize_endpoint(
+    @rate_limited("cohere", _estimated_tokens, _tokens_used)
+    @circuit_breaker(
+        "cohere", exceptions=COHERE_EXCEPTIONS, is_failure=is_retryable_cohere_error
+    )
+    async def _acall_summarize_endpoint(
         self,
         text: str,
         additional_command: str,
@@ -78,7 +135,7 @@ class CohereWrapper:
         :return: Response from Cohere
         :rtype: _type_
         """
-        return self.cohere_client.summarize(
+        return await self.cohere_async_client.summarize(
             model=model,
             text=text,
             temperature=temperature,
@@ -86,7 +143,11 @@ class CohereWrapper:
             **kwargs,
         )
 
-    def _call_generate_endpoint(
+    @rate_limited("cohere", _estimated_tokens, _tokens_used)
+    @circuit_breaker(
+        "cohere", exceptions=COHERE_EXCEPTIONS, is_failure=is_retryable_cohere_error
+    )
+    async def _acall_generate_endpoint(
         self,
         prompt: str,
         model: str,
@@ -109,7 +170,7 @@ class CohereWrapper:
         :return: Response from Cohere
         :rtype: _type_
         """
-        resp = self.cohere_client.generate(
+        return await self.cohere_async_client.generate(
             model=model,
             prompt=prompt,
             max_tokens=max_tokens,
@@ -117,7 +178,19 @@ class CohereWrapper:
             stream=stream,
             **kwargs,
         )
-        return resp
+
+    async def _aopen_stream(self, call):
+        """
+        Start a streamed generation (see `llm_gateway.singleflight.Flight.stream`)
+
+        :param call: Calls Cohere with `stream=True`
+        :type call: Callable[[], Awaitable[StreamingGenerations]]
+        :return: The stream of text, and a function to close it early
+        :rtype: Tuple[AsyncIterator, Optional[Callable[[], None]]]
+        """
+        result = await call()
+        # closing the HTTP response closes its connection too
+        return astream_generator_cohere(result), result.response.close
 
     def _flatten_cohere_response(self, cohere_response):
         """
@@ -130,7 +203,7 @@ class CohereWrapper:
         """
         return json.loads(json.dumps(cohere_response, default=lambda o: o.__dict__))
 
-    def send_cohere_request(
+    async def asend_cohere_request(
         self,
         endpoint: str,
         model: Optional[str] = None,
@@ -138,11 +211,13 @@ class CohereWrapper:
         prompt: Optional[str] = None,
         temperature: Optional[float] = 0,
         stream: bool = False,
+        sse: bool = False,
         additional_command: Optional[str] = "",
         **kwargs,
     ):
         """
-        Send a request to the Cohere API and log interaction to the DB
+        Send a request to the Cohere API and return response and logs for db write,
+        without holding a thread while waiting on Cohere
 
         :param endpoint: Valid Cohere endpoint to hit
         :type endpoint: str
@@ -154,56 +229,138 @@ class CohereWrapper:
         :type prompt: Optional[str], optional
         :param temperature: Temperature altering the creativity of the response, defaults to 0
         :type temperature: Optional[float], optional
+        :param stream: Stream the response as an async iterator of text, defaults to False
+        :type stream: bool
+        :param sse: Stream server-sent events (see `StreamProcessor.aprocess_stream_sse`)
+            instead of plain text, defaults to False
+        :type sse: bool
         :param additional_command: Additional command used for summarization
         :type additional_command: Optional[str], optional
         :param kwargs: other parameters to pass to cohere api.
         :type kwargs: Optional[dict]
-        :return: Flattened response from Cohere
+        :return: Flattened (or streamed) response from Cohere and logs for db write
         :rtype: _type_
         """
         self._validate_cohere_endpoint(endpoint)
 
         # scrub sensitive information
-        prompt = scrub_all(prompt)
+        pii_redactions = Counter()
+        [prompt] = await ascrub_many([prompt], pii_redactions)
 
-        if endpoint == "generate":
-            result = self._call_generate_endpoint(
-                prompt, model, max_tokens, temperature, stream, **kwargs
+        gateway_metadata = {"pii_redactions": dict(pii_redactions)}
+        route = "cohere/generate" if endpoint == "generate" else None
+        request = dict(
+            model=model,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            stream=stream,
+            kwargs=kwargs,
+        )
+        response_cache = CachedResponse("cohere", route, temperature, **request)
+        flight = Flight("cohere", route, temperature, **request)
+        result = response_cache.get()
+        if response_cache.status is not None:
+            gateway_metadata["cache"] = response_cache.status
+        cache_hit = result is not None
+        close_upstream = None
+        if not cache_hit and endpoint == "generate":
+            call = partial(
+                self._acall_generate_endpoint,
+                prompt,
+                model,
+                max_tokens,
+                temperature,
+                stream,
+                **kwargs,
             )
-        elif endpoint == "summarize":
-            result = self._call_summarize_endpoint(
+            if stream:
+                result, close_upstream = await flight.stream(
+                    partial(self._aopen_stream, call)
+                )
+            else:
+                result = await flight.call(call)
+            if flight.role == "follower":
+                gateway_metadata["singleflight"] = flight.role
+        elif not cache_hit and endpoint == "summarize":
+            result = await self._acall_summarize_endpoint(
                 prompt, additional_command, model, temperature, **kwargs
             )
         if not stream:
-            cohere_response = self._flatten_cohere_response(result)
+            if cache_hit:
+                cohere_response = result
+            else:
+                cohere_response = self._flatten_cohere_response(result)
+                response_cache.set(cohere_response)
             cached_response = cohere_response
         else:
-            stream_processor = StreamProcessor(stream_processor=stream_generator_cohere)
-            cohere_response = stream_processor.process_stream(result)
+            stream_processor = StreamProcessor(
+                stream_processor=areplay_stream if cache_hit else astream_items,
+                scrub_output=settings.PII_SCRUB_STREAMED_OUTPUT,
+                provider="cohere",
+                max_tokens=max_tokens,
+                close_upstream=close_upstream,
+                on_complete=None if cache_hit else response_cache.set_stream,
+            )
+            if sse:
+                cohere_response = stream_processor.aprocess_stream_sse(result)
+            else:
+                cohere_response = stream_processor.aprocess_stream(result)
+            cohere_response = stream_processor.cancellable(cohere_response)
+            # all filled in as the stream is returned
             cached_response = stream_processor.get_cached_streamed_response()
-        # The cached streaming response is an empty list at this point.
-        # Once the stream is returned to the user it will be populated
-        # Since the DB write happens after the stream, this will always be populated
-        db_record = {
-            "user_input": prompt,
-            "user_email": None,
-            "cohere_response": cached_response,
+            gateway_metadata["stream"] = stream_processor.metadata
+            if stream_processor.scrubber is not None:
+                gateway_metadata["output_pii_redactions"] = (
+                    stream_processor.scrubber.redaction_counts
+                )
+        db_record = self._make_db_record(
+            endpoint,
+            prompt,
+            cached_response,
+            model,
+            temperature,
+            gateway_metadata,
+            kwargs,
+        )
+        return cohere_response, db_record
+
+    def _make_db_record(
+        self,
+        endpoint: str,
+        prompt: Optional[str],
+        cohere_response: Union[dict, List[str]],
+        model: Optional[str],
+        temperature: Optional[float],
+        gateway_metadata: dict,
+        kwargs: dict,
+    ) -> dict:
+        return {
+            "user_input": logged_user_input(prompt, prompt),
+            "user_email": get_caller(),
+            "cohere_response": cohere_response,
             "cohere_model": model,
             "temperature": temperature,
             "extras": json.dumps(kwargs),
             "created_at": datetime.datetime.now(),
             "cohere_endpoint": endpoint,
+            "gateway_metadata": gateway_metadata,
         }
 
-        return cohere_response, db_record
-
     def write_logs_to_db(self, db_logs: dict):
         if isinstance(db_logs["cohere_response"], list):
             db_logs["cohere_response"] = "".join(db_logs["cohere_response"])
         write_record_to_db(CohereRequests(**db_logs))
 
 
-def stream_generator_cohere(generator: Iterator) -> Iterator[dict]:
+async def astream_generator_cohere(
+    generator: StreamingGenerations,
+) -> AsyncIterator[Union[str, StreamEnd]]:
     chunk: StreamingText
-    for chunk in generator:
+    async for chunk in generator:
         yield chunk.text
+    # filled in by the last line of the stream
+    meta = generator.generations.meta if generator.generations else None
+    yield StreamEnd(
+        finish_reason=generator.finish_reason,
+        usage=(meta or {}).get("billed_units"),
+    )
@@ -17,16 +17,35 @@
 
 import datetime
 import json
-from typing import Iterator, List, Optional, Tuple, Union
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from types import SimpleNamespace
+from typing import AsyncIterator, Iterator, List, Optional, Tuple, Union
 
+import aiohttp
 import openai
 
+from llm_gateway.batching import get_embedding_batcher, split_usage
+from llm_gateway.circuit_breaker import circuit_breaker
 from llm_gateway.constants import get_settings
 from llm_gateway.db.models import OpenAIRequests
 from llm_gateway.db.utils import write_record_to_db
-from llm_gateway.exceptions import OPENAI_EXCEPTIONS
-from llm_gateway.pii_scrubber import scrub_all
-from llm_gateway.utils import StreamProcessor, max_retries
+from llm_gateway.embedding_cache import aembed_cached, get_embedding_cache
+from llm_gateway.exceptions import OPENAI_EXCEPTIONS, is_retryable_openai_error
+from llm_gateway.hedging import hedged
+from llm_gateway.pii_scrubber import ascrub_many
+from llm_gateway.rate_limiter import (
+    estimate_tokens,
+    get_caller,
+    rate_limited,
+    usage_tokens,
+)
+from llm_gateway.response_cache import CachedResponse, areplay_stream
+from llm_gateway.singleflight import Flight
+from llm_gateway.templates import logged_user_input
+from llm_gateway.utils import StreamEnd, StreamProcessor, astream_items, max_retries
 
 settings = get_settings()
 
@@ -38,6 +57,71 @@ SUPPORTED_OPENAI_ENDPOINTS = {
     "Embedding": ("create"),
 }
 
+# Routes of the modules whose temperature 0 responses are cached
+OPENAI_RESPONSE_CACHE_ROUTES = {
+    "Completion": "openai/completion",
+    "ChatCompletion": "openai/chat_completion",
+}
+
+# Most texts OpenAI embeds in one request
+OPENAI_EMBEDDING_MAX_BATCH_SIZE = 2048
+
+
+# The openai module doesn't give access to the HTTP response of a stream, which is
+# needed to close it early. Responses are collected by the session instead, for
+# the task that is waiting on them.
+_responses: ContextVar[Optional[List[aiohttp.ClientResponse]]] = ContextVar(
+    "_responses", default=None
+)
+
+
+async def _on_request_end(
+    session: aiohttp.ClientSession,
+    trace_config_ctx: SimpleNamespace,
+    params: aiohttp.TraceRequestEndParams,
+) -> None:
+    responses = _responses.get()
+    if responses is not None:
+        responses.append(params.response)
+
+
+@contextmanager
+def _collect_responses() -> Iterator[List[aiohttp.ClientResponse]]:
+    """
+    Collect the HTTP responses of the OpenAI calls made inside the block, the last
+    one is the response that was returned
+    """
+    responses = []
+    token = _responses.set(responses)
+    try:
+        yield responses
+    finally:
+        _responses.reset(token)
+
+
+def _estimated_tokens(arguments: dict) -> int:
+    """
+    Tokens an OpenAI call is expected to use, given its arguments (see
+    `llm_gateway.rate_limiter.rate_limited`)
+    """
+    texts = [arguments.get(name) for name in ("prompt", "input", "instruction")]
+    texts += [message.get("content") for message in arguments.get("messages") or []]
+    texts += arguments.get("texts") or []
+    max_tokens = arguments.get("max_tokens") or arguments.get("kwargs", {}).get(
+        "max_tokens"
+    )
+    return estimate_tokens(texts, max_tokens)
+
+
+def _tokens_used(result) -> Optional[int]:
+    """
+    Tokens an OpenAI call used, given its response
+    """
+    # streams only say once they end
+    if isinstance(result, dict):
+        return usage_tokens(result.get("usage"))
+    return None
+
 
 class OpenAIWrapper:
     """
@@ -49,6 +133,34 @@ class OpenAIWrapper:
     def __init__(self) -> None:
         if not openai.api_key:
             openai.api_key = settings.OPENAI_API_KEY
+        self._aiohttp_session: Optional[aiohttp.ClientSession] = None
+
+    def _use_aiohttp_session(self) -> None:
+        """
+        Make the async calls of the current task share one connection pool, without
+        it the openai module opens a new session for every call
+        """
+        if self._aiohttp_session is None or self._aiohttp_session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_end.append(_on_request_end)
+            self._aiohttp_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=settings.PROVIDER_MAX_CONNECTIONS),
+                trace_configs=[trace_config],
+            )
+        openai.aiosession.set(self._aiohttp_session)
+
+    def close(self) -> None:
+        """
+        Nothing to close, the openai module keeps a session per thread itself
+        """
+
+    async def aclose(self) -> None:
+        """
+        Close the connection pool of the async calls
+        """
+        if self._aiohttp_session is not None:
+            await self._aiohttp_session.close()
+            self._aiohttp_session = None
 
     def _validate_openai_endpoint(self, module: str, endpoint: str) -> None:
         """
@@ -70,7 +182,7 @@ class OpenAIWrapper:
                 f"`{endpoint}` not supported action for `{module}`"
             )
 
-    def _call_model_endpoint(self, endpoint: str, model: Optional[str] = None):
+    async def _acall_model_endpoint(self, endpoint: str, model: Optional[str] = None):
         """
         List or retrieve model(s) from OpenAI
 
@@ -83,14 +195,23 @@ class OpenAIWrapper:
         :rtype: _type_
         """
         if endpoint == "list":
-            return openai.Model.list()
+            return await openai.Model.alist()
         elif endpoint == "retrieve":
             if not model:
                 raise Exception("retrieve model needs model name as input")
-            return openai.Model.retrieve(model)
+            return await openai.Model.aretrieve(model)
 
-    @max_retries(3, exceptions=OPENAI_EXCEPTIONS)
-    def _call_completion_endpoint(
+    @max_retries(
+        3,
+        exceptions=OPENAI_EXCEPTIONS,
+        provider="openai",
+        is_retryable=is_retryable_openai_error,
+    )
+    @rate_limited("openai", _estimated_tokens, _tokens_used)
+    @circuit_breaker(
+        "openai", exceptions=OPENAI_EXCEPTIONS, is_failure=is_retryable_openai_error
+    )
+    async def _acall_completion_endpoint(
         self,
         model: str,
         prompt: str,
@@ -116,7 +237,7 @@ class OpenAIWrapper:
         :return: Response from OpenAI
         :rtype: _type_
         """
-        return openai.Completion.create(
+        return await openai.Completion.acreate(
             model=model,
             prompt=prompt,
             max_tokens=max_tokens,
@@ -125,8 +246,17 @@ class OpenAIWrapper:
             **kwargs,
         )
 
-    @max_retries(3, exceptions=OPENAI_EXCEPTIONS)
-    def _call_chat_completion_endpoint(
+    @max_retries(
+        3,
+        exceptions=OPENAI_EXCEPTIONS,
+        provider="openai",
+        is_retryable=is_retryable_openai_error,
+    )
+    @rate_limited("openai", _estimated_tokens, _tokens_used)
+    @circuit_breaker(
+        "openai", exceptions=OPENAI_EXCEPTIONS, is_failure=is_retryable_openai_error
+    )
+    async def _acall_chat_completion_endpoint(
         self,
         model: str,
         messages: list,
@@ -150,7 +280,7 @@ class OpenAIWrapper:
         :return: Response from OpenAI
         :rtype: _type_
         """
-        return openai.ChatCompletion.create(
+        return await openai.ChatCompletion.acreate(
             model=model,
             messages=messages,
             temperature=temperature,
@@ -158,8 +288,17 @@ class OpenAIWrapper:
             **kwargs,
         )
 
-    @max_retries(3, exceptions=OPENAI_EXCEPTIONS)
-    def _call_edits_endpoint(self, model: str, input: str, instruction: str):
+    @max_retries(
+        3,
+        exceptions=OPENAI_EXCEPTIONS,
+        provider="openai",
+        is_retryable=is_retryable_openai_error,
+    )
+    @rate_limited("openai", _estimated_tokens, _tokens_used)
+    @circuit_breaker(
+        "openai", exceptions=OPENAI_EXCEPTIONS, is_failure=is_retryable_openai_error
+    )
+    async def _acall_edits_endpoint(self, model: str, input: str, instruction: str):
         """
         Call the edits endpoint from the OpenAI client and return response
 
@@ -174,10 +313,21 @@ class OpenAIWrapper:
         :return: Response from OpenAI containing edited input
         :rtype: _type_
         """
-        return openai.Edit.create(model=model, input=input, instruction=instruction)
+        return await openai.Edit.acreate(
+            model=model, input=input, instruction=instruction
+        )
 
-    @max_retries(3, exceptions=OPENAI_EXCEPTIONS)
-    def _call_embedding_endpoint(self, model: str, texts: List[str]):
+    @max_retries(
+        3,
+        exceptions=OPENAI_EXCEPTIONS,
+        provider="openai",
+        is_retryable=is_retryable_openai_error,
+    )
+    @rate_limited("openai", _estimated_tokens, _tokens_used)
+    @circuit_breaker(
+        "openai", exceptions=OPENAI_EXCEPTIONS, is_failure=is_retryable_openai_error
+    )
+    async def _acall_embedding_endpoint(self, model: str, texts: List[str]):
         """
         Call the embedding endpoint from the OpenAI client and return response
 
@@ -188,24 +338,163 @@ class OpenAIWrapper:
         :return: Response from OpenAI containing embeddedings
         :rtype: _type_
         """
-        return openai.Embedding.create(input=texts, model=model)
+        return await openai.Embedding.acreate(input=texts, model=model)
+
+    async def _aopen_stream(self, call, generator):
+        """
+        Start a streamed completion (see `llm_gateway.singleflight.Flight.stream`)
+
+        :param call: Calls OpenAI with `stream=True`
+        :type call: Callable[[], Awaitable[AsyncIterator]]
+        :param generator: Turns the chunks from OpenAI into text and a `StreamEnd`
+        :type generator: Callable[[AsyncIterator], AsyncIterator]
+        :return: The stream of text, and a function to close it early
+        :rtype: Tuple[AsyncIterator, Optional[Callable[[], None]]]
+        """
+        result = await call()
+        responses = _responses.get()
+        # closing the HTTP response closes its connection too
+        return generator(result), responses[-1].close if responses else None
+
+    async def _aembed_batch(self, model: str, texts: List[str]):
+        """
+        Embed a batch of requests' texts (see `llm_gateway.batching`), hedging the
+        call if `HEDGE_REQUESTS` is set
+
+        :param model: Model to hit
+        :type model: str
+        :param texts: Texts of every request in the batch
+        :type texts: List[str]
+        :return: Response from OpenAI containing the embeddings of the batch
+        :rtype: _type_
+        """
+        call = partial(self._acall_embedding_endpoint, model, texts)
+        if settings.HEDGE_REQUESTS:
+            result, _ = await hedged(call, "openai", model)
+            return result
+        return await call()
 
-    def send_openai_request(
+    async def _aembed(
+        self, model: str, texts: List[str], hedge: bool, gateway_metadata: dict
+    ):
+        """
+        Embed texts with OpenAI, in a batch with concurrent requests if
+        `EMBEDDING_BATCHING` is set
+
+        :param model: Model to hit
+        :type model: str
+        :param texts: List of strings to embed
+        :type texts: List[str]
+        :param hedge: Hedge the call, if it isn't batched
+        :type hedge: bool
+        :param gateway_metadata: Metadata of the request for the DB log
+        :type gateway_metadata: dict
+        :return: Response from OpenAI containing embeddings
+        :rtype: _type_
+        """
+        if settings.EMBEDDING_BATCHING:
+            # the batch is hedged as a whole, see `_aembed_batch`
+            batcher = get_embedding_batcher(
+                "openai",
+                model,
+                self._aembed_batch,
+                split_openai_embeddings,
+                OPENAI_EMBEDDING_MAX_BATCH_SIZE,
+            )
+            result, gateway_metadata["batch"] = await batcher.submit(texts)
+            return result
+        call = partial(self._acall_embedding_endpoint, model, texts)
+        if hedge:
+            result, gateway_metadata["hedge"] = await hedged(call, "openai", model)
+            return result
+        return await call()
+
+    async def _aembed_cached(
+        self, model: str, texts: List[str], hedge: bool, gateway_metadata: dict
+    ):
+        """
+        Embed texts, only sending the ones missing from the embedding cache to
+        OpenAI (see `_aembed`)
+
+        :return: Response from OpenAI, or one like it, containing embeddings
+        :rtype: _type_
+        """
+        cache = get_embedding_cache()
+        if cache is None:
+            return await self._aembed(model, texts, hedge, gateway_metadata)
+
+        async def embed(misses: List[str]):
+            response = await self._aembed(model, misses, hedge, gateway_metadata)
+            data = sorted(response["data"], key=lambda item: item["index"])
+            return response, [item["embedding"] for item in data]
+
+        embeddings, response, cache_stats = await aembed_cached(
+            cache, "openai", model, texts, embed
+        )
+        gateway_metadata["embedding_cache"] = cache_stats
+        if not cache_stats["hits"] and len(response["data"]) == len(texts):
+            # nothing to merge
+            return response
+        response = response.to_dict_recursive() if response is not None else {}
+        # only texts that were sent used tokens
+        usage = response.get("usage", {"prompt_tokens": 0, "total_tokens": 0})
+        return openai.util.convert_to_openai_object(
+            {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": index, "embedding": embedding}
+                    for index, embedding in enumerate(embeddings)
+                ],
+                "model": response.get("model", model),
+                "usage": usage,
+            }
+        )
+
+    def _get_user_input(
+        self,
+        openai_module: str,
+        endpoint: str,
+        prompt: Optional[str],
+        messages: Optional[list],
+        instruction: Optional[str],
+        embedding_texts: Optional[list],
+    ) -> str:
+        """
+        What to log as the user input of a request, once it has been scrubbed
+
+        :return: User input for the DB record
+        :rtype: str
+        """
+        if openai_module == "Model":
+            return f"/Model/{endpoint}"
+        elif openai_module == "Completion":
+            return logged_user_input(prompt, prompt)
+        elif openai_module == "ChatCompletion":
+            return str(messages)
+        elif openai_module == "Edits":
+            return f"instruction: {instruction} ON prompt: {prompt}"
+        elif openai_module == "Embedding":
+            return str(embedding_texts)
+
+    async def asend_openai_request(
         self,
         openai_module: str,
         endpoint: str,
-        stream: bool = False,
         model: Optional[str] = None,
         max_tokens: Optional[int] = None,
         prompt: Optional[str] = None,
         temperature: Optional[float] = 0,
-        messages: Optional[list] = None,  # TODO: add pydantic type for messages
+        messages: Optional[list] = None,
         instruction: Optional[str] = None,
         embedding_texts: Optional[list] = None,
+        stream: bool = False,
+        sse: bool = False,
+        hedge: Optional[bool] = None,
         **kwargs,
-    ) -> Tuple[Union[dict, Iterator[str]], dict]:
+    ) -> Tuple[Union[dict, AsyncIterator[str]], dict]:
         """
-        Send a request to the OpenAI API and return response and logs for db write
+        Send a request to the OpenAI API and return response and logs for db write,
+        without holding a thread while waiting on OpenAI
 
         :param openai_module: Valid OpenAI module to hit (i.e. "Completion")
         :type openai_module: str
@@ -225,96 +514,233 @@ class OpenAIWrapper:
         :type instruction: Optional[str]
         :param embedding_texts: List of prompts, if calling embedding, defaults to None
         :type embedding_texts: Optional[list]
+        :param stream: Stream the response as an async iterator of text, defaults to False
+        :type stream: bool
+        :param sse: Stream server-sent events (see `StreamProcessor.aprocess_stream_sse`)
+            instead of plain text, defaults to False
+        :type sse: bool
+        :param hedge: Hedge the request (see `llm_gateway.hedging.hedged`) if it is
+            safe to repeat, an embedding or a temperature 0 completion, defaults to
+            None (`HEDGE_REQUESTS`). Batched embeddings are hedged per batch, with
+            `HEDGE_REQUESTS`.
+        :type hedge: Optional[bool]
         :param kwargs: other parameters to pass to openai api. (ie- functions, function_call, etc.)
         :type kwargs: Optional[dict]
-        :return: Flattened response from OpenAI
-        :rtype: _type_
+        :return: Flattened (or streamed) response from OpenAI and logs for db write
+        :rtype: Tuple[Union[dict, AsyncIterator[str]], dict]
         """
         self._validate_openai_endpoint(openai_module, endpoint)
 
+        pii_redactions = Counter()
         if messages:
-            messages = [scrub_all(message) for message in messages]
+            messages = await ascrub_many(messages, pii_redactions)
         if prompt:
-            prompt = scrub_all(prompt)
+            [prompt] = await ascrub_many([prompt], pii_redactions)
         if embedding_texts:
-            embedding_texts = [scrub_all(text) for text in embedding_texts]
+            embedding_texts = await ascrub_many(embedding_texts, pii_redactions)
         if instruction:
-            instruction = scrub_all(instruction)
+            [instruction] = await ascrub_many([instruction], pii_redactions)
 
         if openai_module == "Model":
-            result = self._call_model_endpoint(endpoint, model)
-            user_input = f"/Model/{endpoint}"
+            call = partial(self._acall_model_endpoint, endpoint, model)
         elif openai_module == "Completion":
-            result = self._call_completion_endpoint(
-                model, prompt, max_tokens, temperature, stream, **kwargs
+            call = partial(
+                self._acall_completion_endpoint,
+                model,
+                prompt,
+                max_tokens,
+                temperature,
+                stream,
+                **kwargs,
             )
-            user_input = prompt
         elif openai_module == "ChatCompletion":
-            result = self._call_chat_completion_endpoint(
-                model, messages, temperature, stream, **kwargs
+            call = partial(
+                self._acall_chat_completion_endpoint,
+                model,
+                messages,
+                temperature,
+                stream,
+                **kwargs,
             )
-            user_input = str(messages)
         elif openai_module == "Edits":
-            result = self._call_edits_endpoint(model, prompt, instruction)
-            user_input = f"instruction: {instruction} ON prompt: {prompt}"
+            call = partial(self._acall_edits_endpoint, model, prompt, instruction)
         elif openai_module == "Embedding":
-            result = self._call_embedding_endpoint(model, embedding_texts)
-            user_input = str(embedding_texts)
+            call = partial(self._acall_embedding_endpoint, model, embedding_texts)
+
+        gateway_metadata = {"pii_redactions": dict(pii_redactions)}
+        route = OPENAI_RESPONSE_CACHE_ROUTES.get(openai_module)
+        request = dict(
+            model=model,
+            prompt=prompt,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=stream,
+            kwargs=kwargs,
+        )
+        response_cache = CachedResponse("openai", route, temperature, **request)
+        flight = Flight("openai", route, temperature, **request)
+        result = response_cache.get()
+        if response_cache.status is not None:
+            gateway_metadata["cache"] = response_cache.status
+        cache_hit = result is not None
+        if hedge is None:
+            hedge = settings.HEDGE_REQUESTS
+        idempotent = openai_module == "Embedding" or (
+            openai_module in ("Completion", "ChatCompletion") and temperature == 0
+        )
+        close_upstream = None
+        if not cache_hit:
+            self._use_aiohttp_session()
+            with _collect_responses():
+                if openai_module == "Embedding" and embedding_texts:
+                    result = await self._aembed_cached(
+                        model, embedding_texts, hedge, gateway_metadata
+                    )
+                elif stream:
+                    if openai_module == "ChatCompletion":
+                        generator = astream_generator_openai_chat
+                    else:
+                        generator = astream_generator_openai_completion
+                    result, close_upstream = await flight.stream(
+                        partial(self._aopen_stream, call, generator)
+                    )
+                elif hedge and idempotent:
+                    result, gateway_metadata["hedge"] = await flight.call(
+                        partial(hedged, call, "openai", model)
+                    )
+                else:
+                    result = await flight.call(call)
+            if flight.role == "follower":
+                gateway_metadata["singleflight"] = flight.role
 
         if not stream:
-            openai_response = result.to_dict()
+            openai_response = result if cache_hit else result.to_dict()
             cached_response = openai_response
-        elif openai_module == "ChatCompletion":
-            stream_processor = StreamProcessor(
-                stream_processor=stream_generator_openai_chat
-            )
-            openai_response = stream_processor.process_stream(result)
-            cached_response = stream_processor.get_cached_streamed_response()
-        elif openai_module == "Completion":
+            if not cache_hit:
+                response_cache.set(openai_response)
+        else:
             stream_processor = StreamProcessor(
-                stream_processor=stream_generator_openai_completion
+                stream_processor=areplay_stream if cache_hit else astream_items,
+                scrub_output=settings.PII_SCRUB_STREAMED_OUTPUT,
+                provider="openai",
+                max_tokens=max_tokens or kwargs.get("max_tokens"),
+                close_upstream=close_upstream,
+                on_complete=None if cache_hit else response_cache.set_stream,
             )
-            openai_response = stream_processor.process_stream(result)
+            if sse:
+                openai_response = stream_processor.aprocess_stream_sse(result)
+            else:
+                openai_response = stream_processor.aprocess_stream(result)
+            openai_response = stream_processor.cancellable(openai_response)
+            # all filled in as the stream is returned
             cached_response = stream_processor.get_cached_streamed_response()
-        # The cached streaming response is an empty list at this point.
-        # Once the stream is returned to the user it will be populated
-        # Since the DB write happens after the stream, this will always be populated
-        db_record = {
+            gateway_metadata["stream"] = stream_processor.metadata
+            if stream_processor.scrubber is not None:
+                gateway_metadata["output_pii_redactions"] = (
+                    stream_processor.scrubber.redaction_counts
+                )
+        user_input = self._get_user_input(
+            openai_module, endpoint, prompt, messages, instruction, embedding_texts
+        )
+        db_record = self._make_db_record(
+            openai_module,
+            user_input,
+            cached_response,
+            model,
+            temperature,
+            gateway_metadata,
+            kwargs,
+        )
+        return openai_response, db_record
+
+    def _make_db_record(
+        self,
+        openai_module: str,
+        user_input: str,
+        openai_response: Union[dict, List[str]],
+        model: Optional[str],
+        temperature: Optional[float],
+        gateway_metadata: dict,
+        kwargs: dict,
+    ) -> dict:
+        return {
             "user_input": user_input,
-            "user_email": None,
-            "openai_response": cached_response,
+            "user_email": get_caller(),
+            "openai_response": openai_response,
             "openai_model": model,
             "temperature": temperature,
             "extras": json.dumps(kwargs),
             "openai_endpoint": openai_module,
             "created_at": datetime.datetime.now(),
+            "gateway_metadata": gateway_metadata,
         }
 
-        return openai_response, db_record
-
     def write_logs_to_db(self, db_logs: dict):
         if isinstance(db_logs["openai_response"], list):
             db_logs["openai_response"] = "".join(db_logs["openai_response"])
         write_record_to_db(OpenAIRequests(**db_logs))
 
 
-def stream_generator_openai_chat(generator: Iterator) -> Iterator[str]:
-    for chunk in generator:
-        answer = ""
-        try:
-            current_response = chunk["choices"][0]["delta"]["content"]
-            answer += current_response
-        except KeyError:
-            pass
-        yield answer
-
-
-def stream_generator_openai_completion(generator: Iterator) -> Iterator[str]:
-    for chunk in generator:
-        answer = ""
-        try:
-            current_response = chunk["choices"][0]["text"]
-            answer += current_response
-        except KeyError:
-            pass
-        yield answer
+def split_openai_embeddings(response, texts: List[List[str]]) -> list:
+    """
+    Split the response to a batch of embedding requests into a response per
+    request, as if each had been sent on its own. Tokens are shared out by the
+    length of each request's texts.
+
+    :param response: Response from OpenAI to the batch
+    :type response: openai.openai_object.OpenAIObject
+    :param texts: Texts of each request in the batch
+    :type texts: List[List[str]]
+    :return: Response to each request
+    :rtype: list
+    """
+    response = response.to_dict_recursive()
+    embeddings = sorted(response["data"], key=lambda item: item["index"])
+    tokens = split_usage(
+        response["usage"]["prompt_tokens"],
+        [sum(len(text) for text in request_texts) for request_texts in texts],
+    )
+    parts = []
+    start = 0
+    for request_texts, request_tokens in zip(texts, tokens):
+        end = start + len(request_texts)
+        data = [
+            {**item, "index": index} for index, item in enumerate(embeddings[start:end])
+        ]
+        start = end
+        parts.append(
+            openai.util.convert_to_openai_object(
+                {
+                    **response,
+                    "data": data,
+                    "usage": {
+                        "prompt_tokens": request_tokens,
+                        "total_tokens": request_tokens,
+                    },
+                }
+            )
+        )
+    return parts
+
+
+async def astream_generator_openai_chat(
+    generator: AsyncIterator,
+) -> AsyncIterator[Union[str, StreamEnd]]:
+    finish_reason = None
+    async for chunk in generator:
+        choice = chunk["choices"][0]
+        finish_reason = choice.get("finish_reason") or finish_reason
+        # function calls stream with no content
+        yield choice["delta"].get("content") or ""
+    yield StreamEnd(finish_reason=finish_reason)
+
+
+async def astream_generator_openai_completion(
+    generator: AsyncIterator,
+) -> AsyncIterator[Union[str, StreamEnd]]:
+    finish_reason = None
+    async for chunk in generator:
+        choice = chunk["choices"][0]
+        finish_reason = choice.get("finish_reason") or finish_reason
+        yield choice.get("text") or ""
+    yield StreamEnd(finish_reason=finish_reason)
@@ -0,0 +1,463 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Rate limits kept inside the gateway, so provider calls stay just under each
+provider's requests and tokens per minute instead of going over, getting rate
+limited and backing off.
+
+Each call reserves a request and an estimate of its tokens in token buckets: the
+model's and its provider's (as configured), and the caller's. A call that doesn't
+fit waits its turn, or gets a 429 straight away if its turn is too far off or
+too many calls are already waiting. Once the provider answers, the estimate is
+corrected from the usage it reports.
+"""
+
+import asyncio
+import inspect
+import math
+import time
+import weakref
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+from llm_gateway.retries import get_deadline
+
+# a token is about 4 characters of English
+CHARS_PER_TOKEN = 4
+
+_caller: ContextVar[Optional[str]] = ContextVar("_caller", default=None)
+
+
+def get_caller() -> Optional[str]:
+    """
+    Email of the user the current request is made for, from its `X-User-Email`
+    header
+
+    :return: The email, or None if the request didn't say
+    :rtype: Optional[str]
+    """
+    return _caller.get()
+
+
+class CallerMiddleware:
+    """
+    Keep the `X-User-Email` header of each request, for `get_caller`. The gateway
+    doesn't check it, so it has to be set by a trusted proxy in front of the
+    gateway that authenticates the user, and stripped from requests that come
+    from anywhere else.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        caller = None
+        for name, value in scope["headers"]:
+            if name == b"x-user-email":
+                caller = value.decode("latin-1").strip().lower() or None
+        token = _caller.set(caller)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _caller.reset(token)
+
+
+class RateLimitedError(HTTPException):
+    """
+    Raised instead of calling a provider when the call would go over a rate limit
+    """
+
+    def __init__(self, limit: str, retry_after: float) -> None:
+        retry_after = max(math.ceil(retry_after), 1)
+        super().__init__(
+            status_code=429,
+            detail=f"Rate limit of {limit} reached, try again in {retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class TokenBucket:
+    """
+    Allows `per_minute` a minute, in bursts of up to `burst` seconds' worth. Takes
+    can overdraw it, and later ones wait until it is paid back.
+    """
+
+    def __init__(self, per_minute: float, burst: float = 60) -> None:
+        self.rate = per_minute / 60
+        self.capacity = self.rate * burst
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(now - self.updated, 0)
+        self.level = min(self.capacity, self.level + elapsed * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` can be taken
+        """
+        self._refill(now)
+        # more than the bucket holds goes once it is full
+        amount = min(amount, self.capacity)
+        return max(amount - self.level, 0) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level -= amount
+
+    def give(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Requests and tokens a minute, and calls at once, allowed to a provider, a model
+    or a caller. Unset limits don't apply.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrent: Optional[int] = None,
+        max_queue: int = 100,
+        headroom: float = 0,
+        burst: float = 60,
+    ) -> None:
+        self.name = name
+        self.requests = self.tokens = self.slots = None
+        if requests_per_minute:
+            self.requests = TokenBucket(requests_per_minute * (1 - headroom), burst)
+        if tokens_per_minute:
+            self.tokens = TokenBucket(tokens_per_minute * (1 - headroom), burst)
+        if max_concurrent:
+            self.slots = asyncio.Semaphore(max_concurrent)
+        self.max_queue = max_queue
+        # calls waiting for their turn
+        self.waiting = 0
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        """
+        Seconds until a call of `tokens` fits in the limits a minute
+        """
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.wait_time(1, now)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def take(self, tokens: int, now: float) -> None:
+        if self.requests is not None:
+            self.requests.take(1, now)
+        if self.tokens is not None:
+            self.tokens.take(tokens, now)
+
+    def give(self, requests: int, tokens: int) -> None:
+        if self.requests is not None and requests:
+            self.requests.give(requests)
+        if self.tokens is not None:
+            self.tokens.give(tokens)
+
+
+class Reservation:
+    """
+    A call's share of its limits, from `areserve`
+    """
+
+    def __init__(self, limiters: List[RateLimiter], tokens: int) -> None:
+        self.limiters = limiters
+        self.tokens = tokens
+        self.acquired: List[RateLimiter] = []
+
+    def settle(self, tokens: Optional[int]) -> None:
+        """
+        Correct the tokens taken by the call, once the provider says how many it
+        used
+
+        :param tokens: Tokens used, None if the provider didn't say
+        :type tokens: Optional[int]
+        """
+        if tokens is None:
+            return
+        for limiter in self.limiters:
+            # a negative difference takes the rest
+            limiter.give(0, self.tokens - tokens)
+        self.tokens = tokens
+
+    def release(self) -> None:
+        """
+        Give back the call's slots, once it is done
+        """
+        for limiter in self.acquired:
+            limiter.slots.release()
+        self.acquired = []
+
+
+# limiters belong to the event loop that waits on them
+_limiters: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _get_limiter(
+    name: str,
+    key: str,
+    requests_per_minute: Dict[str, float],
+    tokens_per_minute: Dict[str, float],
+    max_concurrent: Dict[str, int],
+) -> Optional[RateLimiter]:
+    """
+    The limiter called `name` on the running event loop, created on first use with
+    the limits under `key`, or None if there are none. Only configured limits get
+    a limiter, so names that come from requests can't grow the registry.
+    """
+    rpm = requests_per_minute.get(key)
+    tpm = tokens_per_minute.get(key)
+    concurrent = max_concurrent.get(key)
+    if not (rpm or tpm or concurrent):
+        return None
+    limiters: Dict[str, RateLimiter] = _limiters.setdefault(
+        asyncio.get_running_loop(), {}
+    )
+    limiter = limiters.get(name)
+    if limiter is None:
+        settings = get_settings()
+        limiter = limiters[name] = RateLimiter(
+            name,
+            requests_per_minute=rpm,
+            tokens_per_minute=tpm,
+            max_concurrent=concurrent,
+            max_queue=settings.RATE_LIMIT_MAX_QUEUE,
+            headroom=settings.RATE_LIMIT_HEADROOM,
+            burst=settings.RATE_LIMIT_BURST,
+        )
+    return limiter
+
+
+def get_rate_limiters(
+    provider: str, model: Optional[str], caller: Optional[str]
+) -> List[RateLimiter]:
+    """
+    Limiters of a call: its model's, its provider's and its caller's, of the ones
+    that have limits
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param model: Name of the model, None for the provider's default model
+    :type model: Optional[str]
+    :param caller: Email of the user the call is made for, if known
+    :type caller: Optional[str]
+    :return: The limiters
+    :rtype: List[RateLimiter]
+    """
+    settings = get_settings()
+    model_limits = (
+        settings.RATE_LIMIT_RPM,
+        settings.RATE_LIMIT_TPM,
+        settings.RATE_LIMIT_MAX_CONCURRENT,
+    )
+    model_key = f"{provider}/{model or 'default'}"
+    limiters = [
+        _get_limiter(model_key, model_key, *model_limits),
+        # shared by the provider's models
+        _get_limiter(provider, provider, *model_limits),
+    ]
+    if caller is not None:
+        caller_limits = (
+            settings.CALLER_RATE_LIMIT_RPM,
+            settings.CALLER_RATE_LIMIT_TPM,
+            settings.CALLER_RATE_LIMIT_MAX_CONCURRENT,
+        )
+        if any(caller in limits for limits in caller_limits):
+            limiters.append(_get_limiter(f"caller {caller}", caller, *caller_limits))
+        else:
+            # one quota for every caller without their own, so a caller can't get
+            # a fresh one by changing its header
+            limiters.append(_get_limiter("other callers", "*", *caller_limits))
+    return [limiter for limiter in limiters if limiter is not None]
+
+
+def _reject(limiter: RateLimiter, reason: str, retry_after: float, **labels):
+    metrics.increment("rate_limiter.rejected", reason=reason, **labels)
+    return RateLimitedError(limiter.name, retry_after)
+
+
+async def areserve(
+    provider: str, model: Optional[str], tokens: int
+) -> Optional[Reservation]:
+    """
+    Wait for a call's turn in its limits (see `get_rate_limiters`), and reserve a
+    request and its tokens in them
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param model: Name of the model
+    :type model: Optional[str]
+    :param tokens: Tokens the call is expected to use
+    :type tokens: int
+    :raises RateLimitedError: The call would wait longer than
+        `RATE_LIMIT_MAX_WAIT` or the request's deadline, or too many calls are
+        waiting already
+    :return: The call's reservation, None if it has no limits
+    :rtype: Optional[Reservation]
+    """
+    limiters = get_rate_limiters(provider, model, get_caller())
+    if not limiters:
+        return None
+    labels = {"provider": provider, "model": model or "default"}
+    now = time.monotonic()
+    max_wait = get_settings().RATE_LIMIT_MAX_WAIT
+    deadline = get_deadline()
+    if deadline is not None:
+        max_wait = min(max_wait, deadline - now)
+    waits = [limiter.wait_time(tokens, now) for limiter in limiters]
+    wait = max(waits)
+    for limiter, limiter_wait in zip(limiters, waits):
+        if limiter_wait > max_wait:
+            raise _reject(limiter, "wait", limiter_wait, **labels)
+        if limiter.waiting >= limiter.max_queue:
+            raise _reject(limiter, "queue", max(wait, 1), **labels)
+
+    reservation = Reservation(limiters, tokens)
+    for limiter in limiters:
+        limiter.take(tokens, now)
+        limiter.waiting += 1
+    try:
+        if wait > 0:
+            await asyncio.sleep(wait)
+        for limiter in limiters:
+            if limiter.slots is None:
+                continue
+            remaining = max_wait - (time.monotonic() - now)
+            try:
+                await asyncio.wait_for(limiter.slots.acquire(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                # no call finished in time
+                raise _reject(limiter, "concurrency", 1, **labels) from None
+            reservation.acquired.append(limiter)
+    except BaseException:
+        reservation.release()
+        # the call won't be made
+        for limiter in limiters:
+            limiter.give(1, tokens)
+        raise
+    finally:
+        for limiter in limiters:
+            limiter.waiting -= 1
+    metrics.observe("rate_limiter.wait_ms", (time.monotonic() - now) * 1e3, **labels)
+    return reservation
+
+
+def estimate_tokens(texts: Iterable[Any], max_tokens: Optional[int] = None) -> int:
+    """
+    Tokens a call is expected to use, before it is made: about one per
+    `CHARS_PER_TOKEN` characters of input, and all of `max_tokens`
+
+    :param texts: Input of the call, Nones are skipped
+    :type texts: Iterable[Any]
+    :param max_tokens: Most tokens the model may generate, defaults to None
+    :type max_tokens: Optional[int]
+    :return: Estimated tokens
+    :rtype: int
+    """
+    characters = sum(len(str(text)) for text in texts if text is not None)
+    return math.ceil(characters / CHARS_PER_TOKEN) + (max_tokens or 0)
+
+
+def usage_tokens(usage: Optional[dict]) -> Optional[int]:
+    """
+    Tokens used by a call, from the usage reported by the provider
+
+    :param usage: OpenAI (`total_tokens`, or `prompt_tokens` and
+        `completion_tokens`) or Cohere and AWS Bedrock (`input_tokens` and
+        `output_tokens`) usage
+    :type usage: Optional[dict]
+    :return: Tokens used, None if the usage doesn't say
+    :rtype: Optional[int]
+    """
+    if not usage:
+        return None
+    if usage.get("total_tokens") is not None:
+        return int(usage["total_tokens"])
+    counts = [
+        usage.get(name)
+        for name in (
+            "prompt_tokens",
+            "completion_tokens",
+            "input_tokens",
+            "output_tokens",
+        )
+    ]
+    counts = [count for count in counts if count is not None]
+    return int(sum(counts)) if counts else None
+
+
+def rate_limited(
+    provider: str,
+    estimate: Callable[[dict], int],
+    tokens_used: Optional[Callable[[Any], Optional[int]]] = None,
+):
+    """
+    Rate Limiter Decorator
+    Waits for the turn of the wrapped coroutine function in the limits of the model
+    in its `model` argument (see `areserve`), and corrects the tokens it took from
+    what it returned. Put it between `max_retries` and `circuit_breaker`, so every
+    attempt is limited and a rejected call isn't counted as a provider failure.
+    :param provider: Provider of the models
+    :type provider: str
+    :param estimate: Tokens a call is expected to use, given its arguments by name
+    :type estimate: Callable[[dict], int]
+    :param tokens_used: Tokens a call used, given what it returned, defaults to
+        None (the estimate stands, i.e. for streams)
+    :type tokens_used: Optional[Callable[[Any], Optional[int]]]
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        async def anewfn(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs).arguments
+            reservation = await areserve(
+                provider, arguments.get("model"), estimate(arguments)
+            )
+            if reservation is None:
+                return await func(*args, **kwargs)
+            try:
+                result = await func(*args, **kwargs)
+                if tokens_used is not None:
+                    reservation.settle(tokens_used(result))
+                return result
+            finally:
+                reservation.release()
+
+        return anewfn
+
+    return decorator
@@ -0,0 +1,262 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Cache of the responses to temperature 0 completions, which are (close enough to)
+deterministic. Responses are keyed by a hash of everything that was sent to the
+provider, after it was scrubbed of PII, and expire after a TTL set per route.
+
+Requests can skip the cache with a `Cache-Control` header: `no-cache` to get a
+fresh response (which is cached), `no-store` to neither read nor write the cache.
+"""
+
+import hashlib
+import json
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, AsyncIterator, FrozenSet, Optional, Union
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from llm_gateway.cache import LRUCache
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+from llm_gateway.utils import StreamEnd, StreamProcessor
+
+# Routes whose responses can be cached, as keys of `RESPONSE_CACHE_ROUTE_TTLS`.
+# Their /stream routes share the TTL.
+RESPONSE_CACHE_ROUTES = (
+    "openai/completion",
+    "openai/chat_completion",
+    "cohere/generate",
+    "awsbedrock/text",
+)
+
+_cache_control: ContextVar[FrozenSet[str]] = ContextVar(
+    "_cache_control", default=frozenset()
+)
+
+
+class CacheControlMiddleware:
+    """
+    Keep the directives of each request's `Cache-Control` header, for
+    `CachedResponse`
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        directives = frozenset(
+            directive.strip().lower()
+            for name, value in scope["headers"]
+            if name == b"cache-control"
+            for directive in value.decode("latin-1").split(",")
+        )
+        token = _cache_control.set(directives)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _cache_control.reset(token)
+
+
+class ResponseCache:
+    """
+    LRU cache of responses, bounded by their size as JSON, whose entries expire
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self._entries = LRUCache("responses", max_bytes=max_bytes)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a response that hasn't expired
+
+        :param key: Key of the request, see `response_cache_key`
+        :type key: str
+        :return: The response, or None
+        :rtype: Optional[Any]
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, expires_at = entry
+        if time.monotonic() >= expires_at:
+            metrics.increment("response_cache.expired")
+            return None
+        return response
+
+    def set(self, key: str, response: Any, ttl: float) -> None:
+        """
+        Cache a response for `ttl` seconds
+
+        :param key: Key of the request, see `response_cache_key`
+        :type key: str
+        :param response: Response, which has to be JSON serializable
+        :type response: Any
+        :param ttl: Seconds until it expires
+        :type ttl: float
+        """
+        self._entries.set(
+            key,
+            (response, time.monotonic() + ttl),
+            size=len(json.dumps(response, default=str)),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    The process's response cache, or None unless `RESPONSE_CACHE` turns it on
+    """
+    settings = get_settings()
+    if not settings.RESPONSE_CACHE:
+        return None
+    return ResponseCache(settings.RESPONSE_CACHE_MAX_BYTES)
+
+
+def response_cache_key(provider: str, route: str, **request) -> str:
+    """
+    Hash of a request, the same for requests that send the same thing to the same
+    model, whatever order their parameters are in
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param route: Route of the request, one of `RESPONSE_CACHE_ROUTES`
+    :type route: str
+    :param request: Model, scrubbed input and every generation parameter
+    :type request: dict
+    :return: Key of the request
+    :rtype: str
+    """
+    canonical = json.dumps(
+        [provider, route, request],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+class CachedResponse:
+    """
+    The cache entry of a request, if it is one that can be cached: a temperature 0
+    request to a route with a TTL, while `RESPONSE_CACHE` is on
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param route: Route of the request, one of `RESPONSE_CACHE_ROUTES`, or None
+        for one that isn't cached
+    :type route: Optional[str]
+    :param temperature: Temperature of the request
+    :type temperature: Optional[float]
+    :param request: Model, scrubbed input and every generation parameter, including
+        whether the response is streamed
+    :type request: dict
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        route: Optional[str],
+        temperature: Optional[float],
+        **request,
+    ) -> None:
+        settings = get_settings()
+        self.cache = get_response_cache()
+        self.provider = provider
+        self.ttl = settings.RESPONSE_CACHE_ROUTE_TTLS.get(
+            route, settings.RESPONSE_CACHE_TTL
+        )
+        self.key = None
+        # for the DB log: "hit", "miss" or "bypass", None if it can't be cached
+        self.status = None
+        if (
+            self.cache is not None
+            and route in RESPONSE_CACHE_ROUTES
+            and temperature == 0
+            and self.ttl > 0
+        ):
+            self.key = response_cache_key(
+                provider, route, temperature=temperature, **request
+            )
+
+    def get(self) -> Optional[Any]:
+        """
+        Look up the response, unless the request asked for a fresh one
+
+        :return: The cached response, or None
+        :rtype: Optional[Any]
+        """
+        if self.key is None:
+            return None
+        response = None
+        directives = _cache_control.get()
+        if "no-store" in directives:
+            self.key = None
+            self.status = "bypass"
+        elif "no-cache" in directives:
+            self.status = "bypass"
+        else:
+            response = self.cache.get(self.key)
+            self.status = "miss" if response is None else "hit"
+        metrics.increment(
+            "response_cache.requests", provider=self.provider, status=self.status
+        )
+        return response
+
+    def set(self, response: Any) -> None:
+        """
+        Cache the response to the request
+
+        :param response: Response, which has to be JSON serializable
+        :type response: Any
+        """
+        if self.key is not None:
+            self.cache.set(self.key, response, self.ttl)
+
+    def set_stream(self, processor: StreamProcessor) -> None:
+        """
+        Cache a stream that was returned in full, as its text and how it ended, for
+        `areplay_stream`
+
+        :param processor: Processor of the stream
+        :type processor: StreamProcessor
+        """
+        self.set(
+            {
+                "text": "".join(processor.get_cached_streamed_response()),
+                "finish_reason": processor.end.finish_reason,
+                "usage": processor.end.usage,
+            }
+        )
+
+
+async def areplay_stream(cached: dict) -> AsyncIterator[Union[str, StreamEnd]]:
+    """
+    `stream_processor` for a stream cached by `CachedResponse.set_stream`, which
+    streams the whole text at once
+    """
+    yield cached["text"]
+    yield StreamEnd(finish_reason=cached["finish_reason"], usage=cached["usage"])
@@ -0,0 +1,217 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+When and how long to wait before retrying a failed provider request (see
+`llm_gateway.utils.max_retries`).
+
+Retries back off exponentially with full jitter, so callers that failed together
+don't retry together, and wait at least as long as the provider's Retry-After hint.
+They stop at the request's deadline, and when more than a share of recent requests
+would be retries, so an overloaded provider isn't sent even more requests.
+"""
+
+import email.utils
+import math
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from llm_gateway.constants import get_settings
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Seconds to wait before a retry, with "full jitter": a random time up to an
+    exponentially growing ceiling
+
+    :param attempt: How many attempts already failed, from 1
+    :type attempt: int
+    :param base: Ceiling after the first failed attempt, in seconds
+    :type base: float
+    :param cap: Highest ceiling, in seconds
+    :type cap: float
+    :return: Seconds to wait
+    :rtype: float
+    """
+    ceiling = min(cap, base * 2 ** min(attempt - 1, 32))
+    return random.uniform(0, ceiling)
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """
+    Seconds the provider asked to wait before retrying, from the Retry-After (or
+    retry-after-ms) header of the response an error came from
+
+    :param e: Error raised by a provider's client
+    :type e: Exception
+    :return: Seconds to wait, or None if the provider didn't say
+    :rtype: Optional[float]
+    """
+    # OpenAI and Cohere errors keep the response's headers, botocore ones (lower
+    # cased) in their response metadata
+    headers = getattr(e, "headers", None)
+    if headers is None:
+        response = getattr(e, "response", None)
+        if isinstance(response, dict):
+            headers = response.get("ResponseMetadata", {}).get("HTTPHeaders")
+    if not headers:
+        return None
+    headers = {str(name).lower(): value for name, value in headers.items()}
+
+    if "retry-after-ms" in headers:
+        try:
+            return max(float(headers["retry-after-ms"]) / 1000, 0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0)
+
+
+class RetryBudget:
+    """
+    Cap on retries as a share of requests, over a sliding window
+
+    Retries are allowed while they are fewer than `ratio` of the requests started
+    in the last `window` seconds, plus `min_per_second` a second so a quiet
+    process can still retry.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, window: float = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._lock = threading.Lock()
+        # [second, requests, retries], oldest first
+        self._buckets: deque = deque()
+
+    def _bucket(self) -> list:
+        now = math.floor(time.monotonic())
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != now:
+            self._buckets.append([now, 0, 0])
+        return self._buckets[-1]
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._bucket()[1] += 1
+
+    def try_retry(self) -> bool:
+        """
+        Take a retry out of the budget, if there is one left
+
+        :return: Whether the retry is allowed
+        :rtype: bool
+        """
+        with self._lock:
+            bucket = self._bucket()
+            requests = sum(requests for _, requests, _ in self._buckets)
+            retries = sum(retries for _, _, retries in self._buckets)
+            allowed = self.ratio * requests + self.min_per_second * self.window
+            if retries >= allowed:
+                return False
+            bucket[2] += 1
+            return True
+
+
+@lru_cache()
+def get_retry_budget() -> RetryBudget:
+    settings = get_settings()
+    return RetryBudget(
+        ratio=settings.RETRY_BUDGET_RATIO,
+        min_per_second=settings.RETRY_BUDGET_MIN_PER_SECOND,
+        window=settings.RETRY_BUDGET_WINDOW,
+    )
+
+
+def get_deadline() -> Optional[float]:
+    """
+    When the current request has to be answered by, in `time.monotonic()` seconds
+
+    :return: The deadline, or None outside of a `request_deadline`
+    :rtype: Optional[float]
+    """
+    return _deadline.get()
+
+
+@contextmanager
+def request_deadline(timeout: float) -> Iterator[float]:
+    """
+    Give up on retrying provider requests `timeout` seconds from now, or at the
+    enclosing deadline if that is sooner
+
+    :param timeout: Seconds from now
+    :type timeout: float
+    :return: The deadline, in `time.monotonic()` seconds
+    :rtype: Iterator[float]
+    """
+    deadline = time.monotonic() + timeout
+    enclosing = _deadline.get()
+    if enclosing is not None:
+        deadline = min(deadline, enclosing)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+class RequestDeadlineMiddleware:
+    """
+    Set the deadline of each request from its `X-Request-Timeout` header (in
+    seconds), so retries stop when the caller would have stopped waiting
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = get_settings().RETRY_DEADLINE
+        for name, value in scope["headers"]:
+            if name == b"x-request-timeout":
+                try:
+                    requested = float(value)
+                except ValueError:
+                    continue
+                if math.isfinite(requested) and requested >= 0:
+                    timeout = requested
+        with request_deadline(timeout):
+            await self.app(scope, receive, send)
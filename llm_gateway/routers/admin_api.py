@@ -0,0 +1,46 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from fastapi import APIRouter
+
+from llm_gateway.circuit_breaker import get_circuit_breakers
+from llm_gateway.metrics import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def get_metrics() -> dict:
+    """
+    In-process gateway metrics (counters, gauges and summaries) for this worker
+
+    :return: Snapshot of every metric recorded so far
+    :rtype: dict
+    """
+    return metrics.snapshot()
+
+
+@router.get("/circuit_breakers")
+async def get_circuit_breaker_states() -> list:
+    """
+    State of the circuit breaker of every provider model called by this worker
+
+    :return: Provider, model, state ("closed", "half_open" or "open"), failures in
+        a row, and seconds until an open breaker lets probes through
+    :rtype: list
+    """
+    return [breaker.snapshot() for breaker in get_circuit_breakers()]
@@ -15,12 +15,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, BackgroundTasks, Depends, Request
+from fastapi.responses import StreamingResponse
 from starlette.responses import JSONResponse
 
+from llm_gateway.dependencies import get_awsbedrock_wrapper
 from llm_gateway.exceptions import AWSBedrockRouteExceptionHandler
 from llm_gateway.models import AWSBedrockEmbedInput, AWSBedrockTextInput
 from llm_gateway.providers.awsbedrock import AWSBedrockWrapper
+from llm_gateway.streaming import StreamSlot, wants_event_stream
+from llm_gateway.templates import aresolve_prompt
 from llm_gateway.utils import reraise_500
 
 router = APIRouter(route_class=AWSBedrockRouteExceptionHandler)
@@ -28,8 +32,10 @@ router = APIRouter(route_class=AWSBedrockRouteExceptionHandler)
 
 @router.post("/text")
 @reraise_500
-def get_completion_text(
-    user_input: AWSBedrockTextInput, background_tasks: BackgroundTasks
+async def get_completion_text(
+    user_input: AWSBedrockTextInput,
+    background_tasks: BackgroundTasks,
+    wrapper: AWSBedrockWrapper = Depends(get_awsbedrock_wrapper),
 ) -> JSONResponse:
     """
     Use the AWS Bedrock API to generate a response to a prompt
@@ -39,12 +45,11 @@ def get_completion_text(
     :return: Dictionary with LLM response and metadata
     :rtype: JSONResponse
     """
-    wrapper = AWSBedrockWrapper()
-    resp, logs = wrapper.send_awsbedrock_request(
+    resp, logs = await wrapper.asend_awsbedrock_request(
         awsbedrock_module="Text",
         model=user_input.model,
         max_tokens=user_input.max_tokens,
-        prompt=user_input.prompt,
+        prompt=await aresolve_prompt(user_input),
         temperature=user_input.temperature,
         **user_input.model_kwargs,
     )
@@ -53,10 +58,46 @@ def get_completion_text(
     return JSONResponse(resp)
 
 
+@router.post("/text/stream")
+@reraise_500
+async def get_completion_text_stream(
+    user_input: AWSBedrockTextInput,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    wrapper: AWSBedrockWrapper = Depends(get_awsbedrock_wrapper),
+) -> StreamingResponse:
+    """
+    Use the AWS Bedrock API to stream a response to a prompt
+
+    :param user_input: Inputs to the AWS Bedrock API, including prompt
+    :type user_input: AWSBedrockTextInput
+    :return: Text of the LLM response as it is generated
+    :rtype: StreamingResponse
+    """
+    sse = wants_event_stream(request)
+    with StreamSlot() as slot:
+        response, logs = await wrapper.asend_awsbedrock_request(
+            awsbedrock_module="Text",
+            model=user_input.model,
+            max_tokens=user_input.max_tokens,
+            prompt=await aresolve_prompt(user_input),
+            temperature=user_input.temperature,
+            stream=True,
+            sse=sse,
+            **user_input.model_kwargs,
+        )
+
+        background_tasks.add_task(wrapper.write_logs_to_db, db_logs=logs)
+
+        return slot.streaming_response(response, media_type="text/plain", sse=sse)
+
+
 @router.post("/embed")
 @reraise_500
-def get_completion_embedding(
-    user_input: AWSBedrockEmbedInput, background_tasks: BackgroundTasks
+async def get_completion_embedding(
+    user_input: AWSBedrockEmbedInput,
+    background_tasks: BackgroundTasks,
+    wrapper: AWSBedrockWrapper = Depends(get_awsbedrock_wrapper),
 ) -> JSONResponse:
     """
     Use the AWS Bedrock API to generate a embedding vectors from a prompt
@@ -66,8 +107,7 @@ def get_completion_embedding(
     :return: Dictionary with LLM response and metadata
     :rtype: JSONResponse
     """
-    wrapper = AWSBedrockWrapper()
-    resp, logs = wrapper.send_awsbedrock_request(
+    resp, logs = await wrapper.asend_awsbedrock_request(
         awsbedrock_module="Embed",
         model=user_input.model,
         max_tokens=user_input.max_tokens,
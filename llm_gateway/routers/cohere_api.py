@@ -15,13 +15,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, BackgroundTasks, Depends, Request
 from fastapi.responses import StreamingResponse
 from starlette.responses import JSONResponse
 
+from llm_gateway.dependencies import get_cohere_wrapper
 from llm_gateway.exceptions import CohereRouteExceptionHandler
 from llm_gateway.models import GenerateInput, SummarizeInput
 from llm_gateway.providers.cohere import CohereWrapper
+from llm_gateway.routing import asend_generate_request
+from llm_gateway.streaming import StreamSlot, wants_event_stream
+from llm_gateway.templates import aresolve_prompt
 from llm_gateway.utils import reraise_500
 
 router = APIRouter(route_class=CohereRouteExceptionHandler)
@@ -29,22 +33,25 @@ router = APIRouter(route_class=CohereRouteExceptionHandler)
 
 @router.post("/generate")
 @reraise_500
-def generate(
-    user_input: GenerateInput, background_tasks: BackgroundTasks
+async def generate(
+    user_input: GenerateInput,
+    background_tasks: BackgroundTasks,
+    wrapper: CohereWrapper = Depends(get_cohere_wrapper),
 ) -> JSONResponse:
     """
-    Use Cohere's API to generate a response to a prompt
+    Use Cohere's API to generate a response to a prompt, or another backend that
+    serves the same model when `ROUTE_EQUIVALENT_MODELS` is on (see
+    `llm_gateway.routing`)
 
     :param user_input: Inputs to the Cohere API, including prompt
     :type user_input: GenerateInput
     :return: Dictionary with LLM response and metadata
     :rtype: JSONResponse
     """
-    wrapper = CohereWrapper()
-    resp, logs = wrapper.send_cohere_request(
-        "generate",
+    resp, logs, wrapper = await asend_generate_request(
+        wrapper,
         max_tokens=user_input.max_tokens,
-        prompt=user_input.prompt,
+        prompt=await aresolve_prompt(user_input),
         temperature=user_input.temperature,
         model=user_input.model,
         **user_input.model_kwargs
@@ -56,30 +63,36 @@ def generate(
 
 @router.post("/generate/stream")
 @reraise_500
-def generate_stream(
-    user_input: GenerateInput, background_tasks: BackgroundTasks
-) -> JSONResponse:
-    wrapper = CohereWrapper()
-
-    response, logs = wrapper.send_cohere_request(
-        "generate",
-        max_tokens=user_input.max_tokens,
-        prompt=user_input.prompt,
-        temperature=user_input.temperature,
-        model=user_input.model,
-        stream=True,
-        **user_input.model_kwargs
-    )
+async def generate_stream(
+    user_input: GenerateInput,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    wrapper: CohereWrapper = Depends(get_cohere_wrapper),
+) -> StreamingResponse:
+    sse = wants_event_stream(request)
+    with StreamSlot() as slot:
+        response, logs, wrapper = await asend_generate_request(
+            wrapper,
+            max_tokens=user_input.max_tokens,
+            prompt=await aresolve_prompt(user_input),
+            temperature=user_input.temperature,
+            model=user_input.model,
+            stream=True,
+            sse=sse,
+            **user_input.model_kwargs
+        )
 
-    background_tasks.add_task(wrapper.write_logs_to_db, db_logs=logs)
+        background_tasks.add_task(wrapper.write_logs_to_db, db_logs=logs)
 
-    return StreamingResponse(response, media_type="text/plain")
+        return slot.streaming_response(response, media_type="text/plain", sse=sse)
 
 
 @router.post("/summarize")
 @reraise_500
-def summarize(
-    user_input: SummarizeInput, background_tasks: BackgroundTasks
+async def summarize(
+    user_input: SummarizeInput,
+    background_tasks: BackgroundTasks,
+    wrapper: CohereWrapper = Depends(get_cohere_wrapper),
 ) -> JSONResponse:
     """
     Use Cohere's API to summarize a response to a prompt based on additional_command
@@ -89,10 +102,9 @@ def summarize(
     :return: Dictionary with LLM response and metadata
     :rtype: JSONResponse
     """
-    wrapper = CohereWrapper()
-    resp, logs = wrapper.send_cohere_request(
+    resp, logs = await wrapper.asend_cohere_request(
         "summarize",
-        prompt=user_input.prompt,
+        prompt=await aresolve_prompt(user_input),
         additional_command=user_input.additional_command,
         temperature=user_input.temperature,
         model=user_input.model,
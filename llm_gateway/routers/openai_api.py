@@ -15,10 +15,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, BackgroundTasks, Depends, Request
 from fastapi.responses import StreamingResponse
 from starlette.responses import JSONResponse
 
+from llm_gateway.dependencies import get_openai_wrapper
 from llm_gateway.exceptions import OpenAIRouteExceptionHandler
 from llm_gateway.models import (
     ChatCompletionInput,
@@ -27,6 +28,8 @@ from llm_gateway.models import (
     EmbeddingInput,
 )
 from llm_gateway.providers.openai import OpenAIWrapper
+from llm_gateway.streaming import StreamSlot, wants_event_stream
+from llm_gateway.templates import aresolve_prompt
 from llm_gateway.utils import reraise_500
 
 router = APIRouter(route_class=OpenAIRouteExceptionHandler)
@@ -34,8 +37,10 @@ router = APIRouter(route_class=OpenAIRouteExceptionHandler)
 
 @router.post("/completion")
 @reraise_500
-def get_completion(
-    user_input: CompletionInput, background_tasks: BackgroundTasks
+async def get_completion(
+    user_input: CompletionInput,
+    background_tasks: BackgroundTasks,
+    wrapper: OpenAIWrapper = Depends(get_openai_wrapper),
 ) -> JSONResponse:
     """
     Use OpenAI's completion API to generate a response to a prompt
@@ -45,13 +50,12 @@ def get_completion(
     :return: Dictionary with LLM response and metadata
     :rtype: JSONResponse
     """
-    wrapper = OpenAIWrapper()
-    resp, logs = wrapper.send_openai_request(
+    resp, logs = await wrapper.asend_openai_request(
         "Completion",
         "create",
         model=user_input.model,
         max_tokens=user_input.max_tokens,
-        prompt=user_input.prompt,
+        prompt=await aresolve_prompt(user_input),
         temperature=user_input.temperature,
         **user_input.model_kwargs,
     )
@@ -63,31 +67,37 @@ def get_completion(
 
 @router.post("/completion/stream")
 @reraise_500
-def get_completion_stream(
-    user_input: CompletionInput, background_tasks: BackgroundTasks
-) -> JSONResponse:
-    wrapper = OpenAIWrapper()
-
-    resp, logs = wrapper.send_openai_request(
-        "Completion",
-        "create",
-        model=user_input.model,
-        max_tokens=user_input.max_tokens,
-        prompt=user_input.prompt,
-        temperature=user_input.temperature,
-        stream=True,
-        **user_input.model_kwargs,
-    )
+async def get_completion_stream(
+    user_input: CompletionInput,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    wrapper: OpenAIWrapper = Depends(get_openai_wrapper),
+) -> StreamingResponse:
+    sse = wants_event_stream(request)
+    with StreamSlot() as slot:
+        resp, logs = await wrapper.asend_openai_request(
+            "Completion",
+            "create",
+            model=user_input.model,
+            max_tokens=user_input.max_tokens,
+            prompt=await aresolve_prompt(user_input),
+            temperature=user_input.temperature,
+            stream=True,
+            sse=sse,
+            **user_input.model_kwargs,
+        )
 
-    background_tasks.add_task(wrapper.write_logs_to_db, db_logs=logs)
+        background_tasks.add_task(wrapper.write_logs_to_db, db_logs=logs)
 
-    return StreamingResponse(resp, media_type="text/plain")
+        return slot.streaming_response(resp, media_type="text/plain", sse=sse)
 
 
 @router.post("/chat_completion")
 @reraise_500
-def get_chat_completion(
-    user_input: ChatCompletionInput, background_tasks: BackgroundTasks
+async def get_chat_completion(
+    user_input: ChatCompletionInput,
+    background_tasks: BackgroundTasks,
+    wrapper: OpenAIWrapper = Depends(get_openai_wrapper),
 ) -> JSONResponse:
     """
     Use OpenAI's chat_completion API to generate a response given a chat (series of prompts)
@@ -97,8 +107,7 @@ def get_chat_completion(
     :return: Dictionary with LLM response and metadata
     :rtype: JSONResponse
     """
-    wrapper = OpenAIWrapper()
-    resp, logs = wrapper.send_openai_request(
+    resp, logs = await wrapper.asend_openai_request(
         "ChatCompletion",
         "create",
         model=user_input.model,
@@ -113,26 +122,35 @@ def get_chat_completion(
 
 @router.post("/chat_completion/stream")
 @reraise_500
-def get_chat_completion_stream(
-    user_input: ChatCompletionInput, background_tasks: BackgroundTasks
+async def get_chat_completion_stream(
+    user_input: ChatCompletionInput,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    wrapper: OpenAIWrapper = Depends(get_openai_wrapper),
 ) -> StreamingResponse:
-    wrapper = OpenAIWrapper()
-    response, logs = wrapper.send_openai_request(
-        "ChatCompletion",
-        "create",
-        model=user_input.model,
-        messages=user_input.messages,
-        temperature=user_input.temperature,
-        stream=True,
-        **user_input.model_kwargs,
-    )
-    background_tasks.add_task(wrapper.write_logs_to_db, db_logs=logs)
-    return StreamingResponse(response, media_type="text/plain")
+    sse = wants_event_stream(request)
+    with StreamSlot() as slot:
+        response, logs = await wrapper.asend_openai_request(
+            "ChatCompletion",
+            "create",
+            model=user_input.model,
+            messages=user_input.messages,
+            temperature=user_input.temperature,
+            stream=True,
+            sse=sse,
+            **user_input.model_kwargs,
+        )
+        background_tasks.add_task(wrapper.write_logs_to_db, db_logs=logs)
+        return slot.streaming_response(response, media_type="text/plain", sse=sse)
 
 
 @router.post("/edit")
 @reraise_500
-def get_edit(user_input: EditInput, background_tasks: BackgroundTasks) -> JSONResponse:
+async def get_edit(
+    user_input: EditInput,
+    background_tasks: BackgroundTasks,
+    wrapper: OpenAIWrapper = Depends(get_openai_wrapper),
+) -> JSONResponse:
     """
     Use OpenAI's edit API to edit a prompt given some instruction
 
@@ -141,8 +159,7 @@ def get_edit(user_input: EditInput, background_tasks: BackgroundTasks) -> JSONRe
     :return: Dictionary with edited prompts and metadata
     :rtype: JSONResponse
     """
-    wrapper = OpenAIWrapper()
-    resp, logs = wrapper.send_openai_request(
+    resp, logs = await wrapper.asend_openai_request(
         "Edits",
         "create",
         prompt=user_input.prompt,
@@ -156,8 +173,10 @@ def get_edit(user_input: EditInput, background_tasks: BackgroundTasks) -> JSONRe
 
 @router.post("/embedding")
 @reraise_500
-def get_embedding(
-    user_input: EmbeddingInput, background_tasks: BackgroundTasks
+async def get_embedding(
+    user_input: EmbeddingInput,
+    background_tasks: BackgroundTasks,
+    wrapper: OpenAIWrapper = Depends(get_openai_wrapper),
 ) -> JSONResponse:
     """
     Use OpenAI to turn a list of prompts into vectors
@@ -167,8 +186,7 @@ def get_embedding(
     :return: List of embeddings (a vector for each input prompt) and metadata
     :rtype: JSONResponse
     """
-    wrapper = OpenAIWrapper()
-    resp, logs = wrapper.send_openai_request(
+    resp, logs = await wrapper.asend_openai_request(
         "Embedding",
         "create",
         embedding_texts=user_input.embedding_texts,
@@ -0,0 +1,86 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List
+
+from fastapi import APIRouter, HTTPException
+
+from llm_gateway.models import PromptTemplateInput
+from llm_gateway.templates import (
+    PromptTemplateError,
+    PromptTemplateNotFoundError,
+    get_prompt_template,
+    list_prompt_templates,
+    register_prompt_template,
+)
+from llm_gateway.utils import reraise_500
+
+router = APIRouter()
+
+
+@router.post("")
+@reraise_500
+def create_template(template_input: PromptTemplateInput) -> dict:
+    """
+    Register a prompt template, scrubbing its static text of PII once
+
+    Requests to prompt routes can then send `template_id` and `template_variables`
+    instead of `prompt`, and only the variables are scrubbed.
+
+    :param template_input: Name and text of the template, with `{name}` variables
+    :type template_input: PromptTemplateInput
+    :raises HTTPException: 422 if the template can't be parsed
+    :return: Registered template, scrubbed
+    :rtype: dict
+    """
+    try:
+        template = register_prompt_template(
+            template_input.name, template_input.template
+        )
+    except PromptTemplateError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return template.to_dict()
+
+
+@router.get("")
+@reraise_500
+def get_templates() -> List[dict]:
+    """
+    List every registered prompt template
+
+    :return: Registered templates, scrubbed, oldest first
+    :rtype: List[dict]
+    """
+    return [template.to_dict() for template in list_prompt_templates()]
+
+
+@router.get("/{template_id}")
+@reraise_500
+def get_template(template_id: int) -> dict:
+    """
+    Get a registered prompt template
+
+    :param template_id: Id of the template
+    :type template_id: int
+    :raises HTTPException: 404 if there is no template with that id
+    :return: Registered template, scrubbed
+    :rtype: dict
+    """
+    try:
+        return get_prompt_template(template_id).to_dict()
+    except PromptTemplateNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,362 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Routing of requests between backends that serve the same model, i.e. Cohere
+Command called directly or through AWS Bedrock. Each backend's latency and error
+rate are tracked as exponentially weighted moving averages (EWMA). Requests go to
+the fastest healthy backend, and fail over to the next one when it fails.
+"""
+
+import math
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from llm_gateway.circuit_breaker import CircuitOpenError
+from llm_gateway.constants import get_settings
+from llm_gateway.dependencies import get_awsbedrock_wrapper
+from llm_gateway.exceptions import (
+    AWSBEDROCK_EXCEPTIONS,
+    COHERE_EXCEPTIONS,
+    is_retryable_awsbedrock_error,
+    is_retryable_cohere_error,
+)
+from llm_gateway.metrics import metrics
+from llm_gateway.providers.awsbedrock import (
+    COHERE_COMMAND_LIGHT_TEXT_V14,
+    COHERE_COMMAND_TEXT_V14,
+)
+from llm_gateway.providers.cohere import CohereWrapper
+from llm_gateway.rate_limiter import RateLimitedError
+
+
+class Backend(NamedTuple):
+    provider: str
+    model: str
+
+    def __str__(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+
+# Models that give the same answers, whichever backend serves them
+TEXT_EQUIVALENCE_CLASSES: Dict[str, Tuple[Backend, ...]] = {
+    "cohere-command": (
+        Backend("cohere", "command"),
+        Backend("awsbedrock", COHERE_COMMAND_TEXT_V14),
+    ),
+    "cohere-command-light": (
+        Backend("cohere", "command-light"),
+        Backend("awsbedrock", COHERE_COMMAND_LIGHT_TEXT_V14),
+    ),
+}
+
+
+class BackendStats:
+    """
+    EWMA of a backend's latency and error rate. Both also decay towards 0 while
+    the backend isn't used, so a backend that was slow or failing gets tried again.
+    """
+
+    def __init__(self, alpha: float, decay: float) -> None:
+        self.alpha = alpha
+        self.decay = decay
+        self._latency: Optional[float] = None
+        self._error_rate = 0.0
+        self._updated_at = time.monotonic()
+
+    def _decayed(self, value: float, now: Optional[float]) -> float:
+        now = time.monotonic() if now is None else now
+        return value * math.exp(-(now - self._updated_at) / self.decay)
+
+    def latency(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        EWMA of the latency of answers, None until the backend answers
+        """
+        if self._latency is None:
+            return None
+        return self._decayed(self._latency, now)
+
+    def error_rate(self, now: Optional[float] = None) -> float:
+        return self._decayed(self._error_rate, now)
+
+    def record(self, latency: float, failed: bool) -> None:
+        now = time.monotonic()
+        self._error_rate = self.alpha * failed + (1 - self.alpha) * self.error_rate(now)
+        # a failure's latency says nothing about how fast answers are
+        if not failed:
+            previous = self.latency(now)
+            self._latency = (
+                latency
+                if previous is None
+                else self.alpha * latency + (1 - self.alpha) * previous
+            )
+        elif self._latency is not None:
+            self._latency = self.latency(now)
+        self._updated_at = now
+
+
+class ModelRouter:
+    """
+    Picks the backend of a model's equivalence class to send a request to
+    """
+
+    def __init__(
+        self,
+        equivalence_classes: Dict[str, Tuple[Backend, ...]],
+        alpha: float,
+        decay: float,
+        max_error_rate: float,
+    ) -> None:
+        self.equivalence_classes = equivalence_classes
+        self.max_error_rate = max_error_rate
+        self._lock = threading.Lock()
+        self._classes_by_model = {
+            backend.model: name
+            for name, backends in equivalence_classes.items()
+            for backend in backends
+        }
+        self._stats = {
+            backend: BackendStats(alpha, decay)
+            for backends in equivalence_classes.values()
+            for backend in backends
+        }
+
+    def equivalence_class(self, model: Optional[str]) -> Optional[str]:
+        """
+        Name of the equivalence class of a model, None if it has no equivalents
+        """
+        return self._classes_by_model.get(model)
+
+    def rank(self, equivalence_class: str) -> List[Backend]:
+        """
+        Backends of an equivalence class, best first: healthy ones (with an error
+        rate under `max_error_rate`) from the fastest, then the others from the
+        least failing. Backends that haven't answered yet come after the healthy
+        ones that have, in the order the class lists them, so a fallback is only
+        used once the backends before it fail.
+
+        :param equivalence_class: Name of the equivalence class
+        :type equivalence_class: str
+        :return: The class's backends
+        :rtype: List[Backend]
+        """
+        now = time.monotonic()
+        with self._lock:
+            scores = {}
+            for backend in self.equivalence_classes[equivalence_class]:
+                stats = self._stats[backend]
+                error_rate = stats.error_rate(now)
+                latency = stats.latency(now)
+                if error_rate >= self.max_error_rate:
+                    scores[backend] = (2, error_rate)
+                elif latency is None:
+                    scores[backend] = (1, 0)
+                else:
+                    scores[backend] = (0, latency)
+        return sorted(scores, key=scores.get)
+
+    def record(self, backend: Backend, latency: float, failed: bool) -> None:
+        with self._lock:
+            stats = self._stats[backend]
+            stats.record(latency, failed)
+            latency = stats.latency()
+            error_rate = stats.error_rate()
+        if latency is not None:
+            metrics.set_gauge(
+                "routing.latency_ewma_ms", latency * 1e3, backend=str(backend)
+            )
+        metrics.set_gauge("routing.error_rate", error_rate, backend=str(backend))
+
+    async def asend(
+        self,
+        equivalence_class: str,
+        send: Callable[[Backend], Awaitable[Any]],
+        is_failure: Callable[[Backend, Exception], bool],
+        backends: Optional[List[Backend]] = None,
+    ) -> Tuple[Any, Backend, List[Backend]]:
+        """
+        Send a request to the best backend of an equivalence class, failing over to
+        the next best when one fails
+
+        :param equivalence_class: Name of the equivalence class
+        :type equivalence_class: str
+        :param send: Sends the request to a backend
+        :type send: Callable[[Backend], Awaitable[Any]]
+        :param is_failure: Whether an error raised by `send` is the backend failing,
+            to fail over, rather than the request (i.e. an invalid prompt)
+        :type is_failure: Callable[[Backend, Exception], bool]
+        :param backends: Backends to try, defaults to None (`rank`)
+        :type backends: Optional[List[Backend]]
+        :return: What `send` returned, the backend that returned it, and the
+            backends that failed before it
+        :rtype: Tuple[Any, Backend, List[Backend]]
+        """
+        if backends is None:
+            backends = self.rank(equivalence_class)
+        failed = []
+        for backend in backends:
+            start = time.monotonic()
+            try:
+                result = await send(backend)
+            except Exception as e:
+                if not is_failure(backend, e):
+                    # it answered
+                    self.record(backend, time.monotonic() - start, failed=False)
+                    raise
+                self.record(backend, time.monotonic() - start, failed=True)
+                failed.append(backend)
+                if len(failed) == len(backends):
+                    raise
+                metrics.increment(
+                    "routing.failovers",
+                    equivalence_class=equivalence_class,
+                    backend=str(backend),
+                )
+                continue
+
+            self.record(backend, time.monotonic() - start, failed=False)
+            metrics.increment(
+                "routing.requests",
+                equivalence_class=equivalence_class,
+                backend=str(backend),
+            )
+            return result, backend, failed
+
+
+@lru_cache()
+def get_model_router() -> ModelRouter:
+    settings = get_settings()
+    return ModelRouter(
+        TEXT_EQUIVALENCE_CLASSES,
+        alpha=settings.ROUTING_EWMA_ALPHA,
+        decay=settings.ROUTING_STATS_DECAY,
+        max_error_rate=settings.ROUTING_MAX_ERROR_RATE,
+    )
+
+
+def _is_backend_failure(backend: Backend, e: Exception) -> bool:
+    if isinstance(e, (CircuitOpenError, RateLimitedError)):
+        return True
+    if backend.provider == "cohere":
+        return isinstance(e, COHERE_EXCEPTIONS) and is_retryable_cohere_error(e)
+    return isinstance(e, AWSBEDROCK_EXCEPTIONS) and is_retryable_awsbedrock_error(e)
+
+
+def _configured(provider: str) -> bool:
+    settings = get_settings()
+    if provider == "cohere":
+        return bool(settings.COHERE_API_KEY)
+    return bool(settings.AWS_REGION)
+
+
+async def asend_generate_request(
+    wrapper: CohereWrapper,
+    model: str,
+    prompt: Optional[str],
+    max_tokens: int,
+    temperature: float,
+    stream: bool = False,
+    sse: bool = False,
+    **kwargs,
+) -> Tuple[Any, dict, Any]:
+    """
+    Send a Cohere generate request, to whichever backend of the model's equivalence
+    class is the best when `ROUTE_EQUIVALENT_MODELS` is on, else to Cohere
+
+    :param wrapper: Wrapper of the Cohere API
+    :type wrapper: CohereWrapper
+    :param model: Cohere model (i.e. "command")
+    :type model: str
+    :param prompt: String prompt
+    :type prompt: Optional[str]
+    :param max_tokens: Maximum tokens for the completion
+    :type max_tokens: int
+    :param temperature: Temperature altering the creativity of the response
+    :type temperature: float
+    :param stream: Stream the response as an async iterator, defaults to False
+    :type stream: bool
+    :param sse: Stream server-sent events instead of plain text, defaults to False
+    :type sse: bool
+    :param kwargs: other parameters to pass to the model
+    :type kwargs: Optional[dict]
+    :return: Response, logs for db write (with the chosen backend in their
+        gateway metadata), and the wrapper to write them with
+    :rtype: Tuple[Any, dict, Any]
+    """
+    router = get_model_router()
+    equivalence_class = router.equivalence_class(model)
+    backends = []
+    if get_settings().ROUTE_EQUIVALENT_MODELS and equivalence_class is not None:
+        backends = [
+            backend
+            for backend in router.rank(equivalence_class)
+            if _configured(backend.provider)
+        ]
+    if not backends:
+        resp, logs = await wrapper.asend_cohere_request(
+            "generate",
+            max_tokens=max_tokens,
+            prompt=prompt,
+            temperature=temperature,
+            model=model,
+            stream=stream,
+            sse=sse,
+            **kwargs,
+        )
+        return resp, logs, wrapper
+
+    async def send(backend: Backend) -> Tuple[Any, dict, Any]:
+        if backend.provider == "cohere":
+            return (
+                *await wrapper.asend_cohere_request(
+                    "generate",
+                    max_tokens=max_tokens,
+                    prompt=prompt,
+                    temperature=temperature,
+                    model=backend.model,
+                    stream=stream,
+                    sse=sse,
+                    **kwargs,
+                ),
+                wrapper,
+            )
+        awsbedrock_wrapper = get_awsbedrock_wrapper()
+        return (
+            *await awsbedrock_wrapper.asend_awsbedrock_request(
+                awsbedrock_module="Text",
+                model=backend.model,
+                max_tokens=max_tokens,
+                prompt=prompt,
+                temperature=temperature,
+                stream=stream,
+                sse=sse,
+                **kwargs,
+            ),
+            awsbedrock_wrapper,
+        )
+
+    (resp, logs, backend_wrapper), backend, failed = await router.asend(
+        equivalence_class, send, _is_backend_failure, backends
+    )
+    logs["gateway_metadata"]["routing"] = {
+        "equivalence_class": equivalence_class,
+        "backend": str(backend),
+        "failed_over_from": [str(failed_backend) for failed_backend in failed],
+    }
+    return resp, logs, backend_wrapper
@@ -0,0 +1,292 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coalescing of identical requests that are in flight at the same time, i.e. when a
+batch job fans out or a UI retries. Only the first one calls the provider, the
+others wait for its result, or subscribe to its stream.
+
+Only temperature 0 requests are coalesced, as the others are expected to get
+different answers. Requests are identical when they have the same key as the
+response cache (see `llm_gateway.response_cache.response_cache_key`).
+
+The shared call is made for the first request, within its caller's rate limits.
+When those turn it away, the other requests make their own calls instead of
+failing with it.
+"""
+
+import asyncio
+import weakref
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+from llm_gateway.rate_limiter import RateLimitedError
+from llm_gateway.response_cache import RESPONSE_CACHE_ROUTES, response_cache_key
+
+
+class StreamFanout:
+    """
+    Reads a stream once, for any number of subscribers. Each subscriber gets every
+    item from the start of the stream, however late it subscribes. The stream is
+    closed once every subscriber has gone.
+
+    :param items: Stream to read
+    :type items: AsyncIterator
+    :param close: Closes the stream early, defaults to None
+    :type close: Optional[Callable[[], None]]
+    """
+
+    def __init__(
+        self, items: AsyncIterator, close: Optional[Callable[[], None]] = None
+    ) -> None:
+        self._items: List[Any] = []
+        self._error: Optional[BaseException] = None
+        self.done = False
+        # closed early, because every subscriber went
+        self.closed = False
+        self.subscribers = 0
+        self._close = close
+        self._changed = asyncio.Event()
+        self.reader = asyncio.ensure_future(self._read(items))
+
+    async def _read(self, items: AsyncIterator) -> None:
+        try:
+            async for item in items:
+                self._items.append(item)
+                self._notify()
+        except Exception as e:
+            self._error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def subscribe(self) -> Tuple[AsyncIterator, Callable[[], None]]:
+        """
+        Start reading the stream
+
+        :return: The items of the stream, and a function to stop reading it early
+        :rtype: Tuple[AsyncIterator, Callable[[], None]]
+        """
+        self.subscribers += 1
+        subscribed = True
+
+        def unsubscribe() -> None:
+            nonlocal subscribed
+            if not subscribed:
+                return
+            subscribed = False
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                # nobody is left to read it
+                self.closed = True
+                if self._close is not None:
+                    self._close()
+                self.reader.cancel()
+            self._notify()
+
+        async def iterate() -> AsyncIterator:
+            index = 0
+            try:
+                while subscribed:
+                    if index < len(self._items):
+                        yield self._items[index]
+                        index += 1
+                    elif self.done:
+                        if self._error is not None:
+                            raise self._error
+                        return
+                    else:
+                        await self._changed.wait()
+            finally:
+                unsubscribe()
+
+        return iterate(), unsubscribe
+
+
+class _Flights:
+    """
+    Calls and streams in flight on an event loop, by key
+    """
+
+    def __init__(self) -> None:
+        self.calls: Dict[str, asyncio.Future] = {}
+        self.streams: Dict[str, asyncio.Future] = {}
+
+
+# flights belong to the event loop that waits on them
+_flights: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _get_flights() -> _Flights:
+    loop = asyncio.get_running_loop()
+    flights = _flights.get(loop)
+    if flights is None:
+        flights = _flights[loop] = _Flights()
+    return flights
+
+
+def _forget(registry: Dict[str, asyncio.Future], key: str, task: asyncio.Future):
+    if registry.get(key) is task:
+        del registry[key]
+
+
+def _retrieve_exception(task: asyncio.Future) -> None:
+    if not task.cancelled():
+        # retrieved, even if every request waiting on it was cancelled
+        task.exception()
+
+
+async def _open_fanout(open_stream: Callable[[], Awaitable[Tuple]]) -> StreamFanout:
+    return StreamFanout(*await open_stream())
+
+
+class Flight:
+    """
+    The provider call of a request, which is shared with identical requests in
+    flight at the same time when `SINGLEFLIGHT` is on
+
+    :param provider: Provider of the model (i.e. "openai")
+    :type provider: str
+    :param route: Route of the request, one of
+        `llm_gateway.response_cache.RESPONSE_CACHE_ROUTES`, or None for one that
+        isn't coalesced
+    :type route: Optional[str]
+    :param temperature: Temperature of the request
+    :type temperature: Optional[float]
+    :param request: Model, scrubbed input and every generation parameter, including
+        whether the response is streamed
+    :type request: dict
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        route: Optional[str],
+        temperature: Optional[float],
+        **request,
+    ) -> None:
+        self.provider = provider
+        self.key = None
+        # "leader" if it called the provider, "follower" if it shared another
+        # request's call (which the DB log records), None if it can't be coalesced
+        # or made its own call after the leader's was rate limited
+        self.role = None
+        if (
+            get_settings().SINGLEFLIGHT
+            and route in RESPONSE_CACHE_ROUTES
+            and temperature == 0
+        ):
+            self.key = response_cache_key(
+                provider, route, temperature=temperature, **request
+            )
+
+    def _join(self, task: Optional[asyncio.Future]) -> bool:
+        """
+        Whether to follow the task in flight, rather than lead a new one
+        """
+        self.role = "leader" if task is None else "follower"
+        return task is not None
+
+    async def _follow(self, task: asyncio.Future) -> Any:
+        """
+        Wait for the task this request leads or follows. A follower isn't failed
+        with the leader's rate limit error, as the limits were its caller's, it
+        gets None and makes its own call instead.
+        """
+        try:
+            # the task goes on for the other requests if this one is cancelled
+            return await asyncio.shield(task)
+        except RateLimitedError:
+            if self.role == "leader":
+                raise
+            self.role = None
+            return None
+        finally:
+            if self.role == "follower":
+                metrics.increment("singleflight.saved_calls", provider=self.provider)
+
+    async def call(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Call the provider, or wait for the identical call in flight
+
+        :param call: Calls the provider
+        :type call: Callable[[], Awaitable[Any]]
+        :return: What `call` returned
+        :rtype: Any
+        """
+        if self.key is None:
+            return await call()
+        calls = _get_flights().calls
+        task = calls.get(self.key)
+        if not self._join(task):
+            task = calls[self.key] = asyncio.ensure_future(call())
+            task.add_done_callback(partial(_forget, calls, self.key))
+            task.add_done_callback(_retrieve_exception)
+        result = await self._follow(task)
+        if self.role is None:
+            return await call()
+        return result
+
+    async def stream(
+        self,
+        open_stream: Callable[
+            [], Awaitable[Tuple[AsyncIterator, Optional[Callable[[], None]]]]
+        ],
+    ) -> Tuple[AsyncIterator, Optional[Callable[[], None]]]:
+        """
+        Open a stream from the provider, or subscribe to the identical stream in
+        flight
+
+        :param open_stream: Opens the stream, returning its items and a function to
+            close it early
+        :type open_stream: Callable[[], Awaitable[Tuple[AsyncIterator,
+            Optional[Callable[[], None]]]]]
+        :return: The items of the stream, and a function to stop reading it early
+        :rtype: Tuple[AsyncIterator, Optional[Callable[[], None]]]
+        """
+        if self.key is None:
+            return await open_stream()
+        streams = _get_flights().streams
+        task = streams.get(self.key)
+        if task is not None and task.done() and not task.cancelled():
+            if task.exception() is None and task.result().closed:
+                # it didn't finish, and can't be read any further
+                task = None
+        if not self._join(task):
+            task = streams[self.key] = asyncio.ensure_future(_open_fanout(open_stream))
+            task.add_done_callback(partial(self._opened, streams, self.key))
+            task.add_done_callback(_retrieve_exception)
+        fanout: Optional[StreamFanout] = await self._follow(task)
+        if self.role is None:
+            return await open_stream()
+        return fanout.subscribe()
+
+    @staticmethod
+    def _opened(
+        streams: Dict[str, asyncio.Future], key: str, task: asyncio.Future
+    ) -> None:
+        if task.cancelled() or task.exception() is not None:
+            _forget(streams, key, task)
+            return
+        # identical requests share the stream until it ends
+        task.result().reader.add_done_callback(lambda _: _forget(streams, key, task))
@@ -0,0 +1,271 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Streamed responses, which stay open for as long as the model keeps generating.
+They have their own cap on how many can be open at once, so long generations
+can't take every connection and leave nothing for the rest of the gateway.
+"""
+
+import asyncio
+import json
+import math
+from functools import lru_cache
+from typing import AsyncIterator, Callable, List, Optional, Union
+
+from fastapi import HTTPException, Request
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+
+
+def wants_event_stream(request: Request) -> bool:
+    """
+    Whether the client asked for server-sent events rather than plain text
+    """
+    return "text/event-stream" in request.headers.get("accept", "")
+
+
+def format_sse(data: dict, event: Optional[str] = None) -> bytes:
+    """
+    Encode a server-sent event
+
+    :param data: Data of the event, sent as JSON
+    :type data: dict
+    :param event: Type of the event, defaults to None (a "message")
+    :type event: Optional[str]
+    :return: Encoded event
+    :rtype: bytes
+    """
+    event_line = f"event: {event}\n" if event else ""
+    return f"{event_line}data: {json.dumps(data)}\n\n".encode()
+
+
+async def coalesce_stream(
+    chunks: AsyncIterator[str], interval: float, max_chars: int
+) -> AsyncIterator[str]:
+    """
+    Join the chunks of a stream into fewer, larger ones, the way Nagle's algorithm
+    joins small packets
+
+    A chunk that comes more than `interval` seconds after the last batch was sent
+    is sent straight away. Chunks that come sooner are held until `interval`
+    seconds after it, or until `max_chars` characters are waiting.
+
+    At most one chunk is read ahead of the batch being sent, so while a slow client
+    holds up sending, the stream stops being read from the provider too.
+
+    :param chunks: Stream of text
+    :type chunks: AsyncIterator[str]
+    :param interval: Least time between batches, in seconds, 0 to send every chunk
+    :type interval: float
+    :param max_chars: Size at which a batch is sent without waiting
+    :type max_chars: int
+    :return: Batches of text
+    :rtype: AsyncIterator[str]
+    """
+    loop = asyncio.get_running_loop()
+    chunks = aiter(chunks)
+    next_chunk: Optional[asyncio.Future] = None
+    batch: List[str] = []
+    size = 0
+    last_sent = -math.inf
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(anext(chunks))
+            # an empty batch waits for as long as the next chunk takes
+            timeout = max(0, last_sent + interval - loop.time()) if batch else None
+            done, _ = await asyncio.wait((next_chunk,), timeout=timeout)
+            if done:
+                chunk_future, next_chunk = next_chunk, None
+                try:
+                    chunk = chunk_future.result()
+                except StopAsyncIteration:
+                    break
+                batch.append(chunk)
+                size += len(chunk)
+                if size < max_chars and loop.time() < last_sent + interval:
+                    continue
+
+            yield "".join(batch)
+            batch, size = [], 0
+            last_sent = loop.time()
+    finally:
+        if next_chunk is not None:
+            next_chunk.cancel()
+
+    if batch:
+        yield "".join(batch)
+
+
+class CancellableStream:
+    """
+    Stream that can be stopped from outside, i.e. by the response when the client
+    disconnects, as Starlette just drops the stream it was iterating
+    """
+
+    def __init__(self, iterator: AsyncIterator, cancel: Callable[[], None]) -> None:
+        self._iterator = iterator
+        self._cancel = cancel
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self._cancel()
+
+    def __aiter__(self) -> "CancellableStream":
+        return self
+
+    async def __anext__(self):
+        try:
+            return await anext(self._iterator)
+        except Exception:
+            if self.cancelled:
+                # i.e. the upstream connection was closed under it
+                raise StopAsyncIteration
+            raise
+
+
+class StreamLimiter:
+    """
+    Counts the streams that are open, up to `max_streams`
+
+    Only used from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, max_streams: int) -> None:
+        self.max_streams = max_streams
+        self.active = 0
+
+    def try_acquire(self) -> bool:
+        """
+        Take a place for a new stream
+
+        :return: Whether there was a place left
+        :rtype: bool
+        """
+        if self.active >= self.max_streams:
+            metrics.increment("streams.rejected")
+            return False
+        self.active += 1
+        metrics.set_gauge("streams.active", self.active)
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
+        metrics.set_gauge("streams.active", self.active)
+
+
+@lru_cache()
+def get_stream_limiter() -> StreamLimiter:
+    return StreamLimiter(get_settings().MAX_CONCURRENT_STREAMS)
+
+
+class LimitedStreamingResponse(StreamingResponse):
+    """
+    Streaming response that gives its place under the stream limit back once it
+    is done, however the stream ends
+    """
+
+    def __init__(
+        self, content: AsyncIterator, release: Callable[[], None], **kwargs
+    ) -> None:
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def listen_for_disconnect(self, receive: Receive) -> None:
+        await super().listen_for_disconnect(receive)
+        # before the stream is dropped, and before the background tasks write logs
+        if isinstance(self.body_iterator, CancellableStream):
+            self.body_iterator.cancel()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+class StreamSlot:
+    """
+    A place under the stream limit, held from before the provider is called until
+    the response has been streamed
+
+    Wrap the provider call and the returned response in it:
+
+        with StreamSlot() as slot:
+            response, logs = await wrapper.asend_cohere_request(..., stream=True)
+            return slot.streaming_response(response)
+
+    The place is given back straight away if the route fails first.
+    """
+
+    def __init__(self, limiter: Optional[StreamLimiter] = None) -> None:
+        self._limiter = limiter or get_stream_limiter()
+        self._held = False
+        self._response: Optional[StreamingResponse] = None
+
+    def __enter__(self) -> "StreamSlot":
+        if not self._limiter.try_acquire():
+            raise HTTPException(
+                status_code=503,
+                detail="Too many streams are open, try again later",
+                headers={"Retry-After": "1"},
+            )
+        self._held = True
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._response is None:
+            self._release()
+
+    def _release(self) -> None:
+        if self._held:
+            self._held = False
+            self._limiter.release()
+
+    def streaming_response(
+        self,
+        content: Union[AsyncIterator, CancellableStream],
+        media_type: str = "text/plain",
+        sse: bool = False,
+    ) -> StreamingResponse:
+        """
+        Stream `content`, handing the place over to the response
+
+        :param content: Text (or encoded events) to stream, cancelled if the client
+            disconnects when it is a `CancellableStream`
+        :type content: Union[AsyncIterator, CancellableStream]
+        :param media_type: Media type of the response, defaults to "text/plain"
+        :type media_type: str
+        :param sse: Whether `content` is server-sent events, defaults to False
+        :type sse: bool
+        :return: Response that gives the place back when it is done
+        :rtype: StreamingResponse
+        """
+        headers = None
+        if sse:
+            media_type = "text/event-stream"
+            # and stop proxies (i.e. nginx) from buffering the events
+            headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        self._response = LimitedStreamingResponse(
+            content, release=self._release, media_type=media_type, headers=headers
+        )
+        return self._response
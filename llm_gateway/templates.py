@@ -0,0 +1,421 @@
+# llm-gateway - A proxy service in front of llm models to encourage the
+# responsible use of AI.
+#
+# Copyright 2023 Wealthsimple Technologies
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Registry of prompt templates whose static text is scrubbed of PII once, when the
+template is registered, so requests only send (and only scrub) the variables.
+The static text is scrubbed again for denylisted terms when the denylist changes.
+"""
+
+import datetime
+import json
+import string
+from collections import Counter
+from functools import lru_cache
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from llm_gateway.cache import LRUCache
+from llm_gateway.constants import get_settings
+from llm_gateway.db.models import PromptTemplates
+from llm_gateway.db.utils import db_session_scope
+from llm_gateway.denylist import get_denylist
+from llm_gateway.models import TemplatedPromptInput
+from llm_gateway.pii_scrubber import (
+    DENYLIST_KIND,
+    PIISpan,
+    ScrubbedStr,
+    count_pii_spans,
+    find_pii_spans,
+    merge_pii_spans,
+    redact_pii_spans,
+    scrub_many,
+)
+
+# Characters either side of a variable that are rescanned once it is substituted,
+# for PII that only appears across the join, i.e. "call 416-555-{last_four}"
+_BOUNDARY_CONTEXT = 128
+
+
+class PromptTemplateError(ValueError):
+    """
+    Raised for a template that can't be parsed, or variables that don't fit it
+    """
+
+
+class PromptTemplateNotFoundError(LookupError):
+    """
+    Raised when no template is registered with the requested id
+    """
+
+
+def parse_prompt_template(template: str) -> Tuple[List[str], List[str]]:
+    """
+    Split a template into its static segments and the variables between them
+
+    Variables are written as `{name}`, literal braces as `{{` and `}}`, like
+    `str.format` but without positional fields, attributes, indexes, conversions
+    or format specs.
+
+    :param template: Template text
+    :type template: str
+    :raises PromptTemplateError: The template isn't valid
+    :return: Static segments, one more than there are variables, and variable names
+    :rtype: Tuple[List[str], List[str]]
+    """
+    segments = [""]
+    variables = []
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise PromptTemplateError(f"Invalid template: {e}")
+
+    for literal, name, format_spec, conversion in parsed:
+        segments[-1] += literal
+        if name is None:
+            continue
+        if not name.isidentifier() or format_spec or conversion:
+            raise PromptTemplateError(
+                f"Invalid template variable `{{{name}}}`, expected `{{name}}`"
+            )
+        variables.append(name)
+        segments.append("")
+    return segments, variables
+
+
+class PromptTemplate:
+    """
+    A registered template, holding its static segments already scrubbed of PII
+
+    `denylist_version` is the version of the denylist the segments were scrubbed
+    with, None if unknown (i.e. loaded from the database) or there was none.
+    """
+
+    def __init__(
+        self,
+        id: int,
+        name: str,
+        segments: List[str],
+        variables: List[str],
+        redaction_counts: Dict[str, int],
+        created_at: datetime.datetime,
+        denylist_version: Optional[int] = None,
+    ) -> None:
+        self.id = id
+        self.name = name
+        self.segments = segments
+        self.variables = variables
+        self.redaction_counts = redaction_counts
+        self.created_at = created_at
+        self.denylist_version = denylist_version
+
+    @classmethod
+    def from_record(cls, record: PromptTemplates) -> "PromptTemplate":
+        return cls(
+            id=record.id,
+            name=record.name,
+            segments=record.segments,
+            variables=record.variables,
+            redaction_counts=record.redaction_counts,
+            created_at=record.created_at,
+        )
+
+    @property
+    def template(self) -> str:
+        """
+        The scrubbed template, in the syntax it was registered in
+        """
+        parts = [_escape_braces(self.segments[0])]
+        for name, segment in zip(self.variables, self.segments[1:]):
+            parts.append(f"{{{name}}}")
+            parts.append(_escape_braces(segment))
+        return "".join(parts)
+
+    def rescrub_if_stale(self) -> None:
+        """
+        Scrub the static segments for denylisted terms again if the denylist has
+        changed since they were scrubbed, i.e. after it was reloaded
+        """
+        denylist = get_denylist()
+        version = denylist.version if denylist is not None else None
+        if version == self.denylist_version:
+            return
+
+        redaction_counts = Counter(self.redaction_counts)
+        segments = []
+        for segment in self.segments:
+            spans = find_pii_spans(segment, kinds=(DENYLIST_KIND,))
+            redaction_counts.update(count_pii_spans(spans))
+            segments.append(redact_pii_spans(segment, spans))
+        self.segments, self.redaction_counts = segments, dict(redaction_counts)
+        self.denylist_version = version
+
+    def to_dict(self) -> dict:
+        self.rescrub_if_stale()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "template": self.template,
+            "variables": sorted(set(self.variables)),
+            "pii_redactions": self.redaction_counts,
+            "created_at": self.created_at.isoformat(),
+        }
+
+    def render(self, variables: Dict[str, str]) -> "RenderedPrompt":
+        """
+        Substitute variables into the template, scrubbing only the variables
+
+        :param variables: Value of every variable in the template
+        :type variables: Dict[str, str]
+        :raises PromptTemplateError: A variable is missing, or isn't in the template
+        :return: Prompt, scrubbed of PII
+        :rtype: RenderedPrompt
+        """
+        self.rescrub_if_stale()
+        names = sorted(set(self.variables))
+        missing = set(names) - variables.keys()
+        unknown = variables.keys() - set(names)
+        if missing or unknown:
+            raise PromptTemplateError(
+                f"Template {self.id} takes variables {names}, "
+                f"missing {sorted(missing)}, unknown {sorted(unknown)}"
+            )
+
+        redaction_counts = Counter(self.redaction_counts)
+        values = scrub_many([variables[name] for name in names], redaction_counts)
+        scrubbed = dict(zip(names, values))
+        pieces = [self.segments[0]]
+        for name, segment in zip(self.variables, self.segments[1:]):
+            pieces.append(scrubbed[name])
+            pieces.append(segment)
+        text = "".join(pieces)
+
+        spans = _find_boundary_spans(text, list(accumulate(map(len, pieces[:-1]))))
+        redaction_counts.update(count_pii_spans(spans))
+        text = redact_pii_spans(text, spans)
+        return RenderedPrompt(text, dict(redaction_counts), self.id, scrubbed)
+
+
+class RenderedPrompt(ScrubbedStr):
+    """
+    A prompt rendered from a template, which remembers the template and variables
+    so that they can be logged instead of the whole prompt
+    """
+
+    def __new__(
+        cls,
+        text: str,
+        redaction_counts: Dict[str, int],
+        template_id: int,
+        variables: Dict[str, str],
+    ) -> "RenderedPrompt":
+        rendered = super().__new__(cls, text, redaction_counts)
+        rendered.template_id = template_id
+        rendered.variables = variables
+        return rendered
+
+    @property
+    def log_input(self) -> str:
+        return json.dumps(
+            {"template_id": self.template_id, "template_variables": self.variables}
+        )
+
+
+def _escape_braces(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def _find_boundary_spans(text: str, boundaries: List[int]) -> List[PIISpan]:
+    """
+    Find PII that crosses the joins between already scrubbed pieces of text
+
+    :param text: Joined text
+    :type text: str
+    :param boundaries: Index of each join
+    :type boundaries: List[int]
+    :return: Non-overlapping spans that cross at least one join, in order
+    :rtype: List[PIISpan]
+    """
+    spans = set()
+    for boundary in boundaries:
+        start = max(0, boundary - _BOUNDARY_CONTEXT)
+        # one character before the window, so the patterns see a word boundary
+        offset = max(0, start - 1)
+        context = _BOUNDARY_CONTEXT
+        while True:
+            stop = boundary + context
+            window = text[offset:stop]
+            crossing = [
+                PIISpan(span.start + offset, span.end + offset, span.kind)
+                for span in find_pii_spans(window, pos=start - offset)
+                if span.start + offset < boundary < span.end + offset
+            ]
+            # a match that runs up to the end of the window might carry on past it
+            if stop < len(text) and any(span.end >= stop for span in crossing):
+                context *= 2
+                continue
+            spans.update(crossing)
+            break
+    return merge_pii_spans(spans)
+
+
+@lru_cache(maxsize=None)
+def _get_template_cache() -> LRUCache:
+    # templates never change once registered, so cached ones never go stale (they
+    # rescrub themselves when the denylist changes)
+    return LRUCache(
+        "prompt_templates", max_bytes=get_settings().PROMPT_TEMPLATE_CACHE_MAX_BYTES
+    )
+
+
+def _cache_template(template: PromptTemplate) -> None:
+    _get_template_cache().set(
+        template.id, template, size=sum(len(segment) for segment in template.segments)
+    )
+
+
+def register_prompt_template(name: str, template: str) -> PromptTemplate:
+    """
+    Scrub the static segments of a template and store it
+
+    Templates can't be changed once registered, so that logged requests that used
+    them can always be reconstructed. Register a new template instead.
+
+    :param name: Human readable name of the template
+    :type name: str
+    :param template: Template text, see `parse_prompt_template`
+    :type template: str
+    :raises PromptTemplateError: The template isn't valid
+    :return: Registered template
+    :rtype: PromptTemplate
+    """
+    segments, variables = parse_prompt_template(template)
+    denylist = get_denylist()
+    redaction_counts = Counter()
+    segments = scrub_many(segments, redaction_counts)
+    record = PromptTemplates(
+        name=name,
+        segments=segments,
+        variables=variables,
+        redaction_counts=dict(redaction_counts),
+        created_at=datetime.datetime.now(),
+    )
+    with db_session_scope() as session:
+        session.add(record)
+        session.flush()
+        registered = PromptTemplate.from_record(record)
+    if denylist is not None:
+        registered.denylist_version = denylist.version
+
+    _cache_template(registered)
+    return registered
+
+
+def get_prompt_template(template_id: int) -> PromptTemplate:
+    """
+    Look up a registered template, from the cache if it has been used recently
+
+    :param template_id: Id of the template
+    :type template_id: int
+    :raises PromptTemplateNotFoundError: No template has that id
+    :return: Registered template
+    :rtype: PromptTemplate
+    """
+    template = _get_template_cache().get(template_id)
+    if template is not None:
+        return template
+
+    with db_session_scope() as session:
+        record = session.get(PromptTemplates, template_id)
+        if record is None:
+            raise PromptTemplateNotFoundError(
+                f"No prompt template with id {template_id}"
+            )
+        template = PromptTemplate.from_record(record)
+
+    _cache_template(template)
+    return template
+
+
+def list_prompt_templates() -> List[PromptTemplate]:
+    """
+    List every registered template, oldest first
+
+    :return: Registered templates
+    :rtype: List[PromptTemplate]
+    """
+    with db_session_scope() as session:
+        records = session.query(PromptTemplates).order_by(PromptTemplates.id).all()
+        return [PromptTemplate.from_record(record) for record in records]
+
+
+def resolve_prompt(user_input: TemplatedPromptInput) -> Optional[str]:
+    """
+    The prompt of a request, rendered from a template if it names one
+
+    :param user_input: Request input, with either a prompt or a template
+    :type user_input: TemplatedPromptInput
+    :raises HTTPException: 404 for an unknown template, 422 for wrong variables
+    :return: Prompt to send, a `RenderedPrompt` if it came from a template
+    :rtype: Optional[str]
+    """
+    if user_input.template_id is None:
+        return user_input.prompt
+    try:
+        template = get_prompt_template(user_input.template_id)
+        return template.render(user_input.template_variables)
+    except PromptTemplateNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PromptTemplateError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+async def aresolve_prompt(user_input: TemplatedPromptInput) -> Optional[str]:
+    """
+    Version of `resolve_prompt` for async routes. Templates are rendered in a
+    worker thread, since they may have to be looked up in the DB first
+
+    :param user_input: Request input, with either a prompt or a template
+    :type user_input: TemplatedPromptInput
+    :raises HTTPException: 404 for an unknown template, 422 for wrong variables
+    :return: Prompt to send, a `RenderedPrompt` if it came from a template
+    :rtype: Optional[str]
+    """
+    if user_input.template_id is None:
+        return user_input.prompt
+    return await run_in_threadpool(resolve_prompt, user_input)
+
+
+def logged_user_input(
+    prompt: Optional[str], user_input: Optional[str]
+) -> Optional[str]:
+    """
+    What to write to the `user_input` column of a request's DB record
+
+    :param prompt: Prompt that was sent
+    :type prompt: Optional[str]
+    :param user_input: What would be logged for a prompt that wasn't templated
+    :type user_input: Optional[str]
+    :return: The template and variables for a rendered prompt, else user_input
+    :rtype: Optional[str]
+    """
+    if isinstance(prompt, RenderedPrompt):
+        return prompt.log_input
+    return user_input
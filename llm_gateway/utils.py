@@ -15,55 +15,396 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import inspect
+import time
 import traceback
+from collections import Counter
 from functools import wraps
-from typing import Any, Callable, Iterator, List
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
 
 from fastapi import HTTPException
 
+from llm_gateway.constants import get_settings
 from llm_gateway.logger import get_logger
+from llm_gateway.metrics import metrics
+from llm_gateway.pii_scrubber import (
+    PIISpan,
+    find_pii_spans,
+    find_pii_tail,
+    redact_pii_spans,
+)
+from llm_gateway.retries import (
+    backoff_delay,
+    get_deadline,
+    get_retry_budget,
+    retry_after,
+)
+from llm_gateway.streaming import CancellableStream, coalesce_stream, format_sse
 
 logger = get_logger(__name__)
 
 
-def max_retries(times: int, exceptions: tuple = (Exception,)):
+def max_retries(
+    times: int,
+    exceptions: tuple = (Exception,),
+    provider: Optional[str] = None,
+    is_retryable: Optional[Callable[[Exception], bool]] = None,
+):
     """
     Max Retry Decorator
-    Retries the wrapped function/method `times` times
-    :param times: The max number of times to repeat the wrapped function/method
+    Retries the wrapped function/method up to `times` times, awaiting it if it is
+    a coroutine function
+
+    Each retry waits a random time, up to a ceiling that doubles every attempt
+    ("full jitter", see `llm_gateway.retries.backoff_delay`), and at least as long
+    as the error's Retry-After hint. It gives up (raising the last error) instead
+    of retrying past the request's deadline, or when the process-wide retry budget
+    has run out.
+    :param times: The max number of times to retry the wrapped function/method
     :type times: int
-    :param Exceptions: Lists of exceptions that trigger a retry attempt
-    :type Exceptions: List of Exceptions
+    :param exceptions: Exceptions that trigger a retry attempt
+    :type exceptions: tuple
+    :param provider: Provider to label the retry metrics with, defaults to None
+    :type provider: Optional[str]
+    :param is_retryable: Whether one of `exceptions` is worth retrying (i.e. not an
+        authentication error), defaults to None (all of them are)
+    :type is_retryable: Optional[Callable[[Exception], bool]]
     """
 
+    def retry_delay(func: Callable, e: Exception, attempt: int, deadline: float):
+        """
+        Seconds to wait before retrying after the `attempt`th failure, or None to
+        give up
+        """
+        settings = get_settings()
+        labels = {"provider": provider or "unknown"}
+        reason = None
+        delay = None
+        if is_retryable is not None and not is_retryable(e):
+            reason = "non_retryable"
+        elif attempt > times:
+            reason = "attempts"
+        else:
+            delay = backoff_delay(
+                attempt, settings.RETRY_BACKOFF_BASE, settings.RETRY_BACKOFF_MAX
+            )
+            hint = retry_after(e)
+            if hint is not None:
+                delay = max(delay, hint)
+            if time.monotonic() + delay >= deadline:
+                reason = "deadline"
+            elif not get_retry_budget().try_retry():
+                reason = "budget"
+        if reason is not None:
+            metrics.increment("retries.given_up", reason=reason, **labels)
+            return None
+
+        metrics.increment("retries.attempts", exception=type(e).__name__, **labels)
+        logger.error(
+            f"Exception '{e}' thrown when running '{func}'"
+            + f"(attempt {attempt} of {times + 1}, retrying in {delay:.2f}s)"
+        )
+        return delay
+
+    def start_deadline() -> float:
+        get_retry_budget().record_request()
+        deadline = get_deadline()
+        if deadline is None:
+            deadline = time.monotonic() + get_settings().RETRY_DEADLINE
+        return deadline
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def anewfn(*args, **kwargs):
+                deadline = start_deadline()
+                attempt = 0
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except exceptions as e:
+                        attempt += 1
+                        delay = retry_delay(func, e, attempt, deadline)
+                        if delay is None:
+                            raise
+                    await asyncio.sleep(delay)
+
+            return anewfn
+
+        @wraps(func)
         def newfn(*args, **kwargs):
+            deadline = start_deadline()
             attempt = 0
-            while attempt < times:
+            while True:
                 try:
                     return func(*args, **kwargs)
                 except exceptions as e:
-                    logger.error(
-                        f"Exception '{e}' thrown when running '{func}'"
-                        + f"(attempt {attempt} of {times} times)"
-                    )
                     attempt += 1
-            return func(*args, **kwargs)
+                    delay = retry_delay(func, e, attempt, deadline)
+                    if delay is None:
+                        raise
+                time.sleep(delay)
 
         return newfn
 
     return decorator
 
 
+class StreamScrubber:
+    """
+    Scrub PII from text that arrives in chunks, i.e. streamed model output
+
+    Each chunk releases everything that can no longer be part of a match, already
+    scrubbed, and holds back only the tail that could still turn into one (see
+    `find_pii_tail`). Every chunk is scanned together with the held back tail,
+    which is capped at `max_holdback` characters, so the total work is linear in
+    the length of the stream.
+    """
+
+    def __init__(self, max_holdback: Optional[int] = None) -> None:
+        if max_holdback is None:
+            max_holdback = get_settings().PII_SCRUB_STREAM_MAX_HOLDBACK
+        self.max_holdback = max_holdback
+        self.redaction_counts = Counter()
+        self._pending = ""
+        # last character released, so the patterns see the word boundary before
+        # the held back text
+        self._context = ""
+
+    @property
+    def held_back(self) -> int:
+        return len(self._pending)
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a chunk of the stream
+
+        :param chunk: Next chunk of text
+        :type chunk: str
+        :return: Scrubbed text that is safe to release, possibly empty
+        :rtype: str
+        """
+        self._pending += chunk
+        floor = max(0, len(self._pending) - self.max_holdback)
+        return self._release(find_pii_tail(self._pending, floor), floor)
+
+    def flush(self) -> str:
+        """
+        End the stream
+
+        :return: Whatever was still held back, scrubbed
+        :rtype: str
+        """
+        end = len(self._pending)
+        return self._release(end, end)
+
+    def _release(self, release: int, floor: int) -> str:
+        if release == 0:
+            return ""
+
+        offset = len(self._context)
+        spans = []
+        text = self._context + self._pending
+        for start, end, kind in find_pii_spans(text, pos=offset):
+            start, end = start - offset, end - offset
+            if start >= release:
+                break
+            if end > release:
+                # The match runs into the held back tail, so it could still grow.
+                # Hold it back too, unless that would go over `max_holdback`.
+                if start >= floor:
+                    release = start
+                    break
+                release = end
+            spans.append(PIISpan(start, end, kind))
+            self.redaction_counts[kind] += 1
+
+        if release == 0:
+            return ""
+        released = self._pending[:release]
+        self._context = released[-1]
+        self._pending = self._pending[release:]
+        return redact_pii_spans(released, spans)
+
+
+class StreamEnd(NamedTuple):
+    """
+    Yielded last by a `stream_processor` that knows why the stream ended or how
+    much it used of the provider's quota
+    """
+
+    finish_reason: Optional[str] = None
+    usage: Optional[dict] = None
+
+
+async def astream_items(
+    items: AsyncIterator[Union[str, StreamEnd]]
+) -> AsyncIterator[Union[str, StreamEnd]]:
+    """
+    `stream_processor` of a stream whose items are already text and a `StreamEnd`,
+    i.e. one shared by `llm_gateway.singleflight.Flight`
+    """
+    async for item in items:
+        yield item
+
+
 class StreamProcessor:
-    def __init__(self, stream_processor: Callable) -> None:
+    def __init__(
+        self,
+        stream_processor: Callable,
+        scrub_output: bool = False,
+        provider: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        close_upstream: Optional[Callable[[], None]] = None,
+        on_complete: Optional[Callable[["StreamProcessor"], None]] = None,
+    ) -> None:
         self.stream_processor = stream_processor
         self.cached_streamed_response = []
+        self.scrubber = StreamScrubber() if scrub_output else None
+        self.end = StreamEnd()
+        # chunks of text from the provider, about one per token
+        self.chunks = 0
+        self.first_chunk_at: Optional[float] = None
+        # for `cancel`
+        self.provider = provider
+        self.max_tokens = max_tokens
+        self.close_upstream = close_upstream
+        # called once an async stream has been returned in full
+        self.on_complete = on_complete
+        # how the stream ended, filled in once it has, for the logs
+        self.metadata = {}
 
     def process_stream(self, response: Iterator) -> Iterator:
         for item in self.stream_processor(response):
-            self.cached_streamed_response.append(item)
+            if (item := self._process_item(item)) is not None:
+                yield item
+
+        if item := self._finish():
+            yield item
+
+    async def aprocess_stream(self, response: AsyncIterator) -> AsyncIterator:
+        """
+        Version of `process_stream` for the streams of async clients, which needs
+        `stream_processor` to be an async generator function
+        """
+        async for item in self.stream_processor(response):
+            if (item := self._process_item(item)) is not None:
+                yield item
+
+        if not self.metadata:
+            self.metadata.update(
+                cancelled=False,
+                finish_reason=self.end.finish_reason,
+                completion_chunks=self.chunks,
+            )
+        if item := self._finish():
             yield item
+        if self.on_complete is not None and not self.metadata["cancelled"]:
+            self.on_complete(self)
+
+    def cancellable(self, stream: AsyncIterator) -> CancellableStream:
+        """
+        Let the response cancel `stream`, one of this processor's async streams
+        """
+        return CancellableStream(stream, self.cancel)
+
+    def cancel(self) -> None:
+        """
+        Stop a stream that is no longer wanted, i.e. because the client went away:
+        close the upstream response so the provider stops generating, and note how
+        far it got in `metadata`
+        """
+        if self.metadata:
+            # it already ended
+            return
+        self.metadata.update(cancelled=True, completion_chunks=self.chunks)
+        if self.close_upstream is not None:
+            self.close_upstream()
+        metrics.increment("streams.cancelled", provider=self.provider)
+        if self.max_tokens is not None:
+            # at most, the model could have stopped sooner anyway
+            metrics.increment(
+                "streams.tokens_saved",
+                max(0, self.max_tokens - self.chunks),
+                provider=self.provider,
+            )
+
+    async def aprocess_stream_sse(self, response: AsyncIterator) -> AsyncIterator:
+        """
+        Version of `aprocess_stream` that streams server-sent events: the text in
+        batches (see `coalesce_stream`) as `{"text": ...}`, then an "end" event with
+        why the stream ended, usage and timing
+
+        :param response: Stream from an async client
+        :type response: AsyncIterator
+        :return: Encoded events
+        :rtype: AsyncIterator[bytes]
+        """
+        settings = get_settings()
+        started = time.perf_counter()
+        characters = 0
+        async for text in coalesce_stream(
+            self.aprocess_stream(response),
+            interval=settings.STREAM_SSE_COALESCE_INTERVAL,
+            max_chars=settings.STREAM_SSE_COALESCE_MAX_CHARS,
+        ):
+            characters += len(text)
+            yield format_sse({"text": text})
+
+        finished = time.perf_counter()
+        first_chunk = finished if self.first_chunk_at is None else self.first_chunk_at
+        yield format_sse(
+            {
+                "finish_reason": self.end.finish_reason,
+                "usage": {
+                    "completion_chunks": self.chunks,
+                    "completion_characters": characters,
+                    **(self.end.usage or {}),
+                },
+                "timing": {
+                    "first_chunk_ms": round((first_chunk - started) * 1e3, 1),
+                    "duration_ms": round((finished - started) * 1e3, 1),
+                },
+            },
+            event="end",
+        )
+
+    def _process_item(self, item: str | StreamEnd) -> Optional[str]:
+        """
+        Cache an item of the stream, returning what to yield or None to skip it
+        """
+        if isinstance(item, StreamEnd):
+            self.end = item
+            return None
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.perf_counter()
+        self.chunks += 1
+        if self.scrubber is not None:
+            item = self.scrubber.feed(item)
+            if not item:
+                return None
+        self.cached_streamed_response.append(item)
+        return item
+
+    def _finish(self) -> Optional[str]:
+        """
+        Cache the end of the stream, returning what to yield or None
+        """
+        if self.scrubber is not None and (item := self.scrubber.flush()):
+            self.cached_streamed_response.append(item)
+            return item
+        return None
 
     def get_cached_streamed_response(self) -> List[str]:
         return self.cached_streamed_response
@@ -85,21 +426,36 @@ def reraise_500(func: Callable) -> Callable:
     :rtype: Callable
     """
 
+    def handle_exception(e: Exception) -> None:
+        # If the route is already raising a specific HTTPException,
+        # use it instead of overriding with our 500 code
+        if isinstance(e, HTTPException):
+            raise e
+        else:
+            logger.error(traceback.format_exc())
+            raise HTTPException(
+                status_code=500,
+                detail=f"Internal error due to: {str(e)}",
+            )
+
+    if inspect.iscoroutinefunction(func):
+
+        # stops function signature from being overwritten
+        @wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: dict) -> None:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                handle_exception(e)
+
+        return async_wrapper
+
     # stops function signature from being overwritten
     @wraps(func)
     def wrapper(*args: Any, **kwargs: dict) -> None:
         try:
             return func(*args, **kwargs)
         except Exception as e:
-            # If the route is already raising a specific HTTPException,
-            # use it instead of overriding with our 500 code
-            if isinstance(e, HTTPException):
-                raise e
-            else:
-                logger.error(traceback.format_exc())
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Internal error due to: {str(e)}",
-                )
+            handle_exception(e)
 
     return wrapper
@@ -0,0 +1,526 @@
+import asyncio
+import base64
+import json
+import struct
+from binascii import crc32
+from unittest.mock import patch
+
+import pytest
+from aiohttp import web
+from botocore.exceptions import ClientError
+
+from llm_gateway.circuit_breaker import CircuitOpenError, reset_circuit_breakers
+from llm_gateway.constants import get_settings
+from llm_gateway.embedding_cache import get_embedding_cache
+from llm_gateway.hedging import get_latency_windows, reset_latency_windows
+from llm_gateway.providers import awsbedrock
+from llm_gateway.providers.awsbedrock import (
+    AI21_J2_MID_V1,
+    ANTHROPIC_CLAUDE_V2_1,
+    COHERE_EMBED_ENGLISH_V3,
+    AWSBedrockWrapper,
+)
+from llm_gateway.rate_limiter import RateLimitedError
+from llm_gateway.response_cache import get_response_cache
+
+
+async def _serve_bedrock(handler):
+    app = web.Application()
+    app.router.add_post("/model/{model_id}/invoke", handler)
+    app.router.add_post("/model/{model_id}/invoke-with-response-stream", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def _asend(handler, **kwargs):
+    runner, endpoint_url = await _serve_bedrock(handler)
+    try:
+        with patch.multiple(
+            awsbedrock.settings,
+            AWS_REGION="us-east-1",
+            AWS_PUBLIC_ACCESS_KEY="AKIDEXAMPLE",
+            AWS_PRIVATE_ACCESS_KEY="secret",
+            AWS_BEDROCK_ENDPOINT_URL=endpoint_url,
+        ):
+            wrapper = AWSBedrockWrapper()
+        try:
+            resp, logs = await wrapper.asend_awsbedrock_request(
+                max_tokens=10,
+                **{
+                    "awsbedrock_module": "Text",
+                    "model": ANTHROPIC_CLAUDE_V2_1,
+                    **kwargs,
+                },
+            )
+            if kwargs.get("stream"):
+                resp = [text async for text in resp]
+            return resp, logs
+        finally:
+            wrapper.close()
+            await wrapper.aclose()
+    finally:
+        await runner.cleanup()
+
+
+def test_asend_awsbedrock_request_signs_request():
+    requests = []
+
+    async def handler(request: web.Request) -> web.Response:
+        requests.append((request.match_info["model_id"], request.headers))
+        requests.append(await request.json())
+        return web.json_response({"completion": "ok"})
+
+    resp, logs = asyncio.run(_asend(handler, prompt="call me at 416-555-0199"))
+
+    assert resp == {"completion": "ok"}
+    (model_id, headers), body = requests
+    assert model_id == ANTHROPIC_CLAUDE_V2_1
+    assert headers["Authorization"].startswith(
+        "AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/"
+    )
+    assert "/us-east-1/bedrock/aws4_request" in headers["Authorization"]
+    assert "[REDACTED PHONE NUMBER]" in body["prompt"]
+    assert logs["awsbedrock_response"] == resp
+    assert logs["gateway_metadata"] == {"pii_redactions": {"phone_number": 1}}
+
+
+def test_asend_awsbedrock_request_error():
+    async def handler(request: web.Request) -> web.Response:
+        return web.json_response(
+            {"message": "Malformed input request"},
+            status=400,
+            headers={"x-amzn-ErrorType": "ValidationException:http://internal"},
+        )
+
+    with patch("llm_gateway.utils.logger"), pytest.raises(ClientError) as e:
+        asyncio.run(_asend(handler, prompt="hello"))
+
+    assert e.value.response["Error"] == {
+        "Code": "ValidationException",
+        "Message": "Malformed input request",
+    }
+    assert e.value.response["ResponseMetadata"]["HTTPStatusCode"] == 400
+
+
+def _event_message(headers: dict, payload: dict) -> bytes:
+    """
+    Encode a message of an `application/vnd.amazon.eventstream` body
+    """
+    encoded_headers = b"".join(
+        struct.pack("B", len(name)) + name.encode()
+        # string header
+        + struct.pack("!BH", 7, len(value)) + value.encode()
+        for name, value in headers.items()
+    )
+    encoded_payload = json.dumps(payload).encode()
+    prelude = struct.pack(
+        "!II", 16 + len(encoded_headers) + len(encoded_payload), len(encoded_headers)
+    )
+    message = (
+        prelude + struct.pack("!I", crc32(prelude)) + encoded_headers + encoded_payload
+    )
+    return message + struct.pack("!I", crc32(message))
+
+
+def _chunk_message(chunk: dict) -> bytes:
+    return _event_message(
+        {":message-type": "event", ":event-type": "chunk"},
+        {"bytes": base64.b64encode(json.dumps(chunk).encode()).decode()},
+    )
+
+
+def test_asend_awsbedrock_request_stream():
+    paths = []
+
+    async def handler(request: web.Request) -> web.StreamResponse:
+        paths.append(request.path)
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/vnd.amazon.eventstream"}
+        )
+        await response.prepare(request)
+        await response.write(
+            _chunk_message({"completion": "Hello", "stop_reason": None})
+        )
+        # messages can be split across reads
+        last = _chunk_message(
+            {
+                "completion": " world",
+                "stop_reason": "stop_sequence",
+                "amazon-bedrock-invocationMetrics": {
+                    "inputTokenCount": 3,
+                    "outputTokenCount": 2,
+                },
+            }
+        )
+        await response.write(last[:10])
+        await response.write(last[10:])
+        return response
+
+    resp, logs = asyncio.run(_asend(handler, prompt="hello", stream=True))
+
+    assert paths == [f"/model/{ANTHROPIC_CLAUDE_V2_1}/invoke-with-response-stream"]
+    assert "".join(resp) == "Hello world"
+    assert logs["awsbedrock_response"] == ["Hello", " world"]
+    assert logs["gateway_metadata"]["stream"] == {
+        "cancelled": False,
+        "finish_reason": "stop_sequence",
+        "completion_chunks": 2,
+    }
+
+
+def test_asend_awsbedrock_request_stream_exception_event():
+    async def handler(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(
+            _event_message(
+                {
+                    ":message-type": "exception",
+                    ":exception-type": "throttlingException",
+                },
+                {"message": "Too many requests"},
+            )
+        )
+        return response
+
+    with pytest.raises(ClientError) as e:
+        asyncio.run(_asend(handler, prompt="hello", stream=True))
+
+    assert e.value.response["Error"] == {
+        "Code": "throttlingException",
+        "Message": "Too many requests",
+    }
+
+
+def test_asend_awsbedrock_request_stream_unstreamable_model():
+    paths = []
+
+    async def handler(request: web.Request) -> web.Response:
+        paths.append(request.path)
+        return web.json_response(
+            {
+                "completions": [
+                    {
+                        "data": {"text": "Hi there"},
+                        "finishReason": {"reason": "endoftext"},
+                    }
+                ]
+            }
+        )
+
+    resp, logs = asyncio.run(
+        _asend(handler, prompt="hello", model=AI21_J2_MID_V1, stream=True)
+    )
+
+    # Bedrock can't stream Jurassic-2, so it's invoked and sent as one chunk
+    assert paths == [f"/model/{AI21_J2_MID_V1}/invoke"]
+    assert resp == ["Hi there"]
+    assert logs["gateway_metadata"]["stream"]["finish_reason"] == "endoftext"
+
+
+def test_asend_awsbedrock_request_circuit_breaker():
+    calls = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal calls
+        calls += 1
+        return web.json_response(
+            {"message": "Service unavailable"},
+            status=503,
+            headers={"x-amzn-ErrorType": "ServiceUnavailableException"},
+        )
+
+    async def send_times(times: int):
+        runner, endpoint_url = await _serve_bedrock(handler)
+        errors = []
+        try:
+            with patch.multiple(
+                awsbedrock.settings,
+                AWS_REGION="us-east-1",
+                AWS_PUBLIC_ACCESS_KEY="AKIDEXAMPLE",
+                AWS_PRIVATE_ACCESS_KEY="secret",
+                AWS_BEDROCK_ENDPOINT_URL=endpoint_url,
+            ):
+                wrapper = AWSBedrockWrapper()
+            for _ in range(times):
+                try:
+                    await wrapper.asend_awsbedrock_request(
+                        awsbedrock_module="Text",
+                        model=ANTHROPIC_CLAUDE_V2_1,
+                        prompt="hello",
+                    )
+                except Exception as e:
+                    errors.append(e)
+            await wrapper.aclose()
+        finally:
+            await runner.cleanup()
+        return errors
+
+    reset_circuit_breakers()
+    with patch("llm_gateway.utils.logger"), patch("llm_gateway.utils.asyncio.sleep"):
+        errors = asyncio.run(send_times(3))
+    reset_circuit_breakers()
+
+    # 4 attempts of the first request and 1 of the second open the breaker, then
+    # requests fail fast
+    assert calls == 5
+    assert isinstance(errors[0], ClientError)
+    assert all(isinstance(e, CircuitOpenError) for e in errors[1:])
+    assert errors[-1].headers == {"Retry-After": "30"}
+
+
+def test_asend_awsbedrock_request_hedged():
+    requests = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal requests
+        requests += 1
+        if requests == 1:
+            await asyncio.sleep(1)
+        return web.json_response({"completion": f"request {requests}"})
+
+    reset_latency_windows()
+    call_latencies, _ = get_latency_windows("awsbedrock", ANTHROPIC_CLAUDE_V2_1)
+    for _ in range(20):
+        call_latencies.record(0.05)
+    resp, logs = asyncio.run(_asend(handler, prompt="hello", hedge=True))
+    reset_latency_windows()
+
+    assert resp == {"completion": "request 2"}
+    assert logs["gateway_metadata"]["hedge"] == {"hedged": True, "winner": "hedge"}
+
+
+def test_asend_awsbedrock_request_batches_embeddings():
+    requests = []
+
+    async def handler(request: web.Request) -> web.Response:
+        body = await request.json()
+        requests.append(body)
+        return web.json_response(
+            {
+                "id": "1",
+                "embeddings": [[float(len(text))] for text in body["texts"]],
+                "texts": body["texts"],
+                "response_type": "embeddings_floats",
+            }
+        )
+
+    async def send_concurrently():
+        runner, endpoint_url = await _serve_bedrock(handler)
+        try:
+            with patch.multiple(
+                awsbedrock.settings,
+                AWS_REGION="us-east-1",
+                AWS_PUBLIC_ACCESS_KEY="AKIDEXAMPLE",
+                AWS_PRIVATE_ACCESS_KEY="secret",
+                AWS_BEDROCK_ENDPOINT_URL=endpoint_url,
+            ):
+                wrapper = AWSBedrockWrapper()
+            results = await asyncio.gather(
+                *(
+                    wrapper.asend_awsbedrock_request(
+                        awsbedrock_module="Embed",
+                        model=COHERE_EMBED_ENGLISH_V3,
+                        embedding_texts=texts,
+                    )
+                    for texts in (["a"], ["bb", "ccc"], ["dddd"])
+                )
+            )
+            await wrapper.aclose()
+        finally:
+            await runner.cleanup()
+        return results
+
+    get_embedding_cache.cache_clear()
+    with patch.object(get_settings(), "EMBEDDING_BATCHING", True):
+        results = asyncio.run(send_concurrently())
+
+    assert requests == [
+        {"texts": ["a", "bb", "ccc", "dddd"], "input_type": "search_document"}
+    ]
+    (resp_a, logs_a), (resp_bc, _), (resp_d, _) = results
+    assert resp_a["embeddings"] == [[1.0]]
+    assert resp_bc["embeddings"] == [[2.0], [3.0]]
+    assert resp_bc["texts"] == ["bb", "ccc"]
+    assert resp_d["embeddings"] == [[4.0]]
+    assert logs_a["gateway_metadata"]["batch"]["requests"] == 3
+    assert logs_a["gateway_metadata"]["batch"]["texts"] == 4
+
+
+def test_asend_awsbedrock_request_caches_embeddings():
+    requests = []
+
+    async def handler(request: web.Request) -> web.Response:
+        body = await request.json()
+        requests.append(body["texts"])
+        return web.json_response(
+            {
+                "id": str(len(requests)),
+                "embeddings": [[float(len(text))] for text in body["texts"]],
+                "texts": body["texts"],
+                "response_type": "embeddings_floats",
+            }
+        )
+
+    async def embed(*texts: list):
+        return [
+            await _asend(
+                handler,
+                awsbedrock_module="Embed",
+                model=COHERE_EMBED_ENGLISH_V3,
+                embedding_texts=request_texts,
+            )
+            for request_texts in texts
+        ]
+
+    get_embedding_cache.cache_clear()
+    (first, first_logs), (second, second_logs) = asyncio.run(
+        embed(["a", "bb"], ["ccc", "a", "dddd"])
+    )
+    get_embedding_cache.cache_clear()
+
+    assert requests == [["a", "bb"], ["ccc", "dddd"]]
+    assert first == {
+        "id": "1",
+        "embeddings": [[1.0], [2.0]],
+        "texts": ["a", "bb"],
+        "response_type": "embeddings_floats",
+    }
+    assert first_logs["gateway_metadata"]["embedding_cache"] == {
+        "hits": 0,
+        "misses": 2,
+    }
+    assert second["embeddings"] == [[3.0], [1.0], [4.0]]
+    assert second["texts"] == ["ccc", "a", "dddd"]
+    assert second_logs["gateway_metadata"]["embedding_cache"] == {
+        "hits": 1,
+        "misses": 2,
+    }
+
+
+def test_asend_awsbedrock_request_caches_responses():
+    calls = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal calls
+        calls += 1
+        return web.json_response({"completion": f"call {calls}"})
+
+    async def send_twice(**kwargs):
+        return [await _asend(handler, prompt="hello", **kwargs) for _ in range(2)]
+
+    get_response_cache.cache_clear()
+    with patch.object(get_settings(), "RESPONSE_CACHE", True):
+        (first, first_logs), (second, second_logs) = asyncio.run(send_twice())
+        # different parameters aren't the same request
+        asyncio.run(_asend(handler, prompt="hello", top_p=0.5))
+        assert calls == 2
+        (_, logs), _ = asyncio.run(send_twice(temperature=0.5))
+    get_response_cache.cache_clear()
+
+    assert first == second == {"completion": "call 1"}
+    assert first_logs["gateway_metadata"]["cache"] == "miss"
+    assert second_logs["gateway_metadata"]["cache"] == "hit"
+    assert second_logs["awsbedrock_response"] == second
+    assert calls == 4
+    assert "cache" not in logs["gateway_metadata"]
+
+
+def test_asend_awsbedrock_request_replays_cached_stream():
+    calls = 0
+
+    async def handler(request: web.Request) -> web.StreamResponse:
+        nonlocal calls
+        calls += 1
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/vnd.amazon.eventstream"}
+        )
+        await response.prepare(request)
+        await response.write(
+            _chunk_message({"completion": "Hello", "stop_reason": None})
+        )
+        await response.write(
+            _chunk_message({"completion": " world", "stop_reason": "stop_sequence"})
+        )
+        return response
+
+    async def stream_twice():
+        return [await _asend(handler, prompt="hello", stream=True) for _ in range(2)]
+
+    get_response_cache.cache_clear()
+    with patch.object(get_settings(), "RESPONSE_CACHE", True):
+        (first, _), (second, logs) = asyncio.run(stream_twice())
+    get_response_cache.cache_clear()
+
+    assert calls == 1
+    assert "".join(first) == "".join(second) == "Hello world"
+    assert logs["gateway_metadata"]["cache"] == "hit"
+    assert logs["gateway_metadata"]["stream"]["finish_reason"] == "stop_sequence"
+    assert logs["awsbedrock_response"] == ["Hello world"]
+
+
+def test_asend_awsbedrock_request_shares_identical_requests_in_flight():
+    calls = 0
+
+    async def handler(request: web.Request) -> web.StreamResponse:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        if not request.path.endswith("/invoke-with-response-stream"):
+            return web.json_response({"completion": "Hello world"})
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/vnd.amazon.eventstream"}
+        )
+        await response.prepare(request)
+        await response.write(
+            _chunk_message({"completion": "Hello", "stop_reason": None})
+        )
+        await response.write(
+            _chunk_message({"completion": " world", "stop_reason": "stop_sequence"})
+        )
+        return response
+
+    async def send_together(**kwargs):
+        return await asyncio.gather(
+            *(_asend(handler, prompt="hello", **kwargs) for _ in range(3))
+        )
+
+    with patch.object(get_settings(), "SINGLEFLIGHT", True):
+        results = asyncio.run(send_together())
+        assert calls == 1
+        streams = asyncio.run(send_together(stream=True))
+        assert calls == 2
+        asyncio.run(send_together(temperature=0.5))
+        assert calls == 5
+
+    assert [resp for resp, _ in results] == [{"completion": "Hello world"}] * 3
+    assert ["".join(resp) for resp, _ in streams] == ["Hello world"] * 3
+    roles = [logs["gateway_metadata"].get("singleflight") for _, logs in streams]
+    assert roles.count("follower") == 2
+    assert [logs["awsbedrock_response"] for _, logs in streams] == [
+        ["Hello", " world"]
+    ] * 3
+
+
+def test_asend_awsbedrock_request_rate_limits_calls():
+    calls = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal calls
+        calls += 1
+        return web.json_response({"completion": "ok"})
+
+    async def send_twice():
+        await _asend(handler, prompt="hello")
+        await _asend(handler, prompt="hello again")
+
+    with patch.object(get_settings(), "RATE_LIMIT_RPM", {"awsbedrock": 1}):
+        with pytest.raises(RateLimitedError) as e:
+            asyncio.run(send_twice())
+
+    assert calls == 1
+    assert e.value.status_code == 429
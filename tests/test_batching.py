@@ -0,0 +1,144 @@
+import asyncio
+
+import openai
+
+from llm_gateway.batching import EmbeddingBatcher, split_usage
+from llm_gateway.metrics import metrics
+from llm_gateway.providers.openai import split_openai_embeddings
+
+
+class FakeEmbed:
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, model: str, texts: list):
+        self.calls.append(texts)
+        await asyncio.sleep(0)
+        if self.fail:
+            raise ConnectionError("failed")
+        return [len(text) for text in texts]
+
+
+def split(response: list, texts: list) -> list:
+    parts = []
+    start = 0
+    for request_texts in texts:
+        end = start + len(request_texts)
+        parts.append(response[start:end])
+        start = end
+    return parts
+
+
+def _batcher(embed, max_batch_size=100, max_delay=0.01) -> EmbeddingBatcher:
+    return EmbeddingBatcher(
+        "model",
+        embed,
+        split,
+        max_batch_size=max_batch_size,
+        max_delay=max_delay,
+        provider="fake",
+    )
+
+
+def test_embedding_batcher_merges_concurrent_requests():
+    metrics.reset()
+    embed = FakeEmbed()
+
+    async def submit_all():
+        batcher = _batcher(embed)
+        return await asyncio.gather(
+            batcher.submit(["a"]), batcher.submit(["bb", "ccc"]), batcher.submit([""])
+        )
+
+    results = asyncio.run(submit_all())
+
+    assert embed.calls == [["a", "bb", "ccc", ""]]
+    assert [part for part, _ in results] == [[1], [2, 3], [0]]
+    _, batch = results[0]
+    assert batch["requests"] == 3
+    assert batch["texts"] == 4
+    assert batch["queue_delay_ms"] >= 0
+    summaries = metrics.snapshot()["summaries"]
+    assert summaries["embedding_batch.requests{model=model,provider=fake}"]["max"] == 3
+
+
+def test_embedding_batcher_flushes_full_batch():
+    embed = FakeEmbed()
+
+    async def submit_all():
+        # wouldn't flush on time within the test
+        batcher = _batcher(embed, max_batch_size=3, max_delay=60)
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.submit(["a", "b"]), batcher.submit(["c"])),
+            timeout=5,
+        )
+
+    results = asyncio.run(submit_all())
+
+    assert embed.calls == [["a", "b", "c"]]
+    assert [part for part, _ in results] == [[1, 1], [1]]
+
+
+def test_embedding_batcher_starts_new_batch_when_request_doesnt_fit():
+    embed = FakeEmbed()
+
+    async def submit_all():
+        batcher = _batcher(embed, max_batch_size=3)
+        return await asyncio.gather(
+            batcher.submit(["a", "b"]), batcher.submit(["c", "d"])
+        )
+
+    results = asyncio.run(submit_all())
+
+    assert embed.calls == [["a", "b"], ["c", "d"]]
+    assert [part for part, _ in results] == [[1, 1], [1, 1]]
+
+
+def test_embedding_batcher_fails_every_request_of_failed_batch():
+    embed = FakeEmbed(fail=True)
+
+    async def submit_all():
+        batcher = _batcher(embed)
+        return await asyncio.gather(
+            batcher.submit(["a"]), batcher.submit(["b"]), return_exceptions=True
+        )
+
+    results = asyncio.run(submit_all())
+
+    assert len(embed.calls) == 1
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+def test_split_usage():
+    assert split_usage(10, [1, 1]) == [5, 5]
+    assert split_usage(10, [1, 2]) == [3, 7]
+    assert split_usage(10, [1, 1, 1]) == [4, 3, 3]
+    assert split_usage(3, [0, 0]) == [2, 1]
+    assert sum(split_usage(101, [7, 13, 29])) == 101
+
+
+def test_split_openai_embeddings():
+    response = openai.util.convert_to_openai_object(
+        {
+            "object": "list",
+            "model": "text-embedding-ada-002",
+            "data": [
+                {"object": "embedding", "index": index, "embedding": [float(index)]}
+                for index in (2, 0, 1)
+            ],
+            "usage": {"prompt_tokens": 9, "total_tokens": 9},
+        }
+    )
+
+    first, second = split_openai_embeddings(response, [["aa"], ["b", "cccc"]])
+
+    assert first.to_dict_recursive() == {
+        "object": "list",
+        "model": "text-embedding-ada-002",
+        "data": [{"object": "embedding", "index": 0, "embedding": [0.0]}],
+        "usage": {"prompt_tokens": 3, "total_tokens": 3},
+    }
+    assert [item["embedding"] for item in second["data"]] == [[1.0], [2.0]]
+    assert [item["index"] for item in second["data"]] == [0, 1]
+    assert second["usage"]["prompt_tokens"] == 6
@@ -0,0 +1,39 @@
+from llm_gateway.cache import LRUCache
+from llm_gateway.metrics import metrics
+
+
+def test_lru_cache_evicts_least_recently_used():
+    metrics.reset()
+    cache = LRUCache("test", max_bytes=30)
+    cache.set("a", "A", size=10)
+    cache.set("b", "B", size=10)
+    cache.set("c", "C", size=10)
+
+    # touch "a" so that "b" is the least recently used entry
+    assert cache.get("a") == "A"
+    cache.set("d", "D", size=10)
+
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+    assert cache.current_bytes == 30
+    assert metrics.get_counter("cache.evictions", cache="test") == 1
+    assert metrics.get_counter("cache.hits", cache="test") == 4
+    assert metrics.get_counter("cache.misses", cache="test") == 1
+
+
+def test_lru_cache_skips_entries_larger_than_cache():
+    cache = LRUCache("test", max_bytes=10)
+    cache.set("a", "A", size=11)
+
+    assert cache.get("a") is None
+    assert cache.current_bytes == 0
+
+
+def test_lru_cache_replaces_existing_key():
+    cache = LRUCache("test", max_bytes=100)
+    cache.set("a", "A", size=10)
+    cache.set("a", "AA", size=20)
+
+    assert cache.get("a") == "AA"
+    assert len(cache) == 1
+    assert cache.current_bytes == 20
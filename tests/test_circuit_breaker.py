@@ -0,0 +1,191 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from openai.error import APIError, InvalidRequestError
+
+from llm_gateway.app import app
+from llm_gateway.circuit_breaker import (
+    CircuitBreaker,
+    CircuitOpenError,
+    CircuitState,
+    circuit_breaker,
+    get_circuit_breaker,
+    get_circuit_breakers,
+    reset_circuit_breakers,
+)
+from llm_gateway.constants import get_settings
+from llm_gateway.exceptions import is_retryable_openai_error
+from llm_gateway.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def breakers():
+    reset_circuit_breakers()
+    metrics.reset()
+    yield
+    reset_circuit_breakers()
+
+
+def _breaker(**kwargs) -> CircuitBreaker:
+    return CircuitBreaker(
+        "openai",
+        "gpt-4",
+        **{
+            "failure_threshold": 3,
+            "reset_timeout": 30,
+            "half_open_probes": 2,
+            **kwargs,
+        },
+    )
+
+
+def test_circuit_breaker_opens_after_failures_in_a_row():
+    breaker = _breaker()
+    for failed in (True, True, False, True, True):
+        breaker.release(breaker.acquire(), failed)
+    assert breaker.state == CircuitState.CLOSED
+
+    breaker.release(breaker.acquire(), True)
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.acquire()
+
+    assert e.value.status_code == 503
+    assert e.value.headers == {"Retry-After": "30"}
+    assert (
+        metrics.get_counter(
+            "circuit_breaker.rejected", provider="openai", model="gpt-4"
+        )
+        == 1
+    )
+
+
+def test_circuit_breaker_half_open_probes():
+    breaker = _breaker()
+    with patch("llm_gateway.circuit_breaker.time.monotonic", return_value=100):
+        for _ in range(3):
+            breaker.release(breaker.acquire(), True)
+
+    with patch("llm_gateway.circuit_breaker.time.monotonic", return_value=130):
+        # only `half_open_probes` calls at a time
+        assert breaker.acquire() is True
+        assert breaker.acquire() is True
+        assert breaker.state == CircuitState.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.acquire()
+
+        breaker.release(True, False)
+        assert breaker.state == CircuitState.HALF_OPEN
+        breaker.release(True, False)
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.acquire() is False
+
+
+def test_circuit_breaker_reopens_when_probe_fails():
+    breaker = _breaker()
+    with patch("llm_gateway.circuit_breaker.time.monotonic", return_value=100):
+        for _ in range(3):
+            breaker.release(breaker.acquire(), True)
+
+    with patch("llm_gateway.circuit_breaker.time.monotonic", return_value=130):
+        probe = breaker.acquire()
+        # a cancelled probe says nothing about the provider
+        breaker.release(probe, None)
+        assert breaker.state == CircuitState.HALF_OPEN
+        breaker.release(breaker.acquire(), True)
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.snapshot()["retry_after"] == 30
+
+    assert (
+        metrics.get_counter("circuit_breaker.opened", provider="openai", model="gpt-4")
+        == 2
+    )
+
+
+def test_circuit_breaker_decorator():
+    call_mock = AsyncMock(side_effect=APIError("down", http_status=503))
+
+    @circuit_breaker(
+        "openai", exceptions=(APIError,), is_failure=is_retryable_openai_error
+    )
+    async def call(model: str):
+        return await call_mock()
+
+    async def call_times(times: int):
+        for _ in range(times):
+            with pytest.raises((APIError, CircuitOpenError)):
+                await call(model="gpt-4")
+
+    asyncio.run(call_times(7))
+
+    # opened after CIRCUIT_BREAKER_FAILURE_THRESHOLD failures
+    assert call_mock.await_count == 5
+    assert get_circuit_breaker("openai", "gpt-4").state == CircuitState.OPEN
+    assert get_circuit_breaker("openai", "gpt-3.5-turbo").state == CircuitState.CLOSED
+
+
+def test_circuit_breaker_decorator_ignores_request_errors():
+    call_mock = Mock(side_effect=InvalidRequestError("bad prompt", param="prompt"))
+
+    @circuit_breaker(
+        "openai", exceptions=(APIError,), is_failure=is_retryable_openai_error
+    )
+    def call(model: str):
+        return call_mock()
+
+    for _ in range(10):
+        with pytest.raises(InvalidRequestError):
+            call("gpt-4")
+
+    assert call_mock.call_count == 10
+    assert get_circuit_breaker("openai", "gpt-4").consecutive_failures == 0
+
+
+def test_circuit_breakers_admin_endpoint():
+    breaker = get_circuit_breaker("awsbedrock", "anthropic.claude-v2:1")
+    for _ in range(5):
+        breaker.release(breaker.acquire(), True)
+
+    response = TestClient(app).get("/api/admin/circuit_breakers")
+
+    assert response.status_code == 200
+    [state] = response.json()
+    assert state["provider"] == "awsbedrock"
+    assert state["model"] == "anthropic.claude-v2:1"
+    assert state["state"] == "open"
+    assert 29 < state["retry_after"] <= 30
+
+
+def test_circuit_breaker_decorator_only_keeps_breakers_of_failing_models():
+    call_mock = Mock(side_effect=InvalidRequestError("no model", param="model"))
+
+    @circuit_breaker(
+        "openai", exceptions=(APIError,), is_failure=is_retryable_openai_error
+    )
+    def call(model: str):
+        return call_mock()
+
+    for i in range(10):
+        with pytest.raises(InvalidRequestError):
+            call(f"made-up-{i}")
+    assert get_circuit_breakers() == []
+
+    call_mock.side_effect = APIError("down", http_status=503)
+    with pytest.raises(APIError):
+        call("gpt-4")
+    [breaker] = get_circuit_breakers()
+    assert breaker.model == "gpt-4"
+    assert breaker.consecutive_failures == 1
+
+
+def test_get_circuit_breaker_evicts_closed_breakers_first():
+    with patch.object(get_settings(), "CIRCUIT_BREAKER_MAX_MODELS", 2):
+        breaker = get_circuit_breaker("openai", "gpt-4")
+        for _ in range(5):
+            breaker.release(breaker.acquire(), True)
+        get_circuit_breaker("openai", "gpt-3.5-turbo")
+        get_circuit_breaker("openai", "text-davinci-003")
+
+    assert [b.model for b in get_circuit_breakers()] == ["gpt-4", "text-davinci-003"]
@@ -0,0 +1,94 @@
+import os
+from collections import Counter
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+from llm_gateway import denylist as denylist_module
+from llm_gateway.denylist import Denylist, get_denylist
+from llm_gateway.pii_scrubber import scrub_denylisted_terms, scrub_many
+
+
+@pytest.mark.parametrize(
+    argnames=["options", "test_text", "expected_terms"],
+    argvalues=[
+        ({}, "Ask ACME about Project  Falcon.", ["ACME", "Project  Falcon"]),
+        ({}, "acmecorp and falconry are other words", []),
+        ({}, "Acme Corp is longer than Acme", ["Acme Corp", "Acme"]),
+        ({"case_sensitive": True}, "ACME and Acme", ["Acme"]),
+        ({"whole_words": False}, "acmecorp", ["acme"]),
+        ({}, "İstanbul office of Acme", ["Acme"]),
+    ],
+)
+def test_denylist_find(options: dict, test_text: str, expected_terms: list):
+    """Test that terms are found with the case and word boundary options."""
+
+    denylist = Denylist(["Acme", "acme corp", "Project Falcon", "ACCT-1234"], **options)
+
+    found = [test_text[start:end] for start, end in denylist.find(test_text)]
+    assert found == expected_terms
+
+
+def test_denylist_find_many_terms():
+    """Test that thousands of distinct terms in a text are all found."""
+
+    terms = [f"Client{i} Corp" for i in range(5000)]
+    denylist = Denylist(terms + [f"#project{i}" for i in range(5000)])
+    test_text = " and ".join(f"client{i}  corp, #project{i}" for i in range(0, 5000, 2))
+
+    found = [test_text[start:end] for start, end in denylist.find(test_text)]
+    assert found == [
+        term for i in range(0, 5000, 2) for term in (f"client{i}  corp", f"#project{i}")
+    ]
+
+
+@pytest.fixture
+def denylist_file(tmp_path: Path):
+    path = tmp_path / "denylist.txt"
+    path.write_text("# client names\nAcme Corp\n\nProject Falcon\n")
+    settings = Mock(
+        PII_DENYLIST_PATH=path,
+        PII_DENYLIST_CASE_SENSITIVE=False,
+        PII_DENYLIST_WHOLE_WORDS=True,
+        PII_DENYLIST_RELOAD_INTERVAL=0,
+    )
+    with patch.object(denylist_module, "_denylist", None), patch(
+        "llm_gateway.denylist.get_settings", return_value=settings
+    ):
+        yield path
+
+
+def test_scrub_denylisted_terms(denylist_file: Path):
+    """Test that denylisted terms are scrubbed alongside other PII, and counted."""
+
+    redaction_counts = Counter()
+    [scrubbed] = scrub_many(
+        ["Acme Corp called from 123-456-7890 about project falcon"], redaction_counts
+    )
+
+    assert scrubbed == (
+        "[REDACTED TERM] called from [REDACTED PHONE NUMBER] about [REDACTED TERM]"
+    )
+    assert redaction_counts == {"denylisted_term": 2, "phone_number": 1}
+
+
+def test_denylist_hot_reload(denylist_file: Path):
+    """Test that changes to the denylist file are picked up without a restart."""
+
+    first = get_denylist()
+    assert len(first) == 2
+    assert get_denylist() is first
+
+    denylist_file.write_text("Acme Corp\nProject Falcon\nZenith\n")
+    stat = denylist_file.stat()
+    os.utime(denylist_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    second = get_denylist()
+    assert len(second) == 3
+    assert second.version == first.version + 1
+    assert scrub_denylisted_terms("Zenith") == "[REDACTED TERM]"
+
+    # a broken reload keeps the last good denylist
+    denylist_file.unlink()
+    assert get_denylist() is second
@@ -0,0 +1,72 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+from fastapi.testclient import TestClient
+
+from llm_gateway.app import app
+from llm_gateway.dependencies import (
+    aclose_provider_clients,
+    close_provider_clients,
+    get_cohere_wrapper,
+    start_provider_clients,
+)
+
+
+@patch("llm_gateway.providers.cohere.write_record_to_db")
+@patch("cohere.AsyncClient")
+@patch("cohere.Client")
+def test_provider_client_shared_across_requests(
+    mock_cohere_client, mock_cohere_async_client, _
+):
+    mock_cohere_async_client.return_value = AsyncMock()
+    mock_cohere_async_client.return_value.generate.return_value = {"text": "ok"}
+    client = TestClient(app)
+
+    try:
+        for _ in range(3):
+            response = client.post(
+                "/api/cohere/generate", json={"temperature": 0, "prompt": "hi"}
+            )
+            assert response.status_code == 200
+        wrapper = get_cohere_wrapper()
+    finally:
+        close_provider_clients()
+
+    mock_cohere_client.assert_called_once()
+    mock_cohere_async_client.assert_called_once()
+    assert mock_cohere_async_client.return_value.generate.await_count == 3
+    mock_cohere_client.return_value._executor.shutdown.assert_called_once()
+    # closed wrappers are created again when next needed
+    assert get_cohere_wrapper() is not wrapper
+    close_provider_clients()
+
+
+@patch("cohere.Client")
+def test_start_provider_clients(mock_cohere_client):
+    settings = Mock(COHERE_API_KEY=None, AWS_REGION=None)
+    with patch("llm_gateway.dependencies.get_settings", return_value=settings):
+        start_provider_clients()
+    mock_cohere_client.assert_not_called()
+
+    settings.COHERE_API_KEY = "key"
+    mock_cohere_client.side_effect = Exception("invalid api key")
+    with patch("llm_gateway.dependencies.get_settings", return_value=settings):
+        # logged, the first request tries again
+        start_provider_clients()
+    mock_cohere_client.assert_called_once()
+
+    close_provider_clients()
+
+
+@patch("cohere.AsyncClient")
+@patch("cohere.Client")
+def test_aclose_provider_clients(mock_cohere_client, mock_cohere_async_client):
+    mock_cohere_async_client.return_value = AsyncMock()
+    wrapper = get_cohere_wrapper()
+
+    asyncio.run(aclose_provider_clients())
+
+    mock_cohere_client.return_value._executor.shutdown.assert_called_once()
+    mock_cohere_async_client.return_value.close.assert_awaited_once()
+    assert get_cohere_wrapper() is not wrapper
+    close_provider_clients()
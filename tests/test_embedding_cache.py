@@ -0,0 +1,124 @@
+import asyncio
+from unittest.mock import patch
+
+import openai
+
+from llm_gateway.embedding_cache import EmbeddingCache, aembed_cached
+from llm_gateway.metrics import metrics
+from llm_gateway.providers.openai import OpenAIWrapper
+
+
+class FakeEmbed:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, texts: list):
+        self.calls.append(texts)
+        return "response", [[float(len(text)), 0.5] for text in texts]
+
+
+def test_embedding_cache_round_trips_float32():
+    cache = EmbeddingCache(max_bytes=1024)
+    cache.set_many("openai", "model", ["a", "bb"], [[0.1, 0.2], [1.0, 2.0]])
+
+    a, bb, missing = cache.get_many("openai", "model", ["a", "bb", "ccc"])
+
+    assert a == [0.10000000149011612, 0.20000000298023224]
+    assert bb == [1.0, 2.0]
+    assert missing is None
+    assert cache.get_many("openai", "other-model", ["a"]) == [None]
+
+
+def test_embedding_cache_disk_tier_survives_restart(tmp_path):
+    metrics.reset()
+    path = tmp_path / "embeddings.sqlite3"
+    cache = EmbeddingCache(max_bytes=1024, path=path)
+    cache.set_many("awsbedrock", "model", ["a", "bb"], [[1.0], [2.0]])
+    cache.close()
+
+    restarted = EmbeddingCache(max_bytes=1024, path=path)
+    assert restarted.get_many("awsbedrock", "model", ["bb", "c", "a"]) == [
+        [2.0],
+        None,
+        [1.0],
+    ]
+    assert (
+        metrics.get_counter(
+            "embedding_cache.disk_hits", provider="awsbedrock", model="model"
+        )
+        == 2
+    )
+    # now in memory too
+    restarted.close()
+    assert restarted.get_many("awsbedrock", "model", ["a"]) == [[1.0]]
+
+
+def test_aembed_cached_only_sends_misses_in_order():
+    cache = EmbeddingCache(max_bytes=1024)
+    cache.set_many("openai", "model", ["bb"], [[9.0, 9.0]])
+    embed = FakeEmbed()
+
+    embeddings, response, stats = asyncio.run(
+        aembed_cached(cache, "openai", "model", ["a", "bb", "ccc", "a"], embed)
+    )
+
+    # repeated texts are only sent once
+    assert embed.calls == [["a", "ccc"]]
+    assert embeddings == [[1.0, 0.5], [9.0, 9.0], [3.0, 0.5], [1.0, 0.5]]
+    assert response == "response"
+    assert stats == {"hits": 1, "misses": 3}
+
+    embeddings, response, stats = asyncio.run(
+        aembed_cached(cache, "openai", "model", ["ccc", "a"], embed)
+    )
+
+    assert len(embed.calls) == 1
+    assert embeddings == [[3.0, 0.5], [1.0, 0.5]]
+    assert response is None
+    assert stats == {"hits": 2, "misses": 0}
+
+
+def test_openai_embeddings_merge_cached_and_sent_texts():
+    sent = []
+
+    async def aembed(model, texts, hedge, gateway_metadata):
+        sent.append(texts)
+        return openai.util.convert_to_openai_object(
+            {
+                "object": "list",
+                "model": "text-embedding-ada-002-v2",
+                "data": [
+                    {"object": "embedding", "index": index, "embedding": [0.5]}
+                    for index in range(len(texts))
+                ],
+                "usage": {"prompt_tokens": 2, "total_tokens": 2},
+            }
+        )
+
+    cache = EmbeddingCache(max_bytes=1024)
+    cache.set_many("openai", "text-embedding-ada-002", ["cached"], [[1.0]])
+    wrapper = OpenAIWrapper()
+    with patch(
+        "llm_gateway.providers.openai.get_embedding_cache", return_value=cache
+    ), patch.object(wrapper, "_aembed", aembed):
+        resp, logs = asyncio.run(
+            wrapper.asend_openai_request(
+                "Embedding",
+                "create",
+                model="text-embedding-ada-002",
+                embedding_texts=["new", "cached"],
+            )
+        )
+        asyncio.run(wrapper.aclose())
+
+    assert sent == [["new"]]
+    assert resp == {
+        "object": "list",
+        "model": "text-embedding-ada-002-v2",
+        "data": [
+            {"object": "embedding", "index": 0, "embedding": [0.5]},
+            {"object": "embedding", "index": 1, "embedding": [1.0]},
+        ],
+        "usage": {"prompt_tokens": 2, "total_tokens": 2},
+    }
+    assert logs["gateway_metadata"]["embedding_cache"] == {"hits": 1, "misses": 1}
@@ -0,0 +1,124 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from llm_gateway.hedging import (
+    LatencyWindow,
+    get_latency_windows,
+    hedged,
+    reset_latency_windows,
+)
+from llm_gateway.metrics import metrics
+from llm_gateway.retries import RetryBudget
+
+MODEL = "text-embedding-ada-002"
+
+
+@pytest.fixture(autouse=True)
+def latencies():
+    reset_latency_windows()
+    metrics.reset()
+    # hedge after 10ms
+    call_latencies, _ = get_latency_windows("openai", MODEL)
+    for _ in range(20):
+        call_latencies.record(0.01)
+    with patch(
+        "llm_gateway.hedging.get_hedge_budget",
+        return_value=RetryBudget(ratio=1, min_per_second=0),
+    ):
+        yield
+    reset_latency_windows()
+
+
+def test_latency_window_percentile():
+    window = LatencyWindow(size=100)
+    assert window.percentile(95) is None
+    for latency in range(1, 201):
+        window.record(latency)
+
+    # only the last 100 are kept
+    assert len(window) == 100
+    assert window.percentile(50) == 150
+    assert window.percentile(95) == 195
+    assert window.percentile(100) == 200
+
+
+class FakeCalls:
+    def __init__(self, *delays):
+        self.delays = list(delays)
+        self.started = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        delay = self.delays[self.started]
+        self.started += 1
+        number = self.started
+        try:
+            await asyncio.sleep(abs(delay))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if delay < 0:
+            raise ConnectionError("failed")
+        return f"call {number}"
+
+
+def test_hedged_fast_call_isnt_hedged():
+    calls = FakeCalls(0)
+    result, hedge = asyncio.run(hedged(calls, "openai", MODEL))
+
+    assert result == "call 1"
+    assert hedge == {"hedged": False, "winner": "original"}
+    assert calls.started == 1
+
+
+def test_hedged_slow_call_loses_to_hedge():
+    calls = FakeCalls(1, 0.02)
+    result, hedge = asyncio.run(hedged(calls, "openai", MODEL))
+
+    assert result == "call 2"
+    assert hedge == {"hedged": True, "winner": "hedge"}
+    assert calls.cancelled == 1
+    labels = {"provider": "openai", "model": MODEL}
+    assert metrics.get_counter("hedging.hedged", **labels) == 1
+    assert metrics.get_counter("hedging.wins", winner="hedge", **labels) == 1
+
+
+def test_hedged_times_original_call_when_hedge_wins():
+    calls = FakeCalls(1, 0.05)
+    asyncio.run(hedged(calls, "openai", MODEL))
+
+    call_latencies, _ = get_latency_windows("openai", MODEL)
+    assert len(call_latencies) == 21
+    # how long the original ran for, not the hedge's 50ms
+    assert call_latencies.percentile(100) >= 0.06
+
+
+def test_hedged_failed_call_doesnt_win():
+    calls = FakeCalls(0.05, -0.02)
+    result, hedge = asyncio.run(hedged(calls, "openai", MODEL))
+
+    assert result == "call 1"
+    assert hedge == {"hedged": True, "winner": "original"}
+
+
+def test_hedged_raises_when_both_fail():
+    calls = FakeCalls(-0.05, -0.02)
+    with pytest.raises(ConnectionError):
+        asyncio.run(hedged(calls, "openai", MODEL))
+
+
+def test_hedged_without_budget_or_samples():
+    calls = FakeCalls(0.05)
+    with patch(
+        "llm_gateway.hedging.get_hedge_budget",
+        return_value=RetryBudget(ratio=0, min_per_second=0),
+    ):
+        _, hedge = asyncio.run(hedged(calls, "openai", MODEL))
+    assert hedge["hedged"] is False
+
+    calls = FakeCalls(0.05)
+    _, hedge = asyncio.run(hedged(calls, "openai", "new-model"))
+    assert hedge["hedged"] is False
+    assert calls.started == 1
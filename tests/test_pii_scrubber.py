@@ -34,17 +34,33 @@
 
 # flake8: noqa
 
-from unittest.mock import patch
+import asyncio
+import random
+import re
+import time
+from collections import Counter
+from typing import Callable
+from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
 
+from llm_gateway.metrics import metrics
 from llm_gateway.pii_scrubber import (
+    ALL_SCRUBBERS,
+    PII_PATTERNS,
+    PIISpan,
+    _get_scrubbed_message_cache,
+    find_pii_spans,
+    merge_pii_spans,
+    redact_pii_spans,
     scrub_all,
     scrub_credit_card_numbers,
     scrub_email_addresses,
+    scrub_many,
     scrub_phone_numbers,
     scrub_postal_codes,
     scrub_sin_numbers,
+    shutdown_scrub_pool,
 )
 from llm_gateway.providers.openai import OpenAIWrapper
 
@@ -157,6 +173,58 @@ def test_scrub_all_dict():
     assert scrub_all(test_dict) == expected_dict
 
 
+@pytest.mark.parametrize(
+    argnames=["test_text", "expected_text"],
+    argvalues=[
+        ("Nothing to see here.", "Nothing to see here."),
+        (
+            "Call 123-456-7890 or write to abc@def.com",
+            "Call [REDACTED PHONE NUMBER] or write to [REDACTED EMAIL ADDRESS]",
+        ),
+        (
+            "Card 1234 5555 6789 3333, SIN 123 456 789, postal A1A 1A1.",
+            "Card [REDACTED CREDIT CARD NUMBER], SIN [REDACTED SIN NUMBER], "
+            "postal [REDACTED POSTAL CODE].",
+        ),
+        (
+            "version2 shipped in 2023,\nreach me at\tone+weird.trick@gmail.com",
+            "version2 shipped in 2023,\nreach me at\t[REDACTED EMAIL ADDRESS]",
+        ),
+        # a higher priority match wins over an earlier, overlapping one
+        ("9.b5B6C1@7.58", "9.b5B6C[REDACTED EMAIL ADDRESS]"),
+        ("73@11.2144291.3)+7331", "73@[REDACTED CREDIT CARD NUMBER]"),
+        (
+            "id 123 456 789 +1 416 555 0199",
+            "id [REDACTED SIN NUMBER] [REDACTED PHONE NUMBER]",
+        ),
+        ("123 456 789 (416) 555-0199", "123 456 7[REDACTED PHONE NUMBER]"),
+        # a redaction is a word boundary for the match after it
+        ("a@b.co4aK1A 0B1(", "[REDACTED EMAIL ADDRESS][REDACTED POSTAL CODE]("),
+    ],
+)
+def test_scrub_all_mixed_text(test_text: str, expected_text: str):
+    """Test that scrub_all finds every kind of PII in a single pass."""
+
+    assert scrub_all(test_text) == expected_text
+
+
+def _scrub_one_after_another(text: str) -> str:
+    for _, pattern, replacement in PII_PATTERNS:
+        text = re.sub(pattern, replacement, text)
+    return text
+
+
+def test_scrub_all_matches_scrubbing_one_pattern_after_another():
+    """Test that scrub_all redacts what each pattern's re.sub in turn would."""
+
+    rng = random.Random(0)
+    for _ in range(5000):
+        test_text = "".join(
+            rng.choice("0123456789 abcABC@.-()+\n") for _ in range(rng.randint(5, 40))
+        )
+        assert scrub_all(test_text) == _scrub_one_after_another(test_text), test_text
+
+
 def test_scrub_all_wrong_type():
     """Test that scrub_all does not raise any errors on non-string inputs."""
 
@@ -191,7 +259,8 @@ def test_pii_scrubber_end_to_end(mock_write_record_to_db, mock_openai_module):
         def to_dict(self):
             return self.resp
 
-    mock_openai_module.create.return_value = MockResponse(
+    mock_openai_module.acreate = AsyncMock()
+    mock_openai_module.acreate.return_value = MockResponse(
         {
             "id": "chatcmpl-abc123",
             "object": "chat.completion",
@@ -209,19 +278,24 @@ def test_pii_scrubber_end_to_end(mock_write_record_to_db, mock_openai_module):
     )  # garbage data, not important
     wrapper = OpenAIWrapper()
 
-    result = wrapper.send_openai_request(
-        "ChatCompletion",
-        endpoint="create",
-        messages=[
-            "My phone number is 123-456-7890.",
-            "My SIN is 111-222-333",
-            "My credit card number is 1234-5678-9012-3456",
-            "The user's email is email@123.123.123.123, AKA email@domain.ca",
-            "The user's postal code is A1A 1A1, AKA a1a1A1",
-        ],
+    result = asyncio.run(
+        wrapper.asend_openai_request(
+            "ChatCompletion",
+            endpoint="create",
+            messages=[
+                {"role": "user", "content": content}
+                for content in [
+                    "My phone number is 123-456-7890.",
+                    "My SIN is 111-222-333",
+                    "My credit card number is 1234-5678-9012-3456",
+                    "The user's email is email@123.123.123.123, AKA email@domain.ca",
+                    "The user's postal code is A1A 1A1, AKA a1a1A1",
+                ]
+            ],
+        )
     )
 
-    called_with = mock_openai_module.create.call_args_list[0].kwargs["messages"]
+    called_with = mock_openai_module.acreate.call_args_list[0].kwargs["messages"]
     expected = [
         "My phone number is [REDACTED PHONE NUMBER].",
         "My SIN is [REDACTED SIN NUMBER]",
@@ -232,4 +306,231 @@ def test_pii_scrubber_end_to_end(mock_write_record_to_db, mock_openai_module):
 
     # Truncate the result. called_with contains an extra message - the mock response,
     # which isn't actually sent to OpenAI but shows up because of Python list mutability.
-    assert called_with[: len(expected)] == expected
+    assert [message["content"] for message in called_with[: len(expected)]] == expected
+
+    _, db_record = result
+    assert db_record["gateway_metadata"] == {
+        "pii_redactions": {
+            "phone_number": 1,
+            "sin_number": 1,
+            "credit_card_number": 1,
+            "email_address": 2,
+            "postal_code": 2,
+        }
+    }
+
+
+def test_find_pii_spans():
+    """Test that PII is found as (start, end, kind) spans, in order."""
+
+    test_text = "Call 123-456-7890 or write to abc@def.com"
+    spans = find_pii_spans(test_text)
+
+    assert spans == [
+        PIISpan(5, 17, "phone_number"),
+        PIISpan(30, 41, "email_address"),
+    ]
+    assert [test_text[start:end] for start, end, _ in spans] == [
+        "123-456-7890",
+        "abc@def.com",
+    ]
+    assert redact_pii_spans(test_text, spans) == scrub_all(test_text)
+    assert find_pii_spans("Nothing to see here.") == []
+
+
+@pytest.mark.parametrize(
+    argnames=["spans", "expected_spans"],
+    argvalues=[
+        ([], []),
+        (
+            [PIISpan(20, 25, "postal_code"), PIISpan(0, 10, "phone_number")],
+            [PIISpan(0, 10, "phone_number"), PIISpan(20, 25, "postal_code")],
+        ),
+        (
+            [PIISpan(0, 11, "sin_number"), PIISpan(0, 10, "phone_number")],
+            [PIISpan(0, 11, "phone_number")],
+        ),
+        (
+            [PIISpan(5, 20, "email_address"), PIISpan(0, 8, "credit_card_number")],
+            [PIISpan(0, 20, "credit_card_number")],
+        ),
+        (
+            [PIISpan(0, 5, "postal_code"), PIISpan(5, 10, "sin_number")],
+            [PIISpan(0, 5, "postal_code"), PIISpan(5, 10, "sin_number")],
+        ),
+    ],
+)
+def test_merge_pii_spans(spans: list, expected_spans: list):
+    """Test that overlapping spans merge into one, keeping the higher priority kind."""
+
+    assert merge_pii_spans(spans) == expected_spans
+
+
+@pytest.mark.parametrize(
+    argnames=["test_text", "expected_path"],
+    argvalues=[
+        ("No digits or at signs in this message.", "no_candidates"),
+        ("Only a year, 2023, and a v2 release.", "some_patterns"),
+        ("Write to abc@def.com", "some_patterns"),
+        ("Call 123-456-7890 or 1234 5555 6789 3333 or abc@def.com", "all_patterns"),
+    ],
+)
+def test_scrub_all_prefilter(test_text: str, expected_path: str):
+    """Test that the pre-filter skips patterns that cannot match, and counts it."""
+
+    metrics.reset()
+    result = scrub_all(test_text)
+
+    assert metrics.get_counter("pii_scrubber.prefilter", path=expected_path) == 1
+    if expected_path == "no_candidates":
+        # returned as-is, without being copied
+        assert result is test_text
+
+
+@pytest.mark.parametrize(argnames=["pool_threshold"], argvalues=[(10**9,), (0,)])
+def test_scrub_many(pool_threshold: int):
+    """Test that scrub_many keeps input order, inline and in the process pool."""
+
+    items = [
+        (
+            f"Message {i}: call me at 123-456-78{i:02d}"
+            if i % 2
+            else {"role": "user", "content": f"abc{i}@def.com"}
+        )
+        for i in range(40)
+    ]
+    expected = [scrub_all(item) for item in items]
+
+    settings = Mock(
+        PII_SCRUB_POOL_THRESHOLD=pool_threshold,
+        PII_SCRUB_POOL_WORKERS=2,
+        PII_SCRUB_OFFLOAD_THRESHOLD=10**9,
+    )
+    with patch("llm_gateway.pii_scrubber.get_settings", return_value=settings):
+        redaction_counts = Counter()
+        try:
+            assert scrub_many(items, redaction_counts) == expected
+        finally:
+            shutdown_scrub_pool()
+
+    assert redaction_counts == {"phone_number": 20, "email_address": 20}
+
+
+def test_scrub_many_offloads_large_items():
+    """Test that single large items are scrubbed in the process pool."""
+
+    large = "Reach me at 416-555-0199 about the report. " * 1000
+    items = ["call me at 123-456-7890", large, {"role": "user", "content": "a@b.com"}]
+    expected = [scrub_all(item) for item in items]
+
+    metrics.reset()
+    settings = Mock(
+        PII_SCRUB_POOL_THRESHOLD=10**9,
+        PII_SCRUB_POOL_WORKERS=1,
+        PII_SCRUB_OFFLOAD_THRESHOLD=len(large),
+    )
+    with patch("llm_gateway.pii_scrubber.get_settings", return_value=settings):
+        redaction_counts = Counter()
+        try:
+            assert scrub_many(items, redaction_counts) == expected
+            assert scrub_many(items[:1]) == expected[:1]
+        finally:
+            shutdown_scrub_pool()
+
+    snapshot = metrics.snapshot()
+    assert (
+        snapshot["summaries"]["pii_scrubber.scrub_seconds{path=offload}"]["count"] == 1
+    )
+    assert (
+        snapshot["summaries"]["pii_scrubber.scrub_seconds{path=inline}"]["count"] == 1
+    )
+    assert snapshot["gauges"]["pii_scrubber.pool.queue_depth"] == 0
+    assert redaction_counts == {"phone_number": 1001, "email_address": 1}
+
+
+@pytest.mark.parametrize(argnames=["max_bytes"], argvalues=[(1 << 20,), (0,)])
+def test_scrub_all_message_cache(max_bytes: int):
+    """Test that repeated chat messages are scrubbed once, unless the cache is off."""
+
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "My phone number is 123-456-7890."},
+    ]
+    settings = Mock(PII_SCRUB_CACHE_MAX_BYTES=max_bytes)
+    metrics.reset()
+    _get_scrubbed_message_cache.cache_clear()
+    with patch("llm_gateway.pii_scrubber.get_settings", return_value=settings):
+        try:
+            first_turn = [scrub_all(message) for message in messages]
+            second_turn = [scrub_all(message) for message in messages]
+        finally:
+            _get_scrubbed_message_cache.cache_clear()
+
+    assert first_turn == second_turn
+    assert second_turn[1]["content"] == "My phone number is [REDACTED PHONE NUMBER]."
+    hits = metrics.get_counter("cache.hits", cache="scrubbed_messages")
+    assert hits == (2 if max_bytes else 0)
+
+
+@pytest.mark.parametrize(
+    argnames=["test_text", "expected_text"],
+    argvalues=[
+        ("x " + "a" * 70 + "@example.com y", "x [REDACTED EMAIL ADDRESS] y"),
+        ("x " + "a.b" * 30 + "@example.com y", "x [REDACTED EMAIL ADDRESS] y"),
+        ("x " + "a" * 64 + "@example.com y", "x [REDACTED EMAIL ADDRESS] y"),
+    ],
+)
+def test_scrub_all_long_local_part(test_text: str, expected_text: str):
+    """Test that email addresses past the local part length limit are fully redacted."""
+
+    assert scrub_all(test_text) == expected_text
+    assert scrub_email_addresses(test_text) == expected_text
+
+
+# Inputs that made the patterns backtrack, i.e. trying the email pattern at every
+# letter before a far away '@', and long runs of digits and separators
+ADVERSARIAL_SIZE = 100 << 10
+ADVERSARIAL_TIME_LIMIT = 1.0  # seconds
+ADVERSARIAL_INPUTS = {
+    "letters_then_at": "a" * ADVERSARIAL_SIZE + "@",
+    "dots_then_at": "a." * (ADVERSARIAL_SIZE // 2) + "@",
+    "quoted_then_at": '"' + "a" * ADVERSARIAL_SIZE + '"@',
+    "phones_then_at": "1234567890a" * (ADVERSARIAL_SIZE // 11) + "@",
+    "long_domain": "a@" + "a-" * (ADVERSARIAL_SIZE // 2),
+    "many_at_signs": "a@" * (ADVERSARIAL_SIZE // 2),
+    "digits": "1" * ADVERSARIAL_SIZE,
+    "digits_and_separators": "1 -." * (ADVERSARIAL_SIZE // 4),
+    "digits_and_letters": "1a" * (ADVERSARIAL_SIZE // 2),
+    "dots_without_at": "." * ADVERSARIAL_SIZE,
+}
+
+
+def _random_adversarial_text(seed: int) -> str:
+    rng = random.Random(seed)
+    runs = [
+        char * rng.choice((1, 2, 17, 65, 200))
+        for char in rng.sample('a1@.- "_A\t+(),', 4)
+    ]
+    return "".join(rng.choice(runs) for _ in range(ADVERSARIAL_SIZE))[:ADVERSARIAL_SIZE]
+
+
+ADVERSARIAL_INPUTS.update(
+    {f"random_{seed}": _random_adversarial_text(seed) for seed in range(10)}
+)
+
+
+@pytest.mark.parametrize(
+    argnames=["scrubber"],
+    argvalues=[(scrub_all,), *((scrubber,) for scrubber in ALL_SCRUBBERS)],
+)
+@pytest.mark.parametrize(
+    argnames=["name"], argvalues=[(n,) for n in ADVERSARIAL_INPUTS]
+)
+def test_scrubbing_adversarial_input(scrubber: Callable, name: str):
+    """Test that no 100 KB input makes scrubbing backtrack past the time limit."""
+
+    start = time.perf_counter()
+    scrubber(ADVERSARIAL_INPUTS[name])
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < ADVERSARIAL_TIME_LIMIT, f"{scrubber.__name__} took {elapsed:.2f}s"
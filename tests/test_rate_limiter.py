@@ -0,0 +1,238 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+from llm_gateway.rate_limiter import (
+    CallerMiddleware,
+    RateLimitedError,
+    TokenBucket,
+    _limiters,
+    areserve,
+    estimate_tokens,
+    get_caller,
+    get_rate_limiters,
+    rate_limited,
+    usage_tokens,
+)
+
+
+@pytest.fixture(autouse=True)
+def rate_limits():
+    metrics.reset()
+    with patch.multiple(
+        get_settings(),
+        RATE_LIMIT_RPM={},
+        RATE_LIMIT_TPM={},
+        RATE_LIMIT_MAX_CONCURRENT={},
+        CALLER_RATE_LIMIT_RPM={},
+        CALLER_RATE_LIMIT_TPM={},
+        CALLER_RATE_LIMIT_MAX_CONCURRENT={},
+        RATE_LIMIT_HEADROOM=0,
+        RATE_LIMIT_BURST=60,
+        RATE_LIMIT_MAX_WAIT=1,
+        RATE_LIMIT_MAX_QUEUE=100,
+    ):
+        yield
+
+
+async def _as_caller(caller: str, func):
+    """
+    Await func inside a request from caller
+    """
+    result = []
+
+    async def app(scope, receive, send):
+        assert get_caller() == caller
+        result.append(await func())
+
+    await CallerMiddleware(app)(
+        {"type": "http", "headers": [(b"x-user-email", caller.encode())]},
+        None,
+        None,
+    )
+    return result[0]
+
+
+def test_token_bucket_is_overdrawn_and_paid_back():
+    bucket = TokenBucket(600)
+    now = bucket.updated
+
+    assert bucket.wait_time(600, now) == 0
+    bucket.take(600, now)
+    assert bucket.wait_time(10, now) == pytest.approx(1)
+    bucket.take(10, now)
+    # waits for the overdraft to be paid back
+    assert bucket.wait_time(10, now) == pytest.approx(2)
+    assert bucket.wait_time(10, now + 1) == pytest.approx(1)
+    # more than it holds waits until it is full
+    assert bucket.wait_time(1000, now + 1) == pytest.approx(60)
+
+
+def test_areserve_without_limits():
+    assert asyncio.run(areserve("openai", "gpt-4", 100)) is None
+
+
+def test_areserve_waits_for_its_turn():
+    async def main():
+        await areserve("openai", "gpt-4", 600)
+        start = time.monotonic()
+        await areserve("openai", "gpt-4", 1)
+        return time.monotonic() - start
+
+    with patch.object(get_settings(), "RATE_LIMIT_TPM", {"openai/gpt-4": 600}):
+        waited = asyncio.run(main())
+
+    assert 0.05 <= waited < 0.5
+
+
+def test_areserve_rejects_calls_that_would_wait_too_long():
+    async def main():
+        await areserve("openai", "gpt-4", 1)
+        await areserve("openai", "gpt-4", 1)
+
+    with patch.object(get_settings(), "RATE_LIMIT_RPM", {"openai": 1}):
+        with pytest.raises(RateLimitedError) as e:
+            asyncio.run(main())
+
+    assert e.value.status_code == 429
+    assert e.value.headers["Retry-After"] == "60"
+    assert metrics.get_counter(
+        "rate_limiter.rejected", reason="wait", provider="openai", model="gpt-4"
+    )
+
+
+def test_areserve_rejects_calls_when_queue_is_full():
+    async def main():
+        await areserve("openai", "gpt-4", 600)
+        waiting = asyncio.ensure_future(areserve("openai", "gpt-4", 1))
+        await asyncio.sleep(0)
+        try:
+            await areserve("openai", "gpt-4", 1)
+        finally:
+            await waiting
+
+    with patch.multiple(
+        get_settings(), RATE_LIMIT_TPM={"openai/gpt-4": 600}, RATE_LIMIT_MAX_QUEUE=1
+    ):
+        with pytest.raises(RateLimitedError):
+            asyncio.run(main())
+
+
+def test_reservation_settle_corrects_tokens():
+    async def main():
+        reservation = await areserve("openai", "gpt-4", 600)
+        reservation.settle(100)
+        start = time.monotonic()
+        await areserve("openai", "gpt-4", 500)
+        return time.monotonic() - start
+
+    with patch.object(get_settings(), "RATE_LIMIT_TPM", {"openai/gpt-4": 600}):
+        assert asyncio.run(main()) < 0.05
+
+
+def test_areserve_caps_calls_at_once():
+    async def main():
+        first = await areserve("cohere", "command", 1)
+        asyncio.get_running_loop().call_later(0.05, first.release)
+        await areserve("cohere", "command", 1)
+        # the second was never released
+        await areserve("cohere", "command", 1)
+
+    with patch.multiple(
+        get_settings(),
+        RATE_LIMIT_MAX_CONCURRENT={"cohere/command": 1},
+        RATE_LIMIT_MAX_WAIT=0.2,
+    ):
+        with pytest.raises(RateLimitedError):
+            asyncio.run(main())
+
+    assert metrics.get_counter(
+        "rate_limiter.rejected",
+        reason="concurrency",
+        provider="cohere",
+        model="command",
+    )
+
+
+def test_areserve_applies_quota_of_each_caller():
+    async def reserve():
+        return await areserve("openai", "gpt-4", 1)
+
+    async def main(last_caller: str):
+        await _as_caller("a@example.com", reserve)
+        await _as_caller("b@example.com", reserve)
+        await _as_caller("c@example.com", reserve)
+        await _as_caller(last_caller, reserve)
+
+    with patch.object(
+        get_settings(), "CALLER_RATE_LIMIT_RPM", {"*": 2, "a@example.com": 1}
+    ):
+        with pytest.raises(RateLimitedError) as own:
+            asyncio.run(main("a@example.com"))
+        # b and c share the quota of callers without their own
+        with pytest.raises(RateLimitedError) as shared:
+            asyncio.run(main("d@example.com"))
+
+    assert "caller a@example.com" in own.value.detail
+    assert "other callers" in shared.value.detail
+
+
+def test_get_rate_limiters_only_keeps_configured_limits():
+    async def main():
+        for i in range(100):
+            assert get_rate_limiters("openai", f"model-{i}", f"{i}@example.com") == []
+        with patch.object(get_settings(), "CALLER_RATE_LIMIT_RPM", {"*": 10}):
+            callers = [
+                get_rate_limiters("openai", "gpt-4", f"{i}@example.com")
+                for i in range(100)
+            ]
+        return _limiters.get(asyncio.get_running_loop()), callers
+
+    registry, callers = asyncio.run(main())
+
+    assert list(registry) == ["other callers"]
+    assert all(limiters == callers[0] for limiters in callers)
+
+
+def test_rate_limited_corrects_estimate_from_usage():
+    calls = []
+
+    @rate_limited(
+        "openai",
+        lambda arguments: estimate_tokens([arguments["prompt"]], 600),
+        lambda result: usage_tokens(result["usage"]),
+    )
+    async def call(model: str, prompt: str):
+        calls.append(prompt)
+        return {"usage": {"prompt_tokens": 1, "completion_tokens": 9}}
+
+    async def main():
+        await call("gpt-4", "abcd")
+        # the first only used 10 of the 601 estimated tokens
+        await call(model="gpt-4", prompt="abcd")
+        await call("gpt-4", "abcd" * 1000)
+
+    with patch.multiple(
+        get_settings(), RATE_LIMIT_TPM={"openai/gpt-4": 1000}, RATE_LIMIT_MAX_WAIT=0
+    ):
+        with pytest.raises(RateLimitedError):
+            asyncio.run(main())
+
+    assert calls == ["abcd", "abcd"]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens(["abcd", None, "abcde"], 10) == 13
+    assert estimate_tokens([]) == 0
+
+
+def test_usage_tokens():
+    assert usage_tokens(None) is None
+    assert usage_tokens({"total_tokens": 5, "prompt_tokens": 2}) == 5
+    assert usage_tokens({"prompt_tokens": 2, "completion_tokens": 3}) == 5
+    assert usage_tokens({"input_tokens": 2, "output_tokens": None}) == 2
+    assert usage_tokens({"search_units": 1}) is None
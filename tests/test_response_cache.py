@@ -0,0 +1,124 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+from llm_gateway.response_cache import (
+    CacheControlMiddleware,
+    CachedResponse,
+    ResponseCache,
+    get_response_cache,
+    response_cache_key,
+)
+
+
+@pytest.fixture(autouse=True)
+def response_cache():
+    get_response_cache.cache_clear()
+    metrics.reset()
+    with patch.multiple(
+        get_settings(), RESPONSE_CACHE=True, RESPONSE_CACHE_ROUTE_TTLS={}
+    ):
+        yield
+    get_response_cache.cache_clear()
+
+
+async def _with_cache_control(header: str, func):
+    """
+    Run func inside a request with the `Cache-Control` header
+    """
+    result = []
+
+    async def app(scope, receive, send):
+        result.append(func())
+
+    await CacheControlMiddleware(app)(
+        {"type": "http", "headers": [(b"cache-control", header.encode())]},
+        None,
+        None,
+    )
+    return result[0]
+
+
+def test_response_cache_key_is_canonical():
+    key = response_cache_key(
+        "openai", "openai/completion", model="m", prompt="p", kwargs={"a": 1, "b": 2}
+    )
+
+    assert key == response_cache_key(
+        "openai", "openai/completion", kwargs={"b": 2, "a": 1}, prompt="p", model="m"
+    )
+    assert key != response_cache_key(
+        "openai", "openai/completion", model="m", prompt="p", kwargs={"a": 1, "b": 3}
+    )
+    assert key != response_cache_key(
+        "cohere", "openai/completion", model="m", prompt="p", kwargs={"a": 1, "b": 2}
+    )
+
+
+def test_response_cache_expires_entries():
+    cache = ResponseCache(max_bytes=1024)
+    with patch("llm_gateway.response_cache.time.monotonic", return_value=100):
+        cache.set("key", {"text": "hello"}, ttl=10)
+        assert cache.get("key") == {"text": "hello"}
+    with patch("llm_gateway.response_cache.time.monotonic", return_value=110):
+        assert cache.get("key") is None
+    assert metrics.get_counter("response_cache.expired") == 1
+
+
+def test_response_cache_is_bounded_by_bytes():
+    cache = ResponseCache(max_bytes=40)
+    cache.set("a", {"text": "a" * 10}, ttl=10)
+    cache.set("b", {"text": "b" * 10}, ttl=10)
+
+    # each entry is 22 bytes as JSON
+    assert cache.get("a") is None
+    assert cache.get("b") == {"text": "b" * 10}
+
+
+def test_cached_response_only_caches_temperature_0_routes():
+    assert CachedResponse("openai", "openai/completion", 0, prompt="p").key
+    assert CachedResponse("openai", "openai/completion", 0.7, prompt="p").key is None
+    assert CachedResponse("openai", None, 0, prompt="p").key is None
+    with patch.multiple(
+        get_settings(), RESPONSE_CACHE_ROUTE_TTLS={"openai/completion": 0}
+    ):
+        assert CachedResponse("openai", "openai/completion", 0, prompt="p").key is None
+
+
+def test_cached_response_hit_and_miss():
+    first = CachedResponse("openai", "openai/completion", 0, prompt="p")
+    assert first.get() is None
+    assert first.status == "miss"
+    first.set({"text": "hello"})
+
+    second = CachedResponse("openai", "openai/completion", 0, prompt="p")
+    assert second.get() == {"text": "hello"}
+    assert second.status == "hit"
+    assert (
+        metrics.get_counter("response_cache.requests", provider="openai", status="hit")
+        == 1
+    )
+
+
+def test_cached_response_cache_control():
+    CachedResponse("openai", "openai/completion", 0, prompt="p").set({"text": "a"})
+
+    def get_and_set(text):
+        cached = CachedResponse("openai", "openai/completion", 0, prompt="p")
+        response = cached.get()
+        cached.set({"text": text})
+        return response, cached.status
+
+    # a fresh response, which is cached
+    assert asyncio.run(_with_cache_control("no-cache", lambda: get_and_set("b"))) == (
+        None,
+        "bypass",
+    )
+    # a fresh response, which isn't
+    assert asyncio.run(
+        _with_cache_control("max-age=0, No-Store", lambda: get_and_set("c"))
+    ) == (None, "bypass")
+    assert get_and_set("d") == ({"text": "b"}, "hit")
@@ -0,0 +1,154 @@
+import email.utils
+import time
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import (
+    ClientError,
+    EndpointConnectionError,
+    EventStreamError,
+    NoCredentialsError,
+)
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from openai.error import (
+    APIError,
+    AuthenticationError,
+    InvalidRequestError,
+    RateLimitError,
+    Timeout,
+)
+
+from llm_gateway.exceptions import (
+    is_retryable_awsbedrock_error,
+    is_retryable_openai_error,
+)
+from llm_gateway.retries import (
+    RequestDeadlineMiddleware,
+    RetryBudget,
+    backoff_delay,
+    get_deadline,
+    request_deadline,
+    retry_after,
+)
+
+
+def test_backoff_delay_full_jitter():
+    delays = [backoff_delay(3, base=0.5, cap=20) for _ in range(1000)]
+    assert min(delays) >= 0
+    assert max(delays) <= 2
+    # spread over the whole range, not bunched at the ceiling
+    assert min(delays) < 0.2
+    assert max(delays) > 1.8
+
+    assert max(backoff_delay(100, base=0.5, cap=20) for _ in range(100)) <= 20
+
+
+def _client_error(code, status=400, headers=None, error_class=ClientError):
+    return error_class(
+        {
+            "Error": {"Code": code, "Message": ""},
+            "ResponseMetadata": {
+                "HTTPStatusCode": status,
+                "HTTPHeaders": headers or {},
+            },
+        },
+        "InvokeModel",
+    )
+
+
+def test_retry_after():
+    assert retry_after(RateLimitError("slow down", headers={"Retry-After": "3"})) == 3
+    assert retry_after(APIError("error", headers={"retry-after-ms": "250"})) == 0.25
+    assert retry_after(APIError("error")) is None
+    assert retry_after(ValueError()) is None
+    assert (
+        retry_after(_client_error("ThrottlingException", 429, {"retry-after": "2"}))
+        == 2
+    )
+
+    in_ten_seconds = email.utils.formatdate(time.time() + 10, usegmt=True)
+    hint = retry_after(APIError("error", headers={"Retry-After": in_ten_seconds}))
+    assert 8 <= hint <= 10
+
+
+@pytest.mark.parametrize(
+    "error,retryable",
+    [
+        (Timeout("timeout"), True),
+        (RateLimitError("slow down"), True),
+        (RateLimitError("no credit", code="insufficient_quota"), False),
+        (APIError("bad gateway", http_status=502), True),
+        (APIError("unknown"), True),
+        (APIError("bad request", http_status=400), False),
+        (AuthenticationError("bad key"), False),
+        (InvalidRequestError("bad request", param="model"), False),
+    ],
+)
+def test_is_retryable_openai_error(error, retryable):
+    assert is_retryable_openai_error(error) is retryable
+
+
+@pytest.mark.parametrize(
+    "error,retryable",
+    [
+        (_client_error("ThrottlingException", 429), True),
+        (_client_error("ModelTimeoutException", 408), True),
+        (_client_error("AccessDeniedException", 403), False),
+        (_client_error("ValidationException", 400), False),
+        (_client_error("UnknownError", 503), True),
+        (_client_error("throttlingException", error_class=EventStreamError), True),
+        (EndpointConnectionError(endpoint_url="http://bedrock"), True),
+        (NoCredentialsError(), False),
+    ],
+)
+def test_is_retryable_awsbedrock_error(error, retryable):
+    assert is_retryable_awsbedrock_error(error) is retryable
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.1, min_per_second=0.2, window=10)
+
+    # 0.2 a second over 10 seconds, before any requests
+    assert [budget.try_retry() for _ in range(3)] == [True, True, False]
+
+    for _ in range(100):
+        budget.record_request()
+    assert sum(budget.try_retry() for _ in range(20)) == 10
+
+
+def test_retry_budget_window():
+    budget = RetryBudget(ratio=0, min_per_second=0.1, window=10)
+    with patch("llm_gateway.retries.time.monotonic", return_value=1000):
+        assert budget.try_retry()
+        assert not budget.try_retry()
+    with patch("llm_gateway.retries.time.monotonic", return_value=1010):
+        assert budget.try_retry()
+
+
+def test_request_deadline():
+    assert get_deadline() is None
+    with request_deadline(10) as outer:
+        with request_deadline(60) as inner:
+            # can't outlive the enclosing deadline
+            assert inner == outer == get_deadline()
+        with request_deadline(1) as inner:
+            assert inner < outer
+        assert get_deadline() == outer
+    assert get_deadline() is None
+
+
+def test_request_deadline_middleware():
+    app = FastAPI()
+    app.add_middleware(RequestDeadlineMiddleware)
+
+    @app.get("/deadline")
+    async def deadline():
+        return {"remaining": get_deadline() - time.monotonic()}
+
+    client = TestClient(app)
+    remaining = client.get("/deadline", headers={"X-Request-Timeout": "5"}).json()
+    assert 4 < remaining["remaining"] <= 5
+    # RETRY_DEADLINE
+    remaining = client.get("/deadline", headers={"X-Request-Timeout": "nan"}).json()
+    assert 119 < remaining["remaining"] <= 120
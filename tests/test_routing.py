@@ -0,0 +1,203 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+from cohere.error import CohereAPIError
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+from llm_gateway.routing import (
+    Backend,
+    BackendStats,
+    ModelRouter,
+    asend_generate_request,
+    get_model_router,
+)
+
+COHERE = Backend("cohere", "command")
+BEDROCK = Backend("awsbedrock", "cohere.command-text-v14")
+
+
+@pytest.fixture(autouse=True)
+def router():
+    get_model_router.cache_clear()
+    metrics.reset()
+    yield
+    get_model_router.cache_clear()
+
+
+def _router() -> ModelRouter:
+    return ModelRouter(
+        {"cohere-command": (COHERE, BEDROCK)},
+        alpha=0.5,
+        decay=30,
+        max_error_rate=0.5,
+    )
+
+
+def test_backend_stats_ewma():
+    stats = BackendStats(alpha=0.5, decay=30)
+    stats.record(1.0, failed=False)
+    stats.record(3.0, failed=False)
+    assert stats.latency() == pytest.approx(2.0, abs=0.01)
+
+    stats.record(10.0, failed=True)
+    # failures don't count towards latency
+    assert stats.latency() == pytest.approx(2.0, abs=0.01)
+    assert stats.error_rate() == pytest.approx(0.5, abs=0.01)
+
+
+def test_backend_stats_decay():
+    stats = BackendStats(alpha=1, decay=30)
+    with patch("llm_gateway.routing.time.monotonic", return_value=100):
+        stats.record(1.0, failed=False)
+        stats.record(1.0, failed=True)
+    assert stats.error_rate(now=100) == 1
+    assert stats.error_rate(now=130) == pytest.approx(0.37, abs=0.01)
+    assert stats.latency(now=130) == pytest.approx(0.37, abs=0.01)
+
+
+def test_model_router_rank():
+    router = _router()
+    assert router.equivalence_class("cohere.command-text-v14") == "cohere-command"
+    assert router.equivalence_class("command-nightly") is None
+
+    # in the class's order until they answer
+    assert router.rank("cohere-command") == [COHERE, BEDROCK]
+    router.record(BEDROCK, 0.5, failed=False)
+    assert router.rank("cohere-command") == [BEDROCK, COHERE]
+
+    router.record(COHERE, 0.2, failed=False)
+    assert router.rank("cohere-command") == [COHERE, BEDROCK]
+
+    # unhealthy backends last, however fast
+    router.record(COHERE, 0.1, failed=True)
+    router.record(COHERE, 0.1, failed=True)
+    assert router.rank("cohere-command") == [BEDROCK, COHERE]
+
+
+def test_model_router_fails_over():
+    router = _router()
+    send = AsyncMock(side_effect=[ConnectionError("down"), "answer"])
+
+    result, backend, failed = asyncio.run(
+        router.asend("cohere-command", send, lambda backend, e: True)
+    )
+
+    assert result == "answer"
+    assert backend == BEDROCK
+    assert failed == [COHERE]
+    assert (
+        metrics.get_counter(
+            "routing.failovers", equivalence_class="cohere-command", backend=str(COHERE)
+        )
+        == 1
+    )
+    assert (
+        metrics.get_counter(
+            "routing.requests", equivalence_class="cohere-command", backend=str(BEDROCK)
+        )
+        == 1
+    )
+
+
+def test_model_router_doesnt_fail_over_bad_requests():
+    router = _router()
+    send = AsyncMock(side_effect=ValueError("bad prompt"))
+
+    with pytest.raises(ValueError):
+        asyncio.run(router.asend("cohere-command", send, lambda backend, e: False))
+
+    assert send.await_count == 1
+
+
+def test_asend_generate_request_routes_to_bedrock():
+    cohere_wrapper = Mock()
+    cohere_wrapper.asend_cohere_request = AsyncMock(
+        side_effect=CohereAPIError("unavailable", http_status=503)
+    )
+    awsbedrock_wrapper = Mock()
+    awsbedrock_wrapper.asend_awsbedrock_request = AsyncMock(
+        return_value=({"generations": [{"text": "hi"}]}, {"gateway_metadata": {}})
+    )
+
+    with patch.multiple(
+        get_settings(),
+        ROUTE_EQUIVALENT_MODELS=True,
+        COHERE_API_KEY="key",
+        AWS_REGION="us-east-1",
+    ), patch(
+        "llm_gateway.routing.get_awsbedrock_wrapper", return_value=awsbedrock_wrapper
+    ):
+        resp, logs, wrapper = asyncio.run(
+            asend_generate_request(
+                cohere_wrapper, "command", "hello", max_tokens=10, temperature=0
+            )
+        )
+        # Cohere failed, so Bedrock is tried first next time
+        assert get_model_router().rank("cohere-command") == [BEDROCK, COHERE]
+
+    assert resp == {"generations": [{"text": "hi"}]}
+    assert wrapper is awsbedrock_wrapper
+    assert logs["gateway_metadata"]["routing"] == {
+        "equivalence_class": "cohere-command",
+        "backend": str(BEDROCK),
+        "failed_over_from": [str(COHERE)],
+    }
+    awsbedrock_wrapper.asend_awsbedrock_request.assert_awaited_once_with(
+        awsbedrock_module="Text",
+        model="cohere.command-text-v14",
+        max_tokens=10,
+        prompt="hello",
+        temperature=0,
+        stream=False,
+        sse=False,
+    )
+
+
+def test_asend_generate_request_without_routing():
+    cohere_wrapper = Mock()
+    cohere_wrapper.asend_cohere_request = AsyncMock(
+        return_value=({"generations": []}, {"gateway_metadata": {}})
+    )
+
+    with patch.multiple(get_settings(), ROUTE_EQUIVALENT_MODELS=False):
+        _, logs, wrapper = asyncio.run(
+            asend_generate_request(
+                cohere_wrapper, "command", "hello", max_tokens=10, temperature=0
+            )
+        )
+
+    assert wrapper is cohere_wrapper
+    assert "routing" not in logs["gateway_metadata"]
+
+
+def test_asend_generate_request_all_backends_fail():
+    cohere_wrapper = Mock()
+    cohere_wrapper.asend_cohere_request = AsyncMock(
+        side_effect=CohereAPIError("unavailable", http_status=503)
+    )
+    awsbedrock_wrapper = Mock()
+    awsbedrock_wrapper.asend_awsbedrock_request = AsyncMock(
+        side_effect=ClientError(
+            {"Error": {"Code": "ThrottlingException", "Message": "slow down"}},
+            "InvokeModel",
+        )
+    )
+
+    with patch.multiple(
+        get_settings(),
+        ROUTE_EQUIVALENT_MODELS=True,
+        COHERE_API_KEY="key",
+        AWS_REGION="us-east-1",
+    ), patch(
+        "llm_gateway.routing.get_awsbedrock_wrapper", return_value=awsbedrock_wrapper
+    ), pytest.raises(
+        ClientError
+    ):
+        asyncio.run(
+            asend_generate_request(
+                cohere_wrapper, "command", "hello", max_tokens=10, temperature=0
+            )
+        )
@@ -0,0 +1,266 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from llm_gateway.constants import get_settings
+from llm_gateway.metrics import metrics
+from llm_gateway.rate_limiter import RateLimitedError
+from llm_gateway.singleflight import Flight, StreamFanout
+
+
+@pytest.fixture(autouse=True)
+def singleflight():
+    metrics.reset()
+    with patch.object(get_settings(), "SINGLEFLIGHT", True):
+        yield
+
+
+def _flight(temperature=0, prompt="hello"):
+    return Flight("openai", "openai/completion", temperature, model="m", prompt=prompt)
+
+
+async def _collect(items):
+    return [item async for item in items]
+
+
+def test_flight_shares_identical_calls():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        result = calls
+        await asyncio.sleep(0.01)
+        return result
+
+    async def main():
+        flights = [_flight(), _flight(), _flight(prompt="other")]
+        results = await asyncio.gather(*(flight.call(call) for flight in flights))
+        return flights, results
+
+    flights, results = asyncio.run(main())
+
+    assert calls == 2
+    assert results[0] == results[1] != results[2]
+    assert [flight.role for flight in flights] == ["leader", "follower", "leader"]
+    assert metrics.get_counter("singleflight.saved_calls", provider="openai") == 1
+
+
+def test_flight_only_shares_calls_in_flight():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main():
+        return [await _flight().call(call), await _flight().call(call)]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_flight_doesnt_share_nonzero_temperature_calls():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        result = calls
+        await asyncio.sleep(0.01)
+        return result
+
+    async def main():
+        flights = [_flight(temperature=0.5), _flight(temperature=0.5)]
+        return await asyncio.gather(*(flight.call(call) for flight in flights))
+
+    assert sorted(asyncio.run(main())) == [1, 2]
+    with patch.object(get_settings(), "SINGLEFLIGHT", False):
+        assert _flight().key is None
+
+
+def test_flight_fails_every_request_of_failed_call():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def main():
+        return await asyncio.gather(
+            _flight().call(call), _flight().call(call), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+
+    assert calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_flight_doesnt_fail_followers_with_leaders_rate_limit():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if calls == 1:
+            # the leader's caller is over its quota
+            raise RateLimitedError("caller a@b.c", 1)
+        return "done"
+
+    async def main():
+        flights = [_flight(), _flight()]
+        results = await asyncio.gather(
+            *(flight.call(call) for flight in flights), return_exceptions=True
+        )
+        return flights, results
+
+    flights, results = asyncio.run(main())
+
+    assert isinstance(results[0], RateLimitedError)
+    assert results[1] == "done"
+    assert calls == 2
+    assert [flight.role for flight in flights] == ["leader", None]
+    assert metrics.get_counter("singleflight.saved_calls", provider="openai") == 0
+
+
+def test_flight_doesnt_fail_stream_followers_with_leaders_rate_limit():
+    opened = 0
+
+    async def items():
+        yield "a"
+
+    async def open_stream():
+        nonlocal opened
+        opened += 1
+        await asyncio.sleep(0.01)
+        if opened == 1:
+            raise RateLimitedError("caller a@b.c", 1)
+        return items(), None
+
+    async def main():
+        leader = asyncio.ensure_future(_flight().stream(open_stream))
+        await asyncio.sleep(0)
+        follower, _ = await _flight().stream(open_stream)
+        with pytest.raises(RateLimitedError):
+            await leader
+        return await _collect(follower)
+
+    assert asyncio.run(main()) == ["a"]
+    assert opened == 2
+
+
+def test_flight_call_goes_on_when_leader_is_cancelled():
+    async def call():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(_flight().call(call))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(_flight().call(call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_flight_fans_stream_out_to_late_subscribers():
+    opened = 0
+
+    async def items():
+        for item in ["a", "b", "c"]:
+            await asyncio.sleep(0.01)
+            yield item
+
+    async def open_stream():
+        nonlocal opened
+        opened += 1
+        return items(), None
+
+    async def main():
+        first, _ = await _flight().stream(open_stream)
+        first = asyncio.ensure_future(_collect(first))
+        # joins after the first item was read
+        await asyncio.sleep(0.015)
+        second, _ = await _flight().stream(open_stream)
+        return await first, await _collect(second)
+
+    assert asyncio.run(main()) == (["a", "b", "c"], ["a", "b", "c"])
+    assert opened == 1
+
+
+def test_stream_fanout_closes_stream_when_every_subscriber_goes():
+    closed = []
+
+    async def items():
+        while True:
+            await asyncio.sleep(0.01)
+            yield "a"
+
+    async def main():
+        fanout = StreamFanout(items(), lambda: closed.append(True))
+        first, unsubscribe_first = fanout.subscribe()
+        second, unsubscribe_second = fanout.subscribe()
+        assert await first.__anext__() == "a"
+        unsubscribe_first()
+        assert closed == []
+        assert await second.__anext__() == "a"
+        unsubscribe_second()
+        await asyncio.sleep(0)
+        return fanout
+
+    fanout = asyncio.run(main())
+
+    assert closed == [True]
+    assert fanout.closed
+    assert fanout.reader.cancelled()
+
+
+def test_flight_opens_new_stream_after_closed_one():
+    opened = 0
+
+    async def items():
+        while True:
+            await asyncio.sleep(0.01)
+            yield "a"
+
+    async def open_stream():
+        nonlocal opened
+        opened += 1
+        return items(), None
+
+    async def main():
+        first, unsubscribe = await _flight().stream(open_stream)
+        await first.__anext__()
+        unsubscribe()
+        second, unsubscribe = await _flight().stream(open_stream)
+        await second.__anext__()
+        unsubscribe()
+
+    asyncio.run(main())
+
+    assert opened == 2
+
+
+def test_stream_fanout_raises_stream_error_to_subscribers():
+    async def items():
+        yield "a"
+        raise ValueError("upstream failed")
+
+    async def main():
+        fanout = StreamFanout(items())
+        first, _ = fanout.subscribe()
+        second, _ = fanout.subscribe()
+        return await asyncio.gather(
+            _collect(first), _collect(second), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+
+    assert all(isinstance(result, ValueError) for result in results)
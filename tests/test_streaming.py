@@ -0,0 +1,224 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from cohere.responses.generation import StreamingGenerations
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from llm_gateway.app import app
+from llm_gateway.dependencies import close_provider_clients
+from llm_gateway.metrics import metrics
+from llm_gateway.streaming import StreamLimiter, StreamSlot, coalesce_stream
+
+
+async def _lines(lines, delay: float = 0):
+    for line in lines:
+        yield json.dumps(line).encode()
+        await asyncio.sleep(delay)
+
+
+def _stream_text(texts, delay: float = 0):
+    """
+    Cohere's async stream of `texts`, `delay` seconds apart
+    """
+    lines = [{"text": text, "is_finished": False} for text in texts]
+    end = {
+        "generations": [{"id": "1", "text": "".join(texts)}],
+        "meta": {"billed_units": {"input_tokens": 1, "output_tokens": len(texts)}},
+    }
+    lines.append({"is_finished": True, "finish_reason": "COMPLETE", "response": end})
+    return StreamingGenerations(
+        SimpleNamespace(content=_lines(lines, delay), close=Mock())
+    )
+
+
+def test_stream_slot():
+    limiter = StreamLimiter(max_streams=1)
+
+    with pytest.raises(ValueError):
+        with StreamSlot(limiter):
+            assert limiter.active == 1
+            raise ValueError()
+    # given back when the route fails
+    assert limiter.active == 0
+
+    with StreamSlot(limiter) as slot:
+        response = slot.streaming_response(_stream_text([]))
+    # handed over to the response
+    assert limiter.active == 1
+
+    with pytest.raises(HTTPException) as e:
+        with StreamSlot(limiter):
+            pass
+    assert e.value.status_code == 503
+    assert e.value.headers == {"Retry-After": "1"}
+
+    response._release()
+    assert limiter.active == 0
+
+
+@patch("llm_gateway.providers.cohere.write_record_to_db")
+@patch("cohere.AsyncClient", return_value=AsyncMock())
+@patch("cohere.Client")
+def test_stream_route_limit(mock_cohere_client, mock_cohere_async_client, _):
+    mock_cohere_async_client.return_value.generate.side_effect = (
+        lambda **kwargs: _stream_text(["Hello", " there"])
+    )
+    limiter = StreamLimiter(max_streams=1)
+    client = TestClient(app)
+
+    try:
+        with patch("llm_gateway.streaming.get_stream_limiter", return_value=limiter):
+            response = client.post(
+                "/api/cohere/generate/stream", json={"temperature": 0, "prompt": "hi"}
+            )
+            assert response.status_code == 200
+            assert response.text == "Hello there"
+            assert limiter.active == 0
+
+            limiter.active = 1
+            response = client.post(
+                "/api/cohere/generate/stream", json={"temperature": 0, "prompt": "hi"}
+            )
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+    finally:
+        close_provider_clients()
+
+
+async def _delayed(chunks):
+    for delay, chunk in chunks:
+        await asyncio.sleep(delay)
+        yield chunk
+
+
+def _coalesce(chunks, interval: float, max_chars: int = 1024) -> list:
+    async def consume():
+        return [
+            batch
+            async for batch in coalesce_stream(
+                _delayed(chunks), interval=interval, max_chars=max_chars
+            )
+        ]
+
+    return asyncio.run(consume())
+
+
+def test_coalesce_stream():
+    chunks = [(0, "a"), (0, "b"), (0, "c"), (0.3, "d"), (0, "e")]
+
+    assert _coalesce(chunks, interval=0) == ["a", "b", "c", "d", "e"]
+    # the first chunk after a pause goes out straight away
+    assert _coalesce(chunks, interval=0.1) == ["a", "bc", "d", "e"]
+    assert _coalesce(chunks, interval=10) == ["a", "bcde"]
+    assert _coalesce(chunks, interval=10, max_chars=2) == ["a", "bc", "de"]
+
+
+@patch("llm_gateway.providers.cohere.write_record_to_db")
+@patch("cohere.AsyncClient", return_value=AsyncMock())
+@patch("cohere.Client")
+def test_stream_route_sse(mock_cohere_client, mock_cohere_async_client, _):
+    mock_cohere_async_client.return_value.generate.side_effect = (
+        lambda **kwargs: _stream_text(["Hello", " there"])
+    )
+    client = TestClient(app)
+
+    try:
+        response = client.post(
+            "/api/cohere/generate/stream",
+            json={"temperature": 0, "prompt": "hi"},
+            headers={"Accept": "text/event-stream"},
+        )
+    finally:
+        close_provider_clients()
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+    *events, end = response.text.strip().split("\n\n")
+    texts = [json.loads(event.removeprefix("data: "))["text"] for event in events]
+    assert "".join(texts) == "Hello there"
+    event_type, data = end.split("\n")
+    assert event_type == "event: end"
+    end = json.loads(data.removeprefix("data: "))
+    assert end["finish_reason"] == "COMPLETE"
+    assert end["usage"] == {
+        "completion_chunks": 2,
+        "completion_characters": len("Hello there"),
+        "input_tokens": 1,
+        "output_tokens": 2,
+    }
+    assert end["timing"].keys() == {"first_chunk_ms", "duration_ms"}
+
+
+async def _disconnect_after_first_chunk(path: str, body: dict) -> list:
+    """
+    Call the app like a client that goes away after the first chunk of the stream
+    """
+    first_chunk = asyncio.Event()
+    requested = False
+    chunks = []
+
+    async def receive() -> dict:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": json.dumps(body).encode()}
+        await first_chunk.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"])
+            first_chunk.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("gateway", 80),
+    }
+    await app(scope, receive, send)
+    return chunks
+
+
+@patch("llm_gateway.providers.cohere.write_record_to_db")
+@patch("cohere.AsyncClient", return_value=AsyncMock())
+@patch("cohere.Client")
+def test_stream_cancelled_on_disconnect(
+    mock_cohere_client, mock_cohere_async_client, mock_write_record_to_db
+):
+    stream = _stream_text(["Hello", " there", " again"], delay=10)
+    mock_cohere_async_client.return_value.generate.return_value = stream
+    metrics.reset()
+
+    try:
+        chunks = asyncio.run(
+            _disconnect_after_first_chunk(
+                "/api/cohere/generate/stream",
+                {"temperature": 0, "prompt": "hi", "max_tokens": 50},
+            )
+        )
+    finally:
+        close_provider_clients()
+
+    assert chunks == [b"Hello"]
+    stream.response.close.assert_called_once()
+    db_record = mock_write_record_to_db.call_args.args[0]
+    assert db_record.cohere_response == "Hello"
+    assert db_record.gateway_metadata["stream"] == {
+        "cancelled": True,
+        "completion_chunks": 1,
+    }
+    assert metrics.get_counter("streams.cancelled", provider="cohere") == 1
+    assert metrics.get_counter("streams.tokens_saved", provider="cohere") == 49
@@ -0,0 +1,191 @@
+import json
+from collections import Counter
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from llm_gateway.app import app
+from llm_gateway.db.models import Base
+from llm_gateway.denylist import Denylist
+from llm_gateway.dependencies import close_provider_clients
+from llm_gateway.pii_scrubber import scrub_many
+from llm_gateway.templates import (
+    PromptTemplateError,
+    _get_template_cache,
+    parse_prompt_template,
+    register_prompt_template,
+)
+
+
+@pytest.fixture(autouse=True)
+def template_db():
+    """Store templates in an in-memory database shared by every session."""
+
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    make_session = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope():
+        session = make_session()
+        try:
+            yield session
+            session.commit()
+        finally:
+            session.close()
+
+    _get_template_cache.cache_clear()
+    with patch("llm_gateway.templates.db_session_scope", session_scope):
+        yield
+    _get_template_cache.cache_clear()
+    # the Cohere wrapper is shared, don't leave it holding a mock client
+    close_provider_clients()
+
+
+def test_parse_prompt_template():
+    assert parse_prompt_template("Dear {name}, {{literal}} {name} {id}.") == (
+        ["Dear ", ", {literal} ", " ", "."],
+        ["name", "name", "id"],
+    )
+
+
+@pytest.mark.parametrize(
+    argnames=["template"],
+    argvalues=[
+        ("{}",),
+        ("{0}",),
+        ("{name!r}",),
+        ("{name:>10}",),
+        ("{name.x}",),
+        ("{",),
+    ],
+)
+def test_parse_prompt_template_invalid(template: str):
+    with pytest.raises(PromptTemplateError):
+        parse_prompt_template(template)
+
+
+def test_render_prompt_template():
+    """Test that static text is scrubbed once and only variables when rendering."""
+
+    template = register_prompt_template(
+        "support",
+        "Email jane@example.com about {client}. Call 416-555-{last_four}. {{ok}}",
+    )
+    assert template.template == (
+        "Email [REDACTED EMAIL ADDRESS] about {client}. Call 416-555-{last_four}. {{ok}}"
+    )
+    assert template.redaction_counts == {"email_address": 1}
+
+    rendered = template.render({"client": "M5V 2T6", "last_four": "0199"})
+
+    # the phone number only exists once the variable is substituted
+    assert rendered == (
+        "Email [REDACTED EMAIL ADDRESS] about [REDACTED POSTAL CODE]. "
+        "Call [REDACTED PHONE NUMBER]. {ok}"
+    )
+    assert rendered.redaction_counts == {
+        "email_address": 1,
+        "postal_code": 1,
+        "phone_number": 1,
+    }
+
+    redaction_counts = Counter()
+    # already scrubbed, so passed through as-is
+    assert scrub_many([rendered], redaction_counts)[0] is rendered
+    assert redaction_counts == rendered.redaction_counts
+
+    with pytest.raises(PromptTemplateError):
+        template.render({"client": "Acme"})
+    with pytest.raises(PromptTemplateError):
+        template.render({"client": "Acme", "last_four": "0199", "other": ""})
+
+
+def test_render_prompt_template_after_denylist_reload():
+    """Test that static text is scrubbed again for terms denylisted since."""
+
+    template = register_prompt_template("support", "Ask Acme Corp about {topic}.")
+    assert template.template == "Ask Acme Corp about {topic}."
+
+    denylist = Denylist(["Acme Corp"], version=1)
+    with patch("llm_gateway.templates.get_denylist", return_value=denylist), patch(
+        "llm_gateway.pii_scrubber.get_denylist", return_value=denylist
+    ):
+        rendered = template.render({"topic": "fees"})
+
+    assert rendered == "Ask [REDACTED TERM] about fees."
+    assert rendered.redaction_counts == {"denylisted_term": 1}
+    assert template.denylist_version == 1
+
+
+@patch("llm_gateway.providers.cohere.write_record_to_db")
+@patch("cohere.AsyncClient", return_value=AsyncMock())
+@patch("cohere.Client")
+def test_templates_api(
+    mock_cohere_client, mock_cohere_async_client, mock_write_record_to_db
+):
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/templates",
+        json={"name": "summary", "template": "Summarize for {client}: {text}"},
+    )
+    assert response.status_code == 200
+    template = response.json()
+    assert template["variables"] == ["client", "text"]
+    assert client.get(f"/api/templates/{template['id']}").json() == template
+    assert client.get("/api/templates").json() == [template]
+    assert client.get("/api/templates/1000").status_code == 404
+
+    mock_cohere_async_client.return_value.generate.return_value = {"text": "ok"}
+    variables = {"client": "Acme", "text": "call me at 416-555-0199"}
+    response = client.post(
+        "/api/cohere/generate",
+        json={
+            "temperature": 0,
+            "template_id": template["id"],
+            "template_variables": variables,
+        },
+    )
+
+    assert response.status_code == 200
+    generate_kwargs = mock_cohere_async_client.return_value.generate.call_args.kwargs
+    assert generate_kwargs["prompt"] == (
+        "Summarize for Acme: call me at [REDACTED PHONE NUMBER]"
+    )
+    db_record = mock_write_record_to_db.call_args.args[0]
+    assert json.loads(db_record.user_input) == {
+        "template_id": template["id"],
+        "template_variables": variables
+        | {"text": "call me at [REDACTED PHONE NUMBER]"},
+    }
+    assert db_record.gateway_metadata == {"pii_redactions": {"phone_number": 1}}
+
+
+@pytest.mark.parametrize(
+    argnames=["body", "status_code"],
+    argvalues=[
+        ({"template_id": 1000}, 404),
+        ({"template_id": 1, "template_variables": {}}, 422),
+        ({"template_id": 1, "prompt": "hello"}, 422),
+        ({}, 422),
+    ],
+)
+@patch("cohere.AsyncClient", return_value=AsyncMock())
+@patch("cohere.Client")
+def test_templated_request_errors(
+    mock_cohere_client, mock_cohere_async_client, body: dict, status_code: int
+):
+    register_prompt_template("greeting", "Hello {name}")
+    client = TestClient(app)
+
+    response = client.post("/api/cohere/generate", json={"temperature": 0, **body})
+
+    assert response.status_code == status_code
@@ -1,9 +1,14 @@
-from unittest.mock import Mock
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
-from openai.error import APIError
+from openai.error import APIError, AuthenticationError, RateLimitError
 
-from llm_gateway.utils import max_retries
+from llm_gateway.exceptions import is_retryable_openai_error
+from llm_gateway.metrics import metrics
+from llm_gateway.pii_scrubber import scrub_all
+from llm_gateway.retries import request_deadline
+from llm_gateway.utils import StreamProcessor, StreamScrubber, max_retries
 
 
 def test_retry_decorator_mismatch_exception():
@@ -28,3 +33,194 @@ def test_retry_decorator_matching_exception():
         return retry_mock()
 
     assert matching_exception() == "success"
+
+
+def test_retry_decorator_coroutine_function():
+    retry_mock = AsyncMock()
+    retry_mock.side_effect = [APIError("test"), "success"]
+
+    @max_retries(1, exceptions=(APIError,))
+    async def matching_exception():
+        return await retry_mock()
+
+    assert asyncio.run(matching_exception()) == "success"
+    assert retry_mock.await_count == 2
+
+
+def test_retry_decorator_gives_up_after_times_retries():
+    retry_mock = Mock(side_effect=APIError("test"))
+
+    @max_retries(2, exceptions=(APIError,), provider="openai")
+    def always_fails():
+        return retry_mock()
+
+    metrics.reset()
+    with patch("llm_gateway.utils.time.sleep") as sleep, pytest.raises(APIError):
+        always_fails()
+
+    assert retry_mock.call_count == 3
+    assert sleep.call_count == 2
+    assert (
+        metrics.get_counter("retries.attempts", provider="openai", exception="APIError")
+        == 2
+    )
+    assert (
+        metrics.get_counter("retries.given_up", provider="openai", reason="attempts")
+        == 1
+    )
+
+
+def test_retry_decorator_skips_non_retryable_exception():
+    retry_mock = Mock(side_effect=[AuthenticationError("bad key"), "success"])
+
+    @max_retries(
+        3,
+        exceptions=(APIError, AuthenticationError),
+        provider="openai",
+        is_retryable=is_retryable_openai_error,
+    )
+    def bad_key():
+        return retry_mock()
+
+    metrics.reset()
+    with pytest.raises(AuthenticationError):
+        bad_key()
+
+    assert retry_mock.call_count == 1
+    assert (
+        metrics.get_counter(
+            "retries.given_up", provider="openai", reason="non_retryable"
+        )
+        == 1
+    )
+
+
+def test_retry_decorator_backs_off_with_jitter_and_retry_after():
+    rate_limited = RateLimitError("slow down", headers={"Retry-After": "7"})
+    retry_mock = Mock(side_effect=[APIError("test"), APIError("test"), rate_limited, 1])
+
+    @max_retries(3, exceptions=(APIError, RateLimitError))
+    def flaky():
+        return retry_mock()
+
+    with patch("llm_gateway.utils.time.sleep") as sleep:
+        assert flaky() == 1
+
+    first, second, third = (call.args[0] for call in sleep.call_args_list)
+    # full jitter, up to RETRY_BACKOFF_BASE doubled every attempt
+    assert 0 <= first <= 0.5
+    assert 0 <= second <= 1
+    assert third >= 7
+
+
+def test_retry_decorator_stops_at_deadline():
+    rate_limited = RateLimitError("slow down", headers={"retry-after": "5"})
+    retry_mock = AsyncMock(side_effect=[rate_limited, "success"])
+
+    @max_retries(3, exceptions=(RateLimitError,), provider="openai")
+    async def rate_limited_call():
+        return await retry_mock()
+
+    async def call_with_deadline():
+        with request_deadline(1):
+            return await rate_limited_call()
+
+    metrics.reset()
+    with pytest.raises(RateLimitError):
+        asyncio.run(call_with_deadline())
+
+    # waiting 5 seconds would miss the deadline, so it isn't retried
+    assert retry_mock.await_count == 1
+    assert (
+        metrics.get_counter("retries.given_up", provider="openai", reason="deadline")
+        == 1
+    )
+
+
+def test_retry_decorator_respects_budget():
+    retry_mock = Mock(side_effect=[APIError("test"), "success"])
+
+    @max_retries(3, exceptions=(APIError,), provider="openai")
+    def flaky():
+        return retry_mock()
+
+    metrics.reset()
+    budget = Mock()
+    budget.try_retry.return_value = False
+    with patch("llm_gateway.utils.get_retry_budget", return_value=budget):
+        with pytest.raises(APIError):
+            flaky()
+
+    budget.record_request.assert_called_once()
+    assert (
+        metrics.get_counter("retries.given_up", provider="openai", reason="budget") == 1
+    )
+
+
+STREAMED_TEXT = (
+    "Hi Jane, reach me at jane.doe@example.com or 416-555-0199 before 5pm. "
+    "My SIN is 123 456 789 and I live near M5V 2T6. Thanks! "
+) * 3
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_stream_scrubber_matches_scrub_all(chunk_size):
+    scrubber = StreamScrubber()
+    chunks = []
+    for start in range(0, len(STREAMED_TEXT), chunk_size):
+        stop = start + chunk_size
+        chunks.append(STREAMED_TEXT[start:stop])
+
+    scrubbed = "".join(scrubber.feed(chunk) for chunk in chunks) + scrubber.flush()
+
+    assert scrubbed == scrub_all(STREAMED_TEXT)
+    assert scrubber.held_back == 0
+    assert sum(scrubber.redaction_counts.values()) == 12
+
+
+def test_stream_scrubber_holds_back_only_possible_pii():
+    scrubber = StreamScrubber()
+
+    assert scrubber.feed("Call me at 416-55") == "Call me at "
+    assert scrubber.held_back == len("416-55")
+    assert scrubber.feed("5-0199 please") == "[REDACTED PHONE NUMBER] "
+    assert scrubber.flush() == "please"
+
+
+def test_stream_scrubber_max_holdback():
+    scrubber = StreamScrubber(max_holdback=8)
+
+    released = scrubber.feed("1 2 3 4 5 6 7 8 9 0 1 2")
+
+    assert released
+    assert scrubber.held_back <= 8
+
+
+def test_stream_processor_scrubs_output():
+    stream_processor = StreamProcessor(
+        stream_processor=lambda response: iter(response), scrub_output=True
+    )
+
+    streamed = list(stream_processor.process_stream(["Email ", "jane@exa", "mple.com"]))
+
+    assert "".join(streamed) == "Email [REDACTED EMAIL ADDRESS]"
+    assert stream_processor.get_cached_streamed_response() == streamed
+    assert stream_processor.scrubber.redaction_counts == {"email_address": 1}
+
+
+def test_stream_processor_scrubs_async_output():
+    async def chunks(response):
+        for chunk in response:
+            yield chunk
+
+    async def consume(stream):
+        return [item async for item in stream]
+
+    stream_processor = StreamProcessor(stream_processor=chunks, scrub_output=True)
+
+    streamed = asyncio.run(
+        consume(stream_processor.aprocess_stream(["Email ", "jane@exa", "mple.com"]))
+    )
+
+    assert "".join(streamed) == "Email [REDACTED EMAIL ADDRESS]"
+    assert stream_processor.get_cached_streamed_response() == streamed